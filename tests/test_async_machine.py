@@ -0,0 +1,161 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import unittest
+from z80.async_machine import AsyncMachine
+from z80.cpu import CPU
+from z80.loader import load_bytes
+from z80.run_result import STOP_BLOCKED
+from z80.run_result import STOP_PC
+from z80.run_result import STOP_TSTATES
+
+
+# 0000: IN A,(10H) / OUT (10H),A / CP 0AH / JR NZ,0000H / HALT
+ECHO = bytes([0xdb, 0x10, 0xd3, 0x10, 0xfe, 0x0a, 0x20, 0xf8, 0x76])
+# 0000: IN A,(11H) / RRA / JR NC,0000H / IN A,(10H) / OUT (10H),A /
+#       CP 0AH / JR NZ,0000H / HALT
+POLLING_ECHO = bytes([0xdb, 0x11, 0x1f, 0x30, 0xfb]) + ECHO[:6] + \
+    bytes([0x20, 0xf3, 0x76])
+
+
+def machine(code, **options):
+    cpu = CPU(**options)
+    load_bytes(cpu, code)
+    cpu['SP'] = 0xff00
+    m = AsyncMachine(cpu, quantum=10000)
+    return m, m.add_port(0x10)
+
+
+async def output(port):
+    data = b''
+    while not port.output.empty():
+        data += port.output.get_nowait()
+    return data
+
+
+class TestAsyncMachine(unittest.TestCase):
+    def test_blocking_input(self):
+        m, port = machine(ECHO)
+
+        async def main():
+            task = asyncio.ensure_future(m.run(until_pc=0x0008))
+            await asyncio.sleep(0.01)
+            # parked in front of IN without spinning
+            self.assertEqual(m.cpu['PC'], 0x0000)
+            self.assertEqual(m.cpu.blocked, port)
+            self.assertEqual((m.quanta, m.parks), (1, 1))
+            port.input.put_nowait(b'hi')
+            await asyncio.sleep(0.01)
+            port.input.put_nowait(b'!\n')
+            result = await task
+            self.assertEqual(result.reason, STOP_PC)
+            self.assertEqual(await output(port), b'hi!\n')
+            self.assertEqual(m.parks, 2)
+        asyncio.run(main())
+
+    def test_run_stops_in_front_of_input(self):
+        m, port = machine(ECHO)
+        result = m.cpu.run(max_tstates=1000)
+        self.assertEqual(result.reason, STOP_BLOCKED)
+        self.assertEqual((result.instructions, result.tstates), (0, 0))
+        port.receive(b'x')
+        m.cpu.run(max_instructions=2)
+        self.assertEqual(port.output.get_nowait(), b'x')
+        self.assertEqual(m.cpu.tstates, 22)
+
+    def test_idle_polling(self):
+        m, port = machine(POLLING_ECHO, idle_detection=True)
+
+        async def main():
+            task = asyncio.ensure_future(m.run(until_pc=0x000d))
+            await asyncio.sleep(0.05)
+            # the status polling loop is recognised as idle
+            self.assertEqual(m.parks, 1)
+            quanta = m.quanta
+            self.assertLess(quanta, 5)
+            port.input.put_nowait(b'ok\n')
+            await task
+            self.assertEqual(await output(port), b'ok\n')
+            self.assertLess(m.quanta, quanta + 3)
+        asyncio.run(main())
+
+    def test_interrupt(self):
+        # 0000: IM 1 / EI / HALT ... 0038: IN A,(10H) / OUT (10H),A
+        code = bytes([0xed, 0x56, 0xfb, 0x76]) + bytes(0x34) + ECHO[:4]
+        m, port = machine(code)
+        port.interrupt = True
+
+        async def main():
+            task = asyncio.ensure_future(m.run(until_pc=0x003c))
+            await asyncio.sleep(0.01)
+            self.assertTrue(m.cpu.halted)
+            self.assertEqual(m.parks, 1)
+            port.input.put_nowait(b'z')
+            await task
+            self.assertEqual(await output(port), b'z')
+            self.assertIsNone(m.cpu.int_data)
+        asyncio.run(main())
+
+    def test_time_slicing(self):
+        machines = [machine(bytes([0x3c, 0x18, 0xfd]))[0] for _ in range(3)]
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(sum(m.quanta for m in machines))
+                await asyncio.sleep(0)
+
+        async def main():
+            task = asyncio.ensure_future(ticker())
+            results = await asyncio.gather(*(m.run(max_tstates=50000)
+                                             for m in machines))
+            task.cancel()
+            return results
+        results = asyncio.run(main())
+        for result in results:
+            self.assertEqual(result.reason, STOP_TSTATES)
+            self.assertIn(result.tstates, range(50000, 50016))
+        # the machines took turns with the other tasks
+        self.assertEqual(ticks[:3], [0, 3, 6])
+
+    def test_streams(self):
+        m, port = machine(ECHO)
+
+        class Writer(object):
+            data = b''
+
+            def write(self, data):
+                self.data += data
+
+            async def drain(self):
+                pass
+
+        async def main():
+            reader = asyncio.StreamReader()
+            writer = Writer()
+            connection = asyncio.ensure_future(port.connect(reader, writer))
+            reader.feed_data(b'abc\n')
+            await m.run(until_pc=0x0008)
+            reader.feed_eof()
+            await connection
+            self.assertEqual(writer.data, b'abc\n')
+        asyncio.run(main())
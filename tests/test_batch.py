@@ -0,0 +1,174 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random
+import unittest
+from z80.cpu import CPU
+from z80.cpu import INSTRUCTION_SET
+from z80.batch import BatchCPU
+from z80.batch import VECTORISERS
+from z80.benchmark.micro import DATA_END
+from z80.benchmark.micro import DATA_START
+from z80.benchmark.micro import encode
+from z80.benchmark.micro import instruction_key
+from z80.benchmark.programs import assemble
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def state(cpu):
+    """ registers and memory of a CPU """
+    return (cpu.reg.main_register_set, cpu.reg.alt_register_set,
+            bytes(cpu.reg.mem))
+
+
+def registers(state):
+    return state[:2]
+
+
+# sum of 1..B in A for each instance, ends at the JR $
+SUM = assemble(0, [0xaf,                    # XOR A
+                   'loop:',
+                   0x80,                    # ADD A,B
+                   0x10, ('e', 'loop'),     # DJNZ loop
+                   0x32, 0x00, 0x80,        # LD (8000H),A
+                   'end:',
+                   0x18, ('e', 'end')])     # JR $
+SUM_END = len(SUM) - 2
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class TestBatchCPU(unittest.TestCase):
+    def random_batch(self, n, rng):
+        batch = BatchCPU(n)
+        batch.ram[:] = numpy.frombuffer(
+            rng.getrandbits(n * 0x10000 * 8).to_bytes(n * 0x10000, 'little'),
+            numpy.uint8).reshape(n, 0x10000)
+        batch.r8[:] = numpy.frombuffer(
+            rng.getrandbits(18 * n * 8).to_bytes(18 * n, 'little'),
+            numpy.uint8).reshape(18, n)
+        # register pairs address the data area, not the code at 0
+        for rr in ('BC', 'DE', 'HL', 'IX', 'IY', 'SP'):
+            for _ in range(2):
+                batch[rr] = [rng.randrange(DATA_START, DATA_END)
+                             for _ in range(n)]
+                if rr in ('BC', 'DE', 'HL'):
+                    batch.exchange([0, 1, 2, 3, 4, 5], numpy.arange(n))
+        batch['PC'] = 0
+        return batch
+
+    def test_instructions_match_cpu(self):
+        """ every instruction executed on a batch gives the same
+            result as on the scalar CPU """
+        rng = random.Random(0)
+        n = 6
+        batch = self.random_batch(n, rng)
+        saved = batch.r8.copy(), batch.r16.copy(), batch.ram.copy()
+        for group in INSTRUCTION_SET.groups:
+            for template in group.instruction_templates:
+                for instr in template.instructions:
+                    batch.r8[:], batch.r16[:], batch.ram[:] = saved
+                    batch.tstates[:] = 0
+                    code = encode(instr, rng)
+                    batch.ram[:, :len(code)] = code
+                    expected = []
+                    for i in range(n):
+                        cpu = batch.cpu(i)
+                        tstates = cpu.step()
+                        expected.append((state(cpu), tstates))
+                    batch.step()
+                    key = instruction_key(instr)
+                    for i in range(n):
+                        result = state(batch.cpu(i))
+                        tstates = expected[i][1]
+                        self.assertEqual(registers(result),
+                                         registers(expected[i][0]), key)
+                        self.assertTrue(result[2] == expected[i][0][2], key)
+                        self.assertEqual(batch.tstates[i], tstates, key)
+
+    def test_vectorisers(self):
+        self.assertIn('LD_r_r', VECTORISERS)
+        self.assertIn('DJNZ_e', VECTORISERS)
+        self.assertNotIn('LDIR', VECTORISERS)
+
+    def test_divergent_branches(self):
+        n = 10
+        batch = BatchCPU(n)
+        batch.load(0, SUM)
+        batch['B'] = range(1, n + 1)
+        steps = batch.run(until_pc=SUM_END)
+        self.assertEqual(batch['A'].tolist(),
+                         [b * (b + 1) // 2 for b in range(1, n + 1)])
+        self.assertEqual(batch.ram[:, 0x8000].tolist(), batch['A'].tolist())
+        self.assertEqual(steps, 2 * n + 2)
+        for i in range(n):
+            cpu = CPU()
+            cpu.reg.mem[:len(SUM)] = SUM
+            cpu['B'] = i + 1
+            result = cpu.run(until_pc=SUM_END)
+            self.assertEqual(batch.instructions[i], result.instructions)
+            self.assertEqual(batch.tstates[i], result.tstates)
+
+    def test_max_instructions(self):
+        batch = BatchCPU(3)
+        batch.load(0, SUM)
+        batch['B'] = 5
+        batch.run(max_instructions=4)
+        self.assertEqual(batch.instructions.tolist(), [4, 4, 4])
+        self.assertEqual(batch['B'].tolist(), [4, 4, 4])
+
+    def test_rom(self):
+        batch = BatchCPU(4, rom_size=0x4000)
+        # LD (0010H),A; LD (8000H),A; JR $
+        batch.load(0, [0x32, 0x10, 0x00, 0x32, 0x00, 0x80, 0x18, 0xfe])
+        self.assertEqual(batch.ram.shape, (4, 0xc000))
+        batch['A'] = [1, 2, 3, 4]
+        batch.run(until_pc=6)
+        self.assertEqual(batch.rom[0x10], 0)
+        self.assertEqual(batch.ram[:, 0x4000].tolist(), [1, 2, 3, 4])
+        self.assertEqual(batch.memory(2)[0x8000], 3)
+        self.assertEqual(len(batch.memory(2)), 0x10000)
+
+    def test_scalar_rom(self):
+        batch = BatchCPU(2, rom_size=0x4000)
+        # LD HL,0000H; LD DE,3FFEH; LD BC,0004H; LDIR
+        code = [0x21, 0x00, 0x00, 0x11, 0xfe, 0x3f, 0x01, 0x04, 0x00,
+                0xed, 0xb0]
+        batch.load(0, code)
+        batch.run(until_pc=len(code))
+        self.assertEqual(batch.rom[0x3ffe:].tolist(), [0, 0])
+        self.assertEqual(batch.ram[:, :2].tolist(), [[0x00, 0x11]] * 2)
+        self.assertEqual(batch['DE'].tolist(), [0x4002] * 2)
+
+    def test_exchange(self):
+        batch = BatchCPU(2)
+        # EXX on instance 1 only
+        batch.load(0, [0xd9])
+        batch['BC'] = [0x1234, 0x5678]
+        batch.step(numpy.array([1]))
+        self.assertEqual(batch['BC'].tolist(), [0x1234, 0])
+        self.assertEqual(batch.cpu(1).reg.alt_register_set['B'], 0x56)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.benchmark import macro
+from z80.benchmark.programs import CRC16
+
+
+class TestMacroBenchmark(unittest.TestCase):
+    def test_execute_block_compiler(self):
+        interpreted = CPU()
+        compiled = CPU(block_compiler=True)
+        CRC16.load(interpreted)
+        CRC16.load(compiled)
+        n1, t1 = macro.execute(interpreted, CRC16.end)
+        n2, t2 = macro.execute(compiled, CRC16.end)
+        self.assertEqual((n1, t1), (n2, t2))
+        self.assertTrue(CRC16.check(compiled))
+        self.assertGreater(compiled.block_compiler.hits, 1000)
+
+    def test_run_engines(self):
+        results = macro.run_engines(['interpreter', 'block_compiler'],
+                                    ['interrupts'], isolate=False)
+        self.assertEqual(list(results), ['interpreter', 'block_compiler'])
+        for result in results.values():
+            workload = result['workloads']['interrupts']
+            self.assertGreater(workload['instructions'], 16000)
+            self.assertAlmostEqual(workload['real_time'],
+                                   workload['mhz'] / macro.REAL_TIME_MHZ)
+            self.assertGreater(result['mips'], 0)
+        report = macro.build_report(results, benchmark='macro')
+        self.assertEqual(sorted(report['workloads']),
+                         ['block_compiler:interrupts',
+                          'interpreter:interrupts'])
+        lines = macro.format_report(report).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[2].startswith('interpreter        total'))
+
+    def test_wrong_result(self):
+        workload = macro.WORKLOADS[0]
+        check = workload._check
+        workload._check = lambda mem: False
+        try:
+            with self.assertRaises(AssertionError):
+                macro.run_workload(workload, {})
+        finally:
+            workload._check = check
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random
+import unittest
+from z80.cpu import INSTRUCTION_SET
+from z80.benchmark.micro import DATA_END
+from z80.benchmark.micro import DATA_START
+from z80.benchmark.micro import MicroBenchmark
+from z80.benchmark.micro import encode
+from z80.benchmark.micro import instruction_key
+
+
+class TestMicroBenchmark(unittest.TestCase):
+    def test_instruction_keys_are_unique(self):
+        keys = [instruction_key(instr)
+                for group in INSTRUCTION_SET.groups
+                for template in group.instruction_templates
+                for instr in template.instructions]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertIn('LD HL,(nn) [ed 6b]', keys)
+
+    def test_encode(self):
+        rng = random.Random(0)
+        instr = INSTRUCTION_SET.assembler['LD']['A']['(nn)']
+        code = encode(instr, rng)
+        self.assertEqual(len(code), instr.size)
+        self.assertEqual(code[0], 0x3a)
+        self.assertTrue(DATA_START <= code[1] | (code[2] << 8) < DATA_END)
+
+    def test_all_instructions_execute(self):
+        count = sum(len(template.instructions)
+                    for group in INSTRUCTION_SET.groups
+                    for template in group.instruction_templates)
+        for options in ({}, {'checked': True}):
+            benchmark = MicroBenchmark(iterations=2, repeat=1, **options)
+            results = benchmark.run()
+            self.assertEqual(len(results), count)
+            for group, template, key, ns in results:
+                self.assertGreaterEqual(ns, 0.0)
+
+    def test_select(self):
+        benchmark = MicroBenchmark(iterations=2, repeat=1)
+        results = benchmark.run(select=lambda key: key.startswith('EXX'))
+        self.assertEqual([r[2] for r in results], ['EXX [d9]'])
+        self.assertEqual(results[0][:2], ('exchange group', 'EXX'))
+
+
+if __name__ == '__main__':
+    unittest.main()
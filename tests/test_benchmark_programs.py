@@ -0,0 +1,71 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.benchmark.programs import INTERRUPTS
+from z80.benchmark.programs import ORIGIN
+from z80.benchmark.programs import TICKS
+from z80.benchmark.programs import TICK_PERIOD
+from z80.benchmark.programs import WORKLOADS
+from z80.benchmark.programs import assemble
+from z80.benchmark.programs import crc16
+
+
+class TestPrograms(unittest.TestCase):
+    def test_assemble(self):
+        code = assemble(0x1000, ['start:',
+                                 0x00,                  # NOP
+                                 0x18, ('e', 'start'),  # JR start
+                                 0xc3, ('nn', 'end'),   # JP end
+                                 'end:'])
+        self.assertEqual(code, bytes([0x00, 0x18, 0xfd, 0xc3, 0x06, 0x10]))
+        with self.assertRaises(ValueError):
+            items = ['start:'] + [0x00] * 0x80 + [0x18, ('e', 'start')]
+            assemble(0x0000, items)
+
+    def test_crc16(self):
+        self.assertEqual(crc16(b'123456789'), 0x29b1)
+
+    def test_workloads(self):
+        for workload in WORKLOADS:
+            cpu = CPU()
+            workload.load(cpu)
+            self.assertEqual(cpu['PC'], ORIGIN)
+            self.assertFalse(workload.check(cpu), workload.name)
+            result = cpu.run(until_pc=workload.end,
+                             max_instructions=1000000)
+            self.assertEqual(cpu['PC'], workload.end, workload.name)
+            self.assertTrue(workload.check(cpu), workload.name)
+            self.assertGreater(result.instructions, 100)
+
+    def test_interrupts(self):
+        for options in ({}, {'block_compiler': True}):
+            cpu = CPU(**options)
+            INTERRUPTS.load(cpu)
+            result = cpu.run(until_pc=INTERRUPTS.end)
+            self.assertTrue(INTERRUPTS.check(cpu))
+            # the loop ends at the TICKS-th interrupt
+            self.assertIn(result.tstates - TICKS * TICK_PERIOD, range(200))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import tempfile
+import unittest
+from z80.benchmark.report import build_report
+from z80.benchmark.report import compare
+from z80.benchmark.report import format_report
+from z80.benchmark.report import load
+from z80.benchmark.report import save
+from z80.benchmark.report import Regression
+
+
+RESULTS = [('g1', 't1', 'i1', 10.0),
+           ('g1', 't1', 'i2', 20.0),
+           ('g1', 't2', 'i3', 30.0),
+           ('g2', 't3', 'i4', 40.0)]
+
+
+class TestReport(unittest.TestCase):
+    def test_build_report(self):
+        report = build_report(RESULTS, benchmark='micro')
+        self.assertEqual(report['benchmark'], 'micro')
+        self.assertEqual(report['instructions']['i2'], 20.0)
+        self.assertEqual(report['templates'], {'t1': 15.0, 't2': 30.0,
+                                               't3': 40.0})
+        self.assertEqual(report['groups'], {'g1': 20.0, 'g2': 40.0})
+
+    def test_save_load(self):
+        report = build_report(RESULTS)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            save(report, path)
+            self.assertEqual(load(path), report)
+        finally:
+            os.remove(path)
+
+    def test_compare(self):
+        baseline = build_report(RESULTS)
+        slower = build_report([r[:3] + (r[3] * 1.2,) if r[2] == 'i4'
+                               else r for r in RESULTS])
+        self.assertEqual(compare(slower, baseline, 0.25), [])
+        regressions = compare(slower, baseline, 0.1)
+        self.assertEqual([(r.level, r.key) for r in regressions],
+                         [('templates', 't3')])
+        self.assertAlmostEqual(regressions[0].ratio, 1.2)
+        self.assertEqual(str(regressions[0]),
+                         'templates t3: 40 ns -> 48 ns (+20.0%)')
+        regressions = compare(slower, baseline, 0.1, 'instructions')
+        self.assertEqual([r.key for r in regressions], ['i4'])
+
+    def test_regression_units(self):
+        self.assertEqual(str(Regression('workloads', 'idle', 0.5, 0.75)),
+                         'workloads idle: 0.5 s -> 0.75 s (+50.0%)')
+        self.assertEqual(str(Regression('allocations', 'x', 10, 11)),
+                         'allocations x: 10 -> 11 (+10.0%)')
+
+    def test_compare_ignores_missing_entries(self):
+        baseline = build_report(RESULTS[:1])
+        self.assertEqual(compare(build_report(RESULTS), baseline, 0.0,
+                                 'instructions'), [])
+
+    def test_format_report(self):
+        text = format_report(build_report(RESULTS), 'groups')
+        self.assertEqual(text.splitlines()[1], 'g2         40 ns')
+
+
+if __name__ == '__main__':
+    unittest.main()
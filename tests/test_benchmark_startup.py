@@ -0,0 +1,86 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import INSTRUCTION_SET
+from z80.benchmark import startup
+from z80.benchmark.report import compare
+from z80.benchmark.report import load
+
+
+IMPORTTIME = '''import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:        80 |        200 | site
+import time:       300 |        300 |     z80.flags
+import time:      1500 |       1800 |   z80.cpu
+import time:        50 |       1850 | z80
+'''
+
+
+class TestStartupBenchmark(unittest.TestCase):
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(startup.percentile(values, 50), 3)
+        self.assertEqual(startup.percentile(values, 95), 5)
+        self.assertEqual(startup.percentile(values, 0), 1)
+
+    def test_parse_importtime(self):
+        modules = startup.parse_importtime(IMPORTTIME)
+        self.assertEqual(list(modules), ['_io', 'site', 'z80.flags',
+                                         'z80.cpu', 'z80'])
+        self.assertEqual(modules['z80.flags'], (300, 300, 2))
+        self.assertEqual(modules['z80'], (50, 1850, 0))
+
+    def test_count_allocations(self):
+        counts = startup.count_allocations('z80.cpu')
+        self.assertEqual(counts['Instruction'],
+                         sum(len(template.instructions)
+                             for group in INSTRUCTION_SET.groups
+                             for template in group.instruction_templates))
+        self.assertGreater(counts['RegisterPlusOffset'], 0)
+
+    def test_run(self):
+        report = startup.run(['python'], runs=2, top=3)
+        result = report['entry_points']['python']
+        self.assertEqual(len(result['times']), 2)
+        self.assertLessEqual(result['median'], result['p95'])
+        self.assertLessEqual(len(result['importtime']), 3)
+        self.assertEqual(report['startup'], {'python': result['median']})
+        self.assertIn('z80.cpu:Instruction', report['allocations'])
+        self.assertEqual(startup.baseline(report)['allocations'],
+                         report['allocations'])
+        text = startup.format_report(report)
+        self.assertTrue(text.splitlines()[1].startswith('python'))
+
+    def test_baseline(self):
+        baseline = load(startup.BASELINE)
+        # no machine dependent timings
+        self.assertEqual(sorted(baseline),
+                         ['allocations', 'benchmark', 'python'])
+        self.assertEqual(baseline, startup.baseline(baseline))
+        more = {'allocations': {key: n + 1 for key, n
+                                in baseline['allocations'].items()}}
+        regressions = compare(more, baseline, 0.0, 'allocations')
+        self.assertEqual(len(regressions), len(baseline['allocations']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+import random
+import unittest
+from z80.cpu import CPU
+from z80.cpu import INSTRUCTION_SET
+from z80.block_compiler import EMITTERS
+
+
+# interpreted instructions used to test the fallback
+FALLBACK = ('EXX', 'EX_AF_alt_AF', 'LD_A_I', 'LD_I_A')
+
+
+def encode(instr, rnd):
+    """ opcode bytes of instr with random operands """
+    ret = []
+    for c in instr.opcode:
+        if isinstance(c, int):
+            ret.append(c)
+        elif c.memonic == 'nn':
+            nn = rnd.randint(0x8000, 0xfff0)
+            ret += [nn & 0xff, nn >> 8]
+        else:
+            ret.append(rnd.randint(0, 0xff))
+    return ret
+
+
+def straight_line_instructions():
+    names = set(EMITTERS.keys()) | set(FALLBACK)
+    instructions = []
+    for table in INSTRUCTION_SET.tables.values():
+        for instr in table:
+            if instr is None or instr.branch:
+                continue
+            if instr.func.__name__ in names:
+                instructions.append(instr)
+    return instructions
+
+
+class TestBlockCompiler(unittest.TestCase):
+    def setup_cpu(self, cpu, program, rnd):
+        for i, c in enumerate(program):
+            cpu[i] = c
+        for rr in ('BC', 'DE', 'HL', 'IX', 'IY'):
+            cpu[rr] = rnd.randint(0x8000, 0xfff0)
+        cpu['SP'] = 0xff00
+        cpu['AF'] = rnd.randint(0, 0xffff)
+        cpu['I'] = rnd.randint(0, 0xff)
+        for addr in range(0x8000, 0x10000):
+            cpu[addr] = rnd.randint(0, 0xff)
+
+    def assertSameState(self, cpu1, cpu2):
+        self.assertEqual(cpu1.reg.main_register_set,
+                         cpu2.reg.main_register_set)
+        self.assertEqual(cpu1.reg.alt_register_set,
+                         cpu2.reg.alt_register_set)
+        self.assertEqual(cpu1.reg.mem, cpu2.reg.mem)
+
+    def run_compiled(self, cpu, count):
+        """ executes count instructions in blocks """
+        executed = 0
+        tstates = 0
+        while executed < count:
+            cpu.block_compiler.max_length = count - executed
+            n, t = cpu.block_cycle()
+            executed += n
+            tstates += t
+        return executed, tstates
+
+    def test_random_programs(self):
+        rnd = random.Random(42)
+        instructions = straight_line_instructions()
+        for _ in range(50):
+            program = []
+            count = rnd.randint(1, 40)
+            for i in range(count):
+                program += encode(rnd.choice(instructions), rnd)
+            seed = rnd.random()
+            interpreted = CPU()
+            compiled = CPU(block_compiler=True)
+            self.setup_cpu(interpreted, program, random.Random(seed))
+            self.setup_cpu(compiled, program, random.Random(seed))
+            tstates = 0
+            for i in range(count):
+                tstates += interpreted.instr_cycle()
+            self.assertEqual(self.run_compiled(compiled, count),
+                             (count, tstates))
+            self.assertSameState(interpreted, compiled)
+
+    def test_block_ends_at_branch(self):
+        cpu = CPU(block_compiler=True)
+        cpu[0x0000] = 0x00        # NOP
+        cpu[0x0001] = 0xed        # LDIR
+        cpu[0x0002] = 0xb0
+        cpu[0x0003] = 0x00        # NOP
+        block = cpu.block_compiler.get(0x0000)
+        self.assertEqual(block.length, 2)
+        self.assertEqual(block.size, 3)
+        self.assertEqual(block.tstates, 25)
+
+    def test_cache_and_invalidation(self):
+        cpu = CPU(block_compiler=True)
+        compiler = cpu.block_compiler
+        cpu[0x0000] = 0x3e        # LD A, 0x01
+        cpu[0x0001] = 0x01
+        cpu[0x0002] = 0xed        # LDIR
+        cpu[0x0003] = 0xb0
+        cpu['HL'] = 0x8000
+        cpu['DE'] = 0x9000
+        cpu['BC'] = 0x0001
+        cpu.block_cycle()
+        self.assertEqual(cpu['A'], 0x01)
+        self.assertEqual(cpu['PC'], 0x0004)
+        cpu['PC'] = 0x0000
+        cpu.block_cycle()
+        self.assertEqual(compiler.stats(), {'hits': 1,
+                                            'misses': 1,
+                                            'invalidations': 0,
+                                            'blocks': 1})
+        cpu[0x0004] = 0x00        # not covered
+        self.assertEqual(compiler.invalidations, 0)
+        cpu[0x0001] = 0x02
+        self.assertEqual(compiler.invalidations, 1)
+        self.assertEqual(compiler.blocks, {})
+        cpu['PC'] = 0x0000
+        cpu.block_cycle()
+        self.assertEqual(cpu['A'], 0x02)
+
+    def test_self_modifying_block(self):
+        cpu = CPU(block_compiler=True)
+        program = [0x21, 0x07, 0x00,  # LD HL, 0x0007
+                   0x36, 0x3c,        # LD (HL), 0x3c   ; INC A
+                   0x3e, 0x10,        # LD A, 0x10
+                   0x00,              # NOP -> INC A
+                   0x47]              # LD B, A
+        for i, c in enumerate(program):
+            cpu[i] = c
+        self.assertEqual(cpu.block_cycle(), (2, 20))
+        self.assertEqual(cpu['PC'], 0x0005)
+        cpu.block_compiler.max_length = 3
+        self.assertEqual(cpu.block_cycle()[0], 3)
+        self.assertEqual(cpu['PC'], 0x0009)
+        self.assertEqual(cpu['B'], 0x11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80 import bulk
+
+
+class TestBulk(unittest.TestCase):
+    def test_read_write_range_wrap(self):
+        mem = bytearray(0x10000)
+        bulk.write_range(mem, 0xfffe, b'\x01\x02\x03')
+        self.assertEqual(mem[0xfffe], 0x01)
+        self.assertEqual(mem[0x0000], 0x03)
+        self.assertEqual(bulk.read_range(mem, 0xfffe, 3), b'\x01\x02\x03')
+
+    def test_copy_forward_overlap(self):
+        mem = bytearray(0x10000)
+        mem[0x100:0x103] = b'abc'
+        bulk.copy_forward(mem, 0x100, 0x103, 7)
+        self.assertEqual(mem[0x100:0x10a], bytearray(b'abcabcabca'))
+
+    def test_copy_backward_overlap(self):
+        mem = bytearray(0x10000)
+        mem[0x108:0x10a] = b'xy'
+        bulk.copy_backward(mem, 0x109, 0x107, 6)
+        self.assertEqual(mem[0x102:0x10a], bytearray(b'xyxyxyxy'))
+
+    def test_find(self):
+        mem = bytearray(0x10000)
+        mem[0x0002] = 0x42
+        self.assertEqual(bulk.find_forward(mem, 0xfffe, 8, 0x42), 5)
+        self.assertEqual(bulk.find_forward(mem, 0x0003, 8, 0x42), 8)
+        self.assertEqual(bulk.find_backward(mem, 0x0004, 8, 0x42), 3)
+
+    def test_covers(self):
+        self.assertTrue(bulk.covers(0xfffe, 4, 0x0001))
+        self.assertFalse(bulk.covers(0xfffe, 4, 0x0002))
+
+
+if __name__ == '__main__':
+    unittest.main()
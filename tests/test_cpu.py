@@ -20,35 +20,171 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import unittest
-import pytest
 from z80.cpu import CPU
+from z80.run_result import RunResult
+from z80.run_result import STOP_TSTATES
+from z80.run_result import STOP_INSTRUCTIONS
+from z80.run_result import STOP_PC
 
 
 class TestCPU(unittest.TestCase):
-    @pytest.mark.skip()
     def test_fetch_one_byte_instr(self):
         cpu = CPU()
-        cpu.LD_ref_nn_n(0x0000, 0x0a)
+        cpu[0x0000] = 0x0a
         instr = cpu.fetch()
-        self.assertEqual(instr.instr, ('LD', 'A', '(BC)'))
+        self.assertEqual(instr.assembler, ['LD', 'A', '(BC)'])
 
-    @pytest.mark.skip()
     def test_fetch_two_bytes_instr(self):
-        # todo fix this
         cpu = CPU()
-        cpu.LD_ref_nn_n(0x0000, 0xdd)
-        cpu.LD_ref_nn_n(0x0001, 0x36)
+        cpu[0x0000] = 0xdd
+        cpu[0x0001] = 0x36
         instr = cpu.fetch()
-        self.assertEqual(instr.instr, ('LD', '(IX + d)', 'n'))
+        self.assertEqual(instr.assembler, ['LD', '(IX+d)', 'n'])
 
-    @pytest.mark.skip()
     def test_fetch_invalid_two_byte_instr_returns_nop(self):
         cpu = CPU()
-        cpu.LD_ref_nn_n(0x0000, 0xdd)
-        cpu.LD_ref_nn_n(0x0001, 0x01)
+        cpu[0x0000] = 0xdd
+        cpu[0x0001] = 0x01
         instr = cpu.fetch()
         self.assertIsNone(instr)
 
+    def load_inc_program(self, cpu):
+        cpu[0x0000] = 0x3e        # LD A, 0x10
+        cpu[0x0001] = 0x10
+        for addr in range(0x0002, 0x0006):
+            cpu[addr] = 0x3c      # INC A
+
+    def test_run_max_instructions(self):
+        for instruction_cache in (False, True):
+            cpu = CPU(instruction_cache=instruction_cache)
+            self.load_inc_program(cpu)
+            result = cpu.run(max_instructions=3)
+            self.assertEqual(result, RunResult(STOP_INSTRUCTIONS, 3, 15))
+            self.assertEqual(cpu['A'], 0x12)
+            self.assertEqual(cpu['PC'], 0x0004)
+            self.assertEqual(cpu.tstates, 15)
+
+    def test_run_max_tstates(self):
+        cpu = CPU()
+        self.load_inc_program(cpu)
+        result = cpu.run(max_tstates=12)
+        self.assertEqual(result, RunResult(STOP_TSTATES, 3, 15))
+        result = cpu.run(max_tstates=0)
+        self.assertEqual(result, RunResult(STOP_TSTATES, 0, 0))
+
+    def test_run_until_pc(self):
+        cpu = CPU()
+        self.load_inc_program(cpu)
+        result = cpu.run(until_pc=0x0006)
+        self.assertEqual(result, RunResult(STOP_PC, 5, 23))
+        self.assertEqual(cpu['A'], 0x14)
+        result = cpu.run(until_pc=0x0006)
+        self.assertEqual(result, RunResult(STOP_PC, 0, 0))
+        self.assertEqual(cpu.tstates, 23)
+
+    def test_run_matches_instr_cycle(self):
+        cpu1 = CPU()
+        cpu2 = CPU()
+        for cpu in (cpu1, cpu2):
+            self.load_inc_program(cpu)
+            cpu['HL'] = 0x8000
+            cpu['DE'] = 0x9000
+            cpu['BC'] = 0x0004
+            cpu[0x0006] = 0xed    # LDIR
+            cpu[0x0007] = 0xb0
+        tstates = 0
+        while cpu1['PC'] != 0x0008:
+            tstates += cpu1.instr_cycle()
+        result = cpu2.run(until_pc=0x0008)
+        self.assertEqual(result.tstates, tstates)
+        self.assertEqual(cpu1.reg.main_register_set,
+                         cpu2.reg.main_register_set)
+
+    def load_alu_program(self, cpu):
+        program = [0x3e, 0x7f,    # LD A, 0x7f
+                   0xc6, 0x01,    # ADD A, 0x01
+                   0x04,          # INC B
+                   0xce, 0x80,    # ADC A, 0x80
+                   0xf5,          # PUSH AF
+                   0xee, 0x55,    # XOR 0x55
+                   0x08,          # EX AF, AF'
+                   0xfe, 0x10,    # CP 0x10
+                   0x08,          # EX AF, AF'
+                   0x0d,          # DEC C
+                   0xde, 0x01,    # SBC A, 0x01
+                   0xc1,          # POP BC
+                   0xe6, 0x0f,    # AND 0x0f
+                   0xcb, 0x5f,    # BIT 3, A
+                   0xb0]          # OR B
+        for i, c in enumerate(program):
+            cpu[i] = c
+        cpu['SP'] = 0xff00
+        return len(program)
+
+    def test_lazy_flags(self):
+        eager = CPU()
+        lazy = CPU(lazy_flags=True)
+        verified = CPU(verify_flags=True)
+        for cpu in (eager, lazy, verified):
+            end = self.load_alu_program(cpu)
+            cpu.run(until_pc=end)
+        self.assertIsNotNone(lazy.reg.pending_flags)
+        self.assertEqual(lazy.reg.main_register_set,
+                         eager.reg.main_register_set)
+        self.assertIsNone(lazy.reg.pending_flags)
+        self.assertEqual(lazy.reg.alt_register_set,
+                         eager.reg.alt_register_set)
+        self.assertEqual(verified['AF'], eager['AF'])
+
+    def test_compare_borrow(self):
+        program = [0x3e, 0x03,    # LD A, 0x03
+                   0xfe, 0x05,    # CP 0x05
+                   0x38, 0x03,    # JR C, x
+                   0x06, 0x01,    # LD B, 0x01
+                   0x76,          # HALT
+                   0x06, 0x02,    # x: LD B, 0x02
+                   0x76]          # HALT
+        for cpu in (CPU(), CPU(lazy_flags=True), CPU(checked=True),
+                    CPU(block_compiler=True)):
+            for i, c in enumerate(program):
+                cpu[i] = c
+            if cpu.block_compiler is not None:
+                cpu.block_cycle()
+                cpu.block_cycle()
+            else:
+                cpu.run(max_tstates=100)
+            self.assertEqual(cpu['B'], 0x02)
+            self.assertEqual(cpu['F'] & 0x03, 0x03)
+
+    def test_SBC_uses_carry(self):
+        program = [0x3e, 0x05,    # LD A, 0x05
+                   0xde, 0x02]    # SBC A, 0x02
+        for carry, result in ((0, 0x03), (1, 0x02)):
+            for cpu in (CPU(), CPU(block_compiler=True)):
+                for i, c in enumerate(program):
+                    cpu[i] = c
+                cpu['F'] = carry
+                if cpu.block_compiler is not None:
+                    cpu.block_cycle()
+                else:
+                    cpu.run(until_pc=len(program))
+                self.assertEqual(cpu['A'], result)
+                self.assertEqual(cpu['F'], 0x02)
+
+    def test_verify_flags_detects_mismatch(self):
+        cpu = CPU(verify_flags=True)
+        self.load_alu_program(cpu)
+        cpu.instr_cycle()
+        reg = cpu.reg
+        update_flags = reg.update_flags
+
+        def broken(func, *args):
+            update_flags(lambda f, *args: func(f, *args) ^ 0x01, *args)
+
+        reg.update_flags = broken
+        with self.assertRaises(AssertionError):
+            cpu.instr_cycle()
+
     # ################ #
     # 8 bit load group #
     # ################ #
@@ -440,12 +576,183 @@ class TestCPU(unittest.TestCase):
     # ##############
     # block transfer
     # ##############
-    # @todo
+    def repeat(self, opcode, setup, bulk):
+        """ executes the repeated block instruction ED opcode at 0x0000
+            until it terminates, at once or one iteration per step """
+        cpu = CPU()
+        cpu[0x0000] = 0xed
+        cpu[0x0001] = opcode
+        setup(cpu)
+        if bulk:
+            tstates = cpu.instr_cycle()
+            self.assertEqual(cpu['PC'], 0x0002)
+        else:
+            cpu.deadline = 0
+            tstates = 0
+            while cpu['PC'] != 0x0002:
+                tstates += cpu.instr_cycle()
+        return cpu, tstates
+
+    def assertRepeatMatches(self, opcode, setup):
+        cpu1, tstates1 = self.repeat(opcode, setup, False)
+        cpu2, tstates2 = self.repeat(opcode, setup, True)
+        self.assertEqual(tstates1, tstates2)
+        self.assertEqual(cpu1.reg.main_register_set,
+                         cpu2.reg.main_register_set)
+        self.assertEqual(cpu1.reg.mem, cpu2.reg.mem)
+        return cpu2, tstates2
+
+    def test_LDIR(self):
+        def setup(cpu):
+            for i in range(8):
+                cpu[0x8000 + i] = i + 1
+            cpu['HL'] = 0x8000
+            cpu['DE'] = 0x9000
+            cpu['BC'] = 0x0008
+        cpu, tstates = self.assertRepeatMatches(0xb0, setup)
+        self.assertEqual(tstates, 21 * 7 + 16)
+        self.assertEqual(cpu['HL'], 0x8008)
+        self.assertEqual(cpu['DE'], 0x9008)
+        self.assertEqual(cpu['BC'], 0x0000)
+        self.assertEqual(cpu.reg.mem[0x9000:0x9008], bytearray(range(1, 9)))
+
+    def test_LDIR_overlapping_fill(self):
+        def setup(cpu):
+            cpu[0x8000] = 0xaa
+            cpu[0x8001] = 0x55
+            cpu['HL'] = 0x8000
+            cpu['DE'] = 0x8002
+            cpu['BC'] = 0x0010
+        cpu, tstates = self.assertRepeatMatches(0xb0, setup)
+        self.assertEqual(cpu.reg.mem[0x8000:0x8012],
+                         bytearray(b'\xaa\x55' * 9))
+
+    def test_LDIR_wraps_around(self):
+        def setup(cpu):
+            cpu['HL'] = 0xfffc
+            cpu['DE'] = 0x4000
+            cpu['BC'] = 0x0008
+            for i in range(4):
+                cpu[0xfffc + i] = 0x10 + i
+        cpu, tstates = self.assertRepeatMatches(0xb0, setup)
+        self.assertEqual(cpu['HL'], 0x0004)
+        self.assertEqual(cpu.reg.mem[0x4000:0x4006],
+                         bytearray([0x10, 0x11, 0x12, 0x13, 0xed, 0xb0]))
+
+    def test_LDDR(self):
+        def setup(cpu):
+            for i in range(8):
+                cpu[0x8000 + i] = i + 1
+            cpu['HL'] = 0x8007
+            cpu['DE'] = 0x8009
+            cpu['BC'] = 0x0008
+        cpu, tstates = self.assertRepeatMatches(0xb8, setup)
+        self.assertEqual(tstates, 21 * 7 + 16)
+        self.assertEqual(cpu['HL'], 0x7fff)
+        self.assertEqual(cpu['DE'], 0x8001)
+        self.assertEqual(cpu.reg.mem[0x8002:0x800a], bytearray(range(1, 9)))
+
+    def test_LDIR_overwriting_itself_steps(self):
+        cpu = CPU()
+        cpu[0x0000] = 0xed
+        cpu[0x0001] = 0xb0
+        cpu['HL'] = 0x8000
+        cpu['DE'] = 0xfff0
+        cpu['BC'] = 0x0020
+        self.assertEqual(cpu.instr_cycle(), 21)
+        self.assertEqual(cpu['PC'], 0x0000)
+        self.assertEqual(cpu['BC'], 0x001f)
+
+    def test_LDIR_respects_deadline(self):
+        cpu = CPU()
+        cpu[0x0000] = 0xed
+        cpu[0x0001] = 0xb0
+        cpu['HL'] = 0x8000
+        cpu['DE'] = 0x9000
+        cpu['BC'] = 0x0100
+        result = cpu.run(max_tstates=100)
+        self.assertEqual(result, RunResult(STOP_TSTATES, 5, 105))
+        self.assertEqual(cpu['BC'], 0x00fb)
+        self.assertIsNone(cpu.deadline)
 
     # ############
     # Search group
     # ############
-    # @todo
+    def test_LDI_LDD_parity(self):
+        for op in ('LDI', 'LDD'):
+            cpu = CPU()
+            cpu['HL'] = 0x8000
+            cpu['DE'] = 0x9000
+            cpu['BC'] = 0x0002
+            cpu[0x8000] = 0x42
+            getattr(cpu, op)()
+            self.assertEqual(cpu[0x9000], 0x42)
+            self.assertEqual(cpu['BC'], 0x0001)
+            self.assertEqual(cpu['V'], 1, op)
+            getattr(cpu, op)()
+            self.assertEqual(cpu['BC'], 0x0000)
+            self.assertEqual(cpu['V'], 0, op)
+
+    def test_LDIR_clears_parity(self):
+        def setup(cpu):
+            cpu['HL'] = 0x8000
+            cpu['DE'] = 0x9000
+            cpu['BC'] = 0x0008
+            cpu['F'] = 0x04
+        cpu, tstates = self.assertRepeatMatches(0xb0, setup)
+        self.assertEqual(cpu['V'], 0)
+
+    def test_CPI(self):
+        cpu = CPU()
+        cpu['A'] = 0x10
+        cpu['HL'] = 0x8000
+        cpu['BC'] = 0x0002
+        cpu['F'] = 0x01
+        cpu[0x8000] = 0x10
+        cpu.CPI()
+        self.assertEqual(cpu['A'], 0x10)
+        self.assertEqual(cpu['HL'], 0x8001)
+        self.assertEqual(cpu['BC'], 0x0001)
+        self.assertEqual(cpu['Z'], 1)
+        self.assertEqual(cpu['V'], 1)
+        self.assertEqual(cpu['C'], 1)
+        cpu.CPI()
+        self.assertEqual(cpu['Z'], 0)
+        self.assertEqual(cpu['V'], 0)
+
+    def test_CPIR(self):
+        def setup(cpu):
+            cpu['A'] = 0x42
+            cpu['HL'] = 0x8000
+            cpu['BC'] = 0x0100
+            cpu[0x8010] = 0x42
+        cpu, tstates = self.assertRepeatMatches(0xb1, setup)
+        self.assertEqual(tstates, 21 * 16 + 16)
+        self.assertEqual(cpu['HL'], 0x8011)
+        self.assertEqual(cpu['BC'], 0x00ef)
+        self.assertEqual(cpu['Z'], 1)
+
+    def test_CPIR_not_found(self):
+        def setup(cpu):
+            cpu['A'] = 0x42
+            cpu['HL'] = 0x8000
+            cpu['BC'] = 0x0020
+        cpu, tstates = self.assertRepeatMatches(0xb1, setup)
+        self.assertEqual(tstates, 21 * 31 + 16)
+        self.assertEqual(cpu['BC'], 0x0000)
+        self.assertEqual(cpu['Z'], 0)
+
+    def test_CPDR(self):
+        def setup(cpu):
+            cpu['A'] = 0x42
+            cpu['HL'] = 0x8010
+            cpu['BC'] = 0x0000
+            cpu[0x8000] = 0x42
+        cpu, tstates = self.assertRepeatMatches(0xb9, setup)
+        self.assertEqual(tstates, 21 * 16 + 16)
+        self.assertEqual(cpu['HL'], 0x7fff)
+        self.assertEqual(cpu['BC'], 0xffef)
+        self.assertEqual(cpu['Z'], 1)
 
     # ################
     # 8-bit arithmetic
@@ -457,19 +764,19 @@ class TestCPU(unittest.TestCase):
         for t in tests:
             cpu['F'] = 0x00
             cpu['A'] = t[0]
-            cpu['C'] = t[2]
+            cpu.reg.set_flag('C', t[2])
             cpu.ADD_A_n(t[1])
             self.assertEqual(cpu['A'], t[3])
             self.assertEqual(cpu.reg.get_flags('V'), t[4])
 
     def test_SUB_A_n(self):
         # todo add more edge cases
-        tests = [(0x40, 0x40, False, 0x00, 'Z')]
+        tests = [(0x40, 0x40, False, 0x00, 'ZN')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
             cpu['A'] = t[0]
-            cpu['C'] = t[2]
+            cpu.reg.set_flag('C', t[2])
             cpu.SUB_A_n(t[1])
             self.assertEqual(cpu['A'], t[3])
             self.assertEqual(cpu.reg.get_flags('V'), t[4])
@@ -487,7 +794,7 @@ class TestCPU(unittest.TestCase):
 
     def test_OR_A_n(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 0x00, 'ZHP')]
+        tests = [(0x00, 0x00, 0x00, 'ZP')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
@@ -498,7 +805,7 @@ class TestCPU(unittest.TestCase):
 
     def test_XOR_A_n(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 0x00, 'ZHP')]
+        tests = [(0x00, 0x00, 0x00, 'ZP')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
@@ -538,6 +845,17 @@ class TestCPU(unittest.TestCase):
             self.assertEqual(n, t[1])
             self.assertEqual(cpu.reg.get_flags('V'), t[2])
 
+    def test_INC_DEC__HL_(self):
+        cpu = CPU()
+        cpu['HL'] = 0x5000
+        cpu[0x5000] = 0x7f
+        cpu.INC__HL_()
+        self.assertEqual(cpu[0x5000], 0x80)
+        self.assertEqual(cpu['HL'], 0x5000)
+        cpu.DEC__HL_()
+        cpu.DEC__HL_()
+        self.assertEqual(cpu[0x5000], 0x7e)
+
     # ################
     # General purpose
     # ################
@@ -612,17 +930,33 @@ class TestCPU(unittest.TestCase):
             cpu['F'] = 0x00
             cpu['HL'] = t[0]
             cpu['DE'] = t[1]
-            cpu['C'] = t[2]
+            cpu.reg.set_flag('C', t[2])
             cpu.ADD_HL_ss('DE')
             self.assertEqual(cpu['HL'], t[3])
             self.assertEqual(cpu.reg.get_flags('V'), t[4])
 
+    def test_16_bit_carry(self):
+        for cpu in (CPU(), CPU(block_compiler=True)):
+            program = [0x21, 0xff, 0xff,    # LD HL, 0xffff
+                       0x01, 0x01, 0x00,    # LD BC, 0x0001
+                       0x09,                # ADD HL, BC
+                       0xed, 0x42]          # SBC HL, BC
+            for i, c in enumerate(program):
+                cpu[i] = c
+            if cpu.block_compiler is not None:
+                cpu.block_cycle()
+            else:
+                cpu.run(until_pc=len(program))
+            # 0x0000 - 0x0001 - 1
+            self.assertEqual(cpu['HL'], 0xfffe)
+            self.assertEqual(cpu['F'], 0xbb)
+
     # ################
     # rotate and shift
     # ################
     def test_RL(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 'ZP')]
+        tests = [(0x00, 0x00, 'ZP'), (0x80, 0x00, 'ZPC')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
@@ -631,7 +965,7 @@ class TestCPU(unittest.TestCase):
 
     def test_RLC(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 'ZP')]
+        tests = [(0x00, 0x00, 'ZP'), (0x80, 0x01, 'C')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
@@ -640,13 +974,21 @@ class TestCPU(unittest.TestCase):
 
     def test_SLA(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 'ZP')]
+        tests = [(0x00, 0x00, 'ZP'), (0xc1, 0x82, 'SPC')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
             self.assertEqual(cpu.SLA_n(t[0]), t[1])
             self.assertEqual(cpu.reg.get_flags('P'), t[2])
 
+    def test_RLA(self):
+        cpu = CPU()
+        cpu['F'] = 0x01
+        cpu['A'] = 0x80
+        cpu.RLA()
+        self.assertEqual(cpu['A'], 0x01)
+        self.assertEqual(cpu.reg.flag('C'), 1)
+
     def test_RR(self):
         # todo add more edge cases
         tests = [(0x00, 0x00, 'ZP')]
@@ -685,7 +1027,8 @@ class TestCPU(unittest.TestCase):
 
     def test_RLD(self):
         # todo add more edge cases
-        tests = [(0x00, 0x00, 0x00, 0x00, 'ZP')]
+        tests = [(0x00, 0x00, 0x00, 0x00, 'ZP'),
+                 (0x34, 0x98, 0x39, 0x84, 'P')]
         cpu = CPU()
         for t in tests:
             cpu['F'] = 0x00
@@ -731,12 +1074,111 @@ class TestCPU(unittest.TestCase):
     # #######################
     # jump
     # #######################
-    # @todo
+    def test_JP_nn(self):
+        cpu = CPU()
+        cpu[0x0000] = 0xc3        # JP 0x1234
+        cpu[0x0001] = 0x34
+        cpu[0x0002] = 0x12
+        self.assertEqual(cpu.instr_cycle(), 10)
+        self.assertEqual(cpu['PC'], 0x1234)
+
+    def test_JP_cc_nn(self):
+        tests = [('NZ', 0x00, True), ('NZ', 0x40, False),
+                 ('Z', 0x40, True), ('NC', 0x01, False),
+                 ('C', 0x01, True), ('PO', 0x04, False),
+                 ('PE', 0x04, True), ('P', 0x80, False),
+                 ('M', 0x80, True), ('M', 0x00, False)]
+        cpu = CPU()
+        for cc, f, taken in tests:
+            cpu['F'] = f
+            cpu['PC'] = 0x0003
+            cpu.JP_cc_nn(cc, 0x1234)
+            self.assertEqual(cpu['PC'], 0x1234 if taken else 0x0003)
+
+    def test_JR_e(self):
+        cpu = CPU()
+        cpu[0x1000] = 0x18        # JR -2
+        cpu[0x1001] = 0xfe
+        cpu['PC'] = 0x1000
+        self.assertEqual(cpu.instr_cycle(), 12)
+        self.assertEqual(cpu['PC'], 0x1000)
+        cpu[0x1001] = 0x7f        # JR +127
+        cpu.instr_cycle()
+        self.assertEqual(cpu['PC'], 0x1081)
+
+    def test_JR_cc_e(self):
+        cpu = CPU()
+        cpu[0x0000] = 0x20        # JR NZ, +4
+        cpu[0x0001] = 0x04
+        cpu['F'] = 0x40
+        self.assertEqual(cpu.instr_cycle(), 7)
+        self.assertEqual(cpu['PC'], 0x0002)
+        cpu['F'] = 0x00
+        cpu['PC'] = 0x0000
+        self.assertEqual(cpu.instr_cycle(), 12)
+        self.assertEqual(cpu['PC'], 0x0006)
+
+    def test_JP__HL_(self):
+        cpu = CPU()
+        cpu['HL'] = 0x4321
+        cpu['IY'] = 0x1234
+        cpu.JP__HL_()
+        self.assertEqual(cpu['PC'], 0x4321)
+        cpu.JP__ii_('IY')
+        self.assertEqual(cpu['PC'], 0x1234)
+
+    def test_DJNZ_e(self):
+        cpu = CPU()
+        cpu[0x0000] = 0x10        # DJNZ 0x0000
+        cpu[0x0001] = 0xfe
+        cpu['B'] = 0x03
+        result = cpu.run(until_pc=0x0002)
+        self.assertEqual(result.instructions, 3)
+        self.assertEqual(result.tstates, 13 + 13 + 8)
+        self.assertEqual(cpu['B'], 0x00)
 
     # #######################
     # call and return
     # #######################
-    # @todo
+    def test_CALL_RET(self):
+        cpu = CPU()
+        program = [0xcd, 0x00, 0x10,  # CALL 0x1000
+                   0x00]              # NOP
+        for i, c in enumerate(program):
+            cpu[i] = c
+        cpu[0x1000] = 0xc9            # RET
+        cpu['SP'] = 0x8000
+        self.assertEqual(cpu.instr_cycle(), 17)
+        self.assertEqual(cpu['PC'], 0x1000)
+        self.assertEqual(cpu['SP'], 0x7ffe)
+        self.assertEqual(cpu.get16(0x7ffe), 0x0003)
+        self.assertEqual(cpu.instr_cycle(), 10)
+        self.assertEqual(cpu['PC'], 0x0003)
+        self.assertEqual(cpu['SP'], 0x8000)
+
+    def test_CALL_RET_cc(self):
+        cpu = CPU()
+        cpu['SP'] = 0x8000
+        cpu['F'] = 0x01
+        cpu['PC'] = 0x0003
+        self.assertIsNone(cpu.CALL_cc_nn('NC', 0x1000))
+        self.assertEqual(cpu['PC'], 0x0003)
+        self.assertEqual(cpu.CALL_cc_nn('C', 0x1000), 17)
+        self.assertEqual(cpu['PC'], 0x1000)
+        self.assertIsNone(cpu.RET_cc('NC'))
+        self.assertEqual(cpu['PC'], 0x1000)
+        self.assertEqual(cpu.RET_cc('C'), 11)
+        self.assertEqual(cpu['PC'], 0x0003)
+        self.assertEqual(cpu['SP'], 0x8000)
+
+    def test_RST_p(self):
+        cpu = CPU()
+        cpu[0x1234] = 0xff            # RST 38H
+        cpu['PC'] = 0x1234
+        cpu['SP'] = 0x8000
+        self.assertEqual(cpu.instr_cycle(), 11)
+        self.assertEqual(cpu['PC'], 0x0038)
+        self.assertEqual(cpu.get16(0x7ffe), 0x1235)
 
     # #######################
     # input and output
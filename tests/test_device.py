@@ -0,0 +1,127 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.device import Device
+from z80.loader import load_bytes
+
+
+class Counter(Device):
+    """ free running counter incremented every 16 T-states """
+    def __init__(self, cpu):
+        super(Counter, self).__init__(cpu)
+        self.value = 0
+        self.catch_ups = []
+
+    def catch_up(self, now):
+        self.catch_ups.append(now)
+        ticks = (now - self.now) // 16
+        self.value = (self.value + ticks) & 0xff
+        self.now += ticks * 16
+
+    def port_read(self, port):
+        return self.value
+
+    def page_read(self, addr):
+        return self.value
+
+
+class Uart(Device):
+    """ transmits a byte in 1000 T-states, then raises INT """
+    def __init__(self, cpu):
+        super(Uart, self).__init__(cpu)
+        self.busy = False
+        self.sent = []
+
+    def port_read(self, port):
+        return 0x01 if self.busy else 0x00
+
+    def port_write(self, port, value):
+        self.busy = True
+        self.schedule(self.now + 1000, lambda due: self.done(value))
+
+    def done(self, value):
+        self.busy = False
+        self.sent.append((value, self.now))
+        self.cpu.interrupt()
+
+
+class Screen(Device):
+    """ records the writes to its page """
+    def __init__(self, cpu):
+        super(Screen, self).__init__(cpu)
+        self.writes = []
+
+    def page_write(self, addr, value):
+        self.writes.append((addr, value, self.now))
+
+
+class TestDevice(unittest.TestCase):
+    def test_idle_device_is_not_synchronised(self):
+        cpu = CPU()
+        counter = Counter(cpu)
+        cpu.ports.map(0x10, counter)
+        # LD B,0 / DJNZ $ / IN A,(10H)
+        load_bytes(cpu, bytes([0x06, 0x00, 0x10, 0xfe, 0xdb, 0x10]))
+        cpu.run(until_pc=6)
+        self.assertEqual(counter.catch_ups, [7 + 255 * 13 + 8])
+        self.assertEqual(cpu['A'], (7 + 255 * 13 + 8) // 16)
+
+    def test_memory_read(self):
+        for options in ({}, {'block_compiler': True}):
+            cpu = CPU(**options)
+            counter = Counter(cpu)
+            cpu.memory_bus.map(0x4000, 0x100, counter)
+            # LD B,0 / DJNZ $ / LD A,(4000H)
+            load_bytes(cpu, bytes([0x06, 0x00, 0x10, 0xfe, 0x3a, 0x00, 0x40]))
+            cpu.run(until_pc=7)
+            self.assertEqual(counter.catch_ups, [7 + 255 * 13 + 8], options)
+            self.assertEqual(cpu['A'], (7 + 255 * 13 + 8) // 16)
+
+    def test_events(self):
+        cpu = CPU()
+        uart = Uart(cpu)
+        cpu.ports.map(0x20, uart)
+        # 0000: IM 1 / EI / LD A,41H / OUT (20H),A
+        #       poll: IN A,(20H) / RRA / JR C,poll / JR $
+        # 0038: LD B,A / RETI
+        code = bytes([0xed, 0x56, 0xfb, 0x3e, 0x41, 0xd3, 0x20,
+                      0xdb, 0x20, 0x1f, 0x38, 0xfb, 0x18, 0xfe])
+        load_bytes(cpu, code)
+        load_bytes(cpu, bytes([0x47, 0xed, 0x4d]), 0x38)
+        cpu['SP'] = 0xff00
+        cpu.run(max_tstates=2000)
+        # OUT is executed at T-state 8 + 4 + 7
+        self.assertEqual(uart.sent, [(0x41, 19 + 1000)])
+        self.assertFalse(uart.busy)
+        self.assertEqual(cpu['PC'], 0x000c)
+
+    def test_memory_page(self):
+        cpu = CPU()
+        screen = Screen(cpu)
+        cpu.memory_bus.map(0x4000, 0x100, screen)
+        # LD HL,4000H / LD (HL),A / INC L / LD (HL),A
+        load_bytes(cpu, bytes([0x21, 0x00, 0x40, 0x77, 0x2c, 0x77]))
+        cpu['A'] = 0x55
+        cpu.run(until_pc=6)
+        self.assertEqual(screen.writes, [(0x4000, 0x55, 10),
+                                         (0x4001, 0x55, 21)])
@@ -0,0 +1,188 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from multiprocessing import shared_memory
+from xml.etree import ElementTree
+from z80.cpu import CPU
+from z80.farm import Farm
+from z80.farm import Job
+from z80.farm import attach
+from z80.farm import execute
+from z80.farm import junit_xml
+from z80.farm import main
+from z80.farm import memory_diff
+from z80.farm import write_json
+
+
+# sum of 1..B in A stored at 8000H, ends at the JR $ at 0007H
+SUM = bytes([0xaf, 0x80, 0x10, 0xfd, 0x32, 0x00, 0x80, 0x18, 0xfe])
+SUM_END = 7
+
+
+def sum_job(n, **kwargs):
+    return Job('sum{0}'.format(n), 'sum', registers={'B': n},
+               until_pc=SUM_END, **kwargs)
+
+
+class CrashJob(Job):
+    """ job killing the worker process which unpickles it """
+    def __setstate__(self, state):
+        os._exit(1)
+
+
+class TestFarm(unittest.TestCase):
+    def test_memory_diff(self):
+        before = bytearray(0x400)
+        after = bytearray(before)
+        after[0x0ff:0x102] = b'\x01\x02\x03'
+        after[0x3ff] = 4
+        self.assertEqual(memory_diff(before, after),
+                         [(0x0ff, b'\x01\x02\x03'), (0x3ff, b'\x04')])
+        self.assertEqual(memory_diff(before, before), [])
+
+    def test_job_requires_stop_condition(self):
+        with self.assertRaises(ValueError):
+            Job('forever')
+        job = Job.from_dict({'name': 'j', 'until_pc': '0x10',
+                             'load': [{'addr': '0x100', 'hex': '00ff'}],
+                             'expect': {'registers': {'A': '0x0f'},
+                                        'memory': {'0x100': '00'}}})
+        self.assertEqual(job.until_pc, 0x10)
+        self.assertEqual(job.load, [(0x100, b'\x00\xff')])
+        self.assertEqual(job.expect, {'registers': {'A': 0x0f},
+                                      'memory': {0x100: b'\x00'}})
+
+    def test_execute_resets_warm_cpu(self):
+        cpu = CPU()
+        first = execute(cpu, sum_job(10, expect={'registers': {'A': 55}}),
+                        SUM)
+        cpu['H'] = 0x12
+        second = execute(cpu, sum_job(3, expect={'registers': {'A': 7}}),
+                         SUM)
+        self.assertTrue(first.passed)
+        self.assertEqual(first.memory, [(0x8000, bytes([55]))])
+        self.assertEqual(second.registers['A'], 6)
+        self.assertEqual(second.registers['H'], 0)
+        self.assertEqual(second.failures, ['A = 0006, expected 0007'])
+        self.assertEqual(second.reason, 'pc')
+
+    def test_rom_is_mapped_once(self):
+        cpu = CPU()
+        rom = memoryview(SUM + b'\xff' * (0x100 - len(SUM)))
+        # LD (0000H),A writes to the ROM
+        job = Job('rom', load=[(0x100, b'\x32\x00\x00')],
+                  registers={'A': 0x55, 'PC': 0x100}, until_pc=0x103)
+        result = execute(cpu, job, rom)
+        self.assertEqual(result.reason, 'pc')
+        self.assertEqual(result.memory, [])
+        rom_handler = cpu.memory_bus.handler(0)
+        self.assertIs(rom_handler.data, rom)
+        execute(cpu, job, rom)
+        self.assertIs(cpu.memory_bus.handler(0), rom_handler)
+        self.assertEqual(cpu[0x0000], SUM[0])
+        execute(cpu, job)
+        self.assertIsNone(cpu.memory_bus.handler(0))
+        self.assertEqual(cpu[0x0000], 0x55)
+
+    def test_attach_does_not_track(self):
+        block = shared_memory.SharedMemory(create=True, size=16)
+        try:
+            # the resource tracker of a process attaching with tracking
+            # unlinks the block after the process has exited, reading
+            # stderr to its end waits for the tracker
+            child = subprocess.run([
+                sys.executable, '-c',
+                'from z80.farm import attach; attach({0!r}).close()'.
+                format(block.name)], stderr=subprocess.PIPE)
+            self.assertEqual(child.returncode, 0)
+            self.assertEqual(child.stderr, b'')
+            attach(block.name).close()
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_farm(self):
+        jobs = [sum_job(n, expect={'registers': {'A': n * (n + 1) // 2}})
+                for n in range(1, 9)]
+        jobs.append(Job('loaded', load=[(0, SUM), (0x8000, b'\xff')],
+                        registers={'B': 2}, until_pc=SUM_END,
+                        expect={'memory': {0x8000: b'\x03'}}))
+        jobs.append(Job('undefined', load=[(0, b'\xed\x00')],
+                        max_instructions=1))
+        with Farm({'sum': SUM}, workers=2) as farm:
+            results = {r.name: r for r in farm.run(jobs)}
+            with self.assertRaises(KeyError):
+                farm.submit(Job('rom', 'missing', max_instructions=1))
+        self.assertEqual(set(results), {job.name for job in jobs})
+        for n in range(1, 9):
+            result = results['sum{0}'.format(n)]
+            self.assertTrue(result.passed, result.failures)
+            self.assertEqual(result.instructions, 2 + 2 * n)
+        self.assertEqual(results['loaded'].memory, [(0x8000, b'\x03')])
+        self.assertIn('NotImplementedError', results['undefined'].error)
+
+        out = io.StringIO()
+        write_json(list(results.values()), out)
+        self.assertEqual(len(json.loads(out.getvalue())), len(jobs))
+        root = junit_xml(list(results.values())).getroot()
+        self.assertEqual(root.get('tests'), str(len(jobs)))
+        self.assertEqual(root.get('errors'), '1')
+        self.assertEqual(root.get('failures'), '0')
+
+    def test_crashed_worker(self):
+        with Farm(workers=1) as farm:
+            results = list(farm.run([CrashJob('crash', max_instructions=1)]))
+        self.assertEqual([r.name for r in results], ['crash'])
+        self.assertIn('BrokenProcessPool', results[0].error)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def path(name):
+                return os.path.join(directory, name)
+            with open(path('sum.bin'), 'wb') as f:
+                f.write(SUM)
+            with open(path('jobs.json'), 'w') as f:
+                json.dump([{'name': 'ok', 'rom': 'sum', 'until_pc': 7,
+                            'registers': {'B': 4},
+                            'expect': {'memory': {'0x8000': '0a'}}},
+                           {'name': 'bad', 'load': [{'file': 'sum.bin'}],
+                            'until_pc': 7, 'registers': {'B': 4},
+                            'expect': {'registers': {'A': 11}}}], f)
+            status = main([path('jobs.json'),
+                           '--rom', 'sum=' + path('sum.bin'),
+                           '--workers', '1', '--json', path('out.json'),
+                           '--cpu-option', 'block_compiler=true',
+                           '--junit', path('junit.xml')])
+            self.assertEqual(status, 1)
+            with open(path('out.json')) as f:
+                passed = {r['name']: r['passed'] for r in json.load(f)}
+            self.assertEqual(passed, {'ok': True, 'bad': False})
+            root = ElementTree.parse(path('junit.xml')).getroot()
+            self.assertEqual(root.get('failures'), '1')
+            with self.assertRaises(SystemExit):
+                main([path('jobs.json'), '--cpu-option', 'turbo=1'])
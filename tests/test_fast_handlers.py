@@ -0,0 +1,103 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random
+import unittest
+from z80.cpu import CPU
+from z80.cpu import INSTRUCTION_SET
+from z80.fast_handlers import SPECIALISERS
+
+
+def specialised_instructions():
+    return [instr
+            for table in INSTRUCTION_SET.tables.values()
+            for instr in table
+            if instr is not None and instr.fast is not None]
+
+
+def encode(instr, rnd):
+    ret = []
+    for c in instr.opcode:
+        if isinstance(c, int):
+            ret.append(c)
+        elif c.memonic == 'nn':
+            ret += [rnd.randint(0, 0xff), rnd.randint(0, 0xff)]
+        else:
+            ret.append(rnd.randint(0, 0xff))
+    return ret
+
+
+class TestFastHandlers(unittest.TestCase):
+    def setup_cpu(self, cpu, code, rnd, data):
+        for r in 'BCDEHLAF':
+            cpu[r] = rnd.randint(0, 0xff)
+        for rr in ('IX', 'IY', 'SP'):
+            cpu[rr] = rnd.randint(0x0100, 0xffff)
+        cpu.reg.mem[:] = data
+        for i, c in enumerate(code):
+            cpu[i] = c
+        cpu['PC'] = 0x0000
+
+    def assertSameState(self, cpu1, cpu2):
+        self.assertEqual(cpu1.reg.main_register_set,
+                         cpu2.reg.main_register_set)
+        self.assertEqual(cpu1.reg.mem, cpu2.reg.mem)
+
+    def test_specialised(self):
+        instructions = specialised_instructions()
+        self.assertTrue(instructions)
+        names = set(instr.func.__name__ for instr in instructions)
+        self.assertTrue(names <= set(SPECIALISERS))
+        rnd = random.Random(7)
+        data = bytes(rnd.randint(0, 0xff) for _ in range(0x10000))
+        checked = CPU(checked=True)
+        fast = CPU()
+        for instr in instructions:
+            code = encode(instr, rnd)
+            seed = rnd.random()
+            self.setup_cpu(checked, code, random.Random(seed), data)
+            self.setup_cpu(fast, code, random.Random(seed), data)
+            self.assertEqual(checked.instr_cycle(), fast.instr_cycle())
+            self.assertSameState(checked, fast)
+
+    def test_unspecialised(self):
+        instr = INSTRUCTION_SET.tables[()][0xf5]   # PUSH AF
+        self.assertIsNone(instr.fast)
+        self.assertIs(instr.unchecked, instr.func)
+        self.assertEqual(instr.unchecked_args, ('AF',))
+
+    def test_operands(self):
+        cpu = CPU()
+        cpu[0x0000] = 0xdd        # LD (IX+d), n
+        cpu[0x0001] = 0x36
+        cpu[0x0002] = 0xfe
+        cpu[0x0003] = 0x42
+        cpu['IX'] = 0x8002
+        instr, args = INSTRUCTION_SET.decode(cpu.reg.mem, 0x0000, False)
+        self.assertEqual(args, (-2, 0x42))
+        instr, args = INSTRUCTION_SET.decode(cpu.reg.mem, 0x0000)
+        self.assertEqual(args, ('IX', -2, 0x42))
+        cpu.run(max_instructions=1)
+        self.assertEqual(cpu[0x8000], 0x42)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.flags import PARITY
+from z80.flags import SZ53P
+from z80.flags import INC_FLAGS
+from z80.flags import DEC_FLAGS
+from z80.flags import adc16_f
+from z80.flags import add16_f
+from z80.flags import add_flags
+from z80.flags import add_table
+from z80.flags import compare_f
+from z80.flags import logic_f
+from z80.flags import sbc16_f
+from z80.flags import sub_flags
+from z80.flags import sub_table
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def reference_add(a, n, carry):
+    res = a + n + carry
+    t = res % 0x100
+    f = t & 0xa8
+    if t == 0:
+        f |= 0x40
+    if (a & 0x0f) + (n & 0x0f) + carry > 0x0f:
+        f |= 0x10
+    if (a & 0x80) == (n & 0x80) and (t & 0x80) != (a & 0x80):
+        f |= 0x04
+    if res > 0xff:
+        f |= 0x01
+    return t, f
+
+
+def reference_sub(a, n, borrow):
+    res = a - n - borrow
+    t = res % 0x100
+    f = (t & 0xa8) | 0x02
+    if t == 0:
+        f |= 0x40
+    if (a & 0x0f) - (n & 0x0f) - borrow < 0:
+        f |= 0x10
+    if (a & 0x80) != (n & 0x80) and (t & 0x80) != (a & 0x80):
+        f |= 0x04
+    if res < 0:
+        f |= 0x01
+    return t, f
+
+
+class TestFlags(unittest.TestCase):
+    def test_parity(self):
+        self.assertEqual(PARITY[0x00], 0x04)
+        self.assertEqual(PARITY[0x01], 0x00)
+        self.assertEqual(PARITY[0x03], 0x04)
+        self.assertEqual(PARITY[0xfe], 0x00)
+
+    def test_SZ53P(self):
+        self.assertEqual(SZ53P[0x00], 0x44)
+        self.assertEqual(SZ53P[0x80], 0x80)
+        self.assertEqual(SZ53P[0x28], 0x2c)
+
+    def test_INC_DEC_flags(self):
+        self.assertEqual(INC_FLAGS[0x00], 0x00)
+        self.assertEqual(INC_FLAGS[0xa0], 0xa0)
+        self.assertEqual(DEC_FLAGS[0x01], 0x42)
+        self.assertEqual(DEC_FLAGS[0x80], 0x3e)
+        # V at the signed overflow, H at the carry out of / borrow into
+        # bit 4
+        self.assertEqual(INC_FLAGS[0x7f], 0x94)
+        self.assertEqual(INC_FLAGS[0x80], 0x80)
+        self.assertEqual(INC_FLAGS[0x7e], 0x28)
+        self.assertEqual(INC_FLAGS[0x0f], 0x10)
+        self.assertEqual(INC_FLAGS[0x10], 0x00)
+        self.assertEqual(INC_FLAGS[0xff], 0x50)
+        self.assertEqual(DEC_FLAGS[0x7f], 0x2a)
+        self.assertEqual(DEC_FLAGS[0x81], 0x82)
+        self.assertEqual(DEC_FLAGS[0x10], 0x1a)
+        self.assertEqual(DEC_FLAGS[0x0f], 0x0a)
+        self.assertEqual(DEC_FLAGS[0x00], 0xba)
+
+    def test_add_vectors(self):
+        # (a, n, carry, result, F)
+        tests = [(0xff, 0x01, 0, 0x00, 0x51),
+                 (0x7f, 0x01, 0, 0x80, 0x94),
+                 (0x80, 0x80, 0, 0x00, 0x45),
+                 (0x0f, 0x00, 1, 0x10, 0x10),
+                 (0xff, 0xff, 1, 0xff, 0xb9),
+                 (0x12, 0x34, 0, 0x46, 0x00)]
+        for a, n, carry, t, f in tests:
+            self.assertEqual(add_flags(a, n, carry), (t, f))
+
+    def test_sub_vectors(self):
+        # (a, n, borrow, result, F)
+        tests = [(0x03, 0x05, 0, 0xfe, 0xbb),
+                 (0x05, 0x03, 0, 0x02, 0x02),
+                 (0x40, 0x40, 0, 0x00, 0x42),
+                 (0x80, 0x01, 0, 0x7f, 0x3e),
+                 (0x7f, 0xff, 0, 0x80, 0x87),
+                 (0x10, 0x01, 0, 0x0f, 0x1a),
+                 (0x00, 0x00, 1, 0xff, 0xbb),
+                 (0x05, 0x04, 1, 0x00, 0x42)]
+        for a, n, borrow, t, f in tests:
+            self.assertEqual(sub_flags(a, n, borrow), (t, f))
+
+    def test_compare_f(self):
+        # C on A < n, 5 and 3 from n
+        self.assertEqual(compare_f(0x00, 0x03, 0x05), 0x93)
+        self.assertEqual(compare_f(0xff, 0x05, 0x03), 0x02)
+        self.assertEqual(compare_f(0x00, 0x28, 0x28), 0x6a)
+        self.assertEqual(compare_f(0x00, 0x00, 0x80), 0x87)
+
+    def test_logic_f(self):
+        # H for AND only, 5 and 3 from the result, not from the old F
+        self.assertEqual(logic_f(0xff, 0x00, 0x10), 0x54)
+        self.assertEqual(logic_f(0xff, 0x00, 0x00), 0x44)
+        self.assertEqual(logic_f(0x00, 0xa8, 0x00), 0xa8)
+        self.assertEqual(logic_f(0x28, 0x01, 0x00), 0x00)
+
+    def test_add_flags(self):
+        for carry in (0, 1):
+            for a in range(0x100):
+                for n in range(0, 0x100, 7):
+                    self.assertEqual(add_flags(a, n, carry),
+                                     reference_add(a, n, carry))
+
+    def test_sub_flags(self):
+        for borrow in (0, 1):
+            for a in range(0x100):
+                for n in range(0, 0x100, 7):
+                    self.assertEqual(sub_flags(a, n, borrow),
+                                     reference_sub(a, n, borrow))
+
+    def test_16_bit_vectors(self):
+        # C on a result above 0xffff, H on the carry out of bit 11
+        self.assertEqual(add16_f(0x00, 0xffff, 0x0001), 0x11)
+        self.assertEqual(add16_f(0xc4, 0x0fff, 0x0001), 0xd4)
+        self.assertEqual(add16_f(0x03, 0x8000, 0x7fff), 0x28)
+        self.assertEqual(adc16_f(0x00, 0x7fff, 0x0000, 1), 0x94)
+        self.assertEqual(adc16_f(0x00, 0xffff, 0x0000, 1), 0x51)
+        self.assertEqual(adc16_f(0x00, 0xfffe, 0x0000, 1), 0xa8)
+        self.assertEqual(sbc16_f(0x00, 0x0000, 0x0000, 1), 0xbb)
+        self.assertEqual(sbc16_f(0x00, 0x8000, 0x0001, 0), 0x3e)
+        self.assertEqual(sbc16_f(0x00, 0x1234, 0x1234, 0), 0x42)
+        self.assertEqual(sbc16_f(0x00, 0x0003, 0x0005, 0), 0xbb)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_add_table(self):
+        table = add_table()
+        self.assertIs(table, add_table())
+        self.assertEqual(table.shape, (2, 0x100, 0x100))
+        for carry in (0, 1):
+            for a in range(0, 0x100, 3):
+                for n in range(0, 0x100, 5):
+                    t, f = reference_add(a, n, carry)
+                    self.assertEqual(table[carry, a, n], (t << 8) | f)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_sub_table(self):
+        table = sub_table()
+        self.assertIs(table, sub_table())
+        self.assertEqual(table.shape, (2, 0x100, 0x100))
+        for borrow in (0, 1):
+            for a in range(0, 0x100, 3):
+                for n in range(0, 0x100, 5):
+                    t, f = reference_sub(a, n, borrow)
+                    self.assertEqual(table[borrow, a, n], (t << 8) | f)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.device import Device
+from z80.loader import load_bytes
+from z80.scheduler import INFINITY
+
+
+class Status(Device):
+    """ status port reading 01H from ready on, a byte at 8000H is set
+        at the same time """
+    def __init__(self, cpu, ready):
+        super(Status, self).__init__(cpu)
+        self.ready = False
+        self.schedule(ready, self.done)
+
+    def done(self, due):
+        self.ready = True
+        load_bytes(self.cpu, b'\x01', 0x8000)
+
+    def port_read(self, port):
+        return 0x01 if self.ready else 0x00
+
+
+class Counter(Device):
+    """ free running counter incremented every 16 T-states """
+    def catch_up(self, now):
+        self.now = now
+
+    def port_read(self, port):
+        return (self.now // 16) & 0xff
+
+    def stable_until(self, now):
+        return (now // 16 + 1) * 16
+
+
+class Flag(Device):
+    """ memory mapped flag reading 01H from ready on, without event """
+    def __init__(self, cpu, ready):
+        super(Flag, self).__init__(cpu)
+        self.ready = ready
+
+    def page_read(self, addr):
+        return 0x01 if self.now >= self.ready else 0x00
+
+    def stable_until(self, now):
+        return self.ready if now < self.ready else INFINITY
+
+
+def run_both(code, ready=None, **kwargs):
+    """ runs code with and without idle detection, returns the CPUs """
+    cpus = []
+    for idle_detection in (False, True):
+        cpu = CPU(idle_detection=idle_detection)
+        load_bytes(cpu, code)
+        cpu['SP'] = 0xff00
+        if ready is not None:
+            cpu.ports.map(0x20, Status(cpu, ready))
+        cpu.ports.map(0x30, Counter(cpu))
+        cpu.result = cpu.run(**kwargs)
+        cpus.append(cpu)
+    return cpus
+
+
+class TestIdleDetector(unittest.TestCase):
+    def assertSame(self, slow, fast):
+        self.assertEqual(fast.result, slow.result)
+        self.assertEqual(fast.tstates, slow.tstates)
+        self.assertEqual(fast.reg.save_registers(), slow.reg.save_registers())
+        self.assertEqual(fast.reg.mem, slow.reg.mem)
+
+    def test_port_polling(self):
+        # 0000: IN A,(20H) / RRA / JR NC,0000H / HALT
+        code = bytes([0xdb, 0x20, 0x1f, 0x30, 0xfb, 0x76])
+        slow, fast = run_both(code, ready=100003, until_pc=0x0005)
+        self.assertSame(slow, fast)
+        self.assertGreaterEqual(fast.tstates, 100003)
+        self.assertEqual(fast.idle_detector.skips, 1)
+        self.assertGreater(fast.idle_detector.skipped, 90000)
+
+    def test_djnz_timeout(self):
+        # 0000: LD B,0 / LD A,(8000H) / AND 1 / JR NZ,000BH /
+        #       DJNZ 0002H / HALT
+        code = bytes([0x06, 0x00, 0x3a, 0x00, 0x80, 0xe6, 0x01, 0x20, 0x02,
+                      0x10, 0xf7, 0x76])
+        for ready in (None, 6001):
+            slow, fast = run_both(code, ready=ready, until_pc=0x000b)
+            self.assertSame(slow, fast)
+            self.assertEqual(fast.idle_detector.skips, 1)
+        # timed out
+        slow, fast = run_both(code, until_pc=0x000b)
+        self.assertEqual(fast['B'], 0)
+        self.assertEqual(fast.tstates, 7 + 256 * 40 - 5)
+
+    def test_jr_to_itself(self):
+        # 0000: IM 1 / EI / JR $ ... 0038: HALT
+        code = bytes([0xed, 0x56, 0xfb, 0x18, 0xfe]) + bytes(0x33) + b'\x76'
+        cpus = []
+        for idle_detection in (False, True):
+            cpu = CPU(idle_detection=idle_detection)
+            load_bytes(cpu, code)
+            cpu['SP'] = 0xff00
+            cpu.schedule(123457, lambda due, cpu=cpu: cpu.interrupt())
+            cpu.result = cpu.run(until_pc=0x0038)
+            cpus.append(cpu)
+        self.assertSame(*cpus)
+        self.assertGreater(cpus[1].idle_detector.skipped, 110000)
+
+    def test_instruction_budget(self):
+        # 0000: JR $
+        slow, fast = run_both(bytes([0x18, 0xfe]), max_instructions=10000)
+        self.assertSame(slow, fast)
+        self.assertEqual(fast.tstates, 120000)
+
+    def test_counter_port(self):
+        # 0000: IN A,(30H) / CP 0C0H / JR NZ,0000H / HALT
+        code = bytes([0xdb, 0x30, 0xfe, 0xc0, 0x20, 0xfa, 0x76])
+        slow, fast = run_both(code, until_pc=0x0006)
+        self.assertSame(slow, fast)
+        # the value changes every 16 T-states: nothing to skip
+        self.assertEqual(fast.idle_detector.skips, 0)
+
+    def test_page_polling(self):
+        # 0000: LD A,(4000H) / RRA / JR NC,0000H / HALT
+        code = bytes([0x3a, 0x00, 0x40, 0x1f, 0x30, 0xfa, 0x76])
+        cpus = []
+        for idle_detection in (False, True):
+            cpu = CPU(idle_detection=idle_detection)
+            load_bytes(cpu, code)
+            cpu.memory_bus.map(0x4000, 0x100, Flag(cpu, 100003))
+            cpu.result = cpu.run(until_pc=0x0006)
+            cpus.append(cpu)
+        slow, fast = cpus
+        self.assertEqual(fast.result, slow.result)
+        self.assertEqual(fast.tstates, slow.tstates)
+        self.assertGreaterEqual(fast.tstates, 100003)
+        self.assertEqual(fast.idle_detector.skips, 1)
+
+    def test_side_effects(self):
+        for code in (
+                # 0000: LD (8000H),A / JR 0000H
+                [0x32, 0x00, 0x80, 0x18, 0xfb],
+                # 0000: OUT (20H),A / JR 0000H
+                [0xd3, 0x20, 0x18, 0xfc],
+                # 0000: INC A / JR 0000H
+                [0x3c, 0x18, 0xfd],
+                # 0000: LD A,(BC) / DJNZ 0000H
+                [0x0a, 0x10, 0xfd]):
+            slow, fast = run_both(bytes(code), max_tstates=50000)
+            self.assertSame(slow, fast)
+            self.assertEqual(fast.idle_detector.skips, 0, code)
+
+    def test_reset(self):
+        cpu = CPU(idle_detection=True)
+        cpu.run(max_tstates=100)
+        cpu.reset()
+        self.assertEqual(len(cpu.scheduler), 1)
+        # 0000: JR $
+        load_bytes(cpu, bytes([0x18, 0xfe]))
+        result = cpu.run(max_instructions=100000)
+        self.assertEqual(result.tstates, 1200000)
+        self.assertGreater(cpu.idle_detector.skips, 0)
@@ -0,0 +1,97 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+import unittest
+from z80.cpu import CPU
+
+
+class TestInstructionCache(unittest.TestCase):
+    def run_program(self, cpu, start, end):
+        cpu['PC'] = start
+        while cpu['PC'] != end:
+            cpu.instr_cycle()
+
+    def test_hits_and_misses(self):
+        cpu = CPU(instruction_cache=True)
+        cache = cpu.instruction_cache
+        cpu[0x0000] = 0x3e  # LD A, 0x10
+        cpu[0x0001] = 0x10
+        cpu[0x0002] = 0x47  # LD B, A
+        self.run_program(cpu, 0x0000, 0x0003)
+        self.assertEqual(cpu['B'], 0x10)
+        self.assertEqual(cache.stats(), {'hits': 0,
+                                         'misses': 2,
+                                         'invalidations': 0,
+                                         'entries': 2})
+        self.run_program(cpu, 0x0000, 0x0003)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+
+    def test_invalidation_on_write(self):
+        cpu = CPU(instruction_cache=True)
+        cache = cpu.instruction_cache
+        cpu[0x0000] = 0x3e  # LD A, 0x10
+        cpu[0x0001] = 0x10
+        self.run_program(cpu, 0x0000, 0x0002)
+        self.assertEqual(cpu['A'], 0x10)
+        cpu[0x0002] = 0x00  # not covered by LD A, n
+        self.assertEqual(cache.invalidations, 0)
+        cpu[0x0001] = 0x20
+        self.assertEqual(cache.invalidations, 1)
+        self.run_program(cpu, 0x0000, 0x0002)
+        self.assertEqual(cpu['A'], 0x20)
+        self.assertEqual(cache.misses, 2)
+
+    def test_self_modifying_code(self):
+        cpu = CPU(instruction_cache=True)
+        cpu['HL'] = 0x0001
+        cpu[0x0000] = 0x36  # LD (HL), 0x3c   ; patches itself
+        cpu[0x0001] = 0x3c
+        self.run_program(cpu, 0x0000, 0x0002)
+        self.assertEqual(cpu[0x0001], 0x3c)
+        cpu[0x0001] = 0x04  # LD (HL), 0x04: INC B
+        self.run_program(cpu, 0x0000, 0x0002)
+        self.assertEqual(cpu[0x0001], 0x04)
+        self.assertEqual(cpu.instruction_cache.invalidations, 2)
+
+    def test_invalidate_range(self):
+        cpu = CPU(instruction_cache=True)
+        cache = cpu.instruction_cache
+        for addr in (0x0000, 0x0004, 0xfffe):
+            cpu[addr] = 0x3e
+            cache.get(addr)
+        cpu.reg.invalidate_range(0xffff, 0x10001)
+        self.assertEqual(sorted(cache.entries.keys()), [0x0004])
+        cpu.reg.invalidate_range(0x0000, 0x1000)
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(cache.invalidations, 3)
+
+    def test_without_cache(self):
+        cpu = CPU()
+        self.assertIsNone(cpu.instruction_cache)
+        cpu[0x0000] = 0x06  # LD B, 0x42
+        cpu[0x0001] = 0x42
+        self.assertEqual(cpu.instr_cycle(), 7)
+        self.assertEqual(cpu['B'], 0x42)
+        self.assertEqual(cpu['PC'], 0x0002)
+
+
+if __name__ == '__main__':
+    unittest.main()
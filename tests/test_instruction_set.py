@@ -0,0 +1,105 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+import unittest
+from z80.cpu import INSTRUCTION_SET
+from z80.instruction_set import PREFIXES
+
+
+class TestInstructionSet(unittest.TestCase):
+    def decode(self, codes, addr=0x0000):
+        mem = bytearray(0x10000)
+        for i, c in enumerate(codes):
+            mem[(addr + i) % 0x10000] = c
+        return INSTRUCTION_SET.decode(mem, addr)
+
+    def test_tables(self):
+        self.assertEqual(sorted(INSTRUCTION_SET.tables.keys()),
+                         sorted(PREFIXES))
+        for table in INSTRUCTION_SET.tables.values():
+            self.assertEqual(len(table), 0x100)
+        count = sum(len(t.instructions)
+                    for g in INSTRUCTION_SET.groups
+                    for t in g.instruction_templates)
+        self.assertEqual(count,
+                         sum(1
+                             for table in INSTRUCTION_SET.tables.values()
+                             for instr in table
+                             if instr is not None))
+
+    def test_decode_unprefixed(self):
+        instr, args = self.decode([0x50])
+        self.assertEqual(instr.assembler, ['LD', 'D', 'B'])
+        self.assertEqual(args, ('D', 'B'))
+        self.assertEqual(instr.size, 1)
+        instr, args = self.decode([0x3e, 0x42])
+        self.assertEqual(instr.assembler, ['LD', 'A', 'n'])
+        self.assertEqual(args, ('A', 0x42))
+        self.assertEqual(instr.size, 2)
+        instr, args = self.decode([0x3a, 0x34, 0x12])
+        self.assertEqual(instr.assembler, ['LD', 'A', '(nn)'])
+        self.assertEqual(args, (0x1234, ))
+        self.assertEqual(instr.size, 3)
+
+    def test_decode_prefixed(self):
+        instr, args = self.decode([0xed, 0x43, 0x34, 0x12])
+        self.assertEqual(instr.assembler, ['LD', '(nn)', 'BC'])
+        self.assertEqual(args, (0x1234, 'BC'))
+        self.assertEqual(instr.size, 4)
+        instr, args = self.decode([0xcb, 0x47])
+        self.assertEqual(instr.assembler, ['BIT', '0', 'A'])
+        self.assertEqual(args, (0, 'A'))
+        instr, args = self.decode([0xfd, 0x36, 0xfe, 0x12])
+        self.assertEqual(instr.assembler, ['LD', '(IY+d)', 'n'])
+        self.assertEqual(args, ('IY', -2, 0x12))
+
+    def test_decode_jumps(self):
+        instr, args = self.decode([0x20, 0xfe])
+        self.assertEqual(instr.assembler, ['JR', 'NZ', 'e'])
+        self.assertEqual(args, (-2, ))
+        instr, args = self.decode([0xfa, 0x34, 0x12])
+        self.assertEqual(instr.assembler, ['JP', 'M', 'nn'])
+        self.assertEqual(args, ('M', 0x1234))
+        instr, args = self.decode([0xef])
+        self.assertEqual(instr.assembler, ['RST', '28H'])
+        self.assertEqual(args, (0x28, ))
+
+    def test_assembler_tree(self):
+        self.assertIs(INSTRUCTION_SET.assembler['RET'][''],
+                      INSTRUCTION_SET.base[0xc9])
+        self.assertIs(INSTRUCTION_SET.assembler['RET']['NZ'],
+                      INSTRUCTION_SET.base[0xc0])
+
+    def test_decode_index_bit(self):
+        instr, args = self.decode([0xdd, 0xcb, 0x05, 0x7e])
+        self.assertEqual(instr.assembler, ['BIT', '7', '(IX+d)'])
+        self.assertEqual(args, (7, 'IX', 5))
+        self.assertEqual(instr.size, 4)
+        instr, args = self.decode([0xfd, 0xcb, 0x80, 0x06], addr=0xfffe)
+        self.assertEqual(instr.assembler, ['RLC', '(IY+d)'])
+        self.assertEqual(args, ('IY', -128))
+
+    def test_decode_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            self.decode([0xed, 0x00])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import tempfile
+import unittest
+from z80.cpu import CPU
+from z80.loader import load
+from z80.loader import load_bytes
+from z80.loader import memory_array
+from z80.loader import parse_intel_hex
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+HEX = '''
+:0300300002337A1E
+:10010000214601360121470136007EFE09D2190140
+:100110002146017E17C20001FF5F16002148011928
+:0400000500000100F6
+:00000001FF
+'''
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        return path
+
+    def test_load_bytes(self):
+        cpu = CPU(instruction_cache=True)
+        cpu.reg.mem[0xfffe] = 0x3c          # INC A
+        cpu.run(max_instructions=1)
+        self.assertEqual(load_bytes(cpu, b'\x04\x05\x06', 0xfffe), 3)
+        self.assertEqual((cpu[0xfffe], cpu[0xffff], cpu[0x0000]),
+                         (4, 5, 6))
+        self.assertEqual(cpu.instruction_cache.stats()['entries'], 0)
+        with self.assertRaises(ValueError):
+            load_bytes(cpu, bytes(0x10001))
+
+    def test_load_binary(self):
+        cpu = CPU()
+        image = bytes(range(256)) * 192
+        self.assertEqual(load(cpu, self.write('rom.bin', image), 0x4000),
+                         len(image))
+        self.assertEqual(bytes(cpu.memory[0x4000:0x10000]), image)
+        self.assertEqual(load(cpu, self.write('empty.bin', b'')), 0)
+
+    def test_load_com(self):
+        cpu = CPU()
+        self.assertEqual(load(cpu, self.write('prog.COM', b'\xc9')), 1)
+        self.assertEqual((cpu['PC'], cpu['SP'], cpu[0x100]),
+                         (0x100, 0xfffe, 0xc9))
+        cpu.run(max_instructions=1)
+        self.assertEqual(cpu['PC'], 0)
+
+    def test_parse_intel_hex(self):
+        blocks, start = parse_intel_hex(HEX)
+        self.assertEqual([(addr, len(data)) for addr, data in blocks],
+                         [(0x30, 3), (0x100, 32)])
+        self.assertEqual(blocks[0][1], b'\x02\x33\x7a')
+        self.assertEqual(start, 0x100)
+        for text in (':0300300002337A1F', '0300300002337A1E',
+                     ':0400300002337A1E', ':02FFFF000102FD'):
+            with self.assertRaises(ValueError):
+                parse_intel_hex(text)
+
+    def test_load_intel_hex(self):
+        cpu = CPU()
+        self.assertEqual(load(cpu, self.write('prog.hex', HEX)), 35)
+        self.assertEqual(cpu['PC'], 0x100)
+        self.assertEqual(cpu[0x11f], 0x19)
+
+    def test_memory_view(self):
+        cpu = CPU()
+        view = cpu.memory
+        view[0x8000] = 0x12
+        self.assertEqual(cpu[0x8000], 0x12)
+        self.assertEqual(len(view), 0x10000)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_memory_array(self):
+        cpu = CPU()
+        cpu[0x1234] = 7
+        array = memory_array(cpu)
+        self.assertEqual(array[0x1234], 7)
+        array[0x10:0x20] = 1
+        self.assertEqual(cpu[0x1f], 1)
@@ -0,0 +1,177 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.memory import PageHandler
+
+
+ENGINES = ({}, {'checked': True}, {'lazy_flags': True},
+           {'instruction_cache': True}, {'block_compiler': True})
+
+
+class Counter(PageHandler):
+    """ memory mapped device counting the writes to its page """
+    def __init__(self):
+        self.writes = []
+
+    def read_byte(self, addr, now):
+        return len(self.writes)
+
+    def write_byte(self, addr, value, now):
+        self.writes.append((addr, value))
+
+
+class Fifo(PageHandler):
+    """ memory mapped input register, reading consumes a byte """
+    timed = True
+
+    def __init__(self, data):
+        self.data = list(data)
+        self.reads = []
+
+    def read_byte(self, addr, now):
+        self.reads.append((addr, now))
+        return self.data.pop(0) if self.data else 0xff
+
+
+def run(cpu, code, **registers):
+    cpu.reg.mem[0x8000:0x8000 + len(code)] = code
+    cpu['PC'] = 0x8000
+    for r, value in registers.items():
+        cpu[r] = value
+    cpu.run(until_pc=0x8000 + len(code))
+
+
+class TestMemoryBus(unittest.TestCase):
+    def test_rom(self):
+        for options in ENGINES:
+            cpu = CPU(**options)
+            rom = cpu.memory_bus.map_rom(0x0000, b'\x01\x02\x03')
+            self.assertEqual(cpu.memory_bus.handler(0x00ff), rom)
+            self.assertIsNone(cpu.memory_bus.handler(0x0100))
+            self.assertEqual(bytes(cpu.memory[:4]), b'\x01\x02\x03\xff')
+            # LD (HL),A / LD (0001H),HL / LDIR
+            run(cpu, bytes([0x77, 0x22, 0x01, 0x00, 0xed, 0xb0]),
+                A=0x55, HL=0x0000, DE=0x00fe, BC=4)
+            self.assertEqual(bytes(cpu.memory[:4]), b'\x01\x02\x03\xff',
+                             options)
+            self.assertEqual(bytes(cpu.memory[0xfe:0x102]),
+                             b'\xff\xff\x03\xff', options)
+            cpu.reset()
+            self.assertEqual(cpu[0x0001], 0x02)
+
+    def test_banks(self):
+        cpu = CPU(block_compiler=True)
+        banks = [bytes([0x3e, n, 0xc9]) + bytes(0x3ffd) for n in range(4)]
+        window = cpu.memory_bus.map_banks(0x4000, banks)
+        for n in (2, 0, 3):
+            window.select(n)
+            # CALL 4000H
+            run(cpu, bytes([0xcd, 0x00, 0x40]), SP=0xff00)
+            self.assertEqual(cpu['A'], n)
+        # the selected bank is mirrored to the RAM
+        self.assertEqual(cpu.reg.ram[0x4000:0x4003], banks[3][:3])
+        cpu[0x4001] = 0x10
+        window.select(1)
+        self.assertEqual(cpu[0x4001], 1)
+        window.select(3)
+        self.assertEqual(cpu[0x4001], 0x10)
+        self.assertEqual(window.banks[3][1], 0x10)
+
+        window = cpu.memory_bus.map_banks(0xc000, banks[:2], read_only=True)
+        cpu[0xc000] = 0
+        self.assertEqual(cpu[0xc000], 0x3e)
+
+    def test_device(self):
+        cpu = CPU(instruction_cache=True)
+        device = Counter()
+        cpu.memory_bus.map(0xf000, 0x100, device)
+        run(cpu, bytes([0x77, 0x77]), A=0x42, HL=0xf010)
+        self.assertEqual(device.writes, [(0xf010, 0x42), (0xf010, 0x42)])
+        self.assertEqual(cpu[0xf010], 2)
+        self.assertEqual(cpu.reg.ram[0xf010], 0)
+
+    def test_read_side_effects(self):
+        for options in ENGINES:
+            cpu = CPU(**options)
+            fifo = Fifo(b'ab')
+            cpu.memory_bus.map(0xf000, 0x100, fifo)
+            # LD A,(HL) / LD B,A / LD A,(HL)
+            run(cpu, bytes([0x7e, 0x47, 0x7e]), HL=0xf000)
+            self.assertEqual((cpu['B'], cpu['A']), (0x61, 0x62), options)
+            self.assertEqual(fifo.reads, [(0xf000, 0), (0xf000, 11)],
+                             options)
+            self.assertEqual(fifo.data, [])
+            # snapshots and the verify_flags shadow do not read
+            bytes(cpu.reg.mem)
+            self.assertEqual(len(fifo.reads), 2)
+
+    def test_map(self):
+        cpu = CPU()
+        bus = cpu.memory_bus
+        reg = cpu.reg
+        with self.assertRaises(ValueError):
+            bus.map(0x0010, 0x100, Counter())
+        with self.assertRaises(ValueError):
+            bus.map_rom(0xff00, bytes(0x101))
+        self.assertIsNone(reg.paged)
+        bus.map_rom(0xff00, b'\x76')
+        self.assertEqual(cpu[0xff00], 0x76)
+        self.assertEqual(reg.code_caches, [])
+        self.assertIs(reg.paged, bus.memory)
+        device = Counter()
+        bus.map(0xf000, 0x100, device)
+        self.assertIs(reg.mem, bus.memory)
+        bus.unmap(0xf000, 0x100)
+        self.assertIs(reg.mem, reg.ram)
+        bus.unmap(0xff00, 0x100)
+        self.assertIsNone(reg.paged)
+        # the mirrored bytes stay
+        self.assertEqual(cpu[0xff00], 0x76)
+        cpu[0xff00] = 0
+        self.assertEqual(cpu[0xff00], 0)
+
+    def test_mirrored_pages_are_plain_ram_for_reads(self):
+        # the CPU reads ROM and banks directly from the RAM bytearray,
+        # so mapping them does not slow down any memory read
+        cpu = CPU()
+        ram = cpu.reg.ram
+        cpu.memory_bus.map_rom(0x0000, b'\x01\x02')
+        cpu.memory_bus.map_banks(0x8000, [b'\x03' * 0x4000, b'\x04' * 0x4000])
+        self.assertIs(cpu.reg.mem, ram)
+        self.assertIs(type(ram), bytearray)
+        self.assertEqual(ram[0x0001], 0x02)
+        self.assertEqual(ram[0x8000], 0x03)
+
+    def test_slices(self):
+        cpu = CPU()
+        cpu.memory_bus.map_rom(0x0100, b'\x01\x02')
+        device = Counter()
+        cpu.memory_bus.map(0x0200, 0x200, device)
+        mem = cpu.reg.mem
+        mem[0x00fe:0x0202] = bytes(i & 0xff for i in range(0x104))
+        self.assertEqual(device.writes, [(0x200, 0x02), (0x201, 0x03)])
+        self.assertEqual(mem[0x00fc:0x0102], b'\x00\x00\x00\x01\x01\x02')
+        self.assertEqual(mem[0x03ff:0x0401], b'\x02\x00')
+        self.assertEqual(len(bytes(mem)), 0x10000)
+        with self.assertRaises(ValueError):
+            mem[0:4:2]
@@ -0,0 +1,102 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.loader import load_bytes
+from z80.pacing import Pacer
+
+
+class FakeClock(object):
+    """ wall clock advanced by sleep and by the emulated code at cost
+        seconds per T-state """
+    def __init__(self, cpu, cost):
+        self.cpu = cpu
+        self.cost = cost
+        self.now = 0.0
+        self.last = cpu.tstates
+        self.sleeps = []
+
+    def timer(self):
+        self.now += (self.cpu.tstates - self.last) * self.cost
+        self.last = self.cpu.tstates
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def pacer(cost, **kwargs):
+    cpu = CPU()
+    # 0000: JR $
+    load_bytes(cpu, bytes([0x18, 0xfe]))
+    clock = FakeClock(cpu, cost)
+    return Pacer(cpu, clock=1000000, frame_tstates=20000,
+                 timer=clock.timer, sleep=clock.sleep, **kwargs), clock
+
+
+class TestPacer(unittest.TestCase):
+    def test_real_time(self):
+        # the host runs at 4 times the speed of the target
+        p, clock = pacer(0.25e-6)
+        stats = p.run(frames=10)
+        self.assertEqual(stats.frames, 10)
+        self.assertEqual(stats.overruns, 0)
+        self.assertEqual(len(clock.sleeps), 10)
+        self.assertAlmostEqual(stats.speed, 1.0, places=2)
+        self.assertAlmostEqual(stats.mhz, 1.0, places=2)
+        # the overshoot of JR $ is taken from the next frame
+        self.assertLess(p.cpu.tstates - 200000, 12)
+        self.assertAlmostEqual(clock.now, p.cpu.tstates / 1e6)
+
+    def test_drift(self):
+        # a sleep oversleeping by a millisecond does not accumulate
+        p, clock = pacer(0.25e-6)
+
+        def sleep(seconds):
+            clock.sleep(seconds + 0.001)
+        p.sleep = sleep
+        p.run(seconds=0.2)
+        self.assertEqual(p.stats.frames, 10)
+        self.assertAlmostEqual(clock.now, 0.2 + 0.001, places=4)
+        # 15 ms requested for the first frame, 14 ms for the second one
+        self.assertAlmostEqual(clock.sleeps[1], 0.015, places=4)
+
+    def test_overruns(self):
+        # the host runs at half the speed of the target
+        p, clock = pacer(2e-6)
+        stats = p.run(frames=9)
+        self.assertEqual(stats.overruns, 9)
+        self.assertEqual(clock.sleeps, [])
+        self.assertAlmostEqual(stats.speed, 0.5, places=2)
+        # the lag of more than 5 frames after the 5th frame is dropped
+        self.assertEqual(stats.resyncs, 1)
+        self.assertGreater(stats.max_lag, 0.1)
+
+    def test_turbo(self):
+        p, clock = pacer(0.25e-6, turbo=True)
+        stats = p.run(frames=4)
+        self.assertEqual(clock.sleeps, [])
+        self.assertAlmostEqual(stats.speed, 4.0, places=2)
+        p.turbo = False
+        p.run(frames=1)
+        self.assertAlmostEqual(clock.sleeps[0], 0.015, places=4)
@@ -0,0 +1,149 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.loader import load_bytes
+from z80.ports import PortBus
+from z80.ports import PortDevice
+
+
+ENGINES = ({}, {'checked': True}, {'verify_flags': True},
+           {'instruction_cache': True}, {'block_compiler': True})
+
+
+class Serial(PortDevice):
+    """ returns the bytes of data, records the output and the calls """
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.output = bytearray()
+        self.calls = []
+
+    def read(self, port, now):
+        self.calls.append(('read', port))
+        return self.data.pop(0)
+
+    def write(self, port, value, now):
+        self.calls.append(('write', port))
+        self.output.append(value)
+
+    def read_block(self, port, n, now):
+        self.calls.append(('read_block', port, n))
+        data = bytes(self.data[:n])
+        del self.data[:n]
+        return data
+
+    def write_block(self, port, data, now):
+        self.calls.append(('write_block', port, len(data)))
+        self.output.extend(data)
+
+
+def run(cpu, code, **registers):
+    load_bytes(cpu, code, 0x8000)
+    cpu['PC'] = 0x8000
+    for r, value in registers.items():
+        cpu[r] = value
+    return cpu.run(until_pc=0x8000 + len(code))
+
+
+class TestPorts(unittest.TestCase):
+    def test_in_out(self):
+        for options in ENGINES:
+            cpu = CPU(**options)
+            serial = Serial(b'\x00\x81')
+            cpu.ports.map(0x10, serial)
+            # IN A,(10H) / IN E,(C) / OUT (C),E / OUT (10H),A
+            result = run(cpu, bytes([0xdb, 0x10, 0xed, 0x58, 0xed, 0x59,
+                                     0xd3, 0x10]),
+                         A=0x12, BC=0x3410, F=0x01)
+            self.assertEqual(result.tstates, 46)
+            self.assertEqual((cpu['A'], cpu['E']), (0, 0x81), options)
+            self.assertEqual(cpu.reg.get_flags(), 'SVC', options)
+            self.assertEqual(serial.output, b'\x81\x00')
+            self.assertEqual(serial.calls, [('read', 0x1210),
+                                            ('read', 0x3410),
+                                            ('write', 0x3410),
+                                            ('write', 0x0010)])
+            self.assertEqual(cpu.ports.read(0x11, cpu.tstates), 0xff)
+
+    def test_block_input(self):
+        for options in ENGINES:
+            cpu = CPU(**options)
+            serial = Serial(bytes(range(1, 21)))
+            cpu.ports.map(0x20, serial)
+            # INIR / INDR
+            result = run(cpu, bytes([0xed, 0xb2]), BC=0x0a20, HL=0x9000)
+            self.assertEqual(result.tstates, 21 * 9 + 16)
+            run(cpu, bytes([0xed, 0xba]), BC=0x0a20, HL=0x901f)
+            self.assertEqual(bytes(cpu.memory[0x9000:0x900a]),
+                             bytes(range(1, 11)), options)
+            self.assertEqual(bytes(cpu.memory[0x9016:0x9020]),
+                             bytes(range(20, 10, -1)), options)
+            self.assertEqual((cpu['B'], cpu['HL']), (0, 0x9015))
+            self.assertEqual(cpu.reg.get_flags(), 'ZN')
+            if 'verify_flags' not in options:
+                self.assertEqual(serial.calls[0], ('read_block', 0x0a20, 10))
+
+    def test_block_output(self):
+        for options in ENGINES:
+            cpu = CPU(**options)
+            serial = Serial()
+            cpu.ports.map(0x30, serial)
+            cpu.reg.mem[0x9000:0x9100] = bytes(range(256))
+            # OTIR / OUTD
+            run(cpu, bytes([0xed, 0xb3]), BC=0x0030, HL=0x9000)
+            run(cpu, bytes([0xed, 0xab]), BC=0x0230, HL=0x9010)
+            self.assertEqual(serial.output, bytes(range(256)) + b'\x10')
+            self.assertEqual(serial.calls, [('write_block', 0xff30, 256),
+                                            ('write', 0x0130)])
+            self.assertEqual((cpu['B'], cpu['HL']), (1, 0x900f))
+            self.assertEqual(cpu.reg.get_flags(), 'N')
+
+    def test_single_iterations(self):
+        cpu = CPU()
+        serial = Serial()
+        cpu.ports.map(0x30, serial)
+        cpu.reg.mem[0x9000:0x9003] = b'abc'
+        cpu.reg.mem[0:2] = bytes([0xed, 0xb3])     # OTIR
+        cpu['BC'] = 0x0330
+        cpu['HL'] = 0x9000
+        cpu.deadline = 40
+        result = cpu.run(max_instructions=3)
+        self.assertEqual(serial.output, b'abc')
+        self.assertEqual(serial.calls, [('write', 0x0230), ('write', 0x0130),
+                                        ('write', 0x0030)])
+        self.assertEqual(result.tstates, 21 + 21 + 16)
+
+    def test_full_decode(self):
+        cpu = CPU()
+        cpu.ports = PortBus(full_decode=True)
+        low = Serial(bytes(range(8)))
+        high = Serial(bytes(range(8)))
+        cpu.ports.map(0x0240, low, 1)
+        cpu.ports.map(0x0140, low, 1)
+        cpu.ports.map(0x0440, high, 1)
+        cpu.ports.map(0x0340, high, 1)
+        run(cpu, bytes([0xed, 0xb2]), BC=0x0440, HL=0x9000)   # INIR
+        self.assertEqual(high.calls, [('read_block', 0x0440, 2)])
+        self.assertEqual(low.calls, [('read_block', 0x0240, 2)])
+        self.assertEqual(bytes(cpu.memory[0x9000:0x9004]),
+                         b'\x00\x01\x00\x01')
+        self.assertEqual(cpu.ports.read(0x0040, cpu.tstates), 0xff)
@@ -53,6 +53,77 @@ class TestRegisterSet(unittest.TestCase):
         self.assertEqual(reg[PC(1)], 0x30)
         self.assertEqual(reg[DE(2)], 0x40)
 
+    def test_banks(self):
+        reg = RegisterSet()
+        reg['BC'] = 0x1122
+        reg['AF'] = 0x3344
+        reg.exx()
+        self.assertEqual(reg['BC'], 0x0000)
+        self.assertEqual(reg['AF'], 0x3344)
+        self.assertEqual(reg.alt_register_set['B'], 0x11)
+        reg['HL'] = 0x5566
+        reg.ex_af()
+        self.assertEqual(reg['AF'], 0x0000)
+        self.assertEqual(reg.alt_register_set['A'], 0x33)
+        reg.swap()
+        self.assertEqual(reg['BC'], 0x1122)
+        self.assertEqual(reg['AF'], 0x3344)
+        self.assertEqual(reg['HL'], 0x0000)
+        self.assertEqual(reg.alt_register_set['L'], 0x66)
+        reg.ex_q_alt_q('L')
+        self.assertEqual(reg['HL'], 0x0066)
+        self.assertEqual(reg.r8[reg.slot('A')], 0x33)
+
+    def test_reset(self):
+        reg = RegisterSet()
+        mem = reg.mem
+        reg['BC'] = 0x1122
+        reg['SP'] = 0xff00
+        reg.exx()
+        reg[0x1234] = 0x56
+        reg.reset()
+        self.assertIs(reg.mem, mem)
+        self.assertEqual(reg.main_register_set,
+                         RegisterSet().main_register_set)
+        self.assertEqual(reg.alt_register_set['B'], 0)
+        self.assertEqual(reg[0x1234], 0)
+
+    def test_register_file(self):
+        reg = RegisterSet()
+        reg['IR'] = 0x1234
+        reg['PC'] = 0xabcd
+        reg['IX'] = 0x8000
+        self.assertEqual(reg['I'], 0x12)
+        self.assertEqual(reg['R'], 0x34)
+        self.assertEqual(reg.get16('PC'), 0xabcd)
+        self.assertEqual(reg.main_register_set['IX'], 0x8000)
+        self.assertIn('IY', reg)
+        self.assertNotIn('XY', reg)
+        with self.assertRaises(ValueError):
+            reg['A'] = 0x100
+        with self.assertRaises(KeyError):
+            reg['XY']
+
+    def test_lazy_flags(self):
+        reg = RegisterSet()
+        reg.lazy_flags = True
+        reg['F'] = 0x01
+        reg.update_flags(lambda f, n: (f & 0x01) | n, 0x40)
+        self.assertEqual(reg.r8[reg.slot('F')], 0x01)
+        self.assertEqual(reg.peek_flags(), 0x41)
+        self.assertEqual(reg['F'], 0x41)
+        self.assertIsNone(reg.pending_flags)
+        reg.update_flags(lambda f: 0x80)
+        self.assertEqual(reg.flag('S'), 1)
+        reg.update_flags(lambda f: 0x00)
+        reg['F'] = 0x02
+        self.assertEqual(reg['AF'], 0x0002)
+        reg.update_flags(lambda f: 0x04)
+        reg.ex_af()
+        reg.ex_af()
+        self.assertIsNone(reg.pending_flags)
+        self.assertEqual(reg['F'], 0x04)
+
     # #######
     # 16 bit
     # #######
@@ -99,24 +170,35 @@ class TestRegisterSet(unittest.TestCase):
                  'N': False,
                  'C': False}
         for f in flags:
-            self.assertFalse(reg[f])
+            self.assertFalse(reg.flag(f))
         for f in flags.keys():
-            reg[f] = True
+            reg.set_flag(f, True)
             v = reg['F']
-            reg[f] = True
+            reg.set_flag(f, True)
             flags[f] = True
             self.assertEqual(v, reg['F'])
             self.assertEqual(self.flags2str(flags, 'P'), reg.get_flags('P'))
         keys = list(flags.keys())
         for f in keys[::-1]:
-            reg[f] = False
+            reg.set_flag(f, False)
             v = reg['F']
-            reg[f] = False
+            reg.set_flag(f, False)
             flags[f] = False
             self.assertEqual(v, reg['F'])
             self.assertEqual(self.flags2str(flags, 'P'), reg.get_flags('P'))
         for f in flags:
-            self.assertFalse(reg[f])
+            self.assertFalse(reg.flag(f))
+
+    def test_flags_H_C_are_not_registers(self):
+        reg = RegisterSet()
+        reg['H'] = 0x12
+        reg['C'] = 0x34
+        reg.set_flag('H', True)
+        reg.set_flag('C', True)
+        self.assertEqual(reg['H'], 0x12)
+        self.assertEqual(reg['C'], 0x34)
+        self.assertEqual(reg['F'], 0x11)
+        self.assertEqual(reg.get_flags(), 'HC')
 
 
 if __name__ == '__main__':
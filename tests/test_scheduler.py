@@ -0,0 +1,197 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.loader import load_bytes
+from z80.scheduler import INFINITY
+from z80.scheduler import Scheduler
+
+
+class Timer(object):
+    """ asserts INT every period T-states for width T-states """
+    def __init__(self, cpu, period, width=4):
+        self.cpu = cpu
+        self.period = period
+        self.width = width
+        self.ticks = []
+        cpu.schedule(period, self.tick)
+
+    def tick(self, due):
+        self.ticks.append(due)
+        self.cpu.interrupt(0xff)
+        self.cpu.schedule(due + self.width,
+                          lambda due: self.cpu.clear_interrupt())
+        self.cpu.schedule(due + self.period, self.tick)
+
+
+class TestScheduler(unittest.TestCase):
+    def test_order(self):
+        scheduler = Scheduler()
+        fired = []
+        scheduler.schedule(20, lambda due: fired.append(('b', due)))
+        scheduler.schedule(10, lambda due: fired.append(('a', due)))
+        scheduler.schedule(20, lambda due: fired.append(('c', due)))
+        cancelled = scheduler.schedule(5, lambda due: fired.append('x'))
+        cancelled.cancel()
+        self.assertEqual(scheduler.next_due, 10)
+        self.assertEqual(len(scheduler), 3)
+        scheduler.fire(19)
+        self.assertEqual(fired, [('a', 10)])
+        scheduler.schedule(15, lambda due: fired.append(('d', due)))
+        scheduler.fire(25)
+        self.assertEqual(fired, [('a', 10), ('d', 15), ('b', 20),
+                                 ('c', 20)])
+        self.assertEqual(scheduler.next_due, INFINITY)
+
+
+def cpu_with(code, **options):
+    cpu = CPU(**options)
+    load_bytes(cpu, code)
+    cpu['SP'] = 0xff00
+    return cpu
+
+
+class TestInterrupts(unittest.TestCase):
+    def test_im1_halt(self):
+        for options in ({}, {'instruction_cache': True},
+                        {'verify_flags': True}):
+            # 0000: IM 1 / EI / HALT / JR 0002H ... 0038: INC A / EI / RETI
+            code = bytes([0xed, 0x56, 0xfb, 0x76, 0x18, 0xfc]) + \
+                bytes(0x32) + bytes([0x3c, 0xfb, 0xed, 0x4d])
+            cpu = cpu_with(code, **options)
+            timer = Timer(cpu, 100)
+            result = cpu.run(max_tstates=1000)
+            self.assertEqual(timer.ticks, list(range(100, 1000, 100)))
+            self.assertEqual(cpu['A'], 9, options)
+            # HALT is repeated every 4 T-states
+            self.assertIn(result.tstates, range(1000, 1004))
+            self.assertTrue(cpu.halted)
+            self.assertEqual(cpu['PC'], 0x0003)
+            # the return address is the instruction after HALT
+            self.assertEqual(cpu.get16(0xfefe), 0x0004)
+
+    def test_block_compiler(self):
+        # 0000: IM 1 / EI / INC BC / INC DE / ADD HL,BC / JR 0003H
+        # 0038: INC A / EI / RETI
+        code = bytes([0xed, 0x56, 0xfb, 0x03, 0x13, 0x09, 0x18, 0xfb]) + \
+            bytes(0x30) + bytes([0x3c, 0xfb, 0xed, 0x4d])
+        results = []
+        for options in ({}, {'block_compiler': True}):
+            cpu = cpu_with(code, **options)
+            timer = Timer(cpu, 1000, 32)
+            result = cpu.run(max_tstates=10000)
+            results.append((timer.ticks, result.instructions, cpu.tstates,
+                            cpu.reg.main_register_set))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[1][3]['A'], 9)
+        self.assertGreater(cpu.block_compiler.hits, 100)
+
+    def test_reti(self):
+        # RETI restores IFF1 like RETN
+        cpu = cpu_with(bytes([0xed, 0x4d]))
+        cpu.iff1, cpu.iff2 = 0, 1
+        cpu.push(0x1234)
+        cpu.run(max_instructions=1)
+        self.assertEqual((cpu['PC'], cpu.iff1), (0x1234, 1))
+
+    def test_halt_skip(self):
+        # 0000: IM 1 / EI / HALT
+        cpu = cpu_with(bytes([0xed, 0x56, 0xfb, 0x76]))
+        cpu.schedule(10 ** 9 + 2, lambda due: cpu.interrupt())
+        result = cpu.run(max_instructions=10)
+        self.assertEqual(result.tstates, 8 + 4 + 8 * 4)
+        self.assertTrue(cpu.halted)
+        # the repetitions up to the interrupt are not executed one by one
+        result = cpu.run(until_pc=0x0038)
+        self.assertEqual(cpu.tstates, 10 ** 9 + 4 + 13)
+        self.assertEqual(result.instructions, (10 ** 9 + 4 - 44) // 4)
+        self.assertEqual(cpu.get16(0xfefe), 0x0004)
+
+    def test_ei_delay(self):
+        # EI / NOP / NOP
+        cpu = cpu_with(bytes([0xfb, 0x00, 0x00]))
+        cpu.im = 1
+        cpu.interrupt()
+        cpu.run(max_instructions=2)
+        self.assertEqual(cpu['PC'], 0x0038)
+        self.assertEqual(cpu.tstates, 4 + 4 + 13)
+        self.assertEqual(cpu.get16(0xfefe), 0x0002)
+        self.assertEqual((cpu.iff1, cpu.iff2), (0, 0))
+
+    def test_di(self):
+        # DI / JR $
+        cpu = cpu_with(bytes([0xf3, 0x18, 0xfe]))
+        cpu.iff1 = cpu.iff2 = 1
+        cpu.schedule(2, lambda due: cpu.interrupt())
+        cpu.run(max_instructions=10)
+        self.assertEqual(cpu['PC'], 0x0001)
+
+    def test_nmi(self):
+        # 0000: JR $ ... 0066: RETN
+        cpu = cpu_with(bytes([0x18, 0xfe]) + bytes(0x64) + b'\xed\x45')
+        cpu.iff1 = cpu.iff2 = 1
+        cpu.schedule(24, lambda due: cpu.nmi())
+        cpu.run(max_tstates=28)
+        self.assertEqual(cpu['PC'], 0x0066)
+        self.assertEqual((cpu.iff1, cpu.iff2), (0, 1))
+        self.assertEqual(cpu.tstates, 24 + 11)
+        cpu.run(max_instructions=1)
+        self.assertEqual((cpu['PC'], cpu.iff1), (0x0000, 1))
+
+    def test_im2(self):
+        cpu = cpu_with(bytes([0x18, 0xfe]))
+        cpu.im = 2
+        cpu.iff1 = 1
+        cpu['I'] = 0x80
+        cpu.set16(0x8010, 0x1234)
+        cpu.interrupt(0x10)
+        cpu.run(max_tstates=1)
+        self.assertEqual((cpu['PC'], cpu.tstates), (0x1234, 19))
+
+    def test_im0(self):
+        cpu = cpu_with(bytes([0x18, 0xfe]))
+        cpu.iff1 = 1
+        cpu.interrupt(0xd7)     # RST 10H
+        cpu.run(max_tstates=1)
+        self.assertEqual((cpu['PC'], cpu.tstates), (0x0010, 13))
+        cpu.iff1 = 1
+        cpu.interrupt(0x3e)     # LD A,n
+        with self.assertRaises(NotImplementedError):
+            cpu.run(max_instructions=1)
+
+    def test_events_stop_bulk_instructions(self):
+        cpu = cpu_with(bytes([0xed, 0xb0]))     # LDIR
+        cpu['BC'] = 0x100
+        cpu['DE'] = 0x8000
+        fired = []
+        cpu.schedule(100, lambda due: fired.append((cpu.tstates, cpu['BC'])))
+        cpu.run(until_pc=2)
+        self.assertEqual(fired, [(105, 0xfb)])
+
+    def test_reset(self):
+        cpu = cpu_with(bytes([0x18, 0xfe]))
+        cpu.schedule(10, lambda due: cpu.nmi())
+        cpu.iff1 = 1
+        cpu.reset()
+        load_bytes(cpu, bytes([0x18, 0xfe]))
+        cpu.run(max_tstates=100)
+        self.assertEqual((cpu['PC'], cpu.iff1), (0, 0))
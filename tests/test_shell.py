@@ -0,0 +1,83 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import io
+import json
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+from z80.cpu import INSTRUCTION_SET
+from z80.shell import Shell
+from z80.shell import main
+
+
+def output(func, *args):
+    stdout = io.StringIO()
+    with redirect_stdout(stdout):
+        func(*args)
+    return stdout.getvalue()
+
+
+class TestShell(unittest.TestCase):
+    def test_import_is_lazy(self):
+        code = 'import sys, z80.shell; print("z80.cpu" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code],
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_subshells_on_first_use(self):
+        shell = Shell()
+        self.assertIsNone(shell._instr_shell)
+        self.assertIsNone(shell._cpu_shell)
+        self.assertIs(shell.instr_shell, shell.instr_shell)
+        self.assertEqual(shell.instr_shell.group_shells, {})
+        self.assertIsNone(shell.instr_shell._parser_ls)
+        jump = shell.instr_shell.jump_shell
+        self.assertEqual(jump.group.name, 'jump group')
+        self.assertEqual(list(shell.instr_shell.group_shells), ['jump'])
+        self.assertIsNone(jump._parser_ls)
+        with self.assertRaises(AttributeError):
+            shell.instr_shell.unknown_shell
+
+    def test_instr_ls(self):
+        groups = json.loads(output(main, ['instr', 'ls', '--json']))
+        self.assertEqual([g['name'] for g in groups],
+                         [g.name for g in INSTRUCTION_SET.groups])
+
+    def test_group_ls(self):
+        groups = json.loads(output(main, ['instr', 'exchange', 'ls',
+                                          '--json']))
+        self.assertEqual([g['name'] for g in groups], ['exchange group'])
+        self.assertIn('EX DE,HL', output(main, ['instr', 'exchange', 'ls']))
+
+    def test_complete(self):
+        shell = Shell()
+        self.assertEqual(shell.instr_shell.completenames('ju'), ['jump'])
+        self.assertEqual(shell.completedefault('ju', 'instr ju', 0, 0),
+                         ['jump'])
+        self.assertIn('HL', shell.completedefault('', 'instr ls EX DE ',
+                                                  0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
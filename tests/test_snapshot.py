@@ -0,0 +1,131 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+from z80.cpu import CPU
+from z80.snapshot import PAGES
+
+
+# sum of 1..B in A stored at 8000H, ends at the JR $ at 0007H
+SUM = bytes([0xaf, 0x80, 0x10, 0xfd, 0x32, 0x00, 0x80, 0x18, 0xfe])
+SUM_END = 7
+
+
+def state(cpu):
+    return (cpu.reg.main_register_set, cpu.reg.alt_register_set,
+            bytes(cpu.reg.mem), cpu.tstates)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_restore(self):
+        cpu = CPU()
+        cpu.reg.mem[:len(SUM)] = SUM
+        cpu['B'] = 10
+        cpu.reg.exx()
+        cpu['HL'] = 0x1234
+        cpu.reg.exx()
+        before = state(cpu)
+        snap = cpu.snapshot()
+        cpu.run(until_pc=SUM_END)
+        after = state(cpu)
+        self.assertEqual(cpu[0x8000], 55)
+        self.assertEqual(cpu.restore(snap), 1)
+        self.assertEqual(state(cpu), before)
+        cpu.run(until_pc=SUM_END)
+        self.assertEqual(state(cpu), after)
+
+    def test_pages_are_shared(self):
+        cpu = CPU()
+        first = cpu.snapshot()
+        cpu[0x1234] = 1
+        cpu.set16(0x20ff, 0x0203)
+        second = cpu.snapshot()
+        changed = [page for page in range(PAGES)
+                   if first.pages[page] is not second.pages[page]]
+        self.assertEqual(changed, [0x12, 0x20, 0x21])
+        self.assertEqual(second.memory[0x1234], 1)
+        self.assertEqual(first.memory, bytes(len(first.memory)))
+        self.assertIs(cpu.snapshot().pages, second.pages)
+
+    def test_branches(self):
+        cpu = CPU(lazy_flags=True)
+        root = cpu.snapshot()
+        cpu[0x4000] = 1
+        cpu['A'] = 1
+        left = cpu.snapshot()
+        self.assertEqual(cpu.restore(root), 1)
+        cpu[0x5000] = 2
+        right = cpu.snapshot()
+        # the page written on the right and the one of the left branch
+        self.assertEqual(cpu.restore(left), 2)
+        self.assertEqual((cpu[0x4000], cpu[0x5000], cpu['A']), (1, 0, 1))
+        self.assertEqual(cpu.restore(right), 2)
+        self.assertEqual((cpu[0x4000], cpu[0x5000], cpu['A']), (0, 2, 0))
+
+    def test_snapshot_of_other_cpu(self):
+        cpu = CPU()
+        cpu[0x9000] = 3
+        cpu['SP'] = 0xfff0
+        snap = cpu.snapshot()
+        other = CPU()
+        self.assertEqual(other.restore(snap), PAGES)
+        self.assertEqual((other[0x9000], other['SP']), (3, 0xfff0))
+
+    def test_code_caches(self):
+        for options in ({'instruction_cache': True},
+                        {'block_compiler': True}):
+            cpu = CPU(**options)
+            cpu.reg.mem[:len(SUM)] = SUM
+            cpu['B'] = 3
+            snap = cpu.snapshot()
+            cpu.run(until_pc=SUM_END)
+            cpu[0x0001] = 0x90      # SUB B
+            cpu.restore(snap)
+            cpu.run(until_pc=SUM_END)
+            self.assertEqual(cpu['A'], 6, options)
+
+    def test_interrupt_state(self):
+        cpu = CPU()
+        # EI; IM 1 at 0000H, the handler at 0038H increments A
+        cpu.reg.mem[0:3] = bytes([0xfb, 0xed, 0x56])
+        cpu.reg.mem[0x38] = 0x3c
+        cpu['SP'] = 0xfff0
+        cpu.run(until_pc=3)
+        cpu.interrupt()
+        snap = cpu.snapshot()
+        cpu.run(max_instructions=2)
+        self.assertEqual(cpu['A'], 1)
+        after = state(cpu)
+        cpu.restore(snap)
+        self.assertEqual((cpu.iff1, cpu.iff2, cpu.im, cpu.int_data),
+                         (1, 1, 1, 0xff))
+        cpu.run(max_instructions=2)
+        self.assertEqual(state(cpu), after)
+
+    def test_scheduler_not_restored(self):
+        cpu = CPU()
+        fired = []
+        snap = cpu.snapshot()
+        cpu.schedule(100, fired.append)
+        cpu.restore(snap)
+        self.assertEqual(len(cpu.scheduler), 1)
+        cpu.run(max_tstates=200)
+        self.assertEqual(fired, [100])
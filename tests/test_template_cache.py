@@ -0,0 +1,166 @@
+# MIT License
+
+# Copyright (c) 2019 stefan-wolfsheimer
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import shutil
+import tempfile
+import unittest
+from z80.cpu import INSTRUCTION_SET
+from z80.instruction_set import InstructionSet
+from z80.instruction_group import InstructionGroup
+from z80.instruction_template import InstructionTemplate
+from z80.template_cache import TemplateCache
+
+
+def describe(instr):
+    """ comparable description of an expanded instruction """
+    opcode = [c if isinstance(c, int) else (c.d, c.memonic, c.len())
+              for c in instr.opcode]
+    return (instr.assembler, opcode, instr.size, instr.args,
+            instr.operands, instr.arg_order, instr.tstates, instr.branch,
+            instr.unchecked.__qualname__)
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.module = os.path.join(self.directory, 'module.py')
+        self.write_module('# version 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_module(self, source):
+        with open(self.module, 'w') as f:
+            f.write(source)
+
+    def cache(self):
+        return TemplateCache(self.module, self.directory)
+
+    def expand(self, cache):
+        """ expands two templates with cache """
+        group = InstructionGroup('group', InstructionSet())
+
+        @InstructionTemplate(group, ['01{0}110'], expand=['r'], tstates=7,
+                             cache=cache)
+        def LD_r__HL_(self, r):
+            pass
+
+        @InstructionTemplate(group, ['11{0}101', 0x36, 'd', 'n'],
+                             expand=['ii'], tstates=19, cache=cache)
+        def LD__ii_d__n(self, ii, d, n):
+            pass
+
+        return [describe(instr)
+                for template in group.instruction_templates
+                for instr in template.instructions]
+
+    def test_round_trip(self):
+        expected = self.expand(None)
+        cache = self.cache()
+        self.assertEqual(self.expand(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache.save()
+        self.assertTrue(os.path.exists(cache.path))
+        cache = self.cache()
+        self.assertEqual(self.expand(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_stale(self):
+        cache = self.cache()
+        self.expand(cache)
+        cache.save()
+        old_path = cache.path
+        self.write_module('# version 2\n')
+        cache = self.cache()
+        self.assertNotEqual(cache.path, old_path)
+        self.assertEqual(self.expand(cache), self.expand(None))
+        self.assertEqual(cache.misses, 2)
+        cache.save()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(cache.path))
+
+    def test_corrupt_file(self):
+        cache = self.cache()
+        with open(cache.path, 'wb') as f:
+            f.write(b'\x00garbage')
+        cache = self.cache()
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(self.expand(cache), self.expand(None))
+        self.assertEqual(cache.misses, 2)
+
+    def test_disabled(self):
+        cache = TemplateCache(self.module, '')
+        self.assertIsNone(cache.path)
+        self.assertEqual(self.expand(cache), self.expand(None))
+        cache.save()
+        self.assertEqual(os.listdir(self.directory), ['module.py'])
+
+    def test_save_atomic(self):
+        cache = self.cache()
+        self.expand(cache)
+        cache.save()
+        # only the cache file is left, no temporary file
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['module.py', os.path.basename(cache.path)]))
+
+    def test_not_writable(self):
+        # the directory cannot be created below a file
+        cache = TemplateCache(self.module, os.path.join(self.module, 'x'))
+        self.expand(cache)
+        cache.save()
+        self.assertFalse(os.path.exists(cache.path))
+        if hasattr(os, 'geteuid') and os.geteuid() != 0:
+            os.chmod(self.directory, 0o500)
+            try:
+                cache = self.cache()
+                self.expand(cache)
+                cache.save()
+                self.assertFalse(os.path.exists(cache.path))
+            finally:
+                os.chmod(self.directory, 0o700)
+
+    def test_instruction_set(self):
+        """ every template of the cpu survives a round trip """
+        cache = self.cache()
+        templates = [template for group in INSTRUCTION_SET.groups
+                     for template in group.instruction_templates]
+        for template in templates:
+            func = template.instructions[0].func
+            cache.put(func.__name__, template.expansions(func))
+        cache.misses = 1
+        cache.save()
+        cache = self.cache()
+        group = InstructionGroup('copy', InstructionSet())
+        for template in templates:
+            func = template.instructions[0].func
+            copy = InstructionTemplate(group, template.opcode,
+                                       template.expand, template.tstates,
+                                       branch=template.branch, cache=cache)
+            copy(func)
+            self.assertEqual([describe(instr) for instr in copy.instructions],
+                             [describe(instr)
+                              for instr in template.instructions])
+        self.assertEqual(cache.misses, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
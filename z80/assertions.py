@@ -107,3 +107,14 @@ def assert_flag(flag):
     if not isinstance(flag, str) or flag not in FLAGS:
         raise ValueError("Invalid flag pair %s ( expected %s)" %
                          (str(flag), ", ".join(FLAGS)))
+
+
+def assert_cc(cc):
+    conditions = ('NZ', 'Z', 'NC', 'C', 'PO', 'PE', 'P', 'M')
+    if not isinstance(cc, str) or cc not in conditions:
+        raise ValueError("Invalid condition %s" % str(cc))
+
+
+def assert_p(p):
+    if not isinstance(p, int) or p & ~0x38:
+        raise ValueError("Invalid restart address %s" % str(p))
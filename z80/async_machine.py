@@ -0,0 +1,190 @@
+import asyncio
+from collections import deque
+from .device import Device
+from .ports import WouldBlock
+from .run_result import RunResult
+from .run_result import STOP_BLOCKED
+from .run_result import STOP_PC
+from .run_result import STOP_TSTATES
+from .scheduler import INFINITY
+
+
+# T-states run between two yields to the event loop (a 50 Hz frame
+# at 3.5 MHz)
+DEFAULT_QUANTUM = 70000
+STATUS_INPUT = 0x01
+STATUS_OUTPUT = 0x02
+
+
+class QueuePort(Device):
+    """
+    Serial port backed by asyncio queues of byte strings: the data port
+    at port reads from input and writes to output, the status port at
+    port + 1 reads STATUS_INPUT if a byte is available, STATUS_OUTPUT is
+    always set.
+
+    Reading the data port without input raises WouldBlock, so that the
+    AsyncMachine waits for input instead of running the CPU. INIR waits
+    for all of its bytes. With interrupt the INT line is asserted while
+    input is available.
+    """
+    def __init__(self, cpu, port, interrupt=False):
+        super(QueuePort, self).__init__(cpu)
+        self.port = port
+        self.interrupt = interrupt
+        self.input = asyncio.Queue()
+        self.output = asyncio.Queue()
+        # received bytes not read yet
+        self.buffer = deque()
+
+    def receive(self, data):
+        self.buffer.extend(data)
+        if self.interrupt and self.buffer:
+            self.cpu.interrupt()
+
+    def refill(self):
+        """ moves the queued input to the buffer """
+        while not self.input.empty():
+            self.receive(self.input.get_nowait())
+
+    async def wait_input(self):
+        """ waits until input is available """
+        while not self.buffer:
+            self.receive(await self.input.get())
+
+    def stable_until(self, now):
+        # reading the data port consumes input
+        return now if self.buffer else INFINITY
+
+    def port_read(self, port):
+        if port & 0xff != self.port & 0xff:
+            return STATUS_OUTPUT | (STATUS_INPUT if self.buffer else 0)
+        self.refill()
+        if not self.buffer:
+            raise WouldBlock(self)
+        value = self.buffer.popleft()
+        if self.interrupt and not self.buffer:
+            self.cpu.clear_interrupt()
+        return value
+
+    def port_read_block(self, port, n):
+        self.refill()
+        if port & 0xff == self.port & 0xff and len(self.buffer) < n:
+            raise WouldBlock(self)
+        return bytes(self.port_read(port) for _ in range(n))
+
+    def port_write(self, port, value):
+        if port & 0xff == self.port & 0xff:
+            self.output.put_nowait(bytes([value]))
+
+    async def connect(self, reader, writer):
+        """ passes the data of an asyncio stream pair until reader is
+            at EOF, then flushes the output """
+        async def send():
+            while True:
+                writer.write(await self.output.get())
+                await writer.drain()
+        sender = asyncio.ensure_future(send())
+        try:
+            while True:
+                data = await reader.read(256)
+                if not data:
+                    break
+                self.input.put_nowait(data)
+        finally:
+            sender.cancel()
+        while not self.output.empty():
+            writer.write(self.output.get_nowait())
+        await writer.drain()
+
+
+class AsyncMachine(object):
+    """
+    Runs a CPU as a coroutine on the asyncio event loop, quantum
+    T-states at a time, so that many machines share one loop with other
+    asyncio I/O.
+
+    Between the quanta the machine yields to the loop. It parks instead
+    while the CPU cannot proceed without input: when a read raised
+    WouldBlock, and when the CPU is halted or spinning in an idle loop
+    (see CPU(idle_detection=True)) with no event scheduled. Emulated
+    time stands still while a machine is parked.
+    """
+    def __init__(self, cpu, quantum=DEFAULT_QUANTUM):
+        self.cpu = cpu
+        self.quantum = quantum
+        self.devices = []
+        self.stopped = False
+        # number of quanta run and of waits for input
+        self.quanta = 0
+        self.parks = 0
+
+    def add_port(self, port, interrupt=False):
+        """ maps a QueuePort at port (data) and port + 1 (status).
+            Returns the QueuePort. """
+        device = QueuePort(self.cpu, port, interrupt)
+        self.cpu.ports.map(port, device, 2)
+        self.devices.append(device)
+        return device
+
+    def stop(self):
+        """ makes run return after the current quantum """
+        self.stopped = True
+
+    def idle(self, deadline):
+        """ whether the CPU spins until input arrives, deadline is the
+            end of the last quantum """
+        cpu = self.cpu
+        if cpu.nmi_pending or (cpu.int_data is not None and cpu.iff1):
+            return False
+        detector = cpu.idle_detector
+        events = len(cpu.scheduler) - (detector is not None)
+        if events:
+            return False
+        if cpu.halted:
+            return True
+        return detector is not None and detector.idle_until is not None \
+            and detector.idle_until >= deadline
+
+    async def wait_input(self, devices):
+        waiters = [asyncio.ensure_future(device.wait_input())
+                   for device in devices]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def run(self, max_tstates=None, until_pc=None):
+        """ runs until stop is called, max_tstates have been executed or
+            PC reaches until_pc. Returns the combined RunResult. """
+        cpu = self.cpu
+        self.stopped = False
+        start = cpu.tstates
+        instructions = 0
+        reason = STOP_TSTATES
+        while not self.stopped:
+            if max_tstates is None:
+                quantum = self.quantum
+            else:
+                quantum = min(self.quantum, start + max_tstates - cpu.tstates)
+                if quantum <= 0:
+                    break
+            for device in self.devices:
+                device.refill()
+            deadline = cpu.tstates + quantum
+            result = cpu.run(max_tstates=quantum, until_pc=until_pc)
+            self.quanta += 1
+            instructions += result.instructions
+            if result.reason == STOP_PC:
+                reason = STOP_PC
+                break
+            if result.reason == STOP_BLOCKED:
+                self.parks += 1
+                await self.wait_input([cpu.blocked])
+            elif self.devices and self.idle(deadline):
+                self.parks += 1
+                await self.wait_input(self.devices)
+            else:
+                await asyncio.sleep(0)
+        return RunResult(reason, instructions, cpu.tstates - start)
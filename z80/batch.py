@@ -0,0 +1,851 @@
+from array import array
+from operator import and_
+from operator import or_
+from operator import xor
+try:
+    import numpy
+except ImportError:     # BatchCPU requires numpy
+    numpy = None
+from .cpu import CPU
+from .cpu import INSTRUCTION_SET
+from .flags import adc16_f
+from .flags import add16_f
+from .flags import add_table
+from .flags import sub_table
+from .flags import CONDITIONS
+from .flags import DEC_FLAGS
+from .flags import FLAG_3
+from .flags import FLAG_5
+from .flags import FLAG_C
+from .flags import FLAG_H
+from .flags import FLAG_N
+from .flags import FLAG_Z
+from .flags import INC_FLAGS
+from .flags import sbc16_f
+from .flags import SZ53P
+from .register import ACCUMULATOR
+from .register import BANK_OFFSET
+from .register import BANK_SIZE
+from .register import GENERAL_PURPOSE
+from .register import MEMSIZE
+from .register import PAIRS
+from .register import SLOT_I
+from .register import SLOT_R
+from .register import WORDS
+from .register import WORD_PC
+
+
+# row of the 8 bit registers in BatchCPU.r8, the active bank is
+# always stored in rows 0..7 (EXX and EX AF, AF' exchange the rows)
+ROWS = dict(BANK_OFFSET, I=SLOT_I, R=SLOT_R)
+# instructions are grouped by PC and their first four bytes
+CODE_SIZE = 4
+
+VECTORISERS = {}
+
+
+def vectorise(*names):
+    """ registers a vectorised handler for the instruction functions names.
+
+        The handler is called as handler(batch, idx, *args) where idx
+        holds the indices of the instances executing the instruction
+        and args is the argument tuple of the instruction function.
+        It returns None or the T-states per instance for instructions
+        whose duration depends on a condition. """
+    def register(func):
+        for name in names:
+            VECTORISERS[name] = func
+        return func
+    return register
+
+
+_TABLES = None
+
+
+def lookup_tables():
+    """
+    numpy lookup tables of the flag and result computations, built on
+    first use. The rotate and shift tables are indexed by [C, n] and
+    hold (result << 8) | F computed by the scalar CPU handlers.
+    """
+    global _TABLES
+    if _TABLES is None:
+        cpu = CPU()
+        slot = cpu.reg.slot('F')
+        shifts = {}
+        for name in ('RLC_n', 'RL_n', 'RRC_n', 'RR_n', 'SLA_n', 'SRA_n',
+                     'SRL_n'):
+            table = numpy.zeros((2, 0x100), numpy.int64)
+            for carry in range(2):
+                for n in range(0x100):
+                    cpu.reg.r8[slot] = FLAG_C if carry else 0
+                    res = getattr(cpu, name)(n)
+                    table[carry, n] = (res << 8) | cpu.reg.r8[slot]
+            shifts[name] = table
+        sz53p = numpy.array(SZ53P, numpy.int64)
+        _TABLES = {'add': add_table().astype(numpy.int64),
+                   'sub': sub_table().astype(numpy.int64),
+                   'logic': sz53p,
+                   'inc': numpy.array(INC_FLAGS, numpy.int64),
+                   'dec': numpy.array(DEC_FLAGS, numpy.int64),
+                   'shift': shifts}
+    return _TABLES
+
+
+class CodeWindow(object):
+    """ the CODE_SIZE bytes at addr, indexable like the memory """
+    def __init__(self, addr, code):
+        self.addr = addr
+        self.code = code
+
+    def __getitem__(self, addr):
+        return self.code[(addr - self.addr) & 0xffff]
+
+
+class InstanceMemory(object):
+    """
+    64K memory of a batch instance as seen by the scalar CPU, made of
+    the shared rom and the ram row of the instance (memoryviews).
+    Accesses go to the batch arrays in place, writes to the ROM are
+    ignored.
+    """
+    def __init__(self, rom, ram):
+        self.rom = rom
+        self.ram = ram
+        self.rom_size = len(rom)
+
+    def __len__(self):
+        return MEMSIZE
+
+    def __getitem__(self, key):
+        rom_size = self.rom_size
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(MEMSIZE)
+            stop = max(start, stop)
+            return bytes(self.rom[start:min(stop, rom_size)]) \
+                + bytes(self.ram[max(start, rom_size) - rom_size:
+                                 max(stop, rom_size) - rom_size])
+        if key < rom_size:
+            return self.rom[key]
+        return self.ram[key - rom_size]
+
+    def __setitem__(self, key, value):
+        rom_size = self.rom_size
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(MEMSIZE)
+            skip = max(0, min(stop, rom_size) - start)
+            if start + skip < stop:
+                self.ram[start + skip - rom_size:stop - rom_size] = \
+                    bytes(value)[skip:]
+        elif key >= rom_size:
+            self.ram[key - rom_size] = value
+
+
+class BatchCPU(object):
+    """
+    n Z80 instances executing the same program in lockstep.
+
+    The registers are stored in numpy arrays, r8 holds the rows
+    BCDEHLAF, B'C'D'E'H'L'A'F', I and R and r16 the rows IX, IY, SP and
+    PC, each of shape (n,). The memory below rom_size is shared by all
+    instances and is not written by the guest, ram holds the remaining
+    addresses of each instance.
+
+    step groups the instances by PC and code, decodes each group once
+    with INSTRUCTION_SET and executes the group with the handler
+    registered in VECTORISERS. Instructions without a vectorised
+    handler are executed by the scalar CPU one instance at a time, on
+    the memory of the instance in place (see step_scalar).
+    """
+    def __init__(self, n, rom_size=0):
+        if numpy is None:
+            raise ImportError('BatchCPU requires numpy')
+        self.n = n
+        self.rom_size = rom_size
+        self.r8 = numpy.zeros((2 * BANK_SIZE + 2, n), numpy.uint8)
+        self.r16 = numpy.zeros((len(WORDS), n), numpy.uint16)
+        self.rom = numpy.zeros(rom_size, numpy.uint8)
+        self.ram = numpy.zeros((n, MEMSIZE - rom_size), numpy.uint8)
+        self.tstates = numpy.zeros(n, numpy.int64)
+        self.instructions = numpy.zeros(n, numpy.int64)
+        self.tables = lookup_tables()
+        # (instruction, argument tuple) by code key, see groups
+        self.decoded = {}
+        self.scalar = CPU()
+        self.scalar_mem = self.scalar.reg.mem
+
+    # ##################
+    # registers
+    # ##################
+    def get8(self, r, idx):
+        return self.r8[ROWS[r], idx].astype(numpy.int64)
+
+    def set8(self, r, idx, value):
+        self.r8[ROWS[r], idx] = value
+
+    def get16(self, rr, idx):
+        word = WORDS.get(rr)
+        if word is not None:
+            return self.r16[word, idx].astype(numpy.int64)
+        hi, lo = PAIRS[rr]
+        return (self.get8(hi, idx) << 8) | self.get8(lo, idx)
+
+    def set16(self, rr, idx, value):
+        word = WORDS.get(rr)
+        if word is not None:
+            self.r16[word, idx] = value
+        else:
+            hi, lo = PAIRS[rr]
+            self.set8(hi, idx, value >> 8)
+            self.set8(lo, idx, value & 0xff)
+
+    def flags(self, idx):
+        return self.get8('F', idx)
+
+    def __getitem__(self, key):
+        """ register key of all instances """
+        if key in ROWS:
+            return self.get8(key, slice(None))
+        return self.get16(key, slice(None))
+
+    def __setitem__(self, key, value):
+        """ sets register key of all instances to value (an int or
+            an array of shape (n,)) """
+        value = numpy.asarray(value, numpy.int64)
+        if key in ROWS:
+            self.set8(key, slice(None), value & 0xff)
+        else:
+            self.set16(key, slice(None), value & 0xffff)
+
+    def exchange(self, rows, idx):
+        """ exchanges rows with the alternate bank """
+        alt = [r + BANK_SIZE for r in rows]
+        tmp = self.r8[rows][:, idx]
+        self.r8[numpy.ix_(rows, idx)] = self.r8[alt][:, idx]
+        self.r8[numpy.ix_(alt, idx)] = tmp
+
+    # ##################
+    # memory
+    # ##################
+    def read(self, idx, addr):
+        """ bytes at the addresses addr (an int or an array) of the
+            instances idx """
+        addr = numpy.broadcast_to(numpy.asarray(addr, numpy.int64) & 0xffff,
+                                  numpy.shape(idx))
+        if not self.rom_size:
+            return self.ram[idx, addr].astype(numpy.int64)
+        rom = addr < self.rom_size
+        ret = self.ram[idx, numpy.maximum(addr - self.rom_size, 0)]
+        ret = numpy.where(rom, self.rom[numpy.minimum(addr,
+                                                      self.rom_size - 1)],
+                          ret)
+        return ret.astype(numpy.int64)
+
+    def write(self, idx, addr, value):
+        """ writes value to addr of the instances idx, writes to the
+            ROM are ignored """
+        addr = numpy.broadcast_to(numpy.asarray(addr, numpy.int64) & 0xffff,
+                                  numpy.shape(idx))
+        value = numpy.broadcast_to(value, numpy.shape(idx))
+        if self.rom_size:
+            ram = addr >= self.rom_size
+            idx, addr, value = idx[ram], addr[ram] - self.rom_size, value[ram]
+        self.ram[idx, addr] = value
+
+    def read16(self, idx, addr):
+        return self.read(idx, addr) | (self.read(idx, addr + 1) << 8)
+
+    def write16(self, idx, addr, value):
+        self.write(idx, addr, value & 0xff)
+        self.write(idx, addr + 1, value >> 8)
+
+    def load(self, addr, data):
+        """ copies data to addr of all instances (or of the ROM) """
+        data = numpy.frombuffer(bytes(data), numpy.uint8)
+        for offset, c in enumerate(data):
+            a = (addr + offset) & 0xffff
+            if a < self.rom_size:
+                self.rom[a] = c
+            else:
+                self.ram[:, a - self.rom_size] = c
+
+    def memory(self, i):
+        """ the 64K memory of instance i as bytes """
+        return self.rom.tobytes() + self.ram[i].tobytes()
+
+    # ##################
+    # scalar instances
+    # ##################
+    def load_registers(self, i, cpu):
+        """ copies the registers of instance i to cpu """
+        reg = cpu.reg
+        reg.gp_bank = reg.af_bank = 0
+        reg._update_slots()
+        reg.pending_flags = None
+        reg.r8[:] = self.r8[:, i].tobytes()
+        reg.r16[:] = array('H', self.r16[:, i].tolist())
+
+    def cpu(self, i, cpu=None):
+        """ CPU (or cpu) holding the registers and a copy of the memory
+            of instance i """
+        if cpu is None:
+            cpu = CPU()
+        self.load_registers(i, cpu)
+        cpu.reg.mem[:] = self.memory(i)
+        return cpu
+
+    def store_registers(self, i, cpu):
+        """ copies the registers of cpu to instance i """
+        reg = cpu.reg
+        reg.resolve_flags()
+        for registers, bank in ((GENERAL_PURPOSE, reg.gp_bank),
+                                (ACCUMULATOR, reg.af_bank)):
+            for r in registers:
+                row = BANK_OFFSET[r]
+                self.r8[row, i] = reg.r8[bank + row]
+                self.r8[BANK_SIZE + row, i] = reg.r8[(bank ^ BANK_SIZE) + row]
+        self.r8[SLOT_I:, i] = reg.r8[SLOT_I:]
+        self.r16[:, i] = reg.r16
+
+    def store(self, i, cpu):
+        """ copies the registers and the RAM of cpu to instance i """
+        self.store_registers(i, cpu)
+        self.ram[i] = numpy.frombuffer(bytes(cpu.reg.mem),
+                                       numpy.uint8)[self.rom_size:]
+
+    def instance_memory(self, i):
+        """ memory of instance i for the scalar CPU, accessed in place:
+            the RAM row itself without a ROM """
+        ram = memoryview(self.ram[i])
+        if not self.rom_size:
+            return ram
+        return InstanceMemory(memoryview(self.rom), ram)
+
+    def step_scalar(self, i):
+        """ executes the instruction at PC of instance i on the scalar
+            CPU, returns the T-states. The scalar CPU works on the memory
+            of the instance in place, so that only the registers are
+            copied. """
+        cpu = self.scalar
+        self.load_registers(i, cpu)
+        cpu.reg.mem = self.instance_memory(i)
+        try:
+            tstates = cpu.step()
+        finally:
+            cpu.reg.mem = self.scalar_mem
+        self.store_registers(i, cpu)
+        return tstates
+
+    # ##################
+    # execution
+    # ##################
+    def groups(self, idx):
+        """ splits idx into groups of instances with the same PC and
+            code. Returns a list of (key, indices). """
+        pc = self.r16[WORD_PC, idx].astype(numpy.int64)
+        keys = pc << 32
+        for offset in range(CODE_SIZE):
+            keys |= self.read(idx, pc + offset) << (8 * (3 - offset))
+        unique, inverse = numpy.unique(keys, return_inverse=True)
+        if len(unique) == 1:
+            return [(int(unique[0]), idx)]
+        order = numpy.argsort(inverse, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(inverse))[:-1]
+        return list(zip(unique.tolist(), numpy.split(idx[order], bounds)))
+
+    def decode(self, key):
+        """ (instruction, argument tuple) of a group key """
+        entry = self.decoded.get(key)
+        if entry is None:
+            pc = key >> 32
+            code = (key & 0xffffffff).to_bytes(CODE_SIZE, 'big')
+            entry = INSTRUCTION_SET.decode(CodeWindow(pc, code), pc)
+            self.decoded[key] = entry
+        return entry
+
+    def step(self, idx=None):
+        """ executes one instruction on the instances idx (default: all).
+            Returns the number of groups. """
+        if idx is None:
+            idx = numpy.arange(self.n)
+        groups = self.groups(idx)
+        for key, members in groups:
+            instr, args = self.decode(key)
+            handler = VECTORISERS.get(instr.func.__name__)
+            if handler is None:
+                for i in members:
+                    self.tstates[i] += self.step_scalar(i)
+            else:
+                self.r16[WORD_PC, members] = ((key >> 32) + instr.size) \
+                    & 0xffff
+                ret = handler(self, members, *args)
+                self.tstates[members] += instr.tstates if ret is None \
+                    else ret
+            self.instructions[members] += 1
+        return len(groups)
+
+    def run(self, until_pc=None, max_instructions=None, idx=None):
+        """ executes instructions on the instances idx (default: all)
+            until PC reaches until_pc or max_instructions were executed
+            by an instance. Returns the number of steps. """
+        if idx is None:
+            idx = numpy.arange(self.n)
+        limit = None
+        if max_instructions is not None:
+            limit = self.instructions[idx] + max_instructions
+        steps = 0
+        while True:
+            active = numpy.ones(len(idx), bool)
+            if until_pc is not None:
+                active &= self.r16[WORD_PC, idx] != until_pc
+            if limit is not None:
+                active &= self.instructions[idx] < limit
+            if not active.any():
+                return steps
+            self.step(idx[active])
+            steps += 1
+
+
+# ######################
+# vectorised handlers
+# ######################
+def address(batch, idx, ii, d):
+    return (batch.get16(ii, idx) + d) & 0xffff
+
+
+def operand_handlers(prefix, apply, immediate=True):
+    """ registers the r, n (if immediate is True), (HL) and (ii+d)
+        variants of the instruction prefix, apply(batch, idx, value,
+        *extra) executes it with the operand value. extra are the
+        leading arguments (e.g. b). """
+    @vectorise(prefix + '_r')
+    def op_r(batch, idx, *args):
+        return apply(batch, idx, batch.get8(args[-1], idx), *args[:-1])
+
+    def op_n(batch, idx, *args):
+        return apply(batch, idx, args[-1], *args[:-1])
+    if immediate:
+        vectorise(prefix + '_n')(op_n)
+
+    @vectorise(prefix + '__HL_')
+    def op_hl(batch, idx, *args):
+        return apply(batch, idx, batch.read(idx, batch.get16('HL', idx)),
+                     *args)
+
+    @vectorise(prefix + '__ii_d_')
+    def op_ii_d(batch, idx, *args):
+        ii, d = args[-2:]
+        return apply(batch, idx, batch.read(idx, address(batch, idx, ii, d)),
+                     *args[:-2])
+
+
+def modify_handlers(prefix, modify):
+    """ registers the r, (HL) and (ii+d) variants of the read modify
+        write instruction prefix, modify(batch, idx, value, *extra)
+        returns the new value """
+    @vectorise(prefix + '_r')
+    def op_r(batch, idx, *args):
+        r = args[-1]
+        batch.set8(r, idx, modify(batch, idx, batch.get8(r, idx),
+                                  *args[:-1]))
+
+    @vectorise(prefix + '__HL_')
+    def op_hl(batch, idx, *args):
+        addr = batch.get16('HL', idx)
+        batch.write(idx, addr, modify(batch, idx, batch.read(idx, addr),
+                                      *args))
+
+    @vectorise(prefix + '__ii_d_')
+    def op_ii_d(batch, idx, *args):
+        addr = address(batch, idx, *args[-2:])
+        batch.write(idx, addr, modify(batch, idx, batch.read(idx, addr),
+                                      *args[:-2]))
+
+
+# 8 bit load group
+@vectorise('LD_r_r')
+def ld_r_r(batch, idx, r1, r2):
+    batch.set8(r1, idx, batch.get8(r2, idx))
+
+
+@vectorise('LD_r_n')
+def ld_r_n(batch, idx, r, n):
+    batch.set8(r, idx, n)
+
+
+@vectorise('LD_r__HL_')
+def ld_r_hl(batch, idx, r):
+    batch.set8(r, idx, batch.read(idx, batch.get16('HL', idx)))
+
+
+@vectorise('LD_r__ii_d_')
+def ld_r_ii_d(batch, idx, r, ii, d):
+    batch.set8(r, idx, batch.read(idx, address(batch, idx, ii, d)))
+
+
+@vectorise('LD__HL__r')
+def ld_hl_r(batch, idx, r):
+    batch.write(idx, batch.get16('HL', idx), batch.get8(r, idx))
+
+
+@vectorise('LD__HL__n')
+def ld_hl_n(batch, idx, n):
+    batch.write(idx, batch.get16('HL', idx), n)
+
+
+@vectorise('LD__ii_d__r')
+def ld_ii_d_r(batch, idx, ii, r, d):
+    batch.write(idx, address(batch, idx, ii, d), batch.get8(r, idx))
+
+
+@vectorise('LD__ii_d__n')
+def ld_ii_d_n(batch, idx, ii, d, n):
+    batch.write(idx, address(batch, idx, ii, d), n)
+
+
+@vectorise('LD_A__nn_')
+def ld_a_nn(batch, idx, nn):
+    batch.set8('A', idx, batch.read(idx, nn))
+
+
+@vectorise('LD__nn__A')
+def ld_nn_a(batch, idx, nn):
+    batch.write(idx, nn, batch.get8('A', idx))
+
+
+def indirect_a(rr):
+    @vectorise('LD_A__{0}_'.format(rr))
+    def load(batch, idx):
+        batch.set8('A', idx, batch.read(idx, batch.get16(rr, idx)))
+
+    @vectorise('LD__{0}__A'.format(rr))
+    def store(batch, idx):
+        batch.write(idx, batch.get16(rr, idx), batch.get8('A', idx))
+
+
+indirect_a('BC')
+indirect_a('DE')
+
+
+# 16 bit load group
+@vectorise('LD_dd_nn', 'LD_ii_nn')
+def ld_rr_nn(batch, idx, rr, nn):
+    batch.set16(rr, idx, nn)
+
+
+@vectorise('LD_HL__nn_')
+def ld_hl_nn(batch, idx, nn):
+    batch.set16('HL', idx, batch.read16(idx, nn))
+
+
+@vectorise('LD_dd__nn_', 'LD_ii__nn_')
+def ld_rr_indirect_nn(batch, idx, rr, nn):
+    batch.set16(rr, idx, batch.read16(idx, nn))
+
+
+@vectorise('LD__nn__HL')
+def ld_nn_hl(batch, idx, nn):
+    batch.write16(idx, nn, batch.get16('HL', idx))
+
+
+@vectorise('LD__nn__dd', 'LD__nn__ii')
+def ld_nn_rr(batch, idx, nn, rr):
+    batch.write16(idx, nn, batch.get16(rr, idx))
+
+
+@vectorise('LD_SP_HL')
+def ld_sp_hl(batch, idx):
+    batch.set16('SP', idx, batch.get16('HL', idx))
+
+
+@vectorise('LD_SP_ii')
+def ld_sp_ii(batch, idx, ii):
+    batch.set16('SP', idx, batch.get16(ii, idx))
+
+
+def push(batch, idx, value):
+    sp = (batch.get16('SP', idx) - 2) & 0xffff
+    batch.set16('SP', idx, sp)
+    batch.write16(idx, sp, value)
+
+
+def pop(batch, idx):
+    sp = batch.get16('SP', idx)
+    batch.set16('SP', idx, (sp + 2) & 0xffff)
+    return batch.read16(idx, sp)
+
+
+@vectorise('PUSH_qq', 'PUSH_ii')
+def push_rr(batch, idx, rr):
+    push(batch, idx, batch.get16(rr, idx))
+
+
+@vectorise('POP_qq', 'POP_ii')
+def pop_rr(batch, idx, rr):
+    batch.set16(rr, idx, pop(batch, idx))
+
+
+# exchange group
+@vectorise('EX_DE_HL')
+def ex_de_hl(batch, idx):
+    de = batch.get16('DE', idx)
+    batch.set16('DE', idx, batch.get16('HL', idx))
+    batch.set16('HL', idx, de)
+
+
+@vectorise('EX_AF_alt_AF')
+def ex_af(batch, idx):
+    batch.exchange([ROWS['A'], ROWS['F']], idx)
+
+
+@vectorise('EXX')
+def exx(batch, idx):
+    batch.exchange([ROWS[r] for r in 'BCDEHL'], idx)
+
+
+@vectorise('EX__SP__HL')
+def ex_sp_hl(batch, idx):
+    ex_sp_rr(batch, idx, 'HL')
+
+
+@vectorise('EX__SP__ii')
+def ex_sp_rr(batch, idx, rr):
+    sp = batch.get16('SP', idx)
+    value = batch.read16(idx, sp)
+    batch.write16(idx, sp, batch.get16(rr, idx))
+    batch.set16(rr, idx, value)
+
+
+# 8 bit arithmetic group, see flags.add_flags and flags.sub_flags
+def add(batch, idx, n, carry, table='add'):
+    t = batch.tables[table][carry, batch.get8('A', idx), n]
+    batch.set8('A', idx, t >> 8)
+    batch.set8('F', idx, t & 0xff)
+
+
+def carry_flag(batch, idx):
+    return batch.flags(idx) & FLAG_C
+
+
+operand_handlers('ADD_A', lambda batch, idx, n: add(batch, idx, n, 0))
+operand_handlers('ADC_A', lambda batch, idx, n:
+                 add(batch, idx, n, carry_flag(batch, idx)))
+operand_handlers('SUB_A', lambda batch, idx, n: add(batch, idx, n, 0, 'sub'))
+operand_handlers('SBC_A', lambda batch, idx, n:
+                 add(batch, idx, n, carry_flag(batch, idx), 'sub'))
+
+
+def compare(batch, idx, n):
+    """ see flags.compare_f """
+    t = batch.tables['sub'][0, batch.get8('A', idx), n]
+    f = (t & 0xff) & ~(FLAG_5 | FLAG_3)
+    batch.set8('F', idx, f | (n & (FLAG_5 | FLAG_3)))
+
+
+operand_handlers('CP', compare)
+
+
+def logic(op, h):
+    """ see flags.logic_f """
+    def apply(batch, idx, n):
+        a = op(batch.get8('A', idx), n)
+        batch.set8('A', idx, a)
+        batch.set8('F', idx, batch.tables['logic'][a] | h)
+    return apply
+
+
+operand_handlers('AND_A', logic(and_, FLAG_H))
+operand_handlers('OR_A', logic(or_, 0))
+operand_handlers('XOR_A', logic(xor, 0))
+
+
+def inc(batch, idx, n):
+    f = batch.flags(idx) & FLAG_C
+    batch.set8('F', idx, f | batch.tables['inc'][n])
+    return (n + 1) & 0xff
+
+
+def dec(batch, idx, n):
+    f = batch.flags(idx) & FLAG_C
+    batch.set8('F', idx, f | batch.tables['dec'][n])
+    return (n - 1) & 0xff
+
+
+modify_handlers('INC', inc)
+modify_handlers('DEC', dec)
+
+
+@vectorise('NOP')
+def nop(batch, idx):
+    pass
+
+
+# 16 bit arithmetic group, see flags.add16_f, adc16_f and sbc16_f
+def add16(batch, idx, rr, nn):
+    mm = batch.get16(rr, idx)
+    batch.set8('F', idx, add16_f(batch.flags(idx), mm, nn))
+    batch.set16(rr, idx, (mm + nn) & 0xffff)
+
+
+@vectorise('ADD_HL_ss')
+def add_hl_ss(batch, idx, ss):
+    add16(batch, idx, 'HL', batch.get16(ss, idx))
+
+
+@vectorise('ADC_HL_ss')
+def adc_hl_ss(batch, idx, ss):
+    hl = batch.get16('HL', idx)
+    nn = batch.get16(ss, idx)
+    carry = carry_flag(batch, idx)
+    batch.set8('F', idx, adc16_f(0, hl, nn, carry))
+    batch.set16('HL', idx, (hl + nn + carry) & 0xffff)
+
+
+@vectorise('SBC_HL_ss')
+def sbc_hl_ss(batch, idx, ss):
+    hl = batch.get16('HL', idx)
+    nn = batch.get16(ss, idx)
+    borrow = carry_flag(batch, idx)
+    batch.set8('F', idx, sbc16_f(0, hl, nn, borrow))
+    batch.set16('HL', idx, (hl - nn - borrow) & 0xffff)
+
+
+@vectorise('ADD_IX_pp')
+def add_ix_pp(batch, idx, pp):
+    add16(batch, idx, 'IX', batch.get16(pp, idx))
+
+
+@vectorise('ADD_IY_rr')
+def add_iy_rr(batch, idx, rr):
+    add16(batch, idx, 'IY', batch.get16(rr, idx))
+
+
+@vectorise('INC_ss', 'INC_ii')
+def inc_rr(batch, idx, rr):
+    batch.set16(rr, idx, (batch.get16(rr, idx) + 1) & 0xffff)
+
+
+@vectorise('DEC_ss', 'DEC_ii')
+def dec_rr(batch, idx, rr):
+    batch.set16(rr, idx, (batch.get16(rr, idx) - 1) & 0xffff)
+
+
+# rotate and shift group
+def shift(name):
+    def modify(batch, idx, n):
+        carry = (batch.flags(idx) & FLAG_C).astype(bool).astype(numpy.int64)
+        t = batch.tables['shift'][name][carry, n]
+        batch.set8('F', idx, t & 0xff)
+        return t >> 8
+    return modify
+
+
+def rotate_accumulator(name, modify):
+    @vectorise(name)
+    def rotate(batch, idx):
+        batch.set8('A', idx, modify(batch, idx, batch.get8('A', idx)))
+
+
+for name in ('RLC', 'RL', 'RRC', 'RR', 'SLA', 'SRA', 'SRL'):
+    modify_handlers(name, shift(name + '_n'))
+for name in ('RLC', 'RL', 'RRC', 'RR'):
+    rotate_accumulator(name + 'A', shift(name + '_n'))
+
+
+# bit set reset test group, see CPU.BIT_b_n
+def test_bit(batch, idx, n, b):
+    f = (batch.flags(idx) | FLAG_H) & ~(FLAG_N | FLAG_Z)
+    batch.set8('F', idx, f | numpy.where(n & (1 << b), 0, FLAG_Z))
+
+
+operand_handlers('BIT_b', test_bit, immediate=False)
+modify_handlers('SET_b', lambda batch, idx, n, b: n | (1 << b))
+modify_handlers('RES_b', lambda batch, idx, n, b: n & (0xff ^ (1 << b)))
+
+
+# jump, call and return groups
+def condition(batch, idx, cc):
+    mask, value = CONDITIONS[cc]
+    return (batch.flags(idx) & mask) == value
+
+
+def jump(batch, idx, taken, target):
+    """ sets PC to target for the instances where taken holds """
+    pc = batch.get16('PC', idx)
+    batch.set16('PC', idx, numpy.where(taken, target, pc) & 0xffff)
+
+
+@vectorise('JP_nn')
+def jp_nn(batch, idx, nn):
+    batch.set16('PC', idx, nn)
+
+
+@vectorise('JP_cc_nn')
+def jp_cc_nn(batch, idx, cc, nn):
+    jump(batch, idx, condition(batch, idx, cc), nn)
+
+
+@vectorise('JR_e')
+def jr_e(batch, idx, e):
+    batch.set16('PC', idx, (batch.get16('PC', idx) + e) & 0xffff)
+
+
+def relative_jump(cc):
+    @vectorise('JR_{0}_e'.format(cc))
+    def jr_cc_e(batch, idx, e):
+        taken = condition(batch, idx, cc)
+        jump(batch, idx, taken, batch.get16('PC', idx) + e)
+        return numpy.where(taken, 12, 7)
+
+
+for cc in ('C', 'NC', 'Z', 'NZ'):
+    relative_jump(cc)
+
+
+@vectorise('JP__HL_')
+def jp_hl(batch, idx):
+    batch.set16('PC', idx, batch.get16('HL', idx))
+
+
+@vectorise('JP__ii_')
+def jp_ii(batch, idx, ii):
+    batch.set16('PC', idx, batch.get16(ii, idx))
+
+
+@vectorise('DJNZ_e')
+def djnz_e(batch, idx, e):
+    b = (batch.get8('B', idx) - 1) & 0xff
+    batch.set8('B', idx, b)
+    taken = b != 0
+    jump(batch, idx, taken, batch.get16('PC', idx) + e)
+    return numpy.where(taken, 13, 8)
+
+
+@vectorise('CALL_nn')
+def call_nn(batch, idx, nn):
+    push(batch, idx, batch.get16('PC', idx))
+    batch.set16('PC', idx, nn)
+
+
+@vectorise('CALL_cc_nn')
+def call_cc_nn(batch, idx, cc, nn):
+    taken = condition(batch, idx, cc)
+    call_nn(batch, idx[taken], nn)
+    return numpy.where(taken, 17, 10)
+
+
+@vectorise('RET')
+def ret(batch, idx):
+    batch.set16('PC', idx, pop(batch, idx))
+
+
+@vectorise('RET_cc')
+def ret_cc(batch, idx, cc):
+    taken = condition(batch, idx, cc)
+    ret(batch, idx[taken])
+    return numpy.where(taken, 11, 5)
+
+
+@vectorise('RST_p')
+def rst_p(batch, idx, p):
+    call_nn(batch, idx, p)
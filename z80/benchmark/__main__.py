@@ -0,0 +1,123 @@
+import os
+import sys
+import argparse
+from . import macro
+from . import startup as startup_
+from .micro import MicroBenchmark
+from .report import LEVELS
+from .report import build_report
+from .report import compare
+from .report import format_report
+from .report import load
+from .report import save
+
+
+def micro(args):
+    options = {'checked': args.checked,
+               'instruction_cache': args.instruction_cache,
+               'lazy_flags': args.lazy_flags}
+    benchmark = MicroBenchmark(iterations=args.iterations,
+                               repeat=args.repeat, seed=args.seed,
+                               **options)
+
+    def select(key):
+        return args.match is None or args.match in key
+
+    report = build_report(benchmark.run(select=select),
+                          benchmark='micro', iterations=args.iterations,
+                          **options)
+    print(format_report(report, args.level or 'templates'))
+    return report
+
+
+def macro_(args):
+    results = macro.run_engines(args.engine, args.workload, args.repeat,
+                                isolate=not args.in_process)
+    report = macro.build_report(results, benchmark='macro')
+    print(macro.format_report(report))
+    return report
+
+
+def startup(args):
+    report = startup_.run(args.entry_point, args.runs, args.top)
+    print(startup_.format_report(report))
+    if args.update_baseline:
+        save(startup_.baseline(report), startup_.BASELINE)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m z80.benchmark')
+    parser.add_argument('--output', help='write the results to a json file')
+    parser.add_argument('--baseline', help='compare against a json file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='tolerated slowdown (fraction, default 0.1)')
+    parser.add_argument('--level', choices=LEVELS + ('workloads', 'startup',
+                                                     'allocations'),
+                        help='level of the report and the comparison')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_micro = commands.add_parser('micro',
+                                       help='per instruction benchmark')
+    parser_micro.set_defaults(func=micro, default_levels=['templates'])
+    parser_micro.add_argument('--iterations', type=int, default=1000)
+    parser_micro.add_argument('--repeat', type=int, default=3)
+    parser_micro.add_argument('--seed', type=int, default=0)
+    parser_micro.add_argument('--match',
+                              help='only instructions containing MATCH')
+    parser_micro.add_argument('--checked', action='store_true')
+    parser_micro.add_argument('--instruction-cache', action='store_true')
+    parser_micro.add_argument('--lazy-flags', action='store_true')
+
+    parser_macro = commands.add_parser('macro',
+                                       help='guest program benchmark')
+    parser_macro.set_defaults(func=macro_, default_levels=['workloads'])
+    parser_macro.add_argument('--engine', action='append',
+                              choices=list(macro.ENGINES),
+                              help='engine to run (default: all)')
+    parser_macro.add_argument('--workload', action='append',
+                              choices=[w.name for w in macro.WORKLOADS],
+                              help='workload to run (default: all)')
+    parser_macro.add_argument('--repeat', type=int, default=3)
+    parser_macro.add_argument('--in-process', action='store_true',
+                              help='do not start a process per engine')
+
+    parser_startup = commands.add_parser(
+        'startup', help='interpreter start and import time benchmark',
+        description='The committed baseline {0} holds the allocation '
+        'counts only, compare the timings against the --output of an '
+        'earlier run on the same machine'.format(
+            os.path.relpath(startup_.BASELINE, startup_.ROOT)))
+    parser_startup.set_defaults(func=startup,
+                                default_levels=['startup', 'allocations'])
+    parser_startup.add_argument('--entry-point', action='append',
+                                choices=list(startup_.ENTRY_POINTS),
+                                help='entry point to run (default: all)')
+    parser_startup.add_argument('--runs', type=int, default=10)
+    parser_startup.add_argument('--top', type=int, default=10,
+                                help='number of non z80 modules listed '
+                                'in the import time breakdown')
+    parser_startup.add_argument('--update-baseline', action='store_true',
+                                help='write the allocation counts to the '
+                                'committed baseline')
+
+    args = parser.parse_args(argv)
+    report = args.func(args)
+    if args.output:
+        save(report, args.output)
+    if args.baseline:
+        baseline = load(args.baseline)
+        levels = [args.level] if args.level else args.default_levels
+        regressions = [regression for level in levels
+                       for regression in compare(report, baseline,
+                                                 args.threshold, level)]
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import multiprocessing
+from collections import OrderedDict
+from time import perf_counter
+from ..cpu import CPU
+from .programs import WORKLOADS
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+
+# clock of the reference machine
+REAL_TIME_MHZ = 3.5
+
+# CPU options of the engines
+ENGINES = OrderedDict([('interpreter', {}),
+                       ('checked', {'checked': True}),
+                       ('lazy_flags', {'lazy_flags': True}),
+                       ('instruction_cache', {'instruction_cache': True}),
+                       ('block_compiler', {'block_compiler': True})])
+
+
+def peak_rss():
+    """ peak resident set size of the process in KiB or None """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def execute(cpu, end):
+    """ runs cpu until PC reaches end.
+        Returns the number of instructions and T-states. """
+    result = cpu.run(until_pc=end)
+    return result.instructions, result.tstates
+
+
+def run_workload(workload, options, repeat=1):
+    """
+    Executes workload repeat times on a new CPU(**options).
+    Returns a dictionary with the counts of one run and the best time.
+    Raises an AssertionError if the program computes a wrong result.
+    """
+    best = None
+    for _ in range(repeat):
+        cpu = CPU(**options)
+        workload.load(cpu)
+        start = perf_counter()
+        instructions, tstates = execute(cpu, workload.end)
+        seconds = perf_counter() - start
+        if not workload.check(cpu):
+            raise AssertionError('wrong result of {0} with {1}'.
+                                 format(workload.name, options))
+        if best is None or seconds < best:
+            best = seconds
+    mhz = tstates / best / 1e6
+    return OrderedDict([('instructions', instructions),
+                        ('tstates', tstates),
+                        ('seconds', best),
+                        ('mips', instructions / best / 1e6),
+                        ('mhz', mhz),
+                        ('real_time', mhz / REAL_TIME_MHZ)])
+
+
+def run_engine(engine, names=None, repeat=1):
+    """ runs the workloads (default: all) with the engine """
+    options = ENGINES[engine]
+    workloads = OrderedDict()
+    for workload in WORKLOADS:
+        if names is None or workload.name in names:
+            workloads[workload.name] = run_workload(workload, options,
+                                                    repeat)
+    instructions = sum(w['instructions'] for w in workloads.values())
+    tstates = sum(w['tstates'] for w in workloads.values())
+    seconds = sum(w['seconds'] for w in workloads.values())
+    mhz = tstates / seconds / 1e6
+    return OrderedDict([('workloads', workloads),
+                        ('mips', instructions / seconds / 1e6),
+                        ('mhz', mhz),
+                        ('real_time', mhz / REAL_TIME_MHZ),
+                        ('peak_rss_kib', peak_rss())])
+
+
+def run_engines(engines=None, names=None, repeat=1, isolate=True):
+    """
+    Runs the workloads with each engine (default: all engines).
+    If isolate is True each engine runs in a fresh process so that its
+    peak RSS is not affected by the other engines.
+    """
+    if engines is None:
+        engines = list(ENGINES)
+    results = OrderedDict()
+    for engine in engines:
+        if isolate:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(1) as pool:
+                results[engine] = pool.apply(run_engine,
+                                             (engine, names, repeat))
+        else:
+            results[engine] = run_engine(engine, names, repeat)
+    return results
+
+
+def build_report(results, **info):
+    """
+    Report dictionary of run_engines results. The workloads level
+    holds the seconds per 'engine:workload' for report.compare.
+    """
+    report = OrderedDict(info)
+    report['real_time_mhz'] = REAL_TIME_MHZ
+    report['engines'] = results
+    report['workloads'] = OrderedDict(
+        ('{0}:{1}'.format(engine, name), workload['seconds'])
+        for engine, result in results.items()
+        for name, workload in result['workloads'].items())
+    return report
+
+
+def format_report(report):
+    """ table of MIPS, MHz and the real time factor per workload """
+    row = '{0:18} {1:12} {2:>8} {3:>9} {4:>10} {5:>12}'
+    lines = [row.format('engine', 'workload', 'MIPS', 'MHz', 'real time',
+                        'peak RSS')]
+
+    def format_row(engine, name, result, rss=''):
+        return row.format(engine, name, '{0:.3f}'.format(result['mips']),
+                          '{0:.3f}'.format(result['mhz']),
+                          '{0:.2f}'.format(result['real_time']), rss)
+
+    for engine, result in report['engines'].items():
+        for name, workload in result['workloads'].items():
+            lines.append(format_row(engine, name, workload))
+        rss = result['peak_rss_kib']
+        lines.append(format_row(engine, 'total', result,
+                                '' if rss is None else '{0} KiB'.format(rss)))
+    return '\n'.join(lines)
@@ -0,0 +1,127 @@
+import random
+from time import perf_counter
+from ..cpu import CPU
+from ..cpu import INSTRUCTION_SET
+
+
+# registers and nn operands point into DATA_START..DATA_END so that
+# memory writes never hit the instruction at CODE_ADDR
+CODE_ADDR = 0x0000
+DATA_START = 0x4000
+DATA_END = 0x8000
+REGISTER_PAIRS = ('BC', 'DE', 'HL')
+
+
+def instruction_key(instr):
+    """ unique name of an expanded instruction: assembler and opcode """
+    codes = ' '.join('{0:02x}'.format(c) for c in instr.opcode
+                     if isinstance(c, int))
+    return '{0} [{1}]'.format(instr.assembler_to_str(), codes)
+
+
+def template_key(template):
+    return template.assembler_to_str()
+
+
+def encode(instr, rng):
+    """ machine code of instr with random operands """
+    code = []
+    for c in instr.opcode:
+        if isinstance(c, int):
+            code.append(c)
+        elif c.memonic == 'nn':
+            nn = rng.randrange(DATA_START, DATA_END)
+            code.extend((nn & 0xff, nn >> 8))
+        else:
+            code.append(rng.randrange(0x100))
+    return code
+
+
+class MicroBenchmark(object):
+    """
+    Executes every expanded instruction of the instruction set in a
+    tight loop.
+
+    Each instruction is placed at CODE_ADDR with random operands, the
+    registers are set to random values which address the data area.
+    Before each execution the registers (including PC and pending
+    lazy flags) are restored, the time of the restore loop without
+    the instruction is subtracted. options are passed to CPU.
+    """
+    def __init__(self, iterations=1000, repeat=3, seed=0, **options):
+        self.iterations = iterations
+        self.repeat = repeat
+        self.seed = seed
+        self.options = options
+
+    def setup(self, instr, rng):
+        """ CPU with instr at CODE_ADDR and random registers and data """
+        cpu = CPU(**self.options)
+        mem = cpu.reg.mem
+        size = len(mem) - DATA_START
+        mem[DATA_START:] = rng.getrandbits(size * 8).to_bytes(size, 'little')
+        for addr, c in enumerate(encode(instr, rng), CODE_ADDR):
+            mem[addr] = c
+        for r in 'AF':
+            cpu[r] = rng.randrange(0x100)
+        cpu.reg.ex_af()
+        for r in 'AF':
+            cpu[r] = rng.randrange(0x100)
+        cpu.reg.ex_af()
+        for _ in range(2):
+            for rr in REGISTER_PAIRS:
+                cpu[rr] = rng.randrange(DATA_START, DATA_END)
+            cpu.reg.exx()
+        for rr in ('IX', 'IY', 'SP'):
+            cpu[rr] = rng.randrange(DATA_START, DATA_END)
+        cpu['PC'] = CODE_ADDR
+        return cpu
+
+    def measure(self, instr):
+        """ ns per execution of instr """
+        rng = random.Random('{0}:{1}'.format(self.seed,
+                                             instruction_key(instr)))
+        cpu = self.setup(instr, rng)
+        reg = cpu.reg
+        r8, r16 = reg.r8, reg.r16
+        saved8, saved16 = r8[:], r16[:]
+        step = cpu.step
+        iterations = range(self.iterations)
+
+        def nothing():
+            pass
+
+        def loop(execute):
+            start = perf_counter()
+            for _ in iterations:
+                r8[:] = saved8
+                r16[:] = saved16
+                reg.pending_flags = None
+                execute()
+            return perf_counter() - start
+
+        best = None
+        for _ in range(self.repeat):
+            elapsed = loop(step) - loop(nothing)
+            if best is None or elapsed < best:
+                best = elapsed
+        return max(best, 0.0) * 1e9 / self.iterations
+
+    def run(self, groups=None, select=None):
+        """
+        Measures the instructions of groups (default: all groups of
+        the instruction set). select is an optional predicate on the
+        instruction key. Returns a list of (group, template, key, ns).
+        """
+        if groups is None:
+            groups = INSTRUCTION_SET.groups
+        results = []
+        for group in groups:
+            for template in group.instruction_templates:
+                for instr in template.instructions:
+                    key = instruction_key(instr)
+                    if select is not None and not select(key):
+                        continue
+                    results.append((group.name, template_key(template),
+                                    key, self.measure(instr)))
+        return results
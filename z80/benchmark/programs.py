@@ -0,0 +1,389 @@
+import random
+from ..cpu import IM1_VECTOR
+
+
+ORIGIN = 0x0100
+STACK = 0xff00
+SOURCE = 0x4000
+TARGET = 0x8000
+RESULT = 0x9000
+# T-states for which an InterruptTimer asserts INT: longer than any
+# instruction, shorter than the interrupt routine
+INTERRUPT_WIDTH = 32
+
+
+def assemble(origin, items):
+    """
+    Machine code of items located at origin.
+
+    items are bytes, label names ending with ':', ('e', label) for the
+    displacement of a relative jump to label and ('nn', label) for the
+    address of label.
+    """
+    labels = {}
+    addr = origin
+    for item in items:
+        if isinstance(item, str):
+            labels[item[:-1]] = addr
+        else:
+            addr += 2 if isinstance(item, tuple) and item[0] == 'nn' else 1
+    code = []
+    for item in items:
+        if isinstance(item, str):
+            continue
+        elif isinstance(item, tuple):
+            kind, label = item
+            if kind == 'nn':
+                code += [labels[label] & 0xff, labels[label] >> 8]
+            else:
+                e = labels[label] - (origin + len(code) + 1)
+                if not -0x80 <= e <= 0x7f:
+                    raise ValueError('jump to {0} out of range'.format(label))
+                code.append(e & 0xff)
+        else:
+            code.append(item)
+    return bytes(code)
+
+
+class InterruptTimer(object):
+    """ asserts INT of cpu for width T-states every period T-states """
+    def __init__(self, cpu, period, width):
+        self.cpu = cpu
+        self.period = period
+        self.width = width
+        cpu.schedule(cpu.tstates + period, self.tick)
+
+    def tick(self, due):
+        self.cpu.interrupt()
+        self.cpu.schedule(due + self.width, self.release)
+        self.cpu.schedule(due + self.period, self.tick)
+
+    def release(self, due):
+        self.cpu.clear_interrupt()
+
+
+class Workload(object):
+    """
+    A guest program executed by the macro benchmark.
+
+    The program is located at ORIGIN and ends with JR $, the address
+    of which is end. setup(mem) initialises the data of the program,
+    check(mem) returns True if the program computed the right result.
+    With interrupt_period an InterruptTimer interrupts the program.
+    """
+    def __init__(self, name, description, items, setup=None, check=None,
+                 interrupt_period=None):
+        self.name = name
+        self.description = description
+        self.code = assemble(ORIGIN, items + [0x18, 0xfe])    # JR $
+        self.end = ORIGIN + len(self.code) - 2
+        self._setup = setup
+        self._check = check
+        self.interrupt_period = interrupt_period
+
+    def load(self, cpu):
+        """ loads the program and its data into the memory of cpu """
+        reg = cpu.reg
+        if self._setup is not None:
+            self._setup(reg.mem)
+        reg.mem[ORIGIN:ORIGIN + len(self.code)] = self.code
+        if reg.code_caches:
+            reg.invalidate_range(0, len(reg.mem))
+        cpu['SP'] = STACK
+        cpu['PC'] = ORIGIN
+        if self.interrupt_period is not None:
+            InterruptTimer(cpu, self.interrupt_period, INTERRUPT_WIDTH)
+
+    def check(self, cpu):
+        return self._check is None or self._check(cpu.reg.mem)
+
+
+def word(mem, addr):
+    return mem[addr] | (mem[addr + 1] << 8)
+
+
+def random_bytes(n, seed, limit=0x100):
+    rng = random.Random(seed)
+    return bytes(rng.randrange(limit) for _ in range(n))
+
+
+# ###### #
+# memcpy #
+# ###### #
+MEMCPY_SIZE = 0x1000
+
+
+def _memcpy_setup(mem):
+    mem[SOURCE:SOURCE + MEMCPY_SIZE] = random_bytes(MEMCPY_SIZE, 'memcpy')
+
+
+def _memcpy_check(mem):
+    return mem[TARGET:TARGET + MEMCPY_SIZE] == \
+        mem[SOURCE:SOURCE + MEMCPY_SIZE]
+
+
+MEMCPY = Workload(
+    'memcpy', 'copy 4 KiB with a byte loop',
+    [0x21, SOURCE & 0xff, SOURCE >> 8,              # LD HL, SOURCE
+     0x11, TARGET & 0xff, TARGET >> 8,              # LD DE, TARGET
+     0x01, MEMCPY_SIZE & 0xff, MEMCPY_SIZE >> 8,    # LD BC, MEMCPY_SIZE
+     'loop:',
+     0x7e,                                          # LD A, (HL)
+     0x12,                                          # LD (DE), A
+     0x23,                                          # INC HL
+     0x13,                                          # INC DE
+     0x0b,                                          # DEC BC
+     0x78,                                          # LD A, B
+     0xb1,                                          # OR C
+     0x20, ('e', 'loop')],                          # JR NZ, loop
+    _memcpy_setup, _memcpy_check)
+
+
+LDIR_COPIES = 16
+
+LDIR = Workload(
+    'ldir', 'copy 4 KiB with LDIR 16 times',
+    [0x06, LDIR_COPIES,                             # LD B, LDIR_COPIES
+     'loop:',
+     0xc5,                                          # PUSH BC
+     0x21, SOURCE & 0xff, SOURCE >> 8,              # LD HL, SOURCE
+     0x11, TARGET & 0xff, TARGET >> 8,              # LD DE, TARGET
+     0x01, MEMCPY_SIZE & 0xff, MEMCPY_SIZE >> 8,    # LD BC, MEMCPY_SIZE
+     0xed, 0xb0,                                    # LDIR
+     0xc1,                                          # POP BC
+     0x10, ('e', 'loop')],                          # DJNZ loop
+    _memcpy_setup, _memcpy_check)
+
+
+# ###### #
+# CRC-16 #
+# ###### #
+CRC_SIZE = 0x400
+
+
+def crc16(data):
+    """ CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xffff) """
+    crc = 0xffff
+    for c in data:
+        crc ^= c << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ (0x1021 if crc & 0x8000 else 0)) & 0xffff
+    return crc
+
+
+def _crc_setup(mem):
+    mem[SOURCE:SOURCE + CRC_SIZE] = random_bytes(CRC_SIZE, 'crc')
+
+
+def _crc_check(mem):
+    return word(mem, RESULT) == crc16(mem[SOURCE:SOURCE + CRC_SIZE])
+
+
+CRC16 = Workload(
+    'crc16', 'CRC-16/CCITT of 1 KiB, bit by bit',
+    [0xdd, 0x21, SOURCE & 0xff, SOURCE >> 8,        # LD IX, SOURCE
+     0x01, CRC_SIZE & 0xff, CRC_SIZE >> 8,          # LD BC, CRC_SIZE
+     0x21, 0xff, 0xff,                              # LD HL, 0xffff
+     'byte:',
+     0xdd, 0x7e, 0x00,                              # LD A, (IX+0)
+     0xac,                                          # XOR H
+     0x67,                                          # LD H, A
+     0x1e, 0x08,                                    # LD E, 8
+     'bit:',
+     0xcb, 0x7c,                                    # BIT 7, H
+     0x29,                                          # ADD HL, HL
+     0x28, ('e', 'skip'),                           # JR Z, skip
+     0x7c,                                          # LD A, H
+     0xee, 0x10,                                    # XOR 0x10
+     0x67,                                          # LD H, A
+     0x7d,                                          # LD A, L
+     0xee, 0x21,                                    # XOR 0x21
+     0x6f,                                          # LD L, A
+     'skip:',
+     0x1d,                                          # DEC E
+     0x20, ('e', 'bit'),                            # JR NZ, bit
+     0xdd, 0x23,                                    # INC IX
+     0x0b,                                          # DEC BC
+     0x78,                                          # LD A, B
+     0xb1,                                          # OR C
+     0x20, ('e', 'byte'),                           # JR NZ, byte
+     0x22, RESULT & 0xff, RESULT >> 8],             # LD (RESULT), HL
+    _crc_setup, _crc_check)
+
+
+# ########### #
+# bubble sort #
+# ########### #
+SORT_SIZE = 64
+
+
+def _sort_setup(mem):
+    mem[SOURCE:SOURCE + SORT_SIZE] = random_bytes(SORT_SIZE, 'sort')
+
+
+def _sort_check(mem):
+    data = mem[SOURCE:SOURCE + SORT_SIZE]
+    return list(data) == sorted(random_bytes(SORT_SIZE, 'sort'))
+
+
+BUBBLE_SORT = Workload(
+    'bubble_sort', 'bubble sort of 64 bytes',
+    ['outer:',
+     0x21, SOURCE & 0xff, SOURCE >> 8,              # LD HL, SOURCE
+     0x06, SORT_SIZE - 1,                           # LD B, SORT_SIZE - 1
+     0x0e, 0x00,                                    # LD C, 0
+     'inner:',
+     0x23,                                          # INC HL
+     0x7e,                                          # LD A, (HL)
+     0x2b,                                          # DEC HL
+     0xbe,                                          # CP (HL)
+     0x30, ('e', 'next'),                           # JR NC, next
+     0x56,                                          # LD D, (HL)
+     0x77,                                          # LD (HL), A
+     0x23,                                          # INC HL
+     0x72,                                          # LD (HL), D
+     0x2b,                                          # DEC HL
+     0x0e, 0x01,                                    # LD C, 1
+     'next:',
+     0x23,                                          # INC HL
+     0x10, ('e', 'inner'),                          # DJNZ inner
+     0x79,                                          # LD A, C
+     0xb7,                                          # OR A
+     0x20, ('e', 'outer')],                         # JR NZ, outer
+    _sort_setup, _sort_check)
+
+
+# ################## #
+# 16 bit multiplying #
+# ################## #
+MULTIPLY_COUNT = 0xff
+COUNTER = 0xa000
+
+
+def _multiply_setup(mem):
+    mem[SOURCE:SOURCE + 4 * MULTIPLY_COUNT] = \
+        random_bytes(4 * MULTIPLY_COUNT, 'multiply')
+
+
+def _multiply_check(mem):
+    for i in range(MULTIPLY_COUNT):
+        a = word(mem, SOURCE + 4 * i)
+        b = word(mem, SOURCE + 4 * i + 2)
+        if word(mem, RESULT + 2 * i) != (a * b) & 0xffff:
+            return False
+    return True
+
+
+MULTIPLY = Workload(
+    'multiply', '255 16 bit multiplications by shift and add',
+    [0xdd, 0x21, SOURCE & 0xff, SOURCE >> 8,        # LD IX, SOURCE
+     0xfd, 0x21, RESULT & 0xff, RESULT >> 8,        # LD IY, RESULT
+     0x3e, MULTIPLY_COUNT,                          # LD A, MULTIPLY_COUNT
+     0x32, COUNTER & 0xff, COUNTER >> 8,            # LD (COUNTER), A
+     'pair:',
+     0xdd, 0x4e, 0x00,                              # LD C, (IX+0)
+     0xdd, 0x46, 0x01,                              # LD B, (IX+1)
+     0xdd, 0x5e, 0x02,                              # LD E, (IX+2)
+     0xdd, 0x56, 0x03,                              # LD D, (IX+3)
+     0xcd, ('nn', 'multiply'),                      # CALL multiply
+     0xfd, 0x75, 0x00,                              # LD (IY+0), L
+     0xfd, 0x74, 0x01,                              # LD (IY+1), H
+     0x11, 0x04, 0x00,                              # LD DE, 4
+     0xdd, 0x19,                                    # ADD IX, DE
+     0xfd, 0x23,                                    # INC IY
+     0xfd, 0x23,                                    # INC IY
+     0x3a, COUNTER & 0xff, COUNTER >> 8,            # LD A, (COUNTER)
+     0x3d,                                          # DEC A
+     0x32, COUNTER & 0xff, COUNTER >> 8,            # LD (COUNTER), A
+     0x20, ('e', 'pair'),                           # JR NZ, pair
+     0xc3, ('nn', 'done'),                          # JP done
+     'multiply:',                                   # HL <- BC * DE
+     0x21, 0x00, 0x00,                              # LD HL, 0
+     0x3e, 0x10,                                    # LD A, 16
+     'shift:',
+     0x29,                                          # ADD HL, HL
+     0xcb, 0x23,                                    # SLA E
+     0xcb, 0x12,                                    # RL D
+     0x30, ('e', 'no_add'),                         # JR NC, no_add
+     0x09,                                          # ADD HL, BC
+     'no_add:',
+     0x3d,                                          # DEC A
+     0x20, ('e', 'shift'),                          # JR NZ, shift
+     0xc9,                                          # RET
+     'done:'],
+    _multiply_setup, _multiply_check)
+
+
+# ################ #
+# search with CPIR #
+# ################ #
+TEXT_SIZE = 0x800
+LETTERS = b'abcdefghijklmnopqrstuvwxyz '
+TEXT = bytes(LETTERS[c]
+             for c in random_bytes(TEXT_SIZE, 'text', len(LETTERS)))
+
+
+def _search_setup(mem):
+    mem[SOURCE:SOURCE + TEXT_SIZE] = TEXT
+
+
+def _search_check(mem):
+    return word(mem, RESULT) == TEXT.count(b'e')
+
+
+SEARCH = Workload(
+    'search', "count the letter e in 2 KiB of text with CPIR",
+    [0x21, SOURCE & 0xff, SOURCE >> 8,              # LD HL, SOURCE
+     0x01, TEXT_SIZE & 0xff, TEXT_SIZE >> 8,        # LD BC, TEXT_SIZE
+     0x11, 0x00, 0x00,                              # LD DE, 0
+     'search:',
+     0x3e, ord('e'),                                # LD A, 'e'
+     0xed, 0xb1,                                    # CPIR
+     0x20, ('e', 'done'),                           # JR NZ, done
+     0x13,                                          # INC DE
+     0x78,                                          # LD A, B
+     0xb1,                                          # OR C
+     0x20, ('e', 'search'),                         # JR NZ, search
+     'done:',
+     0xed, 0x53, RESULT & 0xff, RESULT >> 8],       # LD (RESULT), DE
+    _search_setup, _search_check)
+
+
+# ########## #
+# interrupts #
+# ########## #
+TICKS = 200
+TICK_PERIOD = 1000
+# IM 1 routine: HL counts the interrupts
+TICK_HANDLER = bytes([0x23,                         # INC HL
+                      0xfb,                         # EI
+                      0xed, 0x4d])                  # RETI
+
+
+def _interrupts_setup(mem):
+    mem[IM1_VECTOR:IM1_VECTOR + len(TICK_HANDLER)] = TICK_HANDLER
+
+
+def _interrupts_check(mem):
+    return word(mem, RESULT) > TICKS and word(mem, RESULT + 2) == TICKS
+
+
+INTERRUPTS = Workload(
+    'interrupts', 'tight loop counting 200 timer interrupts',
+    [0x21, 0x00, 0x00,                              # LD HL, 0
+     0x11, 0x00, 0x00,                              # LD DE, 0
+     0xed, 0x56,                                    # IM 1
+     0xfb,                                          # EI
+     'loop:',
+     0x13,                                          # INC DE
+     0x7d,                                          # LD A, L
+     0xfe, TICKS,                                   # CP TICKS
+     0x38, ('e', 'loop'),                           # JR C, loop
+     0xf3,                                          # DI
+     0xed, 0x53, RESULT & 0xff, RESULT >> 8,        # LD (RESULT), DE
+     0x22, (RESULT + 2) & 0xff, (RESULT + 2) >> 8],  # LD (RESULT + 2), HL
+    _interrupts_setup, _interrupts_check, interrupt_period=TICK_PERIOD)
+
+
+WORKLOADS = [MEMCPY, LDIR, CRC16, BUBBLE_SORT, MULTIPLY, SEARCH,
+             INTERRUPTS]
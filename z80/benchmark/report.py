@@ -0,0 +1,93 @@
+import json
+import platform
+from collections import OrderedDict
+
+
+LEVELS = ('instructions', 'templates', 'groups')
+# unit of the entries of a level, default: ns
+UNITS = {'workloads': 's', 'startup': 's', 'allocations': ''}
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def format_value(level, value):
+    unit = UNITS.get(level, 'ns')
+    if unit == 'ns':
+        return '{0:.0f} ns'.format(value)
+    return '{0:.4g}{1}'.format(value, ' ' + unit if unit else '')
+
+
+def build_report(results, **info):
+    """
+    Report dictionary of MicroBenchmark results: ns per instruction
+    and the mean ns per template and per group. info is stored
+    along with the python version.
+    """
+    levels = OrderedDict((level, OrderedDict()) for level in LEVELS)
+    for group, template, key, ns in results:
+        levels['instructions'][key] = ns
+        levels['templates'].setdefault(template, []).append(ns)
+        levels['groups'].setdefault(group, []).append(ns)
+    for level in ('templates', 'groups'):
+        for key, values in levels[level].items():
+            levels[level][key] = mean(values)
+    report = OrderedDict(info)
+    report['python'] = platform.python_version()
+    report.update(levels)
+    return report
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+        f.write('\n')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class Regression(object):
+    """ an entry which is slower than in the baseline """
+    def __init__(self, level, key, baseline, current):
+        self.level = level
+        self.key = key
+        self.baseline = baseline
+        self.current = current
+
+    @property
+    def ratio(self):
+        if not self.baseline:
+            return float('inf')
+        return self.current / self.baseline
+
+    def __str__(self):
+        return '{0} {1}: {2} -> {3} ({4:+.1%})'.\
+            format(self.level, self.key,
+                   format_value(self.level, self.baseline),
+                   format_value(self.level, self.current), self.ratio - 1)
+
+
+def compare(report, baseline, threshold=0.1, level='templates'):
+    """
+    Regressions of report against baseline: the entries of level
+    which are more than threshold (a fraction) slower. Entries
+    missing in either report are ignored.
+    """
+    regressions = []
+    for key, current in report[level].items():
+        before = baseline.get(level, {}).get(key)
+        if before is not None and current > before * (1 + threshold):
+            regressions.append(Regression(level, key, before, current))
+    return regressions
+
+
+def format_report(report, level='groups'):
+    """ table of the ns per entry of level """
+    entries = report[level]
+    width = max([len(key) for key in entries] + [0])
+    return '\n'.join('{0:{1}} {2:10.0f} ns'.format(key, width, ns)
+                     for key, ns in entries.items())
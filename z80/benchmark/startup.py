@@ -0,0 +1,184 @@
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+from collections import OrderedDict
+from statistics import median
+from time import perf_counter
+
+
+# directory containing the z80 package
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baselines', 'startup.json')
+
+# name: (interpreter arguments, environment variables)
+ENTRY_POINTS = OrderedDict([
+    ('python', (['-c', 'pass'], {})),
+    ('import_cpu', (['-c', 'import z80.cpu'], {})),
+    ('import_cpu_uncached', (['-c', 'import z80.cpu'],
+                             {'Z80_CACHE_DIR': ''})),
+    ('shell', (['-m', 'z80.shell', 'exit'], {})),
+    ('shell_instr_ls', (['-m', 'z80.shell', 'instr', 'ls', '--json'], {}))])
+
+# modules whose import allocations are counted
+ALLOCATION_MODULES = ('z80.cpu', 'z80.shell')
+
+COUNT_SCRIPT = '''
+import json
+import sys
+from z80.instruction import Instruction
+from z80.register import RegisterPlusOffset
+
+counts = {{}}
+
+
+def count(cls):
+    init = cls.__init__
+    counts[cls.__name__] = 0
+
+    def __init__(self, *args, **kwargs):
+        counts[cls.__name__] += 1
+        init(self, *args, **kwargs)
+    cls.__init__ = __init__
+
+
+count(Instruction)
+count(RegisterPlusOffset)
+import {0}
+json.dump(counts, sys.stdout)
+'''
+
+IMPORTTIME_PATTERN = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def environment(env):
+    """ environment of a fresh interpreter which finds the z80 package """
+    ret = dict(os.environ)
+    path = ret.get('PYTHONPATH')
+    ret['PYTHONPATH'] = ROOT if not path else ROOT + os.pathsep + path
+    ret.update(env)
+    return ret
+
+
+def python(argv, env={}, options=()):
+    """ runs the interpreter, returns the completed process """
+    return subprocess.run([sys.executable] + list(options) + list(argv),
+                          env=environment(env), cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def percentile(values, p):
+    """ nearest rank percentile, p in 0..100 """
+    values = sorted(values)
+    rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def parse_importtime(text):
+    """
+    Parses the output of python -X importtime.
+    Returns an OrderedDict module -> (self us, cumulative us, depth).
+    """
+    ret = OrderedDict()
+    for line in text.splitlines():
+        res = IMPORTTIME_PATTERN.match(line)
+        if res is not None:
+            ret[res.group(4)] = (int(res.group(1)), int(res.group(2)),
+                                 len(res.group(3)) // 2)
+    return ret
+
+
+def importtime(argv, env={}, top=10):
+    """ self time in us of the z80 modules and of the top slowest
+        other modules imported by the entry point """
+    modules = parse_importtime(python(argv, env, ['-X', 'importtime']).stderr)
+    ranked = sorted(modules, key=lambda m: modules[m][0], reverse=True)
+    selected = [m for m in ranked if m.split('.')[0] == 'z80'] + \
+        [m for m in ranked if m.split('.')[0] != 'z80'][:top]
+    return OrderedDict((m, modules[m][0])
+                       for m in sorted(selected, key=ranked.index))
+
+
+def time_entry_point(argv, env={}, runs=10):
+    """ wall clock seconds of runs executions in fresh interpreters
+        after one warm up run (which fills the byte code and template
+        caches) """
+    python(argv, env)
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        python(argv, env)
+        times.append(perf_counter() - start)
+    return times
+
+
+def count_allocations(module):
+    """ number of Instruction and RegisterPlusOffset objects
+        constructed while importing module """
+    return json.loads(python(['-c', COUNT_SCRIPT.format(module)]).stdout)
+
+
+def run(names=None, runs=10, top=10):
+    """ times the entry points (default: all) and counts the
+        allocations. Returns a report dictionary, the startup level
+        holds the median seconds per entry point """
+    if names is None:
+        names = list(ENTRY_POINTS)
+    entry_points = OrderedDict()
+    for name in names:
+        argv, env = ENTRY_POINTS[name]
+        times = time_entry_point(argv, env, runs)
+        entry_points[name] = OrderedDict([
+            ('median', median(times)),
+            ('p95', percentile(times, 95)),
+            ('times', times),
+            ('importtime', importtime(argv, env, top))])
+    allocations = OrderedDict()
+    for module in ALLOCATION_MODULES:
+        for cls, n in sorted(count_allocations(module).items()):
+            allocations['{0}:{1}'.format(module, cls)] = n
+    report = OrderedDict([('benchmark', 'startup'),
+                          ('python', platform.python_version()),
+                          ('runs', runs),
+                          ('entry_points', entry_points)])
+    report['startup'] = OrderedDict((name, result['median'])
+                                    for name, result in entry_points.items())
+    report['allocations'] = allocations
+    return report
+
+
+def baseline(report):
+    """ the part of report committed as BASELINE: the allocation
+        counts, which unlike the timings do not depend on the machine.
+        Compare the timings against a report of the same machine
+        (--output, then --baseline). """
+    return OrderedDict([('benchmark', 'startup'),
+                        ('python', report['python']),
+                        ('allocations', report['allocations'])])
+
+
+def format_report(report):
+    """ median and p95 per entry point, the import time breakdown
+        and the allocation counts """
+    lines = ['{0:20} {1:>10} {2:>10}'.format('entry point', 'median',
+                                             'p95')]
+    for name, result in report['entry_points'].items():
+        lines.append('{0:20} {1:>8.1f}ms {2:>8.1f}ms'.format(
+            name, result['median'] * 1e3, result['p95'] * 1e3))
+    for name, result in report['entry_points'].items():
+        lines.append('')
+        lines.append('import time of {0} (self)'.format(name))
+        for module, us in result['importtime'].items():
+            lines.append('  {0:30} {1:>8.1f}ms'.format(module, us / 1e3))
+    lines.append('')
+    lines.append('allocations at import')
+    for key, n in report['allocations'].items():
+        lines.append('  {0:30} {1:>8}'.format(key, n))
+    return '\n'.join(lines)
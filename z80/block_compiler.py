@@ -0,0 +1,679 @@
+from .flags import DEC_FLAGS
+from .flags import FLAG_H
+from .flags import INC_FLAGS
+from .flags import adc16_f
+from .flags import add16_f
+from .flags import add_flags
+from .flags import compare_f
+from .flags import logic_f
+from .flags import sbc16_f
+from .flags import sub_flags
+from .idle import IMPURE
+from .register import BANK_OFFSET
+from .register import GENERAL_PURPOSE
+from .register import PAGE_BITS
+from .register import SLOT_I
+from .register import SLOT_R
+from .register import WORDS
+from .register import WORD_PC
+
+
+PAIRS = {'BC': ('B', 'C'),
+         'DE': ('D', 'E'),
+         'HL': ('H', 'L'),
+         'AF': ('A', 'F')}
+
+MAX_BLOCK_LENGTH = 64
+
+# repeated block instructions, which check the next event themselves
+REPEATS = frozenset(['LDIR', 'LDDR', 'CPIR', 'CPDR',
+                     'INIR', 'INDR', 'OTIR', 'OTDR'])
+
+# code executed before the registers are loaded into locals:
+# resolves lazy flags and loads the active bank offsets
+PROLOGUE = ('if reg.pending_flags is not None:',
+            '    reg.resolve_flags()',
+            'gp_ = reg.gp_bank',
+            'af_ = reg.af_bank')
+
+
+def location(r):
+    """ expression of the storage of register r in the generated code """
+    if r in WORDS:
+        return 'r16[{0}]'.format(WORDS[r])
+    elif r == 'I':
+        return 'r8[{0}]'.format(SLOT_I)
+    elif r == 'R':
+        return 'r8[{0}]'.format(SLOT_R)
+    elif r in GENERAL_PURPOSE:
+        return 'r8[gp_ + {0}]'.format(BANK_OFFSET[r])
+    else:
+        return 'r8[af_ + {0}]'.format(BANK_OFFSET[r])
+
+
+# tables and functions of the flags module called by the generated code,
+# so that the flags are defined once for all engines
+FLAG_FUNCTIONS = {'INC_FLAGS': INC_FLAGS,
+                  'DEC_FLAGS': DEC_FLAGS,
+                  'add_flags': add_flags,
+                  'sub_flags': sub_flags,
+                  'compare_f': compare_f,
+                  'logic_f': logic_f,
+                  'add16_f': add16_f,
+                  'adc16_f': adc16_f,
+                  'sbc16_f': sbc16_f}
+
+EMITTERS = {}
+
+
+def emitter(*names):
+    """ registers a code generator for the instruction functions names """
+    def register(func):
+        for name in names:
+            EMITTERS[name] = func
+        return func
+    return register
+
+
+class Block(object):
+    """
+    A compiled basic block
+
+    func(reg) executes the block on the RegisterSet reg. It returns
+    a tuple (n, extra). n is None if all instructions have been
+    executed or the number of executed instructions if the block has
+    been left early because it modified itself. extra are the T-states
+    returned by called handlers in excess of Instruction.tstates.
+
+    A block is pure if its instructions only act on the registers and
+    the memory (see idle.IMPURE), so that CPU.run may execute it at once
+    between two events. interior holds the addresses of its instructions
+    but the first.
+    """
+    def __init__(self, start, instructions, source, func):
+        self.start = start
+        self.size = sum(instr.size for (_, instr, _) in instructions)
+        self.length = len(instructions)
+        self.interior = frozenset(addr for (addr, _, _) in instructions[1:])
+        names = set(instr.func.__name__ for (_, instr, _) in instructions)
+        self.pure = names.isdisjoint(IMPURE) and names.isdisjoint(REPEATS)
+        self.partial_tstates = [0]
+        for (_, instr, _) in instructions:
+            tstates = self.partial_tstates[-1] + instr.tstates
+            self.partial_tstates.append(tstates)
+        self.tstates = self.partial_tstates[-1]
+        self.source = source
+        self.func = func
+
+    def addresses(self):
+        return [(self.start + i) & 0xffff for i in range(self.size)]
+
+
+class BlockWriter(object):
+    """ Generates the python source of a block """
+    def __init__(self, start, size):
+        self.start = start
+        self.size = size
+        self.lines = []
+        self.used = set()
+        self.dirty = set()
+        self.indent = 1
+        self.index = 0
+        self.next_pc = start
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def reg(self, r):
+        """ local variable of an 8 bit register or SP, IX, IY """
+        self.used.add(r)
+        return r
+
+    def pair(self, rr):
+        """ expression of a 16 bit register """
+        if rr in PAIRS:
+            hi, lo = PAIRS[rr]
+            return '({0} << 8 | {1})'.format(self.reg(hi), self.reg(lo))
+        else:
+            return self.reg(rr)
+
+    def set(self, r, expr):
+        self.used.add(r)
+        self.dirty.add(r)
+        self.emit('{0} = {1}'.format(r, expr))
+
+    def set_all(self, rs, expr):
+        """ assigns the tuple expr to the registers rs """
+        for r in rs:
+            self.used.add(r)
+            self.dirty.add(r)
+        self.emit('{0} = {1}'.format(', '.join(rs), expr))
+
+    def set_pair(self, rr, expr):
+        if rr in PAIRS:
+            hi, lo = PAIRS[rr]
+            self.emit('v_ = {0}'.format(expr))
+            self.set(hi, 'v_ >> 8')
+            self.set(lo, 'v_ & 0xff')
+        else:
+            self.set(rr, expr)
+
+    def spill(self):
+        for r in sorted(self.dirty):
+            self.emit('{0} = {1}'.format(location(r), r))
+        self.dirty = set()
+
+    def write(self, *writes):
+        """ memory writes given as (addr, value) expressions.
+            Leaves the block if it modifies itself """
+        addrs = []
+        for addr, value in writes:
+            a = 'a{0}_'.format(len(addrs))
+            self.emit('{0} = {1}'.format(a, addr))
+            self.emit('if mapped[{0} >> {1}]:'.format(a, PAGE_BITS))
+            self.emit('    reg.paged[{0}] = {1}'.format(a, value))
+            self.emit('else:')
+            self.emit('    mem[{0}] = {1}'.format(a, value))
+            addrs.append(a)
+        self.emit('if caches:')
+        self.indent += 1
+        for a in addrs:
+            self.emit('invalidate({0})'.format(a))
+        self.emit('if {0}:'.format(
+            ' or '.join('({0} - 0x{1:04x}) & 0xffff < {2}'.
+                        format(a, self.start, self.size) for a in addrs)))
+        self.indent += 1
+        dirty = self.dirty
+        self.spill()
+        self.dirty = dirty
+        self.set_pc()
+        self.emit('return {0}, extra_'.format(self.index + 1))
+        self.indent -= 2
+
+    def set_pc(self):
+        self.emit('r16[{0}] = 0x{1:04x}'.format(WORD_PC, self.next_pc))
+
+    def call(self, handler, args, tstates):
+        """ calls the interpreter function of an instruction """
+        self.spill()
+        self.set_pc()
+        self.emit('t_ = {0}{1}'.format(handler, repr(tuple(args))))
+        self.emit('if t_ is not None:')
+        self.emit('    extra_ += t_ - {0}'.format(tstates))
+        self.emit('# reload')
+        self.emit('if blocks.get(0x{0:04x}) is not block:'.format(self.start))
+        self.emit('    return {0}, extra_'.format(self.index + 1))
+
+    def source(self, name, inline_last):
+        loads = list(PROLOGUE)
+        loads += ['{0} = {1}'.format(r, location(r))
+                  for r in sorted(self.used)]
+        lines = ['def {0}(reg):'.format(name),
+                 '    r8 = reg.r8',
+                 '    r16 = reg.r16',
+                 '    mem = reg.mem',
+                 '    mapped = reg.mapped',
+                 '    caches = reg.code_caches',
+                 '    invalidate = reg.invalidate',
+                 '    extra_ = 0']
+        lines += ['    ' + line for line in loads]
+        for line in self.lines:
+            if line.strip() == '# reload':
+                indent = line[:len(line) - len(line.lstrip())]
+                lines += [indent + load for load in loads]
+            else:
+                lines.append(line)
+        for r in sorted(self.dirty):
+            lines.append('    {0} = {1}'.format(location(r), r))
+        if inline_last:
+            lines.append('    r16[{0}] = 0x{1:04x}'.
+                         format(WORD_PC, self.next_pc))
+        lines.append('    return None, extra_')
+        return '\n'.join(lines) + '\n'
+
+
+def hex8(n):
+    return '0x{0:02x}'.format(n)
+
+
+def hex16(nn):
+    return '0x{0:04x}'.format(nn)
+
+
+def index_addr(w, ii, d):
+    return '({0} + ({1})) & 0xffff'.format(w.reg(ii), d)
+
+
+# ################ #
+# 8 bit load group #
+# ################ #
+@emitter('LD_r_r')
+def _LD_r_r(w, r1, r2):
+    w.set(r1, w.reg(r2))
+
+
+@emitter('LD_r_n')
+def _LD_r_n(w, r, n):
+    w.set(r, hex8(n))
+
+
+@emitter('LD_r__HL_')
+def _LD_r__HL_(w, r):
+    w.set(r, 'mem[{0}]'.format(w.pair('HL')))
+
+
+@emitter('LD_r__ii_d_')
+def _LD_r__ii_d_(w, r, ii, d):
+    w.set(r, 'mem[{0}]'.format(index_addr(w, ii, d)))
+
+
+@emitter('LD__HL__r')
+def _LD__HL__r(w, r):
+    w.write((w.pair('HL'), w.reg(r)))
+
+
+@emitter('LD__HL__n')
+def _LD__HL__n(w, n):
+    w.write((w.pair('HL'), hex8(n)))
+
+
+@emitter('LD__ii_d__r')
+def _LD__ii_d__r(w, ii, r, d):
+    w.write((index_addr(w, ii, d), w.reg(r)))
+
+
+@emitter('LD__ii_d__n')
+def _LD__ii_d__n(w, ii, d, n):
+    w.write((index_addr(w, ii, d), hex8(n)))
+
+
+@emitter('LD_A__BC_')
+def _LD_A__BC_(w):
+    w.set('A', 'mem[{0}]'.format(w.pair('BC')))
+
+
+@emitter('LD_A__DE_')
+def _LD_A__DE_(w):
+    w.set('A', 'mem[{0}]'.format(w.pair('DE')))
+
+
+@emitter('LD_A__nn_')
+def _LD_A__nn_(w, nn):
+    w.set('A', 'mem[{0}]'.format(hex16(nn)))
+
+
+@emitter('LD__BC__A')
+def _LD__BC__A(w):
+    w.write((w.pair('BC'), w.reg('A')))
+
+
+@emitter('LD__DE__A')
+def _LD__DE__A(w):
+    w.write((w.pair('DE'), w.reg('A')))
+
+
+@emitter('LD__nn__A')
+def _LD__nn__A(w, nn):
+    w.write((hex16(nn), w.reg('A')))
+
+
+# ################# #
+# 16 bit load group #
+# ################# #
+def write16(w, addr, rr):
+    if rr in PAIRS:
+        hi, lo = PAIRS[rr]
+        low, high = w.reg(lo), w.reg(hi)
+    else:
+        low = '{0} & 0xff'.format(w.reg(rr))
+        high = '{0} >> 8'.format(w.reg(rr))
+    w.write((addr, low), ('({0} + 1) & 0xffff'.format(addr), high))
+
+
+def read16(addr):
+    return 'mem[{0}] | (mem[({0} + 1) & 0xffff] << 8)'.format(addr)
+
+
+@emitter('LD_dd_nn', 'LD_ii_nn')
+def _LD_dd_nn(w, dd, nn):
+    w.set_pair(dd, hex16(nn))
+
+
+@emitter('LD_HL__nn_')
+def _LD_HL__nn_(w, nn):
+    w.set_pair('HL', read16(hex16(nn)))
+
+
+@emitter('LD_dd__nn_', 'LD_ii__nn_')
+def _LD_dd__nn_(w, dd, nn):
+    w.set_pair(dd, read16(hex16(nn)))
+
+
+@emitter('LD__nn__HL')
+def _LD__nn__HL(w, nn):
+    write16(w, hex16(nn), 'HL')
+
+
+@emitter('LD__nn__dd', 'LD__nn__ii')
+def _LD__nn__dd(w, nn, dd):
+    write16(w, hex16(nn), dd)
+
+
+@emitter('LD_SP_HL')
+def _LD_SP_HL(w):
+    w.set('SP', w.pair('HL'))
+
+
+@emitter('LD_SP_ii')
+def _LD_SP_ii(w, ii):
+    w.set('SP', w.reg(ii))
+
+
+@emitter('PUSH_qq', 'PUSH_ii')
+def _PUSH_qq(w, qq):
+    w.set('SP', '({0} - 2) & 0xffff'.format(w.reg('SP')))
+    write16(w, 'SP', qq)
+
+
+@emitter('POP_qq', 'POP_ii')
+def _POP_qq(w, qq):
+    w.set_pair(qq, read16(w.reg('SP')))
+    w.set('SP', '(SP + 2) & 0xffff')
+
+
+# ######## #
+# exchange #
+# ######## #
+@emitter('EX_DE_HL')
+def _EX_DE_HL(w):
+    for r in 'DEHL':
+        w.reg(r)
+        w.dirty.add(r)
+    w.emit('D, E, H, L = H, L, D, E')
+
+
+# ################ #
+# 8-bit arithmetic #
+# ################ #
+def add8(w, n, carry):
+    w.set_all('AF', 'add_flags({0}, {1}, {2})'.format(w.reg('A'), n, carry))
+
+
+def sub8(w, n, borrow):
+    w.set_all('AF', 'sub_flags({0}, {1}, {2})'.format(w.reg('A'), n, borrow))
+
+
+def logic8(w, op, n):
+    w.set('A', '{0} {1} {2}'.format(w.reg('A'), op, n))
+    h = FLAG_H if op == '&' else 0
+    w.set('F', 'logic_f({0}, A, {1})'.format(w.reg('F'), h))
+
+
+def cp8(w, n):
+    w.set('F', 'compare_f({0}, {1}, {2})'.format(w.reg('F'), w.reg('A'), n))
+
+
+def operand8(w, suffix, args):
+    """ source operand of an 8 bit arithmetic instruction """
+    if suffix == '__HL_':
+        return 'mem[{0}]'.format(w.pair('HL'))
+    elif suffix == '__ii_d_':
+        ii, d = args
+        return 'mem[{0}]'.format(index_addr(w, ii, d))
+    elif suffix == '_r':
+        return w.reg(args[0])
+    else:
+        return hex8(args[0])
+
+
+def arithmetic8(name, suffix):
+    """ code generator of the 8 bit arithmetic instruction name + suffix """
+    def emit(w, *args):
+        n = operand8(w, suffix, args)
+        if name == 'ADD_A':
+            add8(w, n, '0')
+        elif name == 'ADC_A':
+            add8(w, n, '{0} & 0x01'.format(w.reg('F')))
+        elif name == 'SUB_A':
+            sub8(w, n, '0')
+        elif name == 'SBC_A':
+            sub8(w, n, '{0} & 0x01'.format(w.reg('F')))
+        elif name == 'AND_A':
+            logic8(w, '&', n)
+        elif name == 'OR_A':
+            logic8(w, '|', n)
+        elif name == 'XOR_A':
+            logic8(w, '^', n)
+        else:
+            cp8(w, n)
+    return emit
+
+
+for _name in ('ADD_A', 'ADC_A', 'SUB_A', 'SBC_A',
+              'AND_A', 'OR_A', 'XOR_A', 'CP'):
+    for _suffix in ('_n', '_r', '__HL_', '__ii_d_'):
+        EMITTERS[_name + _suffix] = arithmetic8(_name, _suffix)
+
+
+@emitter('INC_r')
+def _INC_r(w, r):
+    w.emit('n_ = {0}'.format(w.reg(r)))
+    w.set('F', '({0} & 0x01) | INC_FLAGS[n_]'.format(w.reg('F')))
+    w.set(r, '(n_ + 1) & 0xff')
+
+
+@emitter('DEC_r')
+def _DEC_r(w, r):
+    w.emit('n_ = {0}'.format(w.reg(r)))
+    w.set('F', '({0} & 0x01) | DEC_FLAGS[n_]'.format(w.reg('F')))
+    w.set(r, '(n_ - 1) & 0xff')
+
+
+# ################# #
+# 16 bit arithmetic #
+# ################# #
+def add16(w, target, nn):
+    w.emit('mm_ = {0}'.format(w.pair(target)))
+    w.emit('nn_ = {0}'.format(nn))
+    w.set('F', 'add16_f({0}, mm_, nn_)'.format(w.reg('F')))
+    w.set_pair(target, '(mm_ + nn_) & 0xffff')
+
+
+@emitter('ADD_HL_ss')
+def _ADD_HL_ss(w, ss):
+    add16(w, 'HL', w.pair(ss))
+
+
+@emitter('ADC_HL_ss')
+def _ADC_HL_ss(w, ss):
+    w.emit('mm_ = {0}'.format(w.pair('HL')))
+    w.emit('nn_ = {0}'.format(w.pair(ss)))
+    w.emit('c_ = {0} & 0x01'.format(w.reg('F')))
+    w.set('F', 'adc16_f(F, mm_, nn_, c_)')
+    w.set_pair('HL', '(mm_ + nn_ + c_) & 0xffff')
+
+
+@emitter('SBC_HL_ss')
+def _SBC_HL_ss(w, ss):
+    w.emit('mm_ = {0}'.format(w.pair('HL')))
+    w.emit('nn_ = {0}'.format(w.pair(ss)))
+    w.emit('c_ = {0} & 0x01'.format(w.reg('F')))
+    w.set('F', 'sbc16_f(F, mm_, nn_, c_)')
+    w.set_pair('HL', '(mm_ - nn_ - c_) & 0xffff')
+
+
+@emitter('ADD_IX_pp')
+def _ADD_IX_pp(w, pp):
+    add16(w, 'IX', w.pair(pp))
+
+
+@emitter('ADD_IY_rr')
+def _ADD_IY_rr(w, rr):
+    add16(w, 'IY', w.pair(rr))
+
+
+@emitter('INC_ss', 'INC_ii')
+def _INC_ss(w, ss):
+    w.set_pair(ss, '({0} + 1) & 0xffff'.format(w.pair(ss)))
+
+
+@emitter('DEC_ss', 'DEC_ii')
+def _DEC_ss(w, ss):
+    w.set_pair(ss, '({0} - 1) & 0xffff'.format(w.pair(ss)))
+
+
+# ############### #
+# General purpose #
+# ############### #
+@emitter('NOP')
+def _NOP(w):
+    pass
+
+
+# ####################### #
+# Bit set, reset and test #
+# ####################### #
+@emitter('BIT_b_r')
+def _BIT_b_r(w, b, r):
+    w.set('F', '({0} & 0xad) | 0x10 | (0 if {1} & {2} else 0x40)'.
+          format(w.reg('F'), w.reg(r), hex8(1 << b)))
+
+
+@emitter('SET_b_r')
+def _SET_b_r(w, b, r):
+    w.set(r, '{0} | {1}'.format(w.reg(r), hex8(1 << b)))
+
+
+@emitter('RES_b_r')
+def _RES_b_r(w, b, r):
+    w.set(r, '{0} & {1}'.format(w.reg(r), hex8(0xff ^ (1 << b))))
+
+
+class BlockCompiler(object):
+    """
+    Translates basic blocks of Z80 code into python functions.
+
+    A block starts at an arbitrary address and extends until the
+    first instruction that may modify PC (see Instruction.branch)
+    or MAX_BLOCK_LENGTH instructions. Registers are held in local
+    variables of the generated function. Instructions without
+    code generator are executed by calling their interpreter function.
+    Blocks are cached by start address and dropped when one of their
+    bytes is written.
+    """
+    def __init__(self, cpu, instruction_set, max_length=MAX_BLOCK_LENGTH):
+        self.cpu = cpu
+        self.instruction_set = instruction_set
+        self.max_length = max_length
+        self.blocks = {}
+        self.covers = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, addr):
+        block = self.blocks.get(addr)
+        if block is None:
+            self.misses += 1
+            block = self.compile(addr)
+            self.blocks[addr] = block
+            for a in block.addresses():
+                self.covers.setdefault(a, set()).add(addr)
+        else:
+            self.hits += 1
+        return block
+
+    def execute(self, addr):
+        """ executes the block at addr.
+            Returns the number of executed instructions and T-states """
+        return self.execute_block(self.get(addr))
+
+    def execute_block(self, block):
+        """ executes block, see execute """
+        n, extra = block.func(self.cpu.reg)
+        if n is None:
+            return block.length, block.tstates + extra
+        else:
+            return n, block.partial_tstates[n] + extra
+
+    def decode_block(self, addr):
+        mem = self.cpu.reg.mem
+        instructions = []
+        while len(instructions) < self.max_length:
+            try:
+                instr, args = self.instruction_set.decode(mem, addr)
+            except NotImplementedError:
+                if instructions:
+                    break
+                raise
+            instructions.append((addr, instr, args))
+            addr = (addr + instr.size) & 0xffff
+            if instr.branch:
+                break
+        return instructions
+
+    def compile(self, start):
+        instructions = self.decode_block(start)
+        size = sum(instr.size for (_, instr, _) in instructions)
+        w = BlockWriter(start, size)
+        namespace = dict(FLAG_FUNCTIONS, blocks=self.blocks)
+        inline_last = True
+        for index, (addr, instr, args) in enumerate(instructions):
+            name = instr.func.__name__
+            w.index = index
+            w.next_pc = (addr + instr.size) & 0xffff
+            w.emit('# {0:04x}: {1}'.format(addr, instr.assembler_to_str()))
+            if name in EMITTERS and not instr.branch:
+                EMITTERS[name](w, *args)
+                inline_last = True
+            else:
+                handler = 'h{0}'.format(index)
+                if self.cpu.checked:
+                    func = instr.func
+                else:
+                    func = instr.unchecked
+                    args = instr.decode_unchecked(self.cpu.reg.mem, addr)
+                namespace[handler] = func.__get__(self.cpu)
+                w.call(handler, args, instr.tstates)
+                inline_last = False
+        name = 'block_{0:04x}'.format(start)
+        source = w.source(name, inline_last)
+        exec(compile(source, '<{0}>'.format(name), 'exec'), namespace)
+        block = Block(start, instructions, source, namespace[name])
+        namespace['block'] = block
+        return block
+
+    def invalidate(self, addr):
+        """ drop all blocks covering addr """
+        starts = self.covers.pop(addr, None)
+        if starts is None:
+            return
+        for start in starts:
+            block = self.blocks.pop(start, None)
+            if block is None:
+                continue
+            self.invalidations += 1
+            for a in block.addresses():
+                covering = self.covers.get(a)
+                if covering is not None:
+                    covering.discard(start)
+                    if not covering:
+                        del self.covers[a]
+
+    def invalidate_range(self, start, end):
+        """ drop all blocks covering an address in [start, end) """
+        if not self.covers:
+            return
+        for a in range(start, end):
+            if (a & 0xffff) in self.covers:
+                self.invalidate(a & 0xffff)
+
+    def clear(self):
+        self.blocks.clear()
+        self.covers.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'blocks': len(self.blocks)}
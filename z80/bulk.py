@@ -0,0 +1,62 @@
+from .register import MEMSIZE
+
+
+def read_range(mem, addr, n):
+    """ bytes of the n addresses starting at addr, wrapping at 64K """
+    end = addr + n
+    if end <= MEMSIZE:
+        return bytes(mem[addr:end])
+    return bytes(mem[addr:]) + bytes(mem[:end - MEMSIZE])
+
+
+def write_range(mem, addr, data):
+    """ writes data to the addresses starting at addr, wrapping at 64K """
+    first = min(len(data), MEMSIZE - addr)
+    mem[addr:addr + first] = data[:first]
+    if first < len(data):
+        mem[:len(data) - first] = data[first:]
+
+
+def repeat_pattern(data, period, n):
+    """ the first n bytes of data[:period] repeated """
+    return (data[:period] * (n // period + 1))[:n]
+
+
+def copy_forward(mem, src, dst, n):
+    """ result of n iterations of (dst) <- (src), src++, dst++
+        (LDIR). Bytes written before they are read repeat. """
+    data = read_range(mem, src, n)
+    period = (dst - src) % MEMSIZE
+    if 0 < period < n:
+        data = repeat_pattern(data, period, n)
+    write_range(mem, dst, data)
+
+
+def copy_backward(mem, src, dst, n):
+    """ result of n iterations of (dst) <- (src), src--, dst--
+        (LDDR). Bytes written before they are read repeat. """
+    data = read_range(mem, (src - n + 1) % MEMSIZE, n)[::-1]
+    period = (src - dst) % MEMSIZE
+    if 0 < period < n:
+        data = repeat_pattern(data, period, n)
+    write_range(mem, (dst - n + 1) % MEMSIZE, data[::-1])
+
+
+def find_forward(mem, addr, n, value):
+    """ number of bytes compared by CPIR: the index of the first
+        occurrence of value at addr, addr + 1, ... plus one, or n """
+    index = read_range(mem, addr, n).find(value)
+    return n if index < 0 else index + 1
+
+
+def find_backward(mem, addr, n, value):
+    """ number of bytes compared by CPDR: like find_forward for the
+        addresses addr, addr - 1, ... """
+    data = read_range(mem, (addr - n + 1) % MEMSIZE, n)[::-1]
+    index = data.find(value)
+    return n if index < 0 else index + 1
+
+
+def covers(start, n, addr):
+    """ True if addr is one of the n addresses starting at start """
+    return (addr - start) % MEMSIZE < n
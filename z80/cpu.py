@@ -31,14 +31,54 @@ from .assertions import assert_rr
 from .assertions import assert_ss
 from .assertions import assert_qq
 from .assertions import assert_pp
-
-from .util import parity
+from .assertions import assert_cc
+from .assertions import assert_p
+
+from .flags import add_f
+from .flags import sub_f
+from .flags import compare_f
+from .flags import compare_keep_cv_f
+from .flags import add16_f
+from .flags import adc16_f
+from .flags import sbc16_f
+from .flags import logic_f
+from .flags import inc_f
+from .flags import dec_f
+from .flags import shift_f
+from .flags import block_io_f
+from .flags import CONDITIONS
+from .flags import FLAG_H
 from .instruction_group import InstructionGroup
-from .instruction_template import InstructionTemplate as I
+from functools import partial
+from .instruction_template import InstructionTemplate
+from .template_cache import TemplateCache
 from .instruction_set import InstructionSet
+from .instruction_cache import InstructionCache
+from .block_compiler import BlockCompiler
+from .run_result import RunResult
+from .snapshot import PageTracker
+from .memory import MemoryBus
+from .ports import PortBus
+from .ports import WouldBlock
+from .ports import ReplayPorts
+from .scheduler import Scheduler
+from .scheduler import INFINITY
+from .idle import IdleDetector
+from .bulk import copy_forward
+from .bulk import copy_backward
+from .bulk import find_forward
+from .bulk import find_backward
+from .bulk import covers
+from .bulk import read_range
+from .bulk import write_range
+from .run_result import STOP_TSTATES
+from .run_result import STOP_INSTRUCTIONS
+from .run_result import STOP_PC
+from .run_result import STOP_BLOCKED
 from .register import RegisterSet
 from .register import RegisterPlusOffset
 from .register import MEMSIZE
+from .register import WORD_PC
 from .register import HL
 from .register import BC
 from .register import DE
@@ -46,6 +86,14 @@ from .register import DE
 
 INSTRUCTION_SET = InstructionSet()
 
+# start addresses of the NMI and of the IM 1 interrupt routines
+NMI_VECTOR = 0x0066
+IM1_VECTOR = 0x0038
+
+# expansions of the templates below, saved at the end of the module
+TEMPLATE_CACHE = TemplateCache(__file__)
+I = partial(InstructionTemplate, cache=TEMPLATE_CACHE)
+
 EIGHT_BIT_LOAD_GROUP = InstructionGroup("8 bit load group",
                                         INSTRUCTION_SET,
                                         "8_bit_load")
@@ -77,11 +125,130 @@ ROTATE_AND_SHIFT_GROUP = InstructionGroup("rotate and shift group",
 BIT_SET_RESET_TEST_GROUP = InstructionGroup("bit set reset test group",
                                             INSTRUCTION_SET,
                                             "set_reset_test")
+JUMP_GROUP = InstructionGroup("jump group",
+                              INSTRUCTION_SET,
+                              "jump")
+CALL_AND_RETURN_GROUP = InstructionGroup("call and return group",
+                                         INSTRUCTION_SET,
+                                         "call_and_return")
+INPUT_AND_OUTPUT_GROUP = InstructionGroup("input and output group",
+                                          INSTRUCTION_SET,
+                                          "input_and_output")
 
 
 class CPU(object):
-    def __init__(self):
+    def __init__(self, instruction_cache=False, block_compiler=False,
+                 lazy_flags=False, verify_flags=False, checked=False,
+                 idle_detection=False):
         self.reg = RegisterSet()
+        self.reg.lazy_flags = lazy_flags or verify_flags
+        # execute the argument checking handlers instead of the
+        # specialised ones (see fast_handlers)
+        self.checked = checked
+        # eager CPU repeating each instruction to verify the lazy flags
+        self.shadow = CPU(checked=checked) if verify_flags else None
+        # T-states executed by instr_cycle and run
+        self.tstates = 0
+        # T-state count which must not be passed by an instruction
+        # executing several iterations at once (None: no limit)
+        self.deadline = None
+        self.instruction_cache = None
+        self.block_compiler = None
+        if instruction_cache:
+            self.instruction_cache = InstructionCache(self, INSTRUCTION_SET)
+            self.reg.code_caches.append(self.instruction_cache)
+        if block_compiler:
+            self.block_compiler = BlockCompiler(self, INSTRUCTION_SET)
+            self.reg.code_caches.append(self.block_compiler)
+        # devices of IN and OUT
+        self.ports = PortBus()
+        # ROM, bank windows and other page handlers
+        self.memory_bus = MemoryBus(self.reg, lambda: self.tstates)
+        # pages written since the last snapshot, see snapshot
+        self.page_tracker = None
+        # device events and timers, see schedule
+        self.scheduler = Scheduler()
+        # T-state count at which run services events and interrupts
+        self.limit = INFINITY
+        # device whose read stopped the last run, see ports.WouldBlock
+        self.blocked = None
+        self.reset_interrupts()
+        # fast forward of idle loops, see idle.IdleDetector
+        self.idle_detector = None
+        if idle_detection:
+            self.idle_detector = IdleDetector(self)
+            self.idle_detector.arm()
+
+    def reset(self):
+        """ clears registers, memory and counters so that the CPU can
+            be reused without allocating a new one """
+        self.reg.reset()
+        self.tstates = 0
+        self.deadline = None
+        self.scheduler.clear()
+        self.reset_interrupts()
+        if self.idle_detector is not None:
+            self.idle_detector.arm()
+        if self.shadow is not None:
+            self.shadow.reset()
+
+    def reset_interrupts(self):
+        # interrupt flip-flops and mode
+        self.iff1 = 0
+        self.iff2 = 0
+        self.im = 0
+        # data bus value of the asserted INT line or None
+        self.int_data = None
+        self.nmi_pending = False
+        # EI was the last instruction, INT is not accepted yet
+        self.ei_delay = False
+        # executing HALT
+        self.halted = False
+
+    def save_interrupts(self):
+        """ immutable copy of the interrupt state set by
+            reset_interrupts """
+        return (self.iff1, self.iff2, self.im, self.int_data,
+                self.nmi_pending, self.ei_delay, self.halted)
+
+    def restore_interrupts(self, interrupts):
+        """ sets the interrupt state to a save_interrupts copy """
+        (self.iff1, self.iff2, self.im, self.int_data,
+         self.nmi_pending, self.ei_delay, self.halted) = interrupts
+        # run services a restored INT or NMI before the next instruction
+        self.poll()
+
+    def snapshot(self):
+        """ Snapshot of registers, interrupt state, memory and T-states.
+            Consecutive snapshots share the pages which were not
+            written. The scheduled events, the devices and the pages
+            mapped on the memory bus are not part of a snapshot. """
+        if self.page_tracker is None:
+            self.page_tracker = PageTracker(self.reg)
+        return self.page_tracker.snapshot(self.tstates,
+                                          self.save_interrupts())
+
+    def restore(self, snapshot):
+        """ returns to snapshot rewriting only the pages which differ.
+            The scheduled events are kept. Returns the number of
+            rewritten pages. """
+        if self.page_tracker is None:
+            self.page_tracker = PageTracker(self.reg)
+        n = self.page_tracker.restore(snapshot)
+        self.tstates = snapshot.tstates
+        self.deadline = None
+        self.restore_interrupts(snapshot.interrupts)
+        return n
+
+    @property
+    def memory(self):
+        """ writable memoryview of the memory (zero copy), or the
+            memory.PagedMemory while pages are mapped on the memory bus.
+            Writes through it bypass the code caches and the page
+            tracker. """
+        if self.reg.paged is None:
+            return memoryview(self.reg.mem)
+        return self.reg.paged
 
     def __getitem__(self, key):
         return self.reg[key]
@@ -98,35 +265,321 @@ class CPU(object):
     def fetch(self):
         return INSTRUCTION_SET.fetch(self)
 
+    def fetch_at(self, addr):
+        return INSTRUCTION_SET.lookup(self.reg.mem, addr)
+
+    def decode(self):
+        """ Returns (handler, args, size, tstates) of the
+            instruction at PC """
+        pc = self['PC']
+        if self.instruction_cache is not None:
+            return self.instruction_cache.get(pc)
+        instr, args = INSTRUCTION_SET.decode(self.reg.mem, pc, self.checked)
+        handler = instr.func if self.checked else instr.unchecked
+        return handler.__get__(self), args, instr.size, instr.tstates
+
     def instr_cycle(self):
-        instr = self.instr_set.fetch(self)
-        instr.step(self)
-        self.INC_PC(instr.size)
+        """ Executes the instruction at PC. PC is advanced before the
+            instruction is executed. Returns the number of T-states. """
+        if self.shadow is not None:
+            tstates = self.verify_cycle()
+        else:
+            tstates = self.step()
+        self.tstates += tstates
+        return tstates
+
+    def step(self):
+        """ Executes the instruction at PC. Returns the T-states
+            returned by the handler or Instruction.tstates. """
+        handler, args, size, tstates = self.decode()
+        self.INC_PC(size)
+        ret = handler(*args)
+        return tstates if ret is None else ret
+
+    def verify_cycle(self):
+        """ Executes the instruction at PC and repeats it on the shadow
+            CPU with eager flags. Raises an AssertionError if the
+            flags differ. """
+        pc = self['PC']
+        self.shadow.reg.load(self.reg)
+        self.shadow.tstates = self.tstates
+        self.shadow.deadline = self.deadline
+        # the shadow reads the input of the instruction from the log
+        log = self.ports.log = []
+        self.shadow.ports = ReplayPorts(log)
+        try:
+            tstates = self.step()
+        finally:
+            self.ports.log = None
+        self.shadow.step()
+        lazy = self.reg.peek_flags()
+        eager = self.shadow['F']
+        if lazy != eager:
+            raise AssertionError('lazy F {0:02x} != eager F {1:02x} after '
+                                 '{2} at {3:04x}'.
+                                 format(lazy, eager,
+                                        self.fetch_at(pc).assembler_to_str(),
+                                        pc))
+        return tstates
+
+    def run(self, max_tstates=None, max_instructions=None, until_pc=None):
+        """ Executes instructions until one of the budgets is exhausted
+            or PC reaches until_pc (checked before each instruction).
+            Returns a RunResult. """
+        reg = self.reg
+        r16 = reg.r16
+        lookup = INSTRUCTION_SET.lookup
+        decode = INSTRUCTION_SET.decode
+        cached = None
+        if self.instruction_cache is not None:
+            cached = self.instruction_cache.get
+        checked = self.checked
+        verify = None
+        if self.shadow is not None:
+            verify = self.verify_cycle
+        compiler = None
+        if self.block_compiler is not None and verify is None:
+            compiler = self.block_compiler
+        bus = self.memory_bus
+        start = self.tstates
+        if max_tstates is None:
+            deadline = float('inf')
+        else:
+            deadline = start + max_tstates
+            self.deadline = deadline
+        if max_instructions is None:
+            max_instructions = float('inf')
+        instructions = 0
+        self.limit = self.tstates
+        self.blocked = None
+        pc = r16[WORD_PC]
+        try:
+            while True:
+                if self.tstates >= self.limit:
+                    if self.tstates >= deadline:
+                        reason = STOP_TSTATES
+                        break
+                    instructions += self.service(
+                        deadline, max_instructions - instructions, until_pc)
+                    continue
+                if instructions >= max_instructions:
+                    reason = STOP_INSTRUCTIONS
+                    break
+                pc = r16[WORD_PC]
+                if pc == until_pc:
+                    reason = STOP_PC
+                    break
+                if compiler is not None:
+                    # a block is executed at once if it ends before the
+                    # next event, otherwise its first instruction is
+                    # interpreted
+                    block = compiler.get(pc)
+                    fits = self.tstates + block.tstates <= self.limit and \
+                        instructions + block.length <= max_instructions
+                    if fits and block.pure and not bus.timed \
+                            and until_pc not in block.interior:
+                        n, t = compiler.execute_block(block)
+                        instructions += n
+                        self.tstates += t
+                        continue
+                if verify is not None:
+                    t = verify()
+                elif cached is not None:
+                    handler, args, size, t = cached(pc)
+                    r16[WORD_PC] = (pc + size) & 0xffff
+                    ret = handler(*args)
+                    if ret is not None:
+                        t = ret
+                else:
+                    # mem is replaced when the memory bus maps a page
+                    mem = reg.mem
+                    instr = lookup(mem, pc)
+                    if instr is None or instr.operands:
+                        instr, args = decode(mem, pc, checked)
+                    elif checked:
+                        args = instr.args
+                    else:
+                        args = instr.unchecked_args
+                    t = instr.tstates
+                    r16[WORD_PC] = (pc + instr.size) & 0xffff
+                    if checked:
+                        ret = instr.func(self, *args)
+                    else:
+                        ret = instr.unchecked(self, *args)
+                    if ret is not None:
+                        t = ret
+                instructions += 1
+                self.tstates += t
+        except WouldBlock as e:
+            # the instruction is executed again by the next run
+            r16[WORD_PC] = pc if e.pc is None else e.pc
+            self.blocked = e.device
+            reason = STOP_BLOCKED
+        finally:
+            self.deadline = None
+        return RunResult(reason, instructions, self.tstates - start)
+
+    def schedule(self, due, callback):
+        """ calls callback(due) when run reaches the T-state count due.
+            Returns the Event (see scheduler.Event.cancel). """
+        event = self.scheduler.schedule(due, callback)
+        if due < self.limit:
+            self.limit = due
+        return event
+
+    def poll(self):
+        """ makes run service the interrupts before the next
+            instruction """
+        self.limit = self.tstates
+
+    def interrupt(self, data=0xff):
+        """ asserts the INT line. data is put on the data bus when the
+            interrupt is accepted: the instruction executed in IM 0 or
+            the low byte of the vector address in IM 2. """
+        self.int_data = data
+        self.poll()
+
+    def clear_interrupt(self):
+        """ releases the INT line """
+        self.int_data = None
+
+    def nmi(self):
+        self.nmi_pending = True
+        self.poll()
+
+    def service(self, end, budget=INFINITY, until_pc=None):
+        """ fires the due events and accepts a pending interrupt.
+            Sets limit to the next T-state count (at most end) at
+            which run has to call service again. A halted CPU or an
+            idle loop is then fast forwarded to limit within budget
+            instructions, see skip_halt and idle.IdleDetector.
+            Returns the number of instructions executed or skipped. """
+        scheduler = self.scheduler
+        scheduler.fire(self.tstates)
+        limit = end
+        if self.nmi_pending:
+            self.ei_delay = False
+            self.tstates += self.accept_nmi()
+        elif self.ei_delay:
+            # accepted after the instruction following EI
+            self.ei_delay = False
+            limit = self.tstates + 1
+        elif self.int_data is not None and self.iff1:
+            self.tstates += self.accept_interrupt()
+        self.limit = min(limit, scheduler.next_due)
+        if self.halted:
+            if self['PC'] == until_pc:
+                return 0
+            return self.skip_halt(budget)
+        detector = self.idle_detector
+        if detector is not None and detector.pending:
+            return detector.service(budget, until_pc)
+        return 0
+
+    def skip_halt(self, budget):
+        """ repeats HALT until limit within budget instructions.
+            Returns the number of repetitions. """
+        if self.limit == INFINITY:
+            if budget == INFINITY:
+                # nothing can end the HALT: leave it to run
+                return 0
+            repeats = budget
+        else:
+            repeats = min(-(-(self.limit - self.tstates) // 4), budget)
+        if repeats <= 0:
+            return 0
+        self.tstates += 4 * repeats
+        return repeats
+
+    def leave_halt(self):
+        if self.halted:
+            self.halted = False
+            self.INC_PC(1)
+
+    def accept_nmi(self):
+        """ calls the NMI routine, returns the T-states """
+        self.nmi_pending = False
+        self.leave_halt()
+        self.iff1 = 0
+        self.push(self['PC'])
+        self['PC'] = NMI_VECTOR
+        return 11
+
+    def accept_interrupt(self):
+        """ acknowledges INT in the interrupt mode, returns the
+            T-states """
+        self.leave_halt()
+        self.iff1 = self.iff2 = 0
+        data = self.int_data
+        if self.im == 1:
+            self.push(self['PC'])
+            self['PC'] = IM1_VECTOR
+            return 13
+        if self.im == 2:
+            self.push(self['PC'])
+            self['PC'] = self.get16((self['I'] << 8) | data)
+            return 19
+        instr = INSTRUCTION_SET.base[data]
+        if instr is None or instr.size != 1:
+            raise NotImplementedError('IM 0 instruction {0:02x} not '
+                                      'supported'.format(data))
+        ret = instr.func(self, *instr.args)
+        return (instr.tstates if ret is None else ret) + 2
+
+    def bulk_allowed(self, tstates, start=None, n=0):
+        """ True if a repeated block instruction may execute its
+            iterations at once: they do not pass the deadline or the
+            next event and the n bytes written from start do not
+            overwrite the instruction itself. """
+        end = self.tstates + tstates
+        if self.deadline is not None and end > self.deadline:
+            return False
+        if self.scheduler.heap and end > self.scheduler.next_due:
+            return False
+        if start is not None:
+            pc = (self['PC'] - 2) % MEMSIZE
+            if covers(start, n, pc) or covers(start, n, (pc + 1) % MEMSIZE):
+                return False
+        return True
+
+    def bulk_written(self, start, n):
+        """ notifies the code caches about a bulk write """
+        if self.reg.code_caches:
+            self.reg.invalidate_range(start, start + n)
+
+    def block_cycle(self):
+        """ Executes the compiled basic block at PC and advances tstates
+            without servicing events and interrupts (see run).
+            Returns the number of executed instructions and T-states """
+        n, tstates = self.block_compiler.execute(self['PC'])
+        self.tstates += tstates
+        return n, tstates
 
     # ################ #
     # 8 bit load group #
     # ################ #
-    @I(EIGHT_BIT_LOAD_GROUP, "01{0}{1}", expand=['r', 'r'])
+    @I(EIGHT_BIT_LOAD_GROUP, "01{0}{1}", tstates=4, expand=['r', 'r'])
     def LD_r_r(self, r1, r2):
         """ {0} <- {1} """
         assert_r(r1)
         assert_r(r2)
         self[r1] = self[r2]
 
-    @I(EIGHT_BIT_LOAD_GROUP, ["00{0}110", "n"], expand=['r'])
+    @I(EIGHT_BIT_LOAD_GROUP, ["00{0}110", "n"], tstates=7, expand=['r'])
     def LD_r_n(self, r, n):
         """ {0} <- {1}"""
         assert_r(r)
         assert_n(n)
         self[r] = n
 
-    @I(EIGHT_BIT_LOAD_GROUP, "01{0}110", expand=['r'])
+    @I(EIGHT_BIT_LOAD_GROUP, "01{0}110", tstates=7, expand=['r'])
     def LD_r__HL_(self, r):
         """ {0} <- (HL) """
         assert_r(r)
         self[r] = self[HL()]
 
-    @I(EIGHT_BIT_LOAD_GROUP, ["11{1}101", "01{0}110", "d"], expand=['r', 'ii'])
+    @I(EIGHT_BIT_LOAD_GROUP, ["11{1}101", "01{0}110", "d"], tstates=19,
+       expand=['r', 'ii'])
     def LD_r__ii_d_(self, r, ii, d):
         """ {0} <- ({1} + d) """
         assert_r(r)
@@ -134,86 +587,88 @@ class CPU(object):
         assert_d(d)
         self[r] = self[RegisterPlusOffset(ii, d)]
 
-    @I(EIGHT_BIT_LOAD_GROUP, "01110{0}", expand=['r'])
+    @I(EIGHT_BIT_LOAD_GROUP, "01110{0}", tstates=7, expand=['r'])
     def LD__HL__r(self, r):
         """ (HL) <- {0} """
         assert_r(r)
         self[HL()] = self[r]
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x36, "n"])  # 00 110 110
+    @I(EIGHT_BIT_LOAD_GROUP, [0x36, "n"], tstates=10)  # 00 110 110
     def LD__HL__n(self, n):
         """ (HL) <- n """
         assert_n(n)
         self[HL()] = n
 
-    @I(EIGHT_BIT_LOAD_GROUP, ["11{0}101", "01110{1}", "d"], expand=['ii', 'r'])
+    @I(EIGHT_BIT_LOAD_GROUP, ["11{0}101", "01110{1}", "d"], tstates=19,
+       expand=['ii', 'r'])
     def LD__ii_d__r(self, ii, r, d):
         assert_ii(ii)
         assert_d(d)
         assert_r(r)
         self[RegisterPlusOffset(ii, d)] = self[r]
 
-    @I(EIGHT_BIT_LOAD_GROUP, ["11{0}101", 0x36, "d", "n"], expand=['ii'])
+    @I(EIGHT_BIT_LOAD_GROUP, ["11{0}101", 0x36, "d", "n"], tstates=19,
+       expand=['ii'])
     def LD__ii_d__n(self, ii, d, n):
         assert_ii(ii)
         assert_n(n)
         assert_d(d)
         self[RegisterPlusOffset(ii, d)] = n
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x0a])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x0a], tstates=7)
     def LD_A__BC_(self):
         """ A <- (BC) """
         self['A'] = self[BC()]
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x1a])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x1a], tstates=7)
     def LD_A__DE_(self):
         """ A <- (DE) """
         self['A'] = self[DE()]
 
     # todo: 16 bit values in opcode
-    @I(EIGHT_BIT_LOAD_GROUP, [0x3a, "nn"])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x3a, "nn"], tstates=13)
     def LD_A__nn_(self, nn):
         """ A <- (nn) """
         assert_nn(nn)
         self['A'] = self[nn]
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x02])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x02], tstates=7)
     def LD__BC__A(self):
         """ (BC) <- A """
         self[self['BC']] = self['A']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x12])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x12], tstates=7)
     def LD__DE__A(self):
         """ (DE) <- A """
         self[self['DE']] = self['A']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0x32, "nn"])
+    @I(EIGHT_BIT_LOAD_GROUP, [0x32, "nn"], tstates=13)
     def LD__nn__A(self, nn):
         """ (nn) <- A """
         assert_nn(nn)
         self[nn] = self['A']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x57])
+    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x57], tstates=9)
     def LD_A_I(self):
         """ A <- I """
         # 010 10 111
         # @todo: set flags
         self['A'] = self['I']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x5f])
+    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x5f], tstates=9)
     def LD_A_R(self):
         """ A <- R """
         # 010 11 111
         # @todo: set flags
         self['A'] = self['R']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x47])
+    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x47], tstates=9)
     def LD_I_A(self):
         """ I <- A """
         # 010 00 111
         self['I'] = self['A']
 
-    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x4f])
+    @I(EIGHT_BIT_LOAD_GROUP, [0xed, 0x4f], tstates=9)
     def LD_R_A(self):
         """ R <- A """
         # 010 01 111
@@ -222,72 +677,77 @@ class CPU(object):
     # ##################
     # 16 bit load group
     # ##################
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["00{0}0001", "nn"], expand=['dd'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["00{0}0001", "nn"], tstates=10, expand=['dd'])
     def LD_dd_nn(self, dd, nn):
         """ {0} <- nn """
         assert_dd(dd)
         assert_nn(nn)
         self[dd] = nn
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x21, "nn"], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x21, "nn"], tstates=14,
+       expand=['ii'])
     def LD_ii_nn(self, ii, nn):
         """ {0} <- nn """
         assert_ii(ii)
         assert_nn(nn)
         self[ii] = nn
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, [0x2a, "nn"])
+    @I(SIXTEEN_BIT_LOAD_GROUP, [0x2a, "nn"], tstates=16)
     def LD_HL__nn_(self, nn):
         """ HL <- (nn) """
         assert_nn(nn)
         self['HL'] = self.get16(nn)
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, [0xed, "01{0}1011", "nn"], expand=['dd'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, [0xed, "01{0}1011", "nn"], tstates=20,
+       expand=['dd'])
     def LD_dd__nn_(self, dd, nn):
         """ dd <- (nn) """
         assert_nn(nn)
         assert_dd(dd)
         self[dd] = self.get16(nn)
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x2a, "nn"], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x2a, "nn"], tstates=20,
+       expand=['ii'])
     def LD_ii__nn_(self, ii, nn):
         """ {0} <- (nn) """
         assert_ii(ii)
         assert_nn(nn)
         self[ii] = self.get16(nn)
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, [0x22, "nn"])
+    @I(SIXTEEN_BIT_LOAD_GROUP, [0x22, "nn"], tstates=16)
     def LD__nn__HL(self, nn):
         """ (nn) <- HL, """
         assert_nn(nn)
         self.set16(nn, self['HL'])
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, [0xed, "01{0}0011", "nl", "nh"], expand=['dd'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, [0xed, "01{0}0011", "nn"], tstates=20,
+       expand=['dd'])
     def LD__nn__dd(self, nn, dd):
         """ (nn) <- dd """
         assert_nn(nn)
         assert_dd(dd)
         self.set16(nn, self[dd])
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x22, "nn"], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0x22, "nn"], tstates=20,
+       expand=['ii'])
     def LD__nn__ii(self, nn, ii):
         """ (nn) <- {0} """
         assert_ii(ii)
         assert_nn(nn)
         self.set16(nn, self[ii])
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, [0xf9])
+    @I(SIXTEEN_BIT_LOAD_GROUP, [0xf9], tstates=6)
     def LD_SP_HL(self):
         """ SP <- HL """
         self['SP'] = self['HL']
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xf9], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xf9], tstates=10, expand=['ii'])
     def LD_SP_ii(self, ii):
         """ SP <- {0} """
         assert_ii(ii)
         self['SP'] = self[ii]
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}0101"], expand=['qq'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}0101"], tstates=11, expand=['qq'])
     def PUSH_qq(self, qq):
         """ (SP-2) <- qq,
             SP <- SP-2 """
@@ -295,7 +755,7 @@ class CPU(object):
         self.DEC_ss('SP', 2)
         self.set16(self['SP'], self[qq])
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xe5], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xe5], tstates=15, expand=['ii'])
     def PUSH_ii(self, ii):
         """ (SP-2) <- {0},
             SP <- SP-2 """
@@ -303,14 +763,14 @@ class CPU(object):
         self.DEC_ss('SP', 2)
         self.set16(self['SP'], self[ii])
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}0001"], expand=['qq'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}0001"], tstates=10, expand=['qq'])
     def POP_qq(self, qq):
         """ qq <- (SP),
             SP <- SP+2 """
         self[qq] = self.get16(self['SP'])
         self.INC_ss('SP', 2)
 
-    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xe1], expand=['ii'])
+    @I(SIXTEEN_BIT_LOAD_GROUP, ["11{0}101", 0xe1], tstates=14, expand=['ii'])
     def POP_ii(self, ii):
         """ {0} <- (SP)
             SP <- SP+2 """
@@ -321,29 +781,23 @@ class CPU(object):
     # ##################
     # exchange
     # ##################
-    @I(EXCHANGE_GROUP, [0xeb])
+    @I(EXCHANGE_GROUP, [0xeb], tstates=4)
     def EX_DE_HL(self):
         """ DE <-> HL """
         tmp = self['DE']
         self['DE'] = self['HL']
         self['HL'] = tmp
 
-    @I(EXCHANGE_GROUP, [0x08], assembler=["EX", "AF", "AF'"])
+    @I(EXCHANGE_GROUP, [0x08], tstates=4, assembler=["EX", "AF", "AF'"])
     def EX_AF_alt_AF(self):
         """ AF <-> AF' """
-        self.reg.ex_q_alt_q('A')
-        self.reg.ex_q_alt_q('F')
+        self.reg.ex_af()
 
-    @I(EXCHANGE_GROUP, [0xd9])
+    @I(EXCHANGE_GROUP, [0xd9], tstates=4)
     def EXX(self):
-        self.reg.ex_q_alt_q('B')
-        self.reg.ex_q_alt_q('C')
-        self.reg.ex_q_alt_q('D')
-        self.reg.ex_q_alt_q('E')
-        self.reg.ex_q_alt_q('H')
-        self.reg.ex_q_alt_q('L')
-
-    @I(EXCHANGE_GROUP, [0xe3])
+        self.reg.exx()
+
+    @I(EXCHANGE_GROUP, [0xe3], tstates=19)
     def EX__SP__HL(self):
         """ H <-> (SP+1)
             L <-> (SP) """
@@ -351,7 +805,7 @@ class CPU(object):
         self.set16(self['SP'], self['HL'])
         self['HL'] = tmp
 
-    @I(EXCHANGE_GROUP, ["11{0}101", 0xe3], expand=['ii'])
+    @I(EXCHANGE_GROUP, ["11{0}101", 0xe3], tstates=23, expand=['ii'])
     def EX__SP__ii(self, ii):
         """ {0}_h <-> (SP+1)
             {0}_l <-> (SP) """
@@ -363,8 +817,9 @@ class CPU(object):
     # ##############
     # block transfer
     # ##############
-    # todo: make t-states dynamic, depending on the result
-    # T-states for LDIR and LDDR: if BC = 0: 16
+    # The repeated instructions return their T-states: 21 per repetition
+    # and 16 for the last one. If possible all iterations but the last
+    # are executed at once.
     @I(BLOCK_TRANSFER_GROUP, [0xed, 0xa0], tstates=16)
     def LDI(self):
         """ (DE) <- (HL)
@@ -372,23 +827,37 @@ class CPU(object):
             HL <- HL + 1
             BC <- BC - 1 """
         self[self['DE']] = self[self['HL']]
-        self.INC_ii('DE')
-        self.INC_ii('HL')
-        self.DEC_ii('BC')
-        self['H'] = 0
+        self.INC_ss('DE')
+        self.INC_ss('HL')
+        self.DEC_ss('BC')
+        self.reg.set_flag('H', 0)
         self['N'] = 0
-        self['V'] = 1 if self['BC'] == 1 else 0
+        self['V'] = (self['BC'] != 0x0000)
 
-    @I(BLOCK_TRANSFER_GROUP, [0xed, 0xb0], tstates=21)
+    @I(BLOCK_TRANSFER_GROUP, [0xed, 0xb0], tstates=21,
+       branch=True)
     def LDIR(self):
         """ (DE) <- (HL)
             DE <- DE + 1
             HL <- HL + 1
             BC <- BC - 1
             WHILE BC != 0 """
+        n = self['BC'] or MEMSIZE
+        hl = self['HL']
+        de = self['DE']
+        if n > 1 and self.bulk_allowed(21 * (n - 1) + 16, de, n - 1):
+            copy_forward(self.reg.bulk_mem, hl, de, n - 1)
+            self.bulk_written(de, n - 1)
+            self['HL'] = (hl + n - 1) % MEMSIZE
+            self['DE'] = (de + n - 1) % MEMSIZE
+            self['BC'] = 1
+            self.LDI()
+            return 21 * (n - 1) + 16
         self.LDI()
         if self['BC'] != 0x0000:
             self.DEC_PC(2)
+            return 21
+        return 16
 
     @I(BLOCK_TRANSFER_GROUP, [0xed, 0xa8], tstates=16)
     def LDD(self):
@@ -397,23 +866,38 @@ class CPU(object):
             HL <- HL - 1
             BC <- BC - 1 """
         self[self['DE']] = self[self['HL']]
-        self.DEC_ii('DE')
-        self.DEC_ii('HL')
-        self.DEC_ii('BC')
-        self['H'] = 0
+        self.DEC_ss('DE')
+        self.DEC_ss('HL')
+        self.DEC_ss('BC')
+        self.reg.set_flag('H', 0)
         self['N'] = 0
-        self['V'] = 1 if self['BC'] == 1 else 0
+        self['V'] = (self['BC'] != 0x0000)
 
-    @I(BLOCK_TRANSFER_GROUP, [0xed, 0xb8], tstates=21)
+    @I(BLOCK_TRANSFER_GROUP, [0xed, 0xb8], tstates=21,
+       branch=True)
     def LDDR(self):
         """ (DE) <- (HL)
             DE <- DE - 1
             HL <- HL - 1
             BC <- BC - 1
             WHILE BC != 0 """
+        n = self['BC'] or MEMSIZE
+        hl = self['HL']
+        de = self['DE']
+        start = (de - n + 2) % MEMSIZE
+        if n > 1 and self.bulk_allowed(21 * (n - 1) + 16, start, n - 1):
+            copy_backward(self.reg.bulk_mem, hl, de, n - 1)
+            self.bulk_written(start, n - 1)
+            self['HL'] = (hl - n + 1) % MEMSIZE
+            self['DE'] = (de - n + 1) % MEMSIZE
+            self['BC'] = 1
+            self.LDD()
+            return 21 * (n - 1) + 16
         self.LDD()
         if self['BC'] != 0x0000:
             self.DEC_PC(2)
+            return 21
+        return 16
 
     # ############
     # Search group
@@ -423,38 +907,62 @@ class CPU(object):
         """ A - (HL)
             HL <- HL + 1
             BC <- BC - 1 """
-        self['A'] = self[self['HL']]
-        self['V'] = (self['BC'] != 0x00001)
-        self.INC_ii('HL')
-        self.DEC_ii('BC')
+        self.CP_n(self[self['HL']], set_C_V=False)
+        self.INC_ss('HL')
+        self.DEC_ss('BC')
+        self['V'] = (self['BC'] != 0x0000)
 
-    @I(SEARCH_GROUP, [0xed, 0xb1], tstates=21)
+    @I(SEARCH_GROUP, [0xed, 0xb1], tstates=21,
+       branch=True)
     def CPIR(self):
         """ A - (HL)
             HL <- HL + 1
-            BC <- BC - 1 """
+            BC <- BC - 1
+            WHILE BC != 0 AND A != (HL) """
+        n = self['BC'] or MEMSIZE
+        hl = self['HL']
+        count = find_forward(self.reg.mem, hl, n, self['A'])
+        if count > 1 and self.bulk_allowed(21 * (count - 1) + 16):
+            self['HL'] = (hl + count - 1) % MEMSIZE
+            self['BC'] = (self['BC'] - count + 1) % MEMSIZE
+            self.CPI()
+            return 21 * (count - 1) + 16
         self.CPI()
-        if self['BC'] != 0x0000:
+        if self['BC'] != 0x0000 and not self.reg.flag('Z'):
             self.DEC_PC(2)
+            return 21
+        return 16
 
     @I(SEARCH_GROUP, [0xed, 0xa9], tstates=16)
     def CPD(self):
         """ A - (HL)
             HL <- HL - 1
             BC <- BC - 1 """
-        self['A'] = self[self['HL']]
-        self['V'] = (self.GET_BC() != 0x00001)
-        self.DEC_ii('HL')
-        self.DEC_ii('BC')
+        self.CP_n(self[self['HL']], set_C_V=False)
+        self.DEC_ss('HL')
+        self.DEC_ss('BC')
+        self['V'] = (self['BC'] != 0x0000)
 
-    @I(SEARCH_GROUP, [0xed, 0xb9], tstates=16)
+    @I(SEARCH_GROUP, [0xed, 0xb9], tstates=21,
+       branch=True)
     def CPDR(self):
         """ A - (HL)
             HL <- HL - 1
-            BC <- BC - 1 """
+            BC <- BC - 1
+            WHILE BC != 0 AND A != (HL) """
+        n = self['BC'] or MEMSIZE
+        hl = self['HL']
+        count = find_backward(self.reg.mem, hl, n, self['A'])
+        if count > 1 and self.bulk_allowed(21 * (count - 1) + 16):
+            self['HL'] = (hl - count + 1) % MEMSIZE
+            self['BC'] = (self['BC'] - count + 1) % MEMSIZE
+            self.CPD()
+            return 21 * (count - 1) + 16
         self.CPD()
-        if self['BC'] != 0x0000:
+        if self['BC'] != 0x0000 and not self.reg.flag('Z'):
             self.DEC_PC(2)
+            return 21
+        return 16
 
     # ################
     # 8-bit arithmetic
@@ -464,21 +972,8 @@ class CPU(object):
         """ A <- A + n """
         assert_n(n)
         a = self['A']
-        res = a + n + carry
-        res_modulo = res % 0x100
-        HM = 0b00001111
-        MSB = 0b10000000
-        overflow = (a & MSB) == (n & MSB) and (res_modulo & MSB) != (a & MSB)
-        self['S'] = (res_modulo & 0b10000000)
-        self['Z'] = (res_modulo == 0x00)
-        self['5'] = (res_modulo & 0b00100000)
-        # todo check H flag
-        self['H'] = ((a & HM) + (n & HM) + carry > HM)
-        self['3'] = (res_modulo & 0b00001000)
-        self['V'] = overflow
-        self['N'] = False
-        self['C'] = (res > 0x100)
-        self['A'] = res_modulo
+        self.reg.update_flags(add_f, a, n, carry)
+        self['A'] = (a + n + carry) & 0xff
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10000{0}'], tstates=4, expand=['r'])
     def ADD_A_r(self, r):
@@ -503,7 +998,7 @@ class CPU(object):
     def ADC_A_n(self, n):
         """ A <- A + n """
         assert_n(n)
-        self.ADD_A_n(n, carry=self['C'])
+        self.ADD_A_n(n, carry=self.reg.flag('C'))
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10001{0}'], tstates=4, expand=['r'])
     def ADC_A_r(self, r):
@@ -525,16 +1020,18 @@ class CPU(object):
         self.ADC_A_n(self[RegisterPlusOffset(ii, d)])
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, [0xd6, 'n'], tstates=7)
-    def SUB_A_n(self, n, carry=0):
+    def SUB_A_n(self, n, borrow=0):
         """ A <- A - n """
         assert_n(n)
-        self.ADD_A_n((0x100 - n) % 0x100, carry)
+        a = self['A']
+        self.reg.update_flags(sub_f, a, n, borrow)
+        self['A'] = (a - n - borrow) & 0xff
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10010{0}'], tstates=4, expand=['r'])
     def SUB_A_r(self, r):
         """ A <- A - {0} """
         assert_r(r)
-        self.SUB_A_n(self['r'])
+        self.SUB_A_n(self[r])
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, [0x96], tstates=7)
     def SUB_A__HL_(self):
@@ -553,7 +1050,7 @@ class CPU(object):
     def SBC_A_n(self, n):
         """ A <- A - n - CY """
         assert_n(n)
-        self.SUB_A_n(n, carry=1)
+        self.SUB_A_n(n, borrow=self.reg.flag('C'))
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10011{0}'], tstates=4, expand=['r'])
     def SBC_A_r(self, r):
@@ -564,7 +1061,7 @@ class CPU(object):
     @I(EIGHT_BIT_ARITHMETIC_GROUP, [0x9e], tstates=7)
     def SBC_A__HL_(self):
         """ A <- A - (HL) - CY """
-        self.SBC_n(self[self['HL']])
+        self.SBC_A_n(self[self['HL']])
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['11{0}101', 0x9e, 'd'], tstates=19,
        expand=['ii'])
@@ -576,14 +1073,8 @@ class CPU(object):
     def AND_A_n(self, n):
         """ A <- A AND n """
         assert_n(n)
-        a = self['A']
-        a &= n
-        self['S'] = (a & 0b10000000)
-        self['Z'] = (a == 0x00)
-        self['H'] = True
-        self['P'] = parity(a)
-        self['N'] = False
-        self['C'] = False
+        a = self['A'] & n
+        self.reg.update_flags(logic_f, a, FLAG_H)
         self['A'] = a
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10100{0}'], tstates=4, expand=['r'])
@@ -609,14 +1100,8 @@ class CPU(object):
     def OR_A_n(self, n):
         """ A <- A OR n """
         assert_n(n)
-        a = self['A']
-        a |= n
-        self['S'] = (a & 0b10000000)
-        self['Z'] = (a == 0x00)
-        self['H'] = True
-        self['P'] = parity(a)
-        self['N'] = False
-        self['C'] = False
+        a = self['A'] | n
+        self.reg.update_flags(logic_f, a, 0)
         self['A'] = a
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10110{0}'], tstates=4, expand=['r'])
@@ -642,14 +1127,8 @@ class CPU(object):
     def XOR_A_n(self, n):
         """ A <- A XOR n """
         assert_n(n)
-        a = self['A']
-        a ^= n
-        self['S'] = (a & 0b10000000)
-        self['Z'] = (a == 0x00)
-        self['H'] = True
-        self['P'] = parity(a)
-        self['N'] = False
-        self['C'] = False
+        a = self['A'] ^ n
+        self.reg.update_flags(logic_f, a, 0)
         self['A'] = a
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10101{0}'], tstates=4, expand=['r'])
@@ -675,23 +1154,10 @@ class CPU(object):
     def CP_n(self, n, set_C_V=True):
         """ A - n """
         assert_n(n)
-        a = self['A']
-        n = (0x100 - n) % 0x100
-        res = a + n
-        res_modulo = res % 0x100
-        HM = 0b00001111
-        self['S'] = (res_modulo & 0b10000000)
-        self['Z'] = (res_modulo == 0x00)
-        self['5'] = (res_modulo & 0b00100000)
-        self['H'] = ((a & HM) + (n & HM) > HM)
-        self['3'] = (res_modulo & 0b00001000)
-        self['N'] = True
         if set_C_V:
-            MSB = 0b10000000
-            overflow = (a & MSB) == (n & MSB) and\
-                       (res_modulo & MSB) != (a & MSB)
-            self['C'] = (res > 0x100)
-            self['V'] = overflow
+            self.reg.update_flags(compare_f, self['A'], n)
+        else:
+            self.reg.update_flags(compare_keep_cv_f, self['A'], n)
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['10111{0}'], tstates=4, expand=['r'])
     def CP_r(self, r):
@@ -714,16 +1180,8 @@ class CPU(object):
 
     def INC_n(self, n):
         assert_n(n)
-        HM = 0b00001111
-        ret = (n + 1) % 0x100
-        self['S'] = (ret & 0b10000000)
-        self['Z'] = (ret == 0x00)
-        self['5'] = (ret & 0b00100000)
-        self['H'] = ((ret & HM) + (n & HM) > HM)
-        self['3'] = (ret & 0b00001000)
-        self['V'] = (n == 0x7e)
-        self['N'] = False
-        return ret
+        self.reg.update_flags(inc_f, n)
+        return (n + 1) & 0xff
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['00{0}100'], tstates=4, expand=['r'])
     def INC_r(self, r):
@@ -734,7 +1192,7 @@ class CPU(object):
     @I(EIGHT_BIT_ARITHMETIC_GROUP, [0x34], tstates=11)
     def INC__HL_(self):
         """ (HL) < (HL) + 1 """
-        self[self['HL']] = self.INC_n(self['HL'])
+        self[self['HL']] = self.INC_n(self[self['HL']])
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['11{0}101', 0x34, 'd'], tstates=23,
        expand=['ii'])
@@ -747,16 +1205,8 @@ class CPU(object):
 
     def DEC_n(self, n):
         assert_n(n)
-        HM = 0b00001111
-        ret = (n - 1) % 0x100
-        self['S'] = (ret & 0b10000000)
-        self['Z'] = (ret == 0x00)
-        self['5'] = (ret & 0b00100000)
-        self['H'] = ((ret & HM) + (n & HM) > HM)
-        self['3'] = (ret & 0b00001000)
-        self['V'] = (n == 0x80)
-        self['N'] = True
-        return ret
+        self.reg.update_flags(dec_f, n)
+        return (n - 1) & 0xff
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['00{0}101'], tstates=4, expand=['r'])
     def DEC_r(self, r):
@@ -767,7 +1217,7 @@ class CPU(object):
     @I(EIGHT_BIT_ARITHMETIC_GROUP, [0x35], tstates=11)
     def DEC__HL_(self):
         """ (HL) < (HL) - 1 """
-        self[self['HL']] = self.DEC_n(self['HL'])
+        self[self['HL']] = self.DEC_n(self[self['HL']])
 
     @I(EIGHT_BIT_ARITHMETIC_GROUP, ['11{0}101', 0x35, 'd'],
        tstates=23, expand=['ii'])
@@ -781,11 +1231,48 @@ class CPU(object):
     # ################
     # General purpose
     # ################
-    @I(GENERAL_PURPOSE_GROUP, [0x00])
+    @I(GENERAL_PURPOSE_GROUP, [0x00], tstates=4)
     def NOP(self):
         """ NOP """
         pass
 
+    @I(GENERAL_PURPOSE_GROUP, [0x76], tstates=4, branch=True)
+    def HALT(self):
+        """ repeated until an interrupt is accepted, run skips the
+            repetitions (see skip_halt) """
+        self.halted = True
+        self.DEC_PC(1)
+        self.poll()
+
+    @I(GENERAL_PURPOSE_GROUP, [0xf3], tstates=4)
+    def DI(self):
+        """ IFF1 <- 0
+            IFF2 <- 0 """
+        self.iff1 = self.iff2 = 0
+
+    @I(GENERAL_PURPOSE_GROUP, [0xfb], tstates=4)
+    def EI(self):
+        """ IFF1 <- 1
+            IFF2 <- 1 """
+        self.iff1 = self.iff2 = 1
+        self.ei_delay = True
+        self.poll()
+
+    @I(GENERAL_PURPOSE_GROUP, [0xed, 0x46], tstates=8, assembler=['IM', '0'])
+    def IM_0(self):
+        """ interrupt mode 0 """
+        self.im = 0
+
+    @I(GENERAL_PURPOSE_GROUP, [0xed, 0x56], tstates=8, assembler=['IM', '1'])
+    def IM_1(self):
+        """ interrupt mode 1 """
+        self.im = 1
+
+    @I(GENERAL_PURPOSE_GROUP, [0xed, 0x5e], tstates=8, assembler=['IM', '2'])
+    def IM_2(self):
+        """ interrupt mode 2 """
+        self.im = 2
+
     # ##################
     # 16 bit arithmetic
     # ##################
@@ -799,19 +1286,11 @@ class CPU(object):
         assert_n(n)
         self['PC'] = (self['PC'] - n) % MEMSIZE
 
-    def ADD_mm_nn(self, mm, nn, carry=0):
+    def ADD_mm_nn(self, mm, nn):
         assert_nn(mm)
         assert_nn(nn)
-        res = mm + nn + carry
-        res_modulo = res % 0x10000
-        HM = 0b0000111111111111
-        self['H'] = ((mm & HM) + (nn & HM) + carry > HM)
-        self['C'] = (res > 0x10000)
-        return res_modulo
-
-    def SUB_mm_nn(self, mm, nn, carry=0):
-        assert_nn(nn)
-        return self.ADD_mm_nn(mm, (MEMSIZE - nn) % MEMSIZE, carry)
+        self.reg.update_flags(add16_f, mm, nn)
+        return (mm + nn) & 0xffff
 
     @I(SIXTEEN_BIT_ARITHMETIC_GROUP, ['00{0}1001'], tstates=11, expand=['ss'])
     def ADD_HL_ss(self, ss):
@@ -824,13 +1303,18 @@ class CPU(object):
     def ADC_HL_ss(self, ss):
         """ HL <- HL + {0} + CY """
         assert_ss(ss)
-        self['HL'] = self.ADD_mm_nn(self['HL'], self[ss], carry=self['C'])
+        hl, nn, carry = self['HL'], self[ss], self.reg.flag('C')
+        self.reg.update_flags(adc16_f, hl, nn, carry)
+        self['HL'] = (hl + nn + carry) & 0xffff
 
     @I(SIXTEEN_BIT_ARITHMETIC_GROUP, [0xed, '01{0}0010'], tstates=15,
        expand=['ss'])
     def SBC_HL_ss(self, ss):
         """ HL <- HL - {0} - CY """
-        self['HL'] = self.SUB_mm_nn(self['HL'], self[ss], carry=self['C'])
+        assert_ss(ss)
+        hl, nn, borrow = self['HL'], self[ss], self.reg.flag('C')
+        self.reg.update_flags(sbc16_f, hl, nn, borrow)
+        self['HL'] = (hl - nn - borrow) & 0xffff
 
     @I(SIXTEEN_BIT_ARITHMETIC_GROUP, [0xdd, '00{0}1001'], tstates=15,
        expand=['pp'])
@@ -876,16 +1360,8 @@ class CPU(object):
     # rotate and shift
     # ################
     def _set_flags_after_shift_(self, n, carry=None):
-        MSB = 0b10000000
-        self['S'] = (n & MSB)
-        self['Z'] = (n == 0x00)
-        self['5'] = False
-        self['H'] = False
-        self['3'] = False
-        self['P'] = parity(n)
-        self['N'] = False
-        if carry is not None:
-            self['C'] = carry
+        assert_n(n)
+        self.reg.update_flags(shift_f, n, carry)
 
     def RLC_n(self, n):
         """ Bits of n are shifted left by one position.
@@ -895,7 +1371,7 @@ class CPU(object):
         assert_n(n)
         MSB = 0b10000000
         carry = 1 if (MSB & n) else 0
-        n = (n << 1) | carry
+        n = ((n << 1) | carry) & 0xff
         self._set_flags_after_shift_(n, carry)
         return n
 
@@ -907,7 +1383,7 @@ class CPU(object):
         assert_n(n)
         MSB = 0b10000000
         carry = 1 if (MSB & n) else 0
-        n = (n << 1) | self['C']
+        n = ((n << 1) | self.reg.flag('C')) & 0xff
         self._set_flags_after_shift_(n, carry)
         return n
 
@@ -919,7 +1395,7 @@ class CPU(object):
         assert_n(n)
         MSB = 0b10000000
         carry = 1 if (MSB & n) else 0
-        n = (n << 1)
+        n = (n << 1) & 0xff
         self._set_flags_after_shift_(n, carry)
         return n
 
@@ -945,7 +1421,7 @@ class CPU(object):
         LSB = 0b00000001
         MSB = 0b10000000
         carry = MSB if (LSB & n) else 0
-        n = (n >> 1) | (self['C'] << 7)
+        n = (n >> 1) | (self.reg.flag('C') << 7)
         self._set_flags_after_shift_(n, carry)
         return n
 
@@ -995,7 +1471,7 @@ class CPU(object):
         MSB = 0b11110000
         la = a & LSB
         a = (a & MSB) | ((n & MSB) >> 4)
-        n = (n << 4) | la
+        n = ((n << 4) | la) & 0xff
         self['A'] = a
         self._set_flags_after_shift_(a)
         return n
@@ -1035,7 +1511,7 @@ class CPU(object):
     def RLA(self):
         """ A0 << CY
             CY << A """
-        self['A'] = self.RLA_n(self['A'])
+        self['A'] = self.RL_n(self['A'])
 
     @I(ROTATE_AND_SHIFT_GROUP, [0x0f], tstates=4)
     def RRCA(self):
@@ -1221,7 +1697,7 @@ class CPU(object):
     def BIT_b_n(self, b, n):
         assert_b(b)
         assert_n(n)
-        self['H'] = True
+        self.reg.set_flag('H', True)
         self['N'] = False
         self['Z'] = False if (1 << b) & n else True
 
@@ -1308,11 +1784,304 @@ class CPU(object):
     # #######################
     # jump
     # #######################
+    def condition(self, cc):
+        """ True if the condition cc holds """
+        assert_cc(cc)
+        mask, value = CONDITIONS[cc]
+        return self['F'] & mask == value
+
+    @I(JUMP_GROUP, [0xc3, 'nn'], tstates=10, branch=True)
+    def JP_nn(self, nn):
+        """ PC <- nn """
+        assert_nn(nn)
+        self['PC'] = nn
+
+    @I(JUMP_GROUP, ['11{0}010', 'nn'], tstates=10, expand=['cc'],
+       branch=True)
+    def JP_cc_nn(self, cc, nn):
+        """ IF {0}: PC <- nn """
+        if self.condition(cc):
+            self.JP_nn(nn)
+
+    @I(JUMP_GROUP, [0x18, 'e'], tstates=12, branch=True)
+    def JR_e(self, e):
+        """ PC <- PC + e """
+        assert_d(e)
+        self['PC'] = (self['PC'] + e) % MEMSIZE
+
+    def JR_cc_e(self, cc, e):
+        """ IF cc: PC <- PC + e """
+        if self.condition(cc):
+            self.JR_e(e)
+            return 12
+
+    @I(JUMP_GROUP, [0x38, 'e'], tstates=7, branch=True)
+    def JR_C_e(self, e):
+        """ IF C: PC <- PC + e """
+        return self.JR_cc_e('C', e)
+
+    @I(JUMP_GROUP, [0x30, 'e'], tstates=7, branch=True)
+    def JR_NC_e(self, e):
+        """ IF NC: PC <- PC + e """
+        return self.JR_cc_e('NC', e)
+
+    @I(JUMP_GROUP, [0x28, 'e'], tstates=7, branch=True)
+    def JR_Z_e(self, e):
+        """ IF Z: PC <- PC + e """
+        return self.JR_cc_e('Z', e)
+
+    @I(JUMP_GROUP, [0x20, 'e'], tstates=7, branch=True)
+    def JR_NZ_e(self, e):
+        """ IF NZ: PC <- PC + e """
+        return self.JR_cc_e('NZ', e)
+
+    @I(JUMP_GROUP, [0xe9], tstates=4, branch=True)
+    def JP__HL_(self):
+        """ PC <- HL """
+        self['PC'] = self['HL']
+
+    @I(JUMP_GROUP, ['11{0}101', 0xe9], tstates=8, expand=['ii'],
+       branch=True)
+    def JP__ii_(self, ii):
+        """ PC <- {0} """
+        assert_ii(ii)
+        self['PC'] = self[ii]
+
+    @I(JUMP_GROUP, [0x10, 'e'], tstates=8, branch=True)
+    def DJNZ_e(self, e):
+        """ B <- B - 1
+            IF B != 0: PC <- PC + e """
+        self['B'] = (self['B'] - 1) & 0xff
+        if self['B'] != 0:
+            self.JR_e(e)
+            return 13
 
     # #######################
     # call and return
     # #######################
+    def push(self, nn):
+        """ SP <- SP - 2
+            (SP) <- nn """
+        self.DEC_ss('SP', 2)
+        self.set16(self['SP'], nn)
+
+    def pop(self):
+        """ Returns (SP)
+            SP <- SP + 2 """
+        nn = self.get16(self['SP'])
+        self.INC_ss('SP', 2)
+        return nn
+
+    @I(CALL_AND_RETURN_GROUP, [0xcd, 'nn'], tstates=17, branch=True)
+    def CALL_nn(self, nn):
+        """ (SP - 1, SP - 2) <- PC
+            SP <- SP - 2
+            PC <- nn """
+        assert_nn(nn)
+        self.push(self['PC'])
+        self['PC'] = nn
+
+    @I(CALL_AND_RETURN_GROUP, ['11{0}100', 'nn'], tstates=10,
+       expand=['cc'], branch=True)
+    def CALL_cc_nn(self, cc, nn):
+        """ IF {0}: CALL nn """
+        if self.condition(cc):
+            self.CALL_nn(nn)
+            return 17
+
+    @I(CALL_AND_RETURN_GROUP, [0xc9], tstates=10, branch=True)
+    def RET(self):
+        """ PC <- (SP)
+            SP <- SP + 2 """
+        self['PC'] = self.pop()
+
+    @I(CALL_AND_RETURN_GROUP, [0xed, 0x4d], tstates=14, branch=True)
+    def RETI(self):
+        """ return from interrupt
+            IFF1 <- IFF2 """
+        self['PC'] = self.pop()
+        self.iff1 = self.iff2
+        self.poll()
+
+    @I(CALL_AND_RETURN_GROUP, [0xed, 0x45], tstates=14, branch=True)
+    def RETN(self):
+        """ return from NMI
+            IFF1 <- IFF2 """
+        self['PC'] = self.pop()
+        self.iff1 = self.iff2
+        self.poll()
+
+    @I(CALL_AND_RETURN_GROUP, ['11{0}000'], tstates=5, expand=['cc'],
+       branch=True)
+    def RET_cc(self, cc):
+        """ IF {0}: RET """
+        if self.condition(cc):
+            self.RET()
+            return 11
+
+    @I(CALL_AND_RETURN_GROUP, ['11{0}111'], tstates=11, expand=['p'],
+       branch=True)
+    def RST_p(self, p):
+        """ (SP - 1, SP - 2) <- PC
+            SP <- SP - 2
+            PC <- {0} """
+        assert_p(p)
+        self.push(self['PC'])
+        self['PC'] = p
 
     # #######################
     # input and output
     # #######################
+    @I(INPUT_AND_OUTPUT_GROUP, [0xdb, 'n'], tstates=11,
+       assembler=['IN', 'A', '(n)'])
+    def IN_A__n_(self, n):
+        """ A <- (n) """
+        assert_n(n)
+        self['A'] = self.ports.read((self['A'] << 8) | n, self.tstates)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, '01{0}000'], tstates=12,
+       expand=['r'], assembler=['IN', 'r', '(C)'])
+    def IN_r__C_(self, r):
+        """ {0} <- (C) """
+        assert_r(r)
+        value = self.ports.read(self['BC'], self.tstates)
+        self[r] = value
+        self.reg.update_flags(shift_f, value, None)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xa2], tstates=16)
+    def INI(self):
+        """ (HL) <- (C)
+            B <- B - 1
+            HL <- HL + 1 """
+        self[self['HL']] = self.ports.read(self['BC'], self.tstates)
+        self.io_step(1)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xb2], tstates=21, branch=True)
+    def INIR(self):
+        """ (HL) <- (C)
+            B <- B - 1
+            HL <- HL + 1
+            WHILE B != 0 """
+        return self.input_block(1, self.INI)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xaa], tstates=16)
+    def IND(self):
+        """ (HL) <- (C)
+            B <- B - 1
+            HL <- HL - 1 """
+        self[self['HL']] = self.ports.read(self['BC'], self.tstates)
+        self.io_step(-1)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xba], tstates=21, branch=True)
+    def INDR(self):
+        """ (HL) <- (C)
+            B <- B - 1
+            HL <- HL - 1
+            WHILE B != 0 """
+        return self.input_block(-1, self.IND)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xd3, 'n'], tstates=11,
+       assembler=['OUT', '(n)', 'A'])
+    def OUT__n__A(self, n):
+        """ (n) <- A """
+        assert_n(n)
+        self.ports.write((self['A'] << 8) | n, self['A'], self.tstates)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, '01{0}001'], tstates=12,
+       expand=['r'], assembler=['OUT', '(C)', 'r'])
+    def OUT__C__r(self, r):
+        """ (C) <- {0} """
+        assert_r(r)
+        self.ports.write(self['BC'], self[r], self.tstates)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xa3], tstates=16)
+    def OUTI(self):
+        """ B <- B - 1
+            (C) <- (HL)
+            HL <- HL + 1 """
+        self['B'] = (self['B'] - 1) & 0xff
+        self.ports.write(self['BC'], self[self['HL']], self.tstates)
+        self.io_step(1, decrement=False)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xb3], tstates=21, branch=True)
+    def OTIR(self):
+        """ B <- B - 1
+            (C) <- (HL)
+            HL <- HL + 1
+            WHILE B != 0 """
+        return self.output_block(1, self.OUTI)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xab], tstates=16)
+    def OUTD(self):
+        """ B <- B - 1
+            (C) <- (HL)
+            HL <- HL - 1 """
+        self['B'] = (self['B'] - 1) & 0xff
+        self.ports.write(self['BC'], self[self['HL']], self.tstates)
+        self.io_step(-1, decrement=False)
+
+    @I(INPUT_AND_OUTPUT_GROUP, [0xed, 0xbb], tstates=21, branch=True)
+    def OTDR(self):
+        """ B <- B - 1
+            (C) <- (HL)
+            HL <- HL - 1
+            WHILE B != 0 """
+        return self.output_block(-1, self.OUTD)
+
+    def io_step(self, step, decrement=True):
+        """ HL <- HL + step, decrements B unless it has been decremented
+            before the output and sets the flags """
+        if decrement:
+            self['B'] = (self['B'] - 1) & 0xff
+        self['HL'] = (self['HL'] + step) % MEMSIZE
+        self.reg.update_flags(block_io_f, self['B'])
+
+    def input_block(self, step, single):
+        """ INIR (step 1) or INDR (step -1): passes the bytes of all
+            iterations to the devices at once if allowed, otherwise
+            executes one iteration with single """
+        n = self['B'] or 0x100
+        hl = self['HL']
+        start = hl if step > 0 else (hl - n + 1) % MEMSIZE
+        tstates = 21 * (n - 1) + 16
+        if n > 1 and self.bulk_allowed(tstates, start, n):
+            data = self.ports.read_block(self['C'], self['B'], n,
+                                         self.tstates)
+            write_range(self.reg.bulk_mem, start, data if step > 0
+                        else data[::-1])
+            self.bulk_written(start, n)
+            self['B'] = 0
+            self['HL'] = (hl + step * n) % MEMSIZE
+            self.reg.update_flags(block_io_f, 0)
+            return tstates
+        single()
+        if self['B'] != 0:
+            self.DEC_PC(2)
+            return 21
+        return 16
+
+    def output_block(self, step, single):
+        """ OTIR (step 1) or OTDR (step -1), see input_block """
+        n = self['B'] or 0x100
+        hl = self['HL']
+        tstates = 21 * (n - 1) + 16
+        if n > 1 and self.bulk_allowed(tstates):
+            if step > 0:
+                data = read_range(self.reg.mem, hl, n)
+            else:
+                data = read_range(self.reg.mem, (hl - n + 1) % MEMSIZE,
+                                  n)[::-1]
+            self.ports.write_block(self['C'], (self['B'] - 1) & 0xff, data,
+                                   self.tstates)
+            self['B'] = 0
+            self['HL'] = (hl + step * n) % MEMSIZE
+            self.reg.update_flags(block_io_f, 0)
+            return tstates
+        single()
+        if self['B'] != 0:
+            self.DEC_PC(2)
+            return 21
+        return 16
+
+
+TEMPLATE_CACHE.save()
@@ -0,0 +1,94 @@
+from .memory import PageHandler
+from .ports import PortDevice
+from .scheduler import INFINITY
+
+
+class Device(PortDevice, PageHandler):
+    """
+    Peripheral of a CPU which is synchronised lazily.
+
+    The state of the device is advanced by catch_up(now) only when the
+    CPU reads or writes one of its ports or memory pages, or when one
+    of its events (see schedule) fires. now is the T-state count of the
+    CPU at the start of the accessing instruction, passed by the PortBus
+    and the MemoryBus, or the due count of the event. Between these
+    points an idle device costs nothing.
+
+    Subclasses override catch_up, which has to set self.now, and the
+    port_* and page_* methods instead of the bus methods.
+    """
+    timed = True
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # T-state count the state has been advanced to
+        self.now = cpu.tstates
+
+    def catch_up(self, now):
+        """ advances the state from self.now to now """
+        self.now = now
+
+    def sync(self, now):
+        """ catches up with now """
+        if now > self.now:
+            self.catch_up(now)
+
+    def stable_until(self, now):
+        """ T-state count up to which reading the ports and pages
+            returns the values read at now, used by the idle loop
+            detection (see idle.IdleDetector). By default the state is
+            assumed to change only in events and by writes. """
+        return INFINITY
+
+    def schedule(self, due, callback):
+        """ calls callback(due) after catching up with due.
+            Returns the Event. """
+        def fire(due):
+            self.sync(due)
+            callback(due)
+        return self.cpu.schedule(due, fire)
+
+    # port bus
+    def read(self, port, now):
+        self.sync(now)
+        return self.port_read(port)
+
+    def write(self, port, value, now):
+        self.sync(now)
+        self.port_write(port, value)
+
+    def read_block(self, port, n, now):
+        self.sync(now)
+        return self.port_read_block(port, n)
+
+    def write_block(self, port, data, now):
+        self.sync(now)
+        self.port_write_block(port, data)
+
+    def port_read(self, port):
+        return 0xff
+
+    def port_write(self, port, value):
+        pass
+
+    def port_read_block(self, port, n):
+        return bytes(self.port_read(port) for _ in range(n))
+
+    def port_write_block(self, port, data):
+        for value in data:
+            self.port_write(port, value)
+
+    # memory bus
+    def read_byte(self, addr, now):
+        self.sync(now)
+        return self.page_read(addr)
+
+    def write_byte(self, addr, value, now):
+        self.sync(now)
+        self.page_write(addr, value)
+
+    def page_read(self, addr):
+        return 0xff
+
+    def page_write(self, addr, value):
+        pass
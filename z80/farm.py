@@ -0,0 +1,373 @@
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from time import perf_counter
+from xml.etree import ElementTree
+from .cpu import CPU
+from .loader import load_bytes
+from .memory import PAGE_SIZE
+from .register import MEMSIZE
+
+
+def parse_int(value):
+    """ int of a JSON value, strings may use a base prefix (0x8000) """
+    return value if isinstance(value, int) else int(value, 0)
+
+
+def memory_diff(before, after):
+    """ list of (addr, bytes) of the runs of after differing from before """
+    diffs = []
+    start = None
+    for page in range(0, len(after), PAGE_SIZE):
+        end = page + PAGE_SIZE
+        if start is None and before[page:end] == after[page:end]:
+            continue
+        for addr in range(page, end):
+            if before[addr] != after[addr]:
+                if start is None:
+                    start = addr
+            elif start is not None:
+                diffs.append((start, bytes(after[start:addr])))
+                start = None
+    if start is not None:
+        diffs.append((start, bytes(after[start:])))
+    return diffs
+
+
+class Job(object):
+    """
+    A guest program run.
+
+    rom is the name of a ROM image of the Farm mapped read only at
+    address 0, load is a list of (addr, bytes) copied to the RAM
+    afterwards (writes to the ROM are ignored), registers are
+    set before the run. The run stops at until_pc or when one of the
+    budgets is exhausted, at least one of them is required. expect
+    holds the expected 'registers' ({name: value}) and 'memory'
+    ({addr: bytes}) of a passing job.
+    """
+    def __init__(self, name, rom=None, load=(), registers=None,
+                 until_pc=None, max_tstates=None, max_instructions=None,
+                 expect=None):
+        if until_pc is None and max_tstates is None and \
+           max_instructions is None:
+            raise ValueError('job {0} has no stop condition'.format(name))
+        self.name = name
+        self.rom = rom
+        self.load = [(addr, bytes(data)) for addr, data in load]
+        self.registers = OrderedDict() if registers is None else registers
+        self.until_pc = until_pc
+        self.max_tstates = max_tstates
+        self.max_instructions = max_instructions
+        self.expect = {} if expect is None else expect
+
+    @classmethod
+    def from_dict(cls, d, directory='.'):
+        """ Job of a JSON object, load entries hold 'hex' or a 'file'
+            relative to directory """
+        load = []
+        for entry in d.get('load', []):
+            if 'file' in entry:
+                with open(os.path.join(directory, entry['file']), 'rb') as f:
+                    data = f.read()
+            else:
+                data = bytes.fromhex(entry['hex'])
+            load.append((parse_int(entry.get('addr', 0)), data))
+        expect = d.get('expect', {})
+        registers = {r: parse_int(v)
+                     for r, v in d.get('registers', {}).items()}
+        expect = {'registers': {r: parse_int(v) for r, v
+                                in expect.get('registers', {}).items()},
+                  'memory': {parse_int(a): bytes.fromhex(v) for a, v
+                             in expect.get('memory', {}).items()}}
+
+        def optional(key):
+            return None if d.get(key) is None else parse_int(d[key])
+
+        return cls(d['name'], d.get('rom'), load, registers,
+                   optional('until_pc'), optional('max_tstates'),
+                   optional('max_instructions'), expect)
+
+
+class JobResult(object):
+    """ final registers, counts and memory differences of a Job """
+    def __init__(self, name, reason=None, instructions=0, tstates=0,
+                 registers=None, memory=(), failures=(), error=None,
+                 seconds=0.0):
+        self.name = name
+        self.reason = reason
+        self.instructions = instructions
+        self.tstates = tstates
+        self.registers = {} if registers is None else registers
+        self.memory = list(memory)
+        self.failures = list(failures)
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def passed(self):
+        return self.error is None and not self.failures
+
+    def to_dict(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('passed', self.passed),
+            ('reason', self.reason),
+            ('instructions', self.instructions),
+            ('tstates', self.tstates),
+            ('seconds', self.seconds),
+            ('registers', self.registers),
+            ('memory', OrderedDict(('{0:04x}'.format(addr), data.hex())
+                                   for addr, data in self.memory)),
+            ('failures', self.failures),
+            ('error', self.error)])
+
+
+# state of a worker process, see init_worker
+_WORKER = {}
+
+
+def attach(name):
+    """ attaches to the shared memory block name without tracking it:
+        the block is owned by the Farm, which unlinks it """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:   # track was added in Python 3.13
+        block = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            # the tracker would unlink the block when the worker exits
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+def init_worker(roms, cpu_options):
+    """ attaches the ROM images and creates the warm CPU of a worker.
+        roms maps the ROM name to (shared memory name, size). """
+    blocks = {name: attach(shm) for name, (shm, _) in roms.items()}
+    _WORKER['blocks'] = blocks
+    _WORKER['roms'] = {name: blocks[name].buf[:size]
+                       for name, (_, size) in roms.items()}
+    _WORKER['cpu'] = CPU(**cpu_options)
+
+
+def use_rom(cpu, rom):
+    """ maps the image rom read only at address 0 unless it is mapped
+        already, None unmaps the ROM. Images of whole pages are not
+        copied. """
+    bus = cpu.memory_bus
+    mapped = bus.handler(0)
+    if mapped is not None and mapped.data is rom:
+        return
+    if mapped is not None:
+        bus.unmap(0, len(mapped.data))
+    if rom is not None:
+        bus.map_rom(0, rom)
+
+
+def execute(cpu, job, rom=None):
+    """ maps rom, resets cpu, runs job and returns the JobResult """
+    start = perf_counter()
+    use_rom(cpu, rom)
+    cpu.reset()
+    mem = cpu.reg.mem
+    for addr, data in job.load:
+        load_bytes(cpu, data[:MEMSIZE - addr], addr)
+    initial = bytes(mem)
+    for r, value in job.registers.items():
+        cpu[r] = value
+    try:
+        run = cpu.run(max_tstates=job.max_tstates,
+                      max_instructions=job.max_instructions,
+                      until_pc=job.until_pc)
+    except Exception as e:
+        return JobResult(job.name, error='{0}: {1}'.format(
+            type(e).__name__, e), seconds=perf_counter() - start)
+    registers = OrderedDict(sorted(cpu.reg.main_register_set.items()))
+    registers.update((r + "'", v) for r, v
+                     in sorted(cpu.reg.alt_register_set.items()))
+    failures = []
+    for r, value in job.expect.get('registers', {}).items():
+        if cpu[r] != value:
+            failures.append('{0} = {1:04x}, expected {2:04x}'.
+                            format(r, cpu[r], value))
+    for addr, data in job.expect.get('memory', {}).items():
+        actual = bytes(mem[addr:addr + len(data)])
+        if actual != data:
+            failures.append('({0:04x}) = {1}, expected {2}'.
+                            format(addr, actual.hex(), data.hex()))
+    return JobResult(job.name, run.reason, run.instructions, run.tstates,
+                     registers, memory_diff(initial, mem), failures,
+                     seconds=perf_counter() - start)
+
+
+def run_job(job):
+    """ executes job on the warm CPU of the worker """
+    rom = None if job.rom is None else _WORKER['roms'][job.rom]
+    return execute(_WORKER['cpu'], job, rom)
+
+
+class Farm(object):
+    """
+    Runs Jobs on a pool of worker processes.
+
+    The ROM images (name: bytes) are copied once to shared memory
+    blocks, padded to whole pages with FFH, which the workers attach to
+    and map read only without copying them. Each worker reuses a
+    single CPU(**cpu_options) which is reset in place for every job,
+    the ROM stays mapped while the jobs use the same image. Use the
+    farm as a context manager or call close to release the shared
+    memory.
+    """
+    def __init__(self, roms=None, workers=None, cpu_options=None):
+        self.blocks = {}
+        roms = {} if roms is None else roms
+        for name, image in roms.items():
+            if len(image) > MEMSIZE:
+                raise ValueError('ROM {0} exceeds 64K'.format(name))
+            size = -(-len(image) // PAGE_SIZE) * PAGE_SIZE
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(size, 1))
+            block.buf[:size] = bytes(image) + \
+                b'\xff' * (size - len(image))
+            self.blocks[name] = (block, size)
+        specs = {name: (block.name, size)
+                 for name, (block, size) in self.blocks.items()}
+        self.executor = ProcessPoolExecutor(
+            workers, initializer=init_worker,
+            initargs=(specs, {} if cpu_options is None else cpu_options))
+
+    def submit(self, job):
+        if job.rom is not None and job.rom not in self.blocks:
+            raise KeyError('unknown ROM {0} of job {1}'.
+                           format(job.rom, job.name))
+        return self.executor.submit(run_job, job)
+
+    def run(self, jobs):
+        """ submits jobs and yields the JobResults as they complete. A
+            job whose worker died (and every job pending in the broken
+            pool) yields a JobResult with an error. """
+        futures = OrderedDict((self.submit(job), job) for job in jobs)
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool as e:
+                yield JobResult(futures[future].name,
+                                error='{0}: {1}'.format(type(e).__name__, e))
+
+    def close(self):
+        self.executor.shutdown()
+        for block, _ in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_json(results, f):
+    json.dump([result.to_dict() for result in results], f, indent=4)
+    f.write('\n')
+
+
+def junit_xml(results, suite='z80.farm'):
+    """ ElementTree of a JUnit test suite with a test case per result """
+    root = ElementTree.Element('testsuite', name=suite)
+    failures = errors = 0
+    for result in results:
+        case = ElementTree.SubElement(root, 'testcase', classname=suite,
+                                      name=result.name,
+                                      time='{0:.6f}'.format(result.seconds))
+        if result.error is not None:
+            errors += 1
+            ElementTree.SubElement(case, 'error', message=result.error)
+        elif result.failures:
+            failures += 1
+            failure = ElementTree.SubElement(case, 'failure',
+                                             message=result.failures[0])
+            failure.text = '\n'.join(result.failures)
+        out = ElementTree.SubElement(case, 'system-out')
+        out.text = 'reason={0} instructions={1} tstates={2}'.format(
+            result.reason, result.instructions, result.tstates)
+    root.set('tests', str(len(results)))
+    root.set('failures', str(failures))
+    root.set('errors', str(errors))
+    return ElementTree.ElementTree(root)
+
+
+def write_junit(results, path):
+    junit_xml(results).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def format_result(result):
+    status = 'PASS' if result.passed else \
+        'ERROR' if result.error is not None else 'FAIL'
+    line = '{0:5} {1} instructions={2} tstates={3} {4:.3f}s'.format(
+        status, result.name, result.instructions, result.tstates,
+        result.seconds)
+    details = result.failures if result.error is None else [result.error]
+    return '\n'.join([line] + ['      ' + d for d in details])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m z80.farm',
+        description='Runs the guest program jobs of a JSON file')
+    parser.add_argument('jobs', help='JSON file with a list of jobs')
+    parser.add_argument('--rom', action='append', default=[],
+                        metavar='NAME=FILE', help='ROM image')
+    parser.add_argument('--cpu-option', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='CPU option of the workers, the value is '
+                        'parsed as JSON if possible (block_compiler=true)')
+    parser.add_argument('--workers', type=int,
+                        help='number of processes (default: CPU count)')
+    parser.add_argument('--json', help='write the results to a JSON file')
+    parser.add_argument('--junit', help='write a JUnit XML file')
+    args = parser.parse_args(argv)
+
+    cpu_options = {}
+    for spec in args.cpu_option:
+        key, _, value = spec.partition('=')
+        try:
+            cpu_options[key] = json.loads(value)
+        except ValueError:
+            cpu_options[key] = value
+    try:
+        CPU(**cpu_options)
+    except TypeError as e:
+        parser.error(str(e))
+    roms = {}
+    for spec in args.rom:
+        name, _, path = spec.partition('=')
+        with open(path, 'rb') as f:
+            roms[name] = f.read()
+    with open(args.jobs) as f:
+        directory = os.path.dirname(os.path.abspath(args.jobs))
+        jobs = [Job.from_dict(d, directory) for d in json.load(f)]
+    results = []
+    with Farm(roms, args.workers, cpu_options) as farm:
+        for result in farm.run(jobs):
+            print(format_result(result))
+            sys.stdout.flush()
+            results.append(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            write_json(results, f)
+    if args.junit:
+        write_junit(results, args.junit)
+    return 0 if all(result.passed for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
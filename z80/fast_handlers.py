@@ -0,0 +1,578 @@
+from operator import and_
+from operator import or_
+from operator import xor
+from .flags import add_f
+from .flags import sub_f
+from .flags import compare_f
+from .flags import logic_f
+from .flags import inc_f
+from .flags import dec_f
+from .flags import CONDITIONS
+from .flags import FLAG_H
+from .register import PAGE_BITS
+from .register import PAIRS
+from .register import WORDS
+from .register import WORD_PC
+from .register import WORD_SP
+
+
+SPECIALISERS = {}
+
+
+def specialise(*names):
+    """ registers a specialiser for the instruction functions names.
+
+        A specialiser is called with the register arguments of an
+        expanded instruction and returns a function fast(cpu, *operands)
+        which executes the instruction without argument checks, or None
+        if the expansion is not specialised. operands are the n, nn, d
+        and e values in opcode order. """
+    def register(func):
+        for name in names:
+            SPECIALISERS[name] = func
+        return func
+    return register
+
+
+def reader16(rr):
+    """ function returning the 16 bit register rr of a RegisterSet """
+    if rr in WORDS:
+        word = WORDS[rr]
+
+        def read(reg):
+            return reg.r16[word]
+    else:
+        hi, lo = PAIRS[rr]
+
+        def read(reg):
+            slots = reg.slots
+            return (reg.r8[slots[hi]] << 8) | reg.r8[slots[lo]]
+    return read
+
+
+def writer16(rr):
+    """ function setting the 16 bit register rr of a RegisterSet """
+    if rr in WORDS:
+        word = WORDS[rr]
+
+        def write(reg, value):
+            reg.r16[word] = value
+    else:
+        hi, lo = PAIRS[rr]
+
+        def write(reg, value):
+            slots = reg.slots
+            reg.r8[slots[hi]] = value >> 8
+            reg.r8[slots[lo]] = value & 0xff
+    return write
+
+
+def write8(reg, addr, value):
+    if reg.mapped[addr >> PAGE_BITS]:
+        reg.paged[addr] = value
+    else:
+        reg.mem[addr] = value
+    if reg.code_caches:
+        reg.invalidate(addr)
+
+
+# ################ #
+# 8 bit load group #
+# ################ #
+@specialise('LD_r_r')
+def _LD_r_r(r1, r2):
+    def LD_r_r(cpu):
+        reg = cpu.reg
+        slots = reg.slots
+        reg.r8[slots[r1]] = reg.r8[slots[r2]]
+    return LD_r_r
+
+
+@specialise('LD_r_n')
+def _LD_r_n(r):
+    def LD_r_n(cpu, n):
+        reg = cpu.reg
+        reg.r8[reg.slots[r]] = n
+    return LD_r_n
+
+
+@specialise('LD_r__HL_')
+def _LD_r__HL_(r):
+    read_hl = reader16('HL')
+
+    def LD_r__HL_(cpu):
+        reg = cpu.reg
+        reg.r8[reg.slots[r]] = reg.mem[read_hl(reg)]
+    return LD_r__HL_
+
+
+@specialise('LD_r__ii_d_')
+def _LD_r__ii_d_(r, ii):
+    word = WORDS[ii]
+
+    def LD_r__ii_d_(cpu, d):
+        reg = cpu.reg
+        reg.r8[reg.slots[r]] = reg.mem[(reg.r16[word] + d) & 0xffff]
+    return LD_r__ii_d_
+
+
+@specialise('LD__HL__r')
+def _LD__HL__r(r):
+    read_hl = reader16('HL')
+
+    def LD__HL__r(cpu):
+        reg = cpu.reg
+        write8(reg, read_hl(reg), reg.r8[reg.slots[r]])
+    return LD__HL__r
+
+
+@specialise('LD__HL__n')
+def _LD__HL__n():
+    read_hl = reader16('HL')
+
+    def LD__HL__n(cpu, n):
+        reg = cpu.reg
+        write8(reg, read_hl(reg), n)
+    return LD__HL__n
+
+
+@specialise('LD__ii_d__r')
+def _LD__ii_d__r(ii, r):
+    word = WORDS[ii]
+
+    def LD__ii_d__r(cpu, d):
+        reg = cpu.reg
+        write8(reg, (reg.r16[word] + d) & 0xffff, reg.r8[reg.slots[r]])
+    return LD__ii_d__r
+
+
+@specialise('LD__ii_d__n')
+def _LD__ii_d__n(ii):
+    word = WORDS[ii]
+
+    def LD__ii_d__n(cpu, d, n):
+        reg = cpu.reg
+        write8(reg, (reg.r16[word] + d) & 0xffff, n)
+    return LD__ii_d__n
+
+
+@specialise('LD_A__BC_')
+def _LD_A__BC_():
+    return load_A_indirect('BC')
+
+
+@specialise('LD_A__DE_')
+def _LD_A__DE_():
+    return load_A_indirect('DE')
+
+
+def load_A_indirect(rr):
+    read = reader16(rr)
+
+    def LD_A__rr_(cpu):
+        reg = cpu.reg
+        reg.r8[reg.slots['A']] = reg.mem[read(reg)]
+    return LD_A__rr_
+
+
+@specialise('LD__BC__A')
+def _LD__BC__A():
+    return store_A_indirect('BC')
+
+
+@specialise('LD__DE__A')
+def _LD__DE__A():
+    return store_A_indirect('DE')
+
+
+def store_A_indirect(rr):
+    read = reader16(rr)
+
+    def LD__rr__A(cpu):
+        reg = cpu.reg
+        write8(reg, read(reg), reg.r8[reg.slots['A']])
+    return LD__rr__A
+
+
+@specialise('LD_A__nn_')
+def _LD_A__nn_():
+    def LD_A__nn_(cpu, nn):
+        reg = cpu.reg
+        reg.r8[reg.slots['A']] = reg.mem[nn]
+    return LD_A__nn_
+
+
+@specialise('LD__nn__A')
+def _LD__nn__A():
+    def LD__nn__A(cpu, nn):
+        reg = cpu.reg
+        write8(reg, nn, reg.r8[reg.slots['A']])
+    return LD__nn__A
+
+
+# ################# #
+# 16 bit load group #
+# ################# #
+@specialise('LD_dd_nn', 'LD_ii_nn')
+def _LD_dd_nn(dd):
+    write = writer16(dd)
+
+    def LD_dd_nn(cpu, nn):
+        write(cpu.reg, nn)
+    return LD_dd_nn
+
+
+@specialise('LD_SP_HL', 'LD_SP_ii')
+def _LD_SP_HL(rr='HL'):
+    read = reader16(rr)
+
+    def LD_SP_HL(cpu):
+        reg = cpu.reg
+        reg.r16[WORDS['SP']] = read(reg)
+    return LD_SP_HL
+
+
+@specialise('PUSH_qq', 'PUSH_ii')
+def _PUSH_qq(qq):
+    if qq == 'AF':
+        # F may have to be resolved
+        return None
+    read = reader16(qq)
+    sp = WORDS['SP']
+
+    def PUSH_qq(cpu):
+        reg = cpu.reg
+        addr = (reg.r16[sp] - 2) & 0xffff
+        reg.r16[sp] = addr
+        value = read(reg)
+        write8(reg, addr, value & 0xff)
+        write8(reg, (addr + 1) & 0xffff, value >> 8)
+    return PUSH_qq
+
+
+@specialise('POP_qq', 'POP_ii')
+def _POP_qq(qq):
+    if qq == 'AF':
+        # pending flags have to be dropped
+        return None
+    write = writer16(qq)
+    sp = WORDS['SP']
+
+    def POP_qq(cpu):
+        reg = cpu.reg
+        mem = reg.mem
+        addr = reg.r16[sp]
+        write(reg, mem[addr] | (mem[(addr + 1) & 0xffff] << 8))
+        reg.r16[sp] = (addr + 2) & 0xffff
+    return POP_qq
+
+
+# ######## #
+# exchange #
+# ######## #
+@specialise('EX_DE_HL')
+def _EX_DE_HL():
+    def EX_DE_HL(cpu):
+        reg = cpu.reg
+        r8 = reg.r8
+        slots = reg.slots
+        d, e, h, l = slots['D'], slots['E'], slots['H'], slots['L']
+        r8[d], r8[e], r8[h], r8[l] = r8[h], r8[l], r8[d], r8[e]
+    return EX_DE_HL
+
+
+# ################ #
+# 8-bit arithmetic #
+# ################ #
+def operand8(suffix, args):
+    """ function returning the source operand of an 8 bit arithmetic
+        instruction from the RegisterSet and the operands """
+    if suffix == '_n':
+        def read(reg, n):
+            return n
+    elif suffix == '_r':
+        r = args[0]
+
+        def read(reg):
+            return reg.r8[reg.slots[r]]
+    elif suffix == '__HL_':
+        read_hl = reader16('HL')
+
+        def read(reg):
+            return reg.mem[read_hl(reg)]
+    else:
+        return None
+    return read
+
+
+def arithmetic8(name, suffix):
+    """ specialiser of the 8 bit arithmetic instruction name + suffix """
+    def specialiser(*args):
+        read = operand8(suffix, args)
+        if read is None:
+            return None
+
+        use_carry = name in ('ADC_A', 'SBC_A')
+
+        def add(cpu, *operands):
+            reg = cpu.reg
+            n = read(reg, *operands)
+            carry = reg.flag('C') if use_carry else 0
+            slot = reg.slots['A']
+            a = reg.r8[slot]
+            reg.update_flags(add_f, a, n, carry)
+            reg.r8[slot] = (a + n + carry) & 0xff
+
+        def subtract(cpu, *operands):
+            reg = cpu.reg
+            n = read(reg, *operands)
+            borrow = reg.flag('C') if use_carry else 0
+            slot = reg.slots['A']
+            a = reg.r8[slot]
+            reg.update_flags(sub_f, a, n, borrow)
+            reg.r8[slot] = (a - n - borrow) & 0xff
+
+        operator = {'AND_A': and_, 'OR_A': or_, 'XOR_A': xor}.get(name)
+        h = FLAG_H if name == 'AND_A' else 0
+
+        def logic(cpu, *operands):
+            reg = cpu.reg
+            slot = reg.slots['A']
+            a = operator(reg.r8[slot], read(reg, *operands))
+            reg.update_flags(logic_f, a, h)
+            reg.r8[slot] = a
+
+        def compare(cpu, *operands):
+            reg = cpu.reg
+            reg.update_flags(compare_f, reg.r8[reg.slots['A']],
+                             read(reg, *operands))
+
+        if name in ('AND_A', 'OR_A', 'XOR_A'):
+            return logic
+        elif name == 'CP':
+            return compare
+        elif name in ('SUB_A', 'SBC_A'):
+            return subtract
+        else:
+            return add
+    return specialiser
+
+
+for _name in ('ADD_A', 'ADC_A', 'SUB_A', 'SBC_A',
+              'AND_A', 'OR_A', 'XOR_A', 'CP'):
+    for _suffix in ('_n', '_r', '__HL_'):
+        SPECIALISERS[_name + _suffix] = arithmetic8(_name, _suffix)
+
+
+@specialise('INC_r')
+def _INC_r(r):
+    def INC_r(cpu):
+        reg = cpu.reg
+        slot = reg.slots[r]
+        n = reg.r8[slot]
+        reg.update_flags(inc_f, n)
+        reg.r8[slot] = (n + 1) & 0xff
+    return INC_r
+
+
+@specialise('DEC_r')
+def _DEC_r(r):
+    def DEC_r(cpu):
+        reg = cpu.reg
+        slot = reg.slots[r]
+        n = reg.r8[slot]
+        reg.update_flags(dec_f, n)
+        reg.r8[slot] = (n - 1) & 0xff
+    return DEC_r
+
+
+# ################# #
+# 16 bit arithmetic #
+# ################# #
+@specialise('INC_ss', 'INC_ii')
+def _INC_ss(ss):
+    read = reader16(ss)
+    write = writer16(ss)
+
+    def INC_ss(cpu):
+        reg = cpu.reg
+        write(reg, (read(reg) + 1) & 0xffff)
+    return INC_ss
+
+
+@specialise('DEC_ss', 'DEC_ii')
+def _DEC_ss(ss):
+    read = reader16(ss)
+    write = writer16(ss)
+
+    def DEC_ss(cpu):
+        reg = cpu.reg
+        write(reg, (read(reg) - 1) & 0xffff)
+    return DEC_ss
+
+
+# ############### #
+# General purpose #
+# ############### #
+@specialise('NOP')
+def _NOP():
+    def NOP(cpu):
+        pass
+    return NOP
+
+
+# ####################### #
+# Bit set, reset and test #
+# ####################### #
+@specialise('SET_b_r')
+def _SET_b_r(b, r):
+    mask = 1 << b
+
+    def SET_b_r(cpu):
+        reg = cpu.reg
+        reg.r8[reg.slots[r]] |= mask
+    return SET_b_r
+
+
+@specialise('RES_b_r')
+def _RES_b_r(b, r):
+    mask = 0xff ^ (1 << b)
+
+    def RES_b_r(cpu):
+        reg = cpu.reg
+        reg.r8[reg.slots[r]] &= mask
+    return RES_b_r
+
+
+# #### #
+# jump #
+# #### #
+def condition(cc):
+    """ function returning True if the condition cc holds for a
+        RegisterSet """
+    mask, value = CONDITIONS[cc]
+
+    def holds(reg):
+        reg.resolve_flags()
+        return reg.r8[reg.slots['F']] & mask == value
+    return holds
+
+
+@specialise('JP_nn')
+def _JP_nn():
+    def JP_nn(cpu, nn):
+        cpu.reg.r16[WORD_PC] = nn
+    return JP_nn
+
+
+@specialise('JP_cc_nn')
+def _JP_cc_nn(cc):
+    holds = condition(cc)
+
+    def JP_cc_nn(cpu, nn):
+        reg = cpu.reg
+        if holds(reg):
+            reg.r16[WORD_PC] = nn
+    return JP_cc_nn
+
+
+@specialise('JR_e')
+def _JR_e():
+    def JR_e(cpu, e):
+        r16 = cpu.reg.r16
+        r16[WORD_PC] = (r16[WORD_PC] + e) & 0xffff
+    return JR_e
+
+
+def relative_jump(cc):
+    """ specialiser of JR cc,e """
+    def specialiser():
+        holds = condition(cc)
+
+        def JR_cc_e(cpu, e):
+            reg = cpu.reg
+            if holds(reg):
+                r16 = reg.r16
+                r16[WORD_PC] = (r16[WORD_PC] + e) & 0xffff
+                return 12
+        return JR_cc_e
+    return specialiser
+
+
+for _cc in ('C', 'NC', 'Z', 'NZ'):
+    SPECIALISERS['JR_{0}_e'.format(_cc)] = relative_jump(_cc)
+
+
+@specialise('DJNZ_e')
+def _DJNZ_e():
+    def DJNZ_e(cpu, e):
+        reg = cpu.reg
+        slot = reg.slots['B']
+        b = (reg.r8[slot] - 1) & 0xff
+        reg.r8[slot] = b
+        if b:
+            r16 = reg.r16
+            r16[WORD_PC] = (r16[WORD_PC] + e) & 0xffff
+            return 13
+    return DJNZ_e
+
+
+# ############### #
+# call and return #
+# ############### #
+def push_pc(reg):
+    r16 = reg.r16
+    addr = (r16[WORD_SP] - 2) & 0xffff
+    r16[WORD_SP] = addr
+    pc = r16[WORD_PC]
+    write8(reg, addr, pc & 0xff)
+    write8(reg, (addr + 1) & 0xffff, pc >> 8)
+
+
+def pop_pc(reg):
+    r16 = reg.r16
+    mem = reg.mem
+    addr = r16[WORD_SP]
+    r16[WORD_PC] = mem[addr] | (mem[(addr + 1) & 0xffff] << 8)
+    r16[WORD_SP] = (addr + 2) & 0xffff
+
+
+@specialise('CALL_nn')
+def _CALL_nn():
+    def CALL_nn(cpu, nn):
+        reg = cpu.reg
+        push_pc(reg)
+        reg.r16[WORD_PC] = nn
+    return CALL_nn
+
+
+@specialise('CALL_cc_nn')
+def _CALL_cc_nn(cc):
+    holds = condition(cc)
+
+    def CALL_cc_nn(cpu, nn):
+        reg = cpu.reg
+        if holds(reg):
+            push_pc(reg)
+            reg.r16[WORD_PC] = nn
+            return 17
+    return CALL_cc_nn
+
+
+@specialise('RET')
+def _RET():
+    def RET(cpu):
+        pop_pc(cpu.reg)
+    return RET
+
+
+@specialise('RET_cc')
+def _RET_cc(cc):
+    holds = condition(cc)
+
+    def RET_cc(cpu):
+        reg = cpu.reg
+        if holds(reg):
+            pop_pc(reg)
+            return 11
+    return RET_cc
@@ -0,0 +1,217 @@
+FLAG_S = 0x80
+FLAG_Z = 0x40
+FLAG_5 = 0x20
+FLAG_H = 0x10
+FLAG_3 = 0x08
+FLAG_V = 0x04
+FLAG_P = 0x04
+FLAG_N = 0x02
+FLAG_C = 0x01
+
+# P/V flag value for each byte
+PARITY = tuple(FLAG_P if bin(n).count('1') % 2 == 0 else 0
+               for n in range(0x100))
+
+# S, Z, 5 and 3 flags of each byte
+SZ53 = tuple((n & (FLAG_S | FLAG_5 | FLAG_3)) | (FLAG_Z if n == 0 else 0)
+             for n in range(0x100))
+
+# S, Z, 5, 3 and P flags of each byte
+SZ53P = tuple(SZ53[n] | PARITY[n] for n in range(0x100))
+
+# S and Z flags of each byte
+SZ = tuple(SZ53[n] & (FLAG_S | FLAG_Z) for n in range(0x100))
+
+# H and V flags of an addition a + n = res or a subtraction a - n = res.
+# The index is composed of bit 3 (half carry) or bit 7 (overflow) of a,
+# n and res:
+# lookup = ((a & 0x88) >> 3) | ((n & 0x88) >> 2) | ((res & 0x88) >> 1)
+# HALF_CARRY_ADD[lookup & 0x07], OVERFLOW_ADD[lookup >> 4]
+HALF_CARRY_ADD = (0, FLAG_H, FLAG_H, FLAG_H, 0, 0, 0, FLAG_H)
+OVERFLOW_ADD = (0, 0, 0, FLAG_V, FLAG_V, 0, 0, 0)
+HALF_CARRY_SUB = (0, 0, FLAG_H, 0, FLAG_H, 0, FLAG_H, FLAG_H)
+OVERFLOW_SUB = (0, FLAG_V, 0, 0, 0, 0, FLAG_V, 0)
+
+
+def _inc_flags(n):
+    ret = (n + 1) & 0xff
+    f = SZ53[ret] | (FLAG_V if n == 0x7f else 0)
+    if n & 0x0f == 0x0f:
+        f |= FLAG_H
+    return f
+
+
+def _dec_flags(n):
+    ret = (n - 1) & 0xff
+    f = SZ53[ret] | (FLAG_V if n == 0x80 else 0) | FLAG_N
+    if n & 0x0f == 0x00:
+        f |= FLAG_H
+    return f
+
+
+# F (without C) after INC n / DEC n indexed by n
+INC_FLAGS = tuple(_inc_flags(n) for n in range(0x100))
+DEC_FLAGS = tuple(_dec_flags(n) for n in range(0x100))
+
+
+def add_flags(a, n, carry):
+    """ result and F of the 8 bit addition a + n + carry """
+    res = a + n + carry
+    t = res & 0xff
+    lookup = ((a & 0x88) >> 3) | ((n & 0x88) >> 2) | ((t & 0x88) >> 1)
+    f = SZ53[t] | HALF_CARRY_ADD[lookup & 0x07] | OVERFLOW_ADD[lookup >> 4]
+    if res > 0xff:
+        f |= FLAG_C
+    return t, f
+
+
+def sub_flags(a, n, borrow):
+    """ result and F of the 8 bit subtraction a - n - borrow """
+    res = a - n - borrow
+    t = res & 0xff
+    lookup = ((a & 0x88) >> 3) | ((n & 0x88) >> 2) | ((t & 0x88) >> 1)
+    f = SZ53[t] | HALF_CARRY_SUB[lookup & 0x07] | OVERFLOW_SUB[lookup >> 4]
+    if res < 0:
+        f |= FLAG_C
+    return t, f | FLAG_N
+
+
+_TABLES = {}
+
+
+def _table(flags):
+    """ numpy array indexed by [carry, a, n] holding (result << 8) | F
+        of flags(a, n, carry) """
+    if flags not in _TABLES:
+        import numpy
+        values = ((t << 8) | f
+                  for carry in (0, 1)
+                  for a in range(0x100)
+                  for n in range(0x100)
+                  for t, f in (flags(a, n, carry),))
+        table = numpy.fromiter(values, numpy.uint16, count=0x20000)
+        _TABLES[flags] = table.reshape((2, 0x100, 0x100))
+    return _TABLES[flags]
+
+
+def add_table():
+    """
+    numpy array indexed by [carry, a, n] holding (result << 8) | F of
+    the 8 bit addition a + n + carry (see add_flags).
+
+    The table (256 KiB) is built on first use, numpy is imported at
+    that point.
+    """
+    return _table(add_flags)
+
+
+def sub_table():
+    """ numpy array indexed by [borrow, a, n] holding (result << 8) | F
+        of the 8 bit subtraction a - n - borrow, see add_table """
+    return _table(sub_flags)
+
+
+# Functions computing F from the previous F and the operands of an
+# instruction. They are either applied immediately or recorded by
+# RegisterSet.update_flags when lazy flags are enabled.
+def add_f(f, a, n, carry):
+    """ F after A <- a + n + carry """
+    return add_flags(a, n, carry)[1]
+
+
+def sub_f(f, a, n, borrow):
+    """ F after A <- a - n - borrow """
+    return sub_flags(a, n, borrow)[1]
+
+
+def compare_f(f, a, n):
+    """ F after CP n with A = a, 5 and 3 are copied from n """
+    res = sub_flags(a, n, 0)[1] & ~(FLAG_5 | FLAG_3)
+    return res | (n & (FLAG_5 | FLAG_3))
+
+
+def compare_keep_cv_f(f, a, n):
+    """ F after comparing a with n, V and C are not modified """
+    res = sub_flags(a, n, 0)[1] & ~(FLAG_V | FLAG_C)
+    return res | (f & (FLAG_V | FLAG_C))
+
+
+# The 16 bit functions only use arithmetic and bit operations, so that
+# they apply to numpy arrays as well (see batch).
+def add16_f(f, a, n):
+    """ F after ADD rr, n with rr = a, S, Z and P/V are not modified """
+    res = a + n
+    return (f & (FLAG_S | FLAG_Z | FLAG_V)) \
+        | ((res >> 8) & (FLAG_5 | FLAG_3)) \
+        | ((a ^ n ^ res) >> 8) & FLAG_H \
+        | (res >> 16) & FLAG_C
+
+
+def adc16_f(f, a, n, carry):
+    """ F after ADC HL, n with HL = a """
+    res = a + n + carry
+    t = res & 0xffff
+    return ((t >> 8) & (FLAG_S | FLAG_5 | FLAG_3)) \
+        | FLAG_Z * (t == 0) \
+        | ((a ^ n ^ res) >> 8) & FLAG_H \
+        | (((a ^ n ^ 0xffff) & (a ^ t)) >> 13) & FLAG_V \
+        | (res >> 16) & FLAG_C
+
+
+def sbc16_f(f, a, n, borrow):
+    """ F after SBC HL, n with HL = a """
+    res = a - n - borrow
+    t = res & 0xffff
+    return ((t >> 8) & (FLAG_S | FLAG_5 | FLAG_3)) \
+        | FLAG_Z * (t == 0) \
+        | ((a ^ n ^ res) >> 8) & FLAG_H \
+        | (((a ^ n) & (a ^ t)) >> 13) & FLAG_V \
+        | FLAG_N \
+        | (res >> 16) & FLAG_C
+
+
+def logic_f(f, a, h):
+    """ F after AND / OR / XOR with result a, h is FLAG_H for AND and 0
+        for OR and XOR """
+    return SZ53P[a] | h
+
+
+def inc_f(f, n):
+    """ F after INC n """
+    return (f & FLAG_C) | INC_FLAGS[n]
+
+
+def dec_f(f, n):
+    """ F after DEC n """
+    return (f & FLAG_C) | DEC_FLAGS[n]
+
+
+def shift_f(f, n, carry):
+    """ F after a rotate or shift with result n.
+        C is not modified if carry is None """
+    if carry is None:
+        c = f & FLAG_C
+    else:
+        c = FLAG_C if carry else 0
+    return SZ[n] | PARITY[n] | c
+
+
+def block_io_f(f, b):
+    """ F after INI / IND / OUTI / OUTD with the decremented B = b """
+    return (f & ~FLAG_Z) | (FLAG_Z if b == 0 else 0) | FLAG_N
+
+
+# (mask, value) of F for the conditions of jumps, calls and returns
+CONDITIONS = {'NZ': (FLAG_Z, 0),
+              'Z': (FLAG_Z, FLAG_Z),
+              'NC': (FLAG_C, 0),
+              'C': (FLAG_C, FLAG_C),
+              'PO': (FLAG_P, 0),
+              'PE': (FLAG_P, FLAG_P),
+              'P': (FLAG_S, 0),
+              'M': (FLAG_S, FLAG_S)}
+
+
+# functions which do not depend on the previous F
+INDEPENDENT = frozenset([add_f, sub_f, compare_f, logic_f, adc16_f,
+                         sbc16_f])
@@ -0,0 +1,205 @@
+from .register import WORD_PC
+from .scheduler import INFINITY
+from .ports import UNMAPPED
+from .ports import WouldBlock
+
+
+# T-states between two looks at the code executed by run
+PROBE_PERIOD = 4096
+# instructions of the longest loop recognised
+MAX_BODY = 16
+# horizon below which trying to skip is not worth it
+MIN_HORIZON = 256
+
+# instructions with side effects beyond registers and memory
+IMPURE = frozenset([
+    'OUT__n__A', 'OUT__C__r', 'OUTI', 'OTIR', 'OUTD', 'OTDR',
+    'INI', 'INIR', 'IND', 'INDR',
+    'DI', 'EI', 'HALT', 'RETI', 'RETN', 'IM_0', 'IM_1', 'IM_2'])
+# instructions using B without naming it in their arguments
+USES_B = frozenset(['LD_A__BC_', 'IN_r__C_'])
+
+
+class WriteProbe(object):
+    """ code cache recording whether memory has been written """
+    def __init__(self):
+        self.written = False
+
+    def invalidate(self, addr):
+        self.written = True
+
+    def invalidate_range(self, start, end):
+        self.written = True
+
+
+class IdleDetector(object):
+    """
+    Fast forward of idle loops of the CPU, see CPU(idle_detection=True).
+
+    Every PROBE_PERIOD T-states run executes one iteration of the loop
+    at PC while watching it. A loop qualifies if the iteration returns
+    to PC within MAX_BODY instructions, writes neither memory nor ports,
+    reads only ports of devices which report a stable_until count (as
+    well as every timed handler mapped on the memory bus), and
+    leaves the registers as they were (or only decrements B by its
+    closing DJNZ). Every further iteration then takes the same path and
+    T-states, so that tstates is advanced by whole iterations up to the
+    next event: no device can change what the loop reads before.
+    """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.pending = False
+        self.event = None
+        # number of loops fast forwarded and the T-states skipped
+        self.skips = 0
+        self.skipped = 0
+        # T-state count up to which the last skipped loop is known to
+        # spin, see async_machine.AsyncMachine.idle
+        self.idle_until = None
+
+    def arm(self):
+        """ schedules the next probe """
+        self.pending = False
+        self.event = self.cpu.schedule(self.cpu.tstates + PROBE_PERIOD,
+                                       self.probe)
+
+    def probe(self, due):
+        self.pending = True
+
+    def state(self):
+        cpu = self.cpu
+        return (cpu.reg.save_registers(), cpu.iff1, cpu.iff2, cpu.im)
+
+    def service(self, budget, until_pc):
+        """ tries to skip iterations of the loop at PC until cpu.limit.
+            Returns the number of instructions executed or skipped. """
+        cpu = self.cpu
+        horizon = cpu.limit
+        executed = 0
+        if horizon - cpu.tstates >= MIN_HORIZON and budget > MAX_BODY:
+            executed, horizon, loop = self.trial(horizon, until_pc)
+            if loop is not None:
+                executed += self.skip(loop, horizon, budget - executed)
+        self.arm()
+        return executed
+
+    def trial(self, horizon, until_pc):
+        """ executes one iteration of the loop at PC. Returns
+            (instructions, horizon, loop), loop is (tstates, instructions,
+            B after the iteration or None) if the loop qualifies. """
+        cpu = self.cpu
+        reg = cpu.reg
+        r16 = reg.r16
+        start = r16[WORD_PC]
+        tstates = cpu.tstates
+        before = self.state()
+        # the iteration may read any of the timed pages
+        horizon = min(horizon, self.pages_stable_until())
+        probe = WriteProbe()
+        reg.code_caches.append(probe)
+        n = 0
+        djnz = uses_b = False
+        try:
+            while n == 0 or r16[WORD_PC] != start:
+                pc = r16[WORD_PC]
+                # events scheduled by the iteration itself
+                horizon = min(horizon, cpu.limit)
+                if n == MAX_BODY or pc == until_pc or cpu.tstates >= horizon:
+                    return n, horizon, None
+                instr = cpu.fetch_at(pc)
+                if instr is None:
+                    return n, horizon, None
+                name = instr.func.__name__
+                if name in IMPURE:
+                    return n, horizon, None
+                if name == 'DJNZ_e':
+                    djnz = True
+                elif name in USES_B or 'B' in instr.args \
+                        or 'BC' in instr.args:
+                    uses_b = True
+                if name == 'IN_A__n_':
+                    port = (cpu['A'] << 8) | reg.mem[(pc + 1) & 0xffff]
+                elif name == 'IN_r__C_':
+                    port = cpu['BC']
+                else:
+                    port = None
+                if port is not None:
+                    horizon = min(horizon, self.stable_until(port))
+                    if cpu.tstates >= horizon:
+                        return n, horizon, None
+                try:
+                    cpu.instr_cycle()
+                except WouldBlock as e:
+                    e.pc = pc
+                    raise
+                n += 1
+                if probe.written:
+                    return n, horizon, None
+        finally:
+            reg.code_caches.remove(probe)
+        after = self.state()
+        loop = (cpu.tstates - tstates, n, None)
+        if after == before:
+            return n, horizon, loop
+        slot = reg.slots['B']
+        r8, after_r8 = before[0][0], after[0][0]
+        changed = [i for i in range(len(r8)) if r8[i] != after_r8[i]]
+        if djnz and not uses_b and changed == [slot] \
+                and after[1:] == before[1:] \
+                and after[0][1:] == before[0][1:] \
+                and after_r8[slot] == (r8[slot] - 1) & 0xff:
+            return n, horizon, loop[:2] + (after_r8[slot],)
+        return n, horizon, None
+
+    def stable_until(self, port):
+        """ T-state count until which reading port returns the same
+            value (cpu.tstates if unknown) """
+        device = self.cpu.ports.device(port)
+        if device is UNMAPPED:
+            return INFINITY
+        stable_until = getattr(device, 'stable_until', None)
+        if stable_until is None:
+            return self.cpu.tstates
+        return stable_until(self.cpu.tstates)
+
+    def pages_stable_until(self):
+        """ T-state count until which reading the pages of the timed
+            handlers on the memory bus returns the same values """
+        bus = self.cpu.memory_bus
+        if not bus.timed:
+            return INFINITY
+        now = self.cpu.tstates
+        horizon = INFINITY
+        for handler in set(bus.pages):
+            if handler is None or not handler.timed:
+                continue
+            stable_until = getattr(handler, 'stable_until', None)
+            if stable_until is None:
+                return now
+            horizon = min(horizon, stable_until(now))
+        return horizon
+
+    def skip(self, loop, horizon, budget):
+        """ advances tstates by the iterations of loop ending at or before
+            horizon. Returns the number of instructions skipped. """
+        cpu = self.cpu
+        tstates, instructions, b = loop
+        iterations = INFINITY
+        if horizon != INFINITY:
+            iterations = (horizon - cpu.tstates) // tstates
+        if budget != INFINITY:
+            iterations = min(iterations, budget // instructions)
+        if b is not None:
+            # the last iteration leaves the loop
+            iterations = min(iterations, b - 1)
+        if iterations == INFINITY or iterations <= 0:
+            return 0
+        iterations = int(iterations)
+        if b is not None:
+            cpu['B'] = b - iterations
+        cpu.tstates += iterations * tstates
+        self.skips += 1
+        self.skipped += iterations * tstates
+        if b is None:
+            self.idle_until = horizon
+        return iterations * instructions
@@ -1,9 +1,22 @@
+from inspect import signature
+from inspect import Parameter
 from .register import RegisterPlusOffset
 
 
+OPERAND_MEMONICS = ('n', 'nn', 'd', 'e')
+
+
+def call_arguments(func):
+    """ names of the arguments without default value (except self) """
+    params = list(signature(func).parameters.values())[1:]
+    kinds = (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)
+    return [p.name for p in params
+            if p.default is Parameter.empty and p.kind in kinds]
+
+
 class Instruction(object):
     def __init__(self, assembler, opcode, func, args=[],
-                 tstates=1):
+                 tstates=1, branch=False, arg_order=None):
         def opcode2offset(i, c):
             if isinstance(c, str) and len(c) == 1:
                 return RegisterPlusOffset('PC', i, memonic=c)
@@ -13,16 +26,85 @@ class Instruction(object):
                 return c
 
         self.assembler = assembler
-        self.opcode = [opcode2offset(i, c)
-                       for i, c in enumerate(opcode)]
-        try:
-            self.size = sum([1 if isinstance(c, int) else c.len()
-                             for c in self.opcode])
-        except Exception:
-            print(self.opcode)
-            raise
+        self.opcode = []
+        offset = 0
+        for c in opcode:
+            c = opcode2offset(offset, c)
+            self.opcode.append(c)
+            offset += 1 if isinstance(c, int) else c.len()
+        self.size = offset
         self.func = func
+        self.args = tuple(args)
         self.tstates = tstates
+        # the instruction may modify PC
+        self.branch = branch
+        # (offset, memonic) of the operands following the opcode bytes
+        self.operands = [(c.d, c.memonic) for c in self.opcode
+                         if isinstance(c, RegisterPlusOffset)]
+        # arg_order is passed when the template expansion is cached
+        self.arg_order = self._arg_order() if arg_order is None \
+            else [tuple(a) for a in arg_order]
+        self.specialise(None)
+
+    def specialise(self, specialiser):
+        """ Sets the unchecked handler of the instruction.
+            specialiser (see fast_handlers.specialise) is called with
+            the register arguments. Without specialisation func is
+            used with the full argument tuple. """
+        self.fast = None
+        if specialiser is not None:
+            self.fast = specialiser(*self.args)
+        if self.fast is None:
+            self.unchecked = self.func
+            self.unchecked_args = self.args
+        else:
+            self.unchecked = self.fast
+            self.unchecked_args = ()
+
+    def _arg_order(self):
+        """ Maps the arguments of func to either the register
+            arguments of the expansion or to the operands.
+            Returns a list of (is_operand, index) tuples. """
+        operands = [m for (_, m) in self.operands]
+        args = list(range(len(self.args)))
+        ret = []
+        for name in call_arguments(self.func):
+            if name in OPERAND_MEMONICS and name in operands:
+                ret.append((True, operands.index(name)))
+            elif args:
+                ret.append((False, args.pop(0)))
+            else:
+                raise ValueError('cannot bind argument {0} of {1}'.
+                                 format(name, self.func.__name__))
+        return ret
+
+    def decode_unchecked(self, mem, addr):
+        """ argument tuple of unchecked for the instruction at addr """
+        if self.fast is None:
+            return self.decode_args(mem, addr)
+        return tuple(self.decode_operands(mem, addr))
+
+    def decode_args(self, mem, addr):
+        """ reads the operands from memory at addr and returns
+            the full argument tuple for func """
+        values = self.decode_operands(mem, addr)
+        return tuple(values[i] if is_operand else self.args[i]
+                     for is_operand, i in self.arg_order)
+
+    def decode_operands(self, mem, addr):
+        """ list of the operand values of the instruction at addr.
+            d and e are signed, e is relative to the next instruction """
+        values = []
+        for offset, memonic in self.operands:
+            a = (addr + offset) & 0xffff
+            if memonic == 'nn':
+                values.append(mem[a] | (mem[(a + 1) & 0xffff] << 8))
+            elif memonic in ('d', 'e'):
+                v = mem[a]
+                values.append(v - 0x100 if v & 0x80 else v)
+            else:
+                values.append(mem[a])
+        return values
 
     def step(self, cpu):
         pass
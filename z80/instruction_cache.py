@@ -0,0 +1,69 @@
+MAX_INSTRUCTION_SIZE = 4
+
+
+class InstructionCache(object):
+    """
+    Pre-decoded instructions of a CPU keyed by address.
+
+    An entry is a tuple (handler, args, size, tstates) where handler
+    is the instruction function bound to the CPU and args contains
+    the register arguments and the n/nn/d operands.
+    Entries are invalidated when one of their bytes is written.
+    """
+    def __init__(self, cpu, instruction_set):
+        self.cpu = cpu
+        self.instruction_set = instruction_set
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, addr):
+        entry = self.entries.get(addr)
+        if entry is None:
+            self.misses += 1
+            checked = self.cpu.checked
+            instr, args = self.instruction_set.decode(self.cpu.reg.mem, addr,
+                                                      checked)
+            handler = instr.func if checked else instr.unchecked
+            entry = (handler.__get__(self.cpu), args,
+                     instr.size, instr.tstates)
+            self.entries[addr] = entry
+        else:
+            self.hits += 1
+        return entry
+
+    def invalidate(self, addr):
+        """ drop all entries covering addr """
+        entries = self.entries
+        if not entries:
+            return
+        for back in range(MAX_INSTRUCTION_SIZE):
+            a = (addr - back) & 0xffff
+            entry = entries.get(a)
+            if entry is not None and back < entry[2]:
+                del entries[a]
+                self.invalidations += 1
+
+    def invalidate_range(self, start, end):
+        """ drop all entries covering an address in [start, end) """
+        length = end - start
+        entries = self.entries
+        if length > len(entries):
+            for a in [a for a, entry in entries.items()
+                      if any(((a + i - start) & 0xffff) < length
+                             for i in range(entry[2]))]:
+                del entries[a]
+                self.invalidations += 1
+        else:
+            for a in range(start, end):
+                self.invalidate(a & 0xffff)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries)}
@@ -1,4 +1,5 @@
-from .register import PC
+PREFIXES = ((), (0xcb,), (0xed,), (0xdd,), (0xfd,),
+            (0xdd, 0xcb), (0xfd, 0xcb))
 
 
 class InstructionSet(object):
@@ -6,6 +7,17 @@ class InstructionSet(object):
         self.instructions = {}
         self.groups = []
         self.assembler = {}
+        # flat dispatch tables: one 256 slot page per prefix
+        self.tables = {prefix: [None] * 0x100 for prefix in PREFIXES}
+        self.base = self.tables[()]
+        # page selected by the first byte (None: unprefixed)
+        self.prefix_tables = [None] * 0x100
+        for prefix in ((0xcb,), (0xed,), (0xdd,), (0xfd,)):
+            self.prefix_tables[prefix[0]] = self.tables[prefix]
+        # DDCB / FDCB: opcode follows the displacement byte
+        self.index_bit_tables = [None] * 0x100
+        self.index_bit_tables[0xdd] = self.tables[(0xdd, 0xcb)]
+        self.index_bit_tables[0xfd] = self.tables[(0xfd, 0xcb)]
 
     def __getitem__(self, key):
         return self.instructions[key]
@@ -25,34 +37,76 @@ class InstructionSet(object):
                     instructions[codes[0]] = {}
                 set_code(instructions[codes[0]], codes[1:], instr)
 
+        # an instruction without further operands sharing its prefix
+        # with other instructions (RET and RET cc) is stored under ''
         def set_assembler(assembler, asm, instr):
+            node = assembler.get(asm[0])
             if len(asm) == 1:
-                assembler[asm[0]] = instr
+                if isinstance(node, dict):
+                    node[''] = instr
+                else:
+                    assembler[asm[0]] = instr
             else:
-                if not asm[0] in assembler:
-                    assembler[asm[0]] = {}
-                set_assembler(assembler[asm[0]], asm[1:], instr)
+                if node is None:
+                    node = assembler[asm[0]] = {}
+                elif not isinstance(node, dict):
+                    node = assembler[asm[0]] = {'': node}
+                set_assembler(node, asm[1:], instr)
 
         set_code(self.instructions, instr.opcode, instr)
         set_assembler(self.assembler, instr.assembler, instr)
+        self.set_table_entry(instr)
 
-    def fetch(self, cpu):
-        code1 = cpu[PC()]
-        if code1 in self:
-            if isinstance(self[code1], dict):
-                code2 = self[PC(1)]
-                if code2 in self[code1]:
-                    instr = self[code1][code2]
-                    import pprint
-                    pprint.pprint(vars(instr))
-                    return instr
-                else:
-                    return None
+    def set_table_entry(self, instr):
+        codes = [c for c in instr.opcode if isinstance(c, int)]
+        prefix = tuple(codes[:-1])
+        if prefix not in self.tables:
+            raise ValueError('invalid prefix {0} of {1}'.
+                             format(prefix, instr.assembler_to_str()))
+        table = self.tables[prefix]
+        if table[codes[-1]] is not None:
+            raise ValueError('opcode of {0} already used by {1}'.
+                             format(instr.assembler_to_str(),
+                                    table[codes[-1]].assembler_to_str()))
+        table[codes[-1]] = instr
+
+    def lookup(self, mem, addr):
+        """ returns the instruction at addr or None """
+        code = mem[addr]
+        table = self.prefix_tables[code]
+        if table is None:
+            return self.base[code]
+        code2 = mem[(addr + 1) & 0xffff]
+        if code2 == 0xcb:
+            bit_table = self.index_bit_tables[code]
+            if bit_table is not None:
+                return bit_table[mem[(addr + 3) & 0xffff]]
+        return table[code2]
+
+    def decode(self, mem, addr, checked=True):
+        """ returns the instruction at addr and its argument tuple.
+            The arguments are those of func if checked is True,
+            otherwise those of the unchecked handler. """
+        instr = self.lookup(mem, addr)
+        if instr is None:
+            codes = [mem[(addr + i) & 0xffff] for i in range(4)]
+            raise NotImplementedError('instruction not implemented %s' %
+                                      ' '.join('%02x' % c for c in codes))
+        if checked:
+            if instr.operands:
+                return instr, instr.decode_args(mem, addr)
             else:
-                instr = self[code1]
-                import pprint
-                pprint.pprint(vars(instr))
-                return self[code1]
+                return instr, instr.args
+        elif instr.operands:
+            return instr, instr.decode_unchecked(mem, addr)
         else:
+            return instr, instr.unchecked_args
+
+    def fetch(self, cpu):
+        mem = cpu.reg.mem
+        pc = cpu['PC']
+        instr = self.lookup(mem, pc)
+        if instr is None and self.prefix_tables[mem[pc]] is None:
             raise NotImplementedError('instruction not implemented %02x' %
-                                      code1)
+                                      mem[pc])
+        return instr
@@ -1,6 +1,7 @@
 import re
 from functools import wraps
 from .instruction import Instruction
+from .fast_handlers import SPECIALISERS
 
 
 REGISTER_CODE = {'r': {'A': '111',
@@ -39,7 +40,23 @@ REGISTER_CODE = {'r': {'A': '111',
                         'IY': '10',
                         'SP': '11'},
                  "ii": {'IX': '011',
-                        'IY': '111'}}
+                        'IY': '111'},
+                 "cc": {'NZ': '000',
+                        'Z': '001',
+                        'NC': '010',
+                        'C': '011',
+                        'PO': '100',
+                        'PE': '101',
+                        'P': '110',
+                        'M': '111'},
+                 "p": {'00H': '000',
+                       '08H': '001',
+                       '10H': '010',
+                       '18H': '011',
+                       '20H': '100',
+                       '28H': '101',
+                       '30H': '110',
+                       '38H': '111'}}
 
 
 FUNCTION_ARGUMENT = '(_([a-zA-Z]{1,2}|_[a-zA-Z]{2}_|_ii_d_))?'
@@ -90,6 +107,15 @@ def function_name_to_assembler(func_name):
         raise ValueError('invalid function name {0}'.format(func_name))
 
 
+def expansion_argument(r_code, reg):
+    """ argument of the instruction function for an expansion """
+    if r_code == 'b':
+        return int(reg)
+    elif r_code == 'p':
+        return int(reg[:-1], 16)
+    return reg
+
+
 def expand_assembler(assembler, expand):
     ret = [assembler[0]]
     for arg in assembler[1:]:
@@ -101,13 +127,20 @@ def expand_assembler(assembler, expand):
 
 
 class InstructionTemplate(object):
+    """
+    Decorator of an instruction function which expands the template
+    and adds it to group. If cache (a TemplateCache) is given the
+    expansion is looked up by function name first.
+    """
     def __init__(self, group, opcode, expand=None,
-                 tstates=None, assembler=None):
+                 tstates=None, assembler=None, branch=False, cache=None):
         self.group = group
         self.opcode = opcode if isinstance(opcode, list) else [opcode]
         self.expand = [] if expand is None else expand
         self.tstates = 1 if tstates is None else tstates
         self.assembler = assembler
+        self.branch = branch
+        self.cache = cache
         self.instructions = []
 
     def __call__(self, func):
@@ -115,20 +148,39 @@ class InstructionTemplate(object):
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
 
-        if self.assembler is None:
-            self.assembler = function_name_to_assembler(func.__name__)
+        entry = None if self.cache is None else self.cache.get(func.__name__)
+        if entry is None:
+            entry = self.expansions(func)
+            if self.cache is not None:
+                self.cache.put(func.__name__, entry)
+        self.assembler, expansions = entry
+        for assembler, opcode, args, arg_order in expansions:
+            instr = Instruction(assembler, opcode, func,
+                                args=args,
+                                tstates=self.tstates,
+                                branch=self.branch,
+                                arg_order=arg_order)
+            instr.specialise(SPECIALISERS.get(func.__name__))
+            self.instructions.append(instr)
+        self.group.add(self)
+        return wrapper
 
+    def expansions(self, func):
+        """ (assembler, [(assembler, opcode, args, arg_order)]) of the
+            template: one tuple of marshallable values per expansion """
+        template_assembler = self.assembler
+        if template_assembler is None:
+            template_assembler = function_name_to_assembler(func.__name__)
+        ret = []
         for regs, codes in enum_register_codes(self.expand):
-            assembler = expand_assembler(self.assembler,
+            assembler = expand_assembler(template_assembler,
                                          list(zip(self.expand, regs)))
-            self.instructions.append(Instruction(assembler,
-                                                 encode_opcode(self.opcode,
-                                                               codes),
-                                                 func,
-                                                 args=list(regs),
-                                                 tstates=self.tstates))
-        self.group.add(self)
-        return wrapper
+            args = [expansion_argument(r_code, reg)
+                    for r_code, reg in zip(self.expand, regs)]
+            opcode = encode_opcode(self.opcode, codes)
+            instr = Instruction(assembler, opcode, func, args=args)
+            ret.append((assembler, opcode, args, instr.arg_order))
+        return template_assembler, ret
 
     def assembler_to_str(self):
         if len(self.assembler) == 1:
@@ -0,0 +1,144 @@
+import mmap
+import os
+from .bulk import write_range
+from .register import MEMSIZE
+from .register import WORD_PC
+from .register import WORD_SP
+try:
+    import numpy
+except ImportError:     # memory_array requires numpy
+    numpy = None
+
+
+# CP/M programs are loaded and started at the beginning of the TPA
+COM_START = 0x0100
+
+# Intel HEX record types
+HEX_DATA = 0x00
+HEX_EOF = 0x01
+HEX_SEGMENT = 0x02
+HEX_START_SEGMENT = 0x03
+HEX_LINEAR = 0x04
+HEX_START_LINEAR = 0x05
+
+
+def load_bytes(cpu, data, addr=0):
+    """ copies the buffer data to addr with a single slice assignment
+        (two if it wraps around) and notifies the code caches.
+        Returns the number of bytes. """
+    n = len(data)
+    if n > MEMSIZE:
+        raise ValueError('image of {0} bytes exceeds 64K'.format(n))
+    write_range(cpu.reg.bulk_mem, addr, data)
+    if cpu.reg.code_caches:
+        cpu.reg.invalidate_range(addr, addr + n)
+    return n
+
+
+def load_binary(cpu, path, addr=0):
+    """ loads the raw binary file at path to addr. The file is mapped
+        read only and copied without an intermediate bytes object.
+        Returns the number of bytes. """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image, \
+                memoryview(image) as view:
+            return load_bytes(cpu, view, addr)
+
+
+def load_com(cpu, path):
+    """ loads the CP/M program at path to 0100H. PC is set to 0100H and
+        SP to FFFEH with a return address of 0000H (warm boot) on the
+        stack. Returns the number of bytes. """
+    if os.path.getsize(path) > MEMSIZE - COM_START - 2:
+        raise ValueError('{0} does not fit into the TPA'.format(path))
+    n = load_binary(cpu, path, COM_START)
+    load_bytes(cpu, b'\x00\x00', 0xfffe)
+    cpu.reg.r16[WORD_PC] = COM_START
+    cpu.reg.r16[WORD_SP] = 0xfffe
+    return n
+
+
+def parse_intel_hex(text):
+    """
+    Parses the records of an Intel HEX file.
+    Returns (blocks, start) where blocks is a list of (addr, bytes) of
+    the data records with adjacent records merged and start is the
+    start address or None. Raises a ValueError on a malformed record
+    or an address beyond 64K.
+    """
+    blocks = []
+    start = None
+    base = 0
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if not line.startswith(':'):
+                raise ValueError('missing start code')
+            record = bytes.fromhex(line[1:])
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError('wrong record length')
+            if sum(record) & 0xff:
+                raise ValueError('wrong checksum')
+        except ValueError as e:
+            raise ValueError('line {0}: {1}'.format(number, e))
+        kind = record[3]
+        data = record[4:-1]
+        if kind == HEX_DATA:
+            addr = base + ((record[1] << 8) | record[2])
+            if addr + len(data) > MEMSIZE:
+                raise ValueError('line {0}: address {1:x} beyond 64K'.
+                                 format(number, addr))
+            if blocks and blocks[-1][0] + len(blocks[-1][1]) == addr:
+                blocks[-1][1].extend(data)
+            else:
+                blocks.append((addr, bytearray(data)))
+        elif kind == HEX_EOF:
+            break
+        elif kind == HEX_SEGMENT:
+            base = ((data[0] << 8) | data[1]) << 4
+        elif kind == HEX_LINEAR:
+            base = ((data[0] << 8) | data[1]) << 16
+        elif kind == HEX_START_SEGMENT:
+            start = ((data[0] << 8 | data[1]) << 4) + (data[2] << 8 | data[3])
+        elif kind == HEX_START_LINEAR:
+            start = int.from_bytes(data, 'big')
+    return [(addr, bytes(data)) for addr, data in blocks], start
+
+
+def load_intel_hex(cpu, path):
+    """ loads the Intel HEX file at path, sets PC to its start address
+        if the file has one. Returns the number of bytes. """
+    with open(path) as f:
+        blocks, start = parse_intel_hex(f.read())
+    for addr, data in blocks:
+        load_bytes(cpu, data, addr)
+    if start is not None:
+        cpu.reg.r16[WORD_PC] = start & 0xffff
+    return sum(len(data) for _, data in blocks)
+
+
+# loader by (lower case) file extension, see load
+LOADERS = {'.com': load_com,
+           '.hex': load_intel_hex,
+           '.ihx': load_intel_hex}
+
+
+def load(cpu, path, addr=0):
+    """ loads the file at path with the loader of its extension,
+        other files are raw binaries loaded to addr """
+    loader = LOADERS.get(os.path.splitext(path)[1].lower())
+    if loader is None:
+        return load_binary(cpu, path, addr)
+    return loader(cpu, path)
+
+
+def memory_array(cpu):
+    """ numpy uint8 array sharing the RAM of cpu (zero copy), pages
+        mapped on the memory bus are not seen """
+    if numpy is None:
+        raise ImportError('memory_array requires numpy')
+    return numpy.frombuffer(cpu.reg.ram, numpy.uint8)
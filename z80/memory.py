@@ -0,0 +1,264 @@
+from .register import MEMSIZE
+from .register import PAGE_BITS
+
+
+PAGE_SIZE = 1 << PAGE_BITS
+PAGES = MEMSIZE >> PAGE_BITS
+
+
+class PageHandler(object):
+    """
+    Handler of the pages of a region mapped on the MemoryBus.
+
+    The CPU writes the pages through the handler, now is the T-state
+    count of the CPU at the start of the accessing instruction. By
+    default reads return FFH and writes are ignored, the range methods
+    repeat the byte methods.
+
+    A mirrored handler keeps the content of its pages in RegisterSet.ram
+    (see mirror), the CPU reads them there like plain RAM. Reads of the
+    other handlers are dispatched by a PagedMemory, which makes every
+    read slower while one is mapped.
+
+    A timed handler depends on now. While one is mapped, CPU.run
+    interprets the code instead of executing compiled blocks, whose
+    accesses would all see the T-state count at the start of the block.
+    """
+    mirrored = False
+    timed = False
+
+    def mirror(self, ram, start, end):
+        """ copies the content of [start, end) to ram (mirrored only) """
+
+    def read_byte(self, addr, now):
+        return 0xff
+
+    def write_byte(self, addr, value, now):
+        pass
+
+    def read_bytes(self, start, end, now):
+        """ bytes of [start, end) """
+        return bytes(self.read_byte(addr, now) for addr in range(start, end))
+
+    def write_bytes(self, start, data, now):
+        """ writes data to the addresses starting at start """
+        for i, value in enumerate(data):
+            self.write_byte(start + i, value, now)
+
+    def peek_bytes(self, start, end):
+        """ bytes of [start, end) without the side effects of a read, see
+            PagedMemory.__bytes__ """
+        return b'\xff' * (end - start)
+
+
+class Rom(PageHandler):
+    """ read only memory at base, mirrored, writes are ignored. data is
+        kept as given, e.g. a view of shared memory. """
+    mirrored = True
+
+    def __init__(self, data, base):
+        self.data = data
+        self.base = base
+
+    def mirror(self, ram, start, end):
+        ram[start:end] = self.data[start - self.base:end - self.base]
+
+    def write_bytes(self, start, data, now):
+        pass
+
+
+class BankWindow(PageHandler):
+    """
+    Window at base showing one of the equally sized banks, mirrored.
+
+    Writes go to the selected bank and its mirror, they are ignored if
+    the banks are read only. A bank switch copies the bank to the
+    window in RegisterSet.ram with one slice assignment.
+    """
+    mirrored = True
+
+    def __init__(self, bus, base, banks, read_only=False):
+        self.bus = bus
+        self.base = base
+        self.banks = [bytearray(bank) for bank in banks]
+        self.size = len(self.banks[0])
+        if any(len(bank) != self.size for bank in self.banks):
+            raise ValueError('banks differ in size')
+        self.read_only = read_only
+        self.selected = 0
+        self.bank = self.banks[0]
+
+    def mirror(self, ram, start, end):
+        ram[start:end] = self.bank[start - self.base:end - self.base]
+
+    def write_byte(self, addr, value, now):
+        if not self.read_only:
+            self.bank[addr - self.base] = value
+            self.bus.reg.ram[addr] = value
+
+    def write_bytes(self, start, data, now):
+        if not self.read_only:
+            offset = start - self.base
+            self.bank[offset:offset + len(data)] = data
+            self.bus.reg.ram[start:start + len(data)] = data
+
+    def select(self, bank):
+        """ shows bank in the window """
+        if bank != self.selected:
+            self.selected = bank
+            self.bank = self.banks[bank]
+            self.bus.refresh(self.base, self.base + self.size)
+
+
+def runs(pages, start, end):
+    """ (handler, start, end) of the parts of [start, end) with the same
+        entry in pages """
+    while start < end:
+        handler = pages[start >> PAGE_BITS]
+        stop = min(end, ((start >> PAGE_BITS) + 1) << PAGE_BITS)
+        while stop < end and pages[stop >> PAGE_BITS] is handler:
+            stop = min(end, stop + PAGE_SIZE)
+        yield handler, start, stop
+        start = stop
+
+
+class PagedMemory(object):
+    """
+    64K memory of a RegisterSet dispatching the mapped pages, see
+    MemoryBus.
+
+    Reads go to ram unless readers has a handler for the page, writes
+    unless pages has one. The handlers get the T-state count returned
+    by clock. Slices (step 1) are split at the handler boundaries.
+    """
+    def __init__(self, ram, pages, readers, clock):
+        self.ram = ram
+        self.pages = pages
+        self.readers = readers
+        self.clock = clock
+
+    def __len__(self):
+        return MEMSIZE
+
+    def indices(self, key):
+        start, stop, step = key.indices(MEMSIZE)
+        if step != 1:
+            raise ValueError('slice step {0} is not supported'.format(step))
+        return start, max(start, stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self.indices(key)
+            now = self.clock()
+            return b''.join(
+                bytes(self.ram[lo:hi]) if handler is None
+                else handler.read_bytes(lo, hi, now)
+                for handler, lo, hi in runs(self.readers, start, stop))
+        handler = self.readers[key >> PAGE_BITS]
+        if handler is None:
+            return self.ram[key]
+        return handler.read_byte(key, self.clock())
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self.indices(key)
+            value = bytes(value)
+            if len(value) != stop - start:
+                raise ValueError('cannot resize the memory')
+            now = self.clock()
+            for handler, lo, hi in runs(self.pages, start, stop):
+                data = value[lo - start:hi - start]
+                if handler is None:
+                    self.ram[lo:hi] = data
+                else:
+                    handler.write_bytes(lo, data, now)
+            return
+        handler = self.pages[key >> PAGE_BITS]
+        if handler is None:
+            self.ram[key] = value
+        else:
+            handler.write_byte(key, value, self.clock())
+
+    def __bytes__(self):
+        """ the memory as seen by the CPU without read side effects """
+        return b''.join(
+            bytes(self.ram[lo:hi]) if handler is None
+            else handler.peek_bytes(lo, hi)
+            for handler, lo, hi in runs(self.readers, 0, MEMSIZE))
+
+
+class MemoryBus(object):
+    """
+    Page table of the 256 pages of 256 bytes of a RegisterSet.
+
+    A page is either plain RAM (None) or has a PageHandler. Plain RAM
+    and mirrored pages are read directly from the bytearray
+    RegisterSet.ram, which stays RegisterSet.mem unless a handler
+    which is not mirrored is mapped: then mem is a PagedMemory. Writes
+    check RegisterSet.mapped and pass the mapped pages to
+    RegisterSet.paged, the PagedMemory while a page is mapped. clock
+    returns the T-state count passed to the handlers.
+    """
+    def __init__(self, reg, clock):
+        self.reg = reg
+        self.pages = [None] * PAGES
+        # handlers of the pages which are not mirrored
+        self.readers = [None] * PAGES
+        # a timed handler is mapped, see PageHandler
+        self.timed = False
+        self.memory = PagedMemory(reg.ram, self.pages, self.readers, clock)
+
+    def handler(self, addr):
+        """ handler of the page of addr or None for plain RAM """
+        return self.pages[addr >> PAGE_BITS]
+
+    def map(self, addr, size, handler):
+        """ maps the pages of [addr, addr + size) to handler (None: plain
+            RAM keeping the bytes of a mirrored handler). addr and size
+            must be multiples of PAGE_SIZE. """
+        if addr % PAGE_SIZE or size % PAGE_SIZE or addr + size > MEMSIZE:
+            raise ValueError('region {0:04x}+{1:x} is not page aligned'.
+                             format(addr, size))
+        reader = None if handler is None or handler.mirrored else handler
+        reg = self.reg
+        for page in range(addr >> PAGE_BITS, (addr + size) >> PAGE_BITS):
+            self.pages[page] = handler
+            self.readers[page] = reader
+            reg.mapped[page] = handler is not None
+        self.timed = any(page is not None and page.timed
+                         for page in self.pages)
+        reg.paged = self.memory if any(reg.mapped) else None
+        if any(reader is not None for reader in self.readers):
+            reg.mem = self.memory
+        else:
+            reg.mem = reg.ram
+        self.refresh(addr, addr + size)
+
+    def unmap(self, addr, size):
+        self.map(addr, size, None)
+
+    def map_rom(self, addr, data):
+        """ maps data read only at addr, the last page is padded with
+            FFH (without padding data is not copied). Returns the Rom. """
+        size = -(-len(data) // PAGE_SIZE) * PAGE_SIZE
+        if size != len(data):
+            data = bytes(data) + b'\xff' * (size - len(data))
+        rom = Rom(data, addr)
+        self.map(addr, size, rom)
+        return rom
+
+    def map_banks(self, addr, banks, read_only=False):
+        """ maps a BankWindow of banks at addr showing bank 0.
+            Returns the BankWindow. """
+        window = BankWindow(self, addr, banks, read_only)
+        self.map(addr, window.size, window)
+        return window
+
+    def refresh(self, start=0, end=MEMSIZE):
+        """ mirrors the mirrored pages of [start, end) to the RAM again
+            and drops the decoded code of the region """
+        reg = self.reg
+        for handler, lo, hi in runs(self.pages, start, end):
+            if handler is not None and handler.mirrored:
+                handler.mirror(reg.ram, lo, hi)
+        reg.invalidate_range(start, end)
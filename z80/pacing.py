@@ -0,0 +1,135 @@
+from time import perf_counter
+from time import sleep
+
+
+# ZX Spectrum clock and frame rate
+DEFAULT_CLOCK = 3500000
+DEFAULT_FRAME_RATE = 50
+# lag in frames after which the pacer gives up catching up
+MAX_LAG_FRAMES = 5
+
+
+class PacingStats(object):
+    """
+    Statistics of a Pacer: frames run, overruns (frames completed after
+    their wall clock deadline), resyncs (the lag exceeded MAX_LAG_FRAMES
+    and was dropped), the largest lag in seconds, the T-states executed
+    and the wall clock seconds spent in the frames, sleeping included.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.frames = 0
+        self.overruns = 0
+        self.resyncs = 0
+        self.max_lag = 0.0
+        self.tstates = 0
+        self.seconds = 0.0
+
+    @property
+    def emulated_seconds(self):
+        return self.tstates / self.clock
+
+    @property
+    def speed(self):
+        """ emulated time per wall clock time (1.0: real time) """
+        if self.seconds <= 0:
+            return 0.0
+        return self.emulated_seconds / self.seconds
+
+    @property
+    def mhz(self):
+        """ achieved clock in MHz """
+        return self.speed * self.clock / 1e6
+
+    def __repr__(self):
+        return '<PacingStats frames={0} overruns={1} resyncs={2} ' \
+            'speed={3:.3f} max_lag={4:.6f}>'.format(
+                self.frames, self.overruns, self.resyncs, self.speed,
+                self.max_lag)
+
+
+class Pacer(object):
+    """
+    Runs a CPU at clock T-states per second in frames of frame_tstates.
+
+    Each frame is executed in one CPU.run batch, then the pacer sleeps
+    until the wall clock deadline of the frame. Deadlines are computed
+    from the T-state count since the start instead of adding up frame
+    durations, so that neither the overshoot of run nor the oversleeping
+    of sleep accumulate. A frame ending after its deadline is an
+    overrun, the following frames run without sleeping to catch up
+    unless the lag exceeds MAX_LAG_FRAMES frames: then the schedule is
+    restarted from now. With turbo the pacer never sleeps.
+
+    timer and sleep default to time.perf_counter and time.sleep.
+    """
+    def __init__(self, cpu, clock=DEFAULT_CLOCK, frame_tstates=None,
+                 turbo=False, timer=perf_counter, sleep=sleep):
+        self.cpu = cpu
+        self.clock = clock
+        if frame_tstates is None:
+            frame_tstates = clock // DEFAULT_FRAME_RATE
+        self.frame_tstates = frame_tstates
+        self.timer = timer
+        self.sleep = sleep
+        self.stats = PacingStats(clock)
+        self._turbo = turbo
+        self.start()
+
+    def start(self):
+        """ starts the schedule at the current T-state count and time """
+        self.origin_tstates = self.cpu.tstates
+        self.origin_time = self.timer()
+        self.frame_end = self.origin_tstates + self.frame_tstates
+
+    @property
+    def turbo(self):
+        return self._turbo
+
+    @turbo.setter
+    def turbo(self, turbo):
+        """ leaving turbo restarts the schedule from now """
+        if self._turbo and not turbo:
+            self.start()
+        self._turbo = turbo
+
+    def deadline(self, tstates):
+        """ wall clock time at which the T-state count is due """
+        return self.origin_time + (tstates - self.origin_tstates) / self.clock
+
+    def run_frame(self):
+        """ runs one frame and waits for its deadline.
+            Returns the RunResult of the frame. """
+        cpu = self.cpu
+        stats = self.stats
+        start = self.timer()
+        result = cpu.run(max_tstates=max(self.frame_end - cpu.tstates, 0))
+        # the next frame ends a frame after this one, the overshoot of
+        # run is taken from it
+        self.frame_end += self.frame_tstates
+        stats.frames += 1
+        stats.tstates += result.tstates
+        if not self._turbo:
+            lag = self.timer() - self.deadline(cpu.tstates)
+            if lag > 0:
+                stats.overruns += 1
+                stats.max_lag = max(stats.max_lag, lag)
+                if lag > MAX_LAG_FRAMES * self.frame_tstates / self.clock:
+                    stats.resyncs += 1
+                    self.start()
+            elif lag < 0:
+                self.sleep(-lag)
+        stats.seconds += self.timer() - start
+        return result
+
+    def run(self, frames=None, seconds=None):
+        """ runs frames frames or seconds of emulated time (default:
+            forever). Returns the PacingStats. """
+        if seconds is not None:
+            tstates = int(seconds * self.clock)
+            frames = -(-tstates // self.frame_tstates)
+        count = 0
+        while frames is None or count < frames:
+            self.run_frame()
+            count += 1
+        return self.stats
@@ -0,0 +1,131 @@
+class WouldBlock(Exception):
+    """
+    Raised by a read which cannot be answered yet, e.g. from an empty
+    input buffer, before the read has any effect. CPU.run then stops in
+    front of the reading instruction, as if the device held the WAIT
+    line, so that the instruction is executed again by the next run.
+    pc is set to the address of the instruction by the executing loop.
+    """
+    def __init__(self, device):
+        super(WouldBlock, self).__init__(device)
+        self.device = device
+        self.pc = None
+
+
+class PortDevice(object):
+    """
+    Base of the devices on the PortBus. An unmapped port reads FFH
+    (floating bus) and ignores writes. now is the T-state count of the
+    CPU at the start of the accessing instruction.
+
+    The block instructions (INIR, OTIR, ...) pass all bytes of a device
+    to read_block / write_block at once, port is the port address of
+    the first iteration. Devices moving buffers override them.
+    """
+    def read(self, port, now):
+        return 0xff
+
+    def write(self, port, value, now):
+        pass
+
+    def read_block(self, port, n, now):
+        """ bytes of n reads """
+        return bytes(self.read(port, now) for _ in range(n))
+
+    def write_block(self, port, data, now):
+        for value in data:
+            self.write(port, value, now)
+
+
+UNMAPPED = PortDevice()
+
+
+class PortBus(object):
+    """
+    Dispatch table of the I/O ports.
+
+    By default the devices are decoded on the lower 8 bits of the port
+    address (256 entries), with full_decode on all 16 bits.
+    """
+    def __init__(self, full_decode=False):
+        self.full_decode = full_decode
+        self.mask = 0xffff if full_decode else 0xff
+        self.devices = [UNMAPPED] * (self.mask + 1)
+        # list receiving the input values if not None, see ReplayPorts
+        self.log = None
+
+    def map(self, port, device, count=1):
+        """ maps count ports starting at port to device """
+        for p in range(port, port + count):
+            self.devices[p & self.mask] = device
+
+    def unmap(self, port, count=1):
+        self.map(port, UNMAPPED, count)
+
+    def device(self, port):
+        return self.devices[port & self.mask]
+
+    def read(self, port, now):
+        value = self.devices[port & self.mask].read(port, now)
+        if self.log is not None:
+            self.log.append(value)
+        return value
+
+    def write(self, port, value, now):
+        self.devices[port & self.mask].write(port, value, now)
+
+    def runs(self, c, high, n):
+        """ (device, port, count) of the iterations of a block
+            instruction using the ports (high - k) << 8 | c for
+            k in range(n), consecutive iterations of a device are
+            combined """
+        if not self.full_decode:
+            return [(self.devices[c], (high << 8) | c, n)]
+        ret = []
+        for k in range(n):
+            port = ((high - k) & 0xff) << 8 | c
+            device = self.devices[port]
+            if ret and ret[-1][0] is device:
+                ret[-1][2] += 1
+            else:
+                ret.append([device, port, 1])
+        return [tuple(run) for run in ret]
+
+    def read_block(self, c, high, n, now):
+        """ bytes of the n iterations of INIR / INDR """
+        data = b''.join(device.read_block(port, count, now)
+                        for device, port, count in self.runs(c, high, n))
+        if self.log is not None:
+            self.log.extend(data)
+        return data
+
+    def write_block(self, c, high, data, now):
+        """ outputs data in the iterations of OTIR / OTDR """
+        offset = 0
+        for device, port, count in self.runs(c, high, len(data)):
+            device.write_block(port, data[offset:offset + count], now)
+            offset += count
+
+
+class ReplayPorts(object):
+    """
+    Port bus of the shadow CPU of CPU(verify_flags=True), which repeats
+    each instruction: the input values are taken from the log of the
+    PortBus of the CPU, output is ignored.
+    """
+    def __init__(self, log):
+        self.log = log
+
+    def read(self, port, now):
+        return self.log.pop(0)
+
+    def write(self, port, value, now):
+        pass
+
+    def read_block(self, c, high, n, now):
+        data = bytes(self.log[:n])
+        del self.log[:n]
+        return data
+
+    def write_block(self, c, high, data, now):
+        pass
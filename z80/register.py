@@ -1,11 +1,15 @@
+from array import array
 from .assertions import assert_aa
 from .assertions import assert_nn
 from .assertions import assert_q
 from .assertions import assert_n
 from .assertions import assert_d
+from .flags import INDEPENDENT
 
 
 MEMSIZE = 0x10000
+# pages of the memory bus, see memory.MemoryBus
+PAGE_BITS = 8
 
 
 class RegisterPlusOffset(object):
@@ -58,7 +62,41 @@ def IY(d=0):
     return RegisterPlusOffset('IY', d)
 
 
+# offsets of the 8 bit registers within a bank of r8
+BANK_OFFSET = {'B': 0, 'C': 1, 'D': 2, 'E': 3,
+               'H': 4, 'L': 5, 'A': 6, 'F': 7}
+BANK_SIZE = 8
+# BC, DE and HL are exchanged by EXX, AF by EX AF, AF'
+GENERAL_PURPOSE = 'BCDEHL'
+ACCUMULATOR = 'AF'
+# I and R follow the two banks in r8
+SLOT_I = 2 * BANK_SIZE
+SLOT_R = 2 * BANK_SIZE + 1
+# indices of the 16 bit registers in r16
+WORD_IX = 0
+WORD_IY = 1
+WORD_SP = 2
+WORD_PC = 3
+WORDS = {'IX': WORD_IX, 'IY': WORD_IY, 'SP': WORD_SP, 'PC': WORD_PC}
+PAIRS = {'BC': ('B', 'C'), 'DE': ('D', 'E'), 'HL': ('H', 'L'),
+         'AF': ('A', 'F'), 'IR': ('I', 'R')}
+
+
 class RegisterSet(object):
+    """
+    Register file and memory of the CPU.
+
+    The 8 bit registers are stored in the bytearray r8 which holds two
+    banks of BCDEHLAF followed by I and R. gp_bank and af_bank are the
+    offsets of the active banks of BCDEHL and AF, so that EXX and
+    EX AF, AF' only flip an offset. IX, IY, SP and PC are stored in r16.
+    slots maps the names of the 8 bit registers to their current index
+    in r8.
+
+    With lazy_flags enabled, update_flags only records the function
+    computing F and its operands in pending_flags. F is computed when
+    it is accessed (resolve_flags).
+    """
     FLAG_MASK = {'S': 0x80,
                  'Z': 0x40,
                  '5': 0x20,
@@ -70,31 +108,152 @@ class RegisterSet(object):
                  'C': 0x01}
 
     def __init__(self):
-        self.main_register_set = {'B': 0x00, 'C': 0x00,
-                                  'D': 0x00, 'E': 0x00,
-                                  'H': 0x00, 'L': 0x00,
-                                  'A': 0x00, 'F': 0x00,
-                                  'I': 0x00, 'R': 0x00,
-                                  'IX': 0x0000,
-                                  'IY': 0x0000,
-                                  'PC': 0x0000,
-                                  'SP': 0x0000}
-        self.alt_register_set = {'B': 0x00, 'C': 0x00,
-                                 'D': 0x00, 'E': 0x00,
-                                 'H': 0x00, 'L': 0x00,
-                                 'A': 0x00, 'F': 0x00,
-                                 'I': 0x00, 'R': 0x00}
-        self.mem = bytearray(MEMSIZE)
+        self.r8 = bytearray(2 * BANK_SIZE + 2)
+        self.r16 = array('H', [0] * len(WORDS))
+        self.gp_bank = 0
+        self.af_bank = 0
+        self.slots = {'I': SLOT_I, 'R': SLOT_R}
+        self._update_slots()
+        self.lazy_flags = False
+        self.pending_flags = None
+        # plain RAM, mem is ram unless pages are mapped on the memory
+        # bus (see memory.MemoryBus)
+        self.ram = bytearray(MEMSIZE)
+        self.mem = self.ram
+        # pages with a handler on the memory bus, which are written
+        # through paged (the PagedMemory of the bus while any page is
+        # mapped)
+        self.mapped = bytearray(MEMSIZE >> PAGE_BITS)
+        self.paged = None
+        # caches of decoded code, invalidated on memory writes
+        self.code_caches = []
+
+    def _update_slots(self):
+        for r in GENERAL_PURPOSE:
+            self.slots[r] = self.gp_bank + BANK_OFFSET[r]
+        for r in ACCUMULATOR:
+            self.slots[r] = self.af_bank + BANK_OFFSET[r]
+
+    def slot(self, r):
+        """ index of the 8 bit register r in r8 """
+        return self.slots[r]
+
+    def update_flags(self, func, *args):
+        """ F <- func(F, *args), deferred if lazy_flags is enabled """
+        if self.lazy_flags:
+            if self.pending_flags is not None and func not in INDEPENDENT:
+                self.resolve_flags()
+            self.pending_flags = (func, args)
+        else:
+            slot = self.slots['F']
+            self.r8[slot] = func(self.r8[slot], *args)
+
+    def peek_flags(self):
+        """ value of F without resolving pending flags """
+        f = self.r8[self.slots['F']]
+        if self.pending_flags is not None:
+            func, args = self.pending_flags
+            f = func(f, *args)
+        return f
+
+    def resolve_flags(self):
+        """ computes F from the pending flag operation """
+        if self.pending_flags is not None:
+            self.r8[self.slots['F']] = self.peek_flags()
+            self.pending_flags = None
+
+    def load(self, other):
+        """ copies registers and memory of the RegisterSet other """
+        self.r8[:] = other.r8
+        self.r16[:] = other.r16
+        self.gp_bank = other.gp_bank
+        self.af_bank = other.af_bank
+        self._update_slots()
+        self.r8[self.slots['F']] = other.peek_flags()
+        self.pending_flags = None
+        mem = other.mem
+        self.bulk_mem[:] = mem if mem is other.ram else bytes(mem)
+        if self.code_caches:
+            self.invalidate_range(0, MEMSIZE)
+
+    def reset(self):
+        """ clears the registers and the RAM, keeps the buffers and the
+            pages mapped on the memory bus """
+        self.r8[:] = bytes(len(self.r8))
+        self.r16[:] = array('H', [0] * len(WORDS))
+        self.gp_bank = 0
+        self.af_bank = 0
+        self._update_slots()
+        self.pending_flags = None
+        if any(self.mapped):
+            size = 1 << PAGE_BITS
+            for page, mapped in enumerate(self.mapped):
+                if not mapped:
+                    self.ram[page * size:(page + 1) * size] = bytes(size)
+        else:
+            self.ram[:] = bytes(MEMSIZE)
+        if self.code_caches:
+            self.invalidate_range(0, MEMSIZE)
+
+    def save_registers(self):
+        """ immutable copy of the register file with resolved flags """
+        self.resolve_flags()
+        return (bytes(self.r8), tuple(self.r16), self.gp_bank, self.af_bank)
+
+    def restore_registers(self, registers):
+        """ sets the register file to a save_registers copy """
+        r8, r16, self.gp_bank, self.af_bank = registers
+        self.r8[:] = r8
+        self.r16[:] = array('H', r16)
+        self._update_slots()
+        self.pending_flags = None
+
+    def exx(self):
+        """ BC/DE/HL <-> BC'/DE'/HL' """
+        self.gp_bank ^= BANK_SIZE
+        self._update_slots()
+
+    def ex_af(self):
+        """ AF <-> AF' """
+        self.resolve_flags()
+        self.af_bank ^= BANK_SIZE
+        self._update_slots()
+
+    @property
+    def main_register_set(self):
+        """ snapshot of the active registers """
+        self.resolve_flags()
+        ret = {r: self.r8[slot] for r, slot in self.slots.items()}
+        ret.update((w, self.r16[i]) for w, i in WORDS.items())
+        return ret
+
+    @property
+    def alt_register_set(self):
+        """ snapshot of the inactive bank """
+        ret = {}
+        for r in GENERAL_PURPOSE:
+            ret[r] = self.r8[(self.gp_bank ^ BANK_SIZE) + BANK_OFFSET[r]]
+        for r in ACCUMULATOR:
+            ret[r] = self.r8[(self.af_bank ^ BANK_SIZE) + BANK_OFFSET[r]]
+        return ret
 
     def __getitem__(self, key):
-        if key in self.main_register_set:
-            return self.main_register_set[key]
-        elif key in ['BC', 'DE', 'HL', 'AF', 'IX', 'IY', 'SP', 'PC']:
-            return self.get16(key)
+        slot = self.slots.get(key)
+        if slot is not None:
+            if self.pending_flags is not None and key == 'F':
+                self.resolve_flags()
+            return self.r8[slot]
+        word = WORDS.get(key)
+        if word is not None:
+            return self.r16[word]
+        pair = PAIRS.get(key)
+        if pair is not None:
+            if key == 'AF':
+                self.resolve_flags()
+            hi, lo = pair
+            return (self.r8[self.slots[hi]] << 8) | self.r8[self.slots[lo]]
         elif key in RegisterSet.FLAG_MASK:
-            return 1 \
-                if self.main_register_set['F'] & RegisterSet.FLAG_MASK[key] \
-                else 0
+            return self.flag(key)
         elif isinstance(key, RegisterPlusOffset):
             return self.mem[key(self[key.reg])]
         elif isinstance(key, int):
@@ -104,45 +263,77 @@ class RegisterSet(object):
             raise KeyError('cannot access memory: ' + str(key))
 
     def __setitem__(self, key, value):
-        if key in ['B', 'C', 'D', 'E', 'H', 'L', 'A', 'F', 'I', 'R']:
+        slot = self.slots.get(key)
+        if slot is not None:
             assert_n(value)
-            self.main_register_set[key] = value
-        elif key in ['BC', 'DE', 'HL', 'AF', 'IR', 'IX', 'IY', 'SP', 'PC']:
+            if key == 'F':
+                self.pending_flags = None
+            self.r8[slot] = value
+        elif key in WORDS or key in PAIRS:
             self.set16(key, value)
-            assert_nn(value)
         elif key in RegisterSet.FLAG_MASK:
-            if value:
-                self.main_register_set['F'] |= RegisterSet.FLAG_MASK[key]
-            else:
-                self.main_register_set['F'] &= (0xff ^
-                                                RegisterSet.FLAG_MASK[key])
+            self.set_flag(key, value)
         elif isinstance(key, RegisterPlusOffset):
             assert_n(value)
-            self.mem[key(self[key.reg])] = value
+            nn = key(self[key.reg])
+            if self.mapped[nn >> PAGE_BITS]:
+                self.paged[nn] = value
+            else:
+                self.mem[nn] = value
+            if self.code_caches:
+                self.invalidate(nn)
         elif isinstance(key, int):
             assert_nn(key)
             assert_n(value)
-            self.mem[key] = value
+            if self.mapped[key >> PAGE_BITS]:
+                self.paged[key] = value
+            else:
+                self.mem[key] = value
+            if self.code_caches:
+                self.invalidate(key)
         else:
             raise KeyError('cannot access memory: ' + str(key))
 
+    @property
+    def bulk_mem(self):
+        """ memory for slice writes: mem, or paged while a page is
+            mapped on the memory bus """
+        return self.mem if self.paged is None else self.paged
+
+    def invalidate(self, nn):
+        """ notify the code caches about a write to address nn """
+        for cache in self.code_caches:
+            cache.invalidate(nn)
+
+    def invalidate_range(self, start, end):
+        """ notify the code caches about writes to [start, end) """
+        for cache in self.code_caches:
+            cache.invalidate_range(start, end)
+
     def __contains__(self, key):
         return \
-            key in self.main_register_set or \
+            key in self.slots or \
+            key in WORDS or \
             key in RegisterSet.FLAG_MASK
 
     def ex_q_alt_q(self, q):
         assert_q(q)
-        alt_value = self.alt_register_set[q]
-        self.alt_register_set[q] = self.main_register_set[q]
-        self.main_register_set[q] = alt_value
+        self.resolve_flags()
+        bank = self.af_bank if q in ACCUMULATOR else self.gp_bank
+        slot = self.slots[q]
+        alt = (bank ^ BANK_SIZE) + BANK_OFFSET[q]
+        self.r8[slot], self.r8[alt] = self.r8[alt], self.r8[slot]
 
     def get16(self, key):
-        if key in ['BC', 'DE', 'HL', 'AF']:
-            return ((self.main_register_set[key[0]] << 8) +
-                    (self.main_register_set[key[1]]))
-        elif key in ['IX', 'IY', 'SP', 'PC']:
-            return self.main_register_set[key]
+        word = WORDS.get(key)
+        if word is not None:
+            return self.r16[word]
+        pair = PAIRS.get(key)
+        if pair is not None:
+            if key == 'AF':
+                self.resolve_flags()
+            hi, lo = pair
+            return (self.r8[self.slots[hi]] << 8) | self.r8[self.slots[lo]]
         elif isinstance(key, RegisterPlusOffset):
             nn = key(self[key.reg])
             return self[nn] + (self[(nn + 1) % MEMSIZE] << 8)
@@ -154,11 +345,16 @@ class RegisterSet(object):
 
     def set16(self, key, value):
         assert_nn(value)
-        if key in ['BC', 'DE', 'HL', 'AF', 'IR']:
-            self.main_register_set[key[1]] = (value & 0x00ff)
-            self.main_register_set[key[0]] = (value >> 8)
-        elif key in ['IX', 'IY', 'SP', 'PC']:
-            self.main_register_set[key] = value
+        word = WORDS.get(key)
+        if word is not None:
+            self.r16[word] = value
+            return
+        pair = PAIRS.get(key)
+        if pair is not None:
+            if key == 'AF':
+                self.pending_flags = None
+            self.r8[self.slots[pair[0]]] = value >> 8
+            self.r8[self.slots[pair[1]]] = value & 0x00ff
         elif isinstance(key, RegisterPlusOffset):
             nn = key(self[key.reg])
             self[nn] = (value & 0x00ff)
@@ -171,10 +367,24 @@ class RegisterSet(object):
             raise KeyError('cannot access memory: ' + str(key))
 
     def swap(self):
-        for r in "BCDEHLAFIR":
-            v = self.main_register_set[r]
-            self.main_register_set[r] = self.alt_register_set[r]
-            self.alt_register_set = v
+        """ exchanges both banks """
+        self.exx()
+        self.ex_af()
+
+    def flag(self, f):
+        """ returns 1 if flag f is set, 0 otherwise.
+            Unlike self[f] this is not ambiguous for H and C """
+        self.resolve_flags()
+        return 1 if self.r8[self.slots['F']] & RegisterSet.FLAG_MASK[f] \
+            else 0
+
+    def set_flag(self, f, value):
+        self.resolve_flags()
+        slot = self.slots['F']
+        if value:
+            self.r8[slot] |= RegisterSet.FLAG_MASK[f]
+        else:
+            self.r8[slot] &= (0xff ^ RegisterSet.FLAG_MASK[f])
 
     def get_flags(self, V_or_P='V'):
         if V_or_P == 'V':
@@ -183,6 +393,6 @@ class RegisterSet(object):
             flags = 'SZ5H3PNC'
         ret = ''
         for f in flags:
-            if self[f]:
+            if self.flag(f):
                 ret += f
         return ret
@@ -0,0 +1,29 @@
+STOP_TSTATES = 'tstates'
+STOP_INSTRUCTIONS = 'instructions'
+STOP_PC = 'pc'
+STOP_BLOCKED = 'blocked'
+
+
+class RunResult(object):
+    """
+    Outcome of CPU.run.
+
+    reason is one of STOP_TSTATES, STOP_INSTRUCTIONS, STOP_PC or
+    STOP_BLOCKED (a port read raised ports.WouldBlock, see
+    CPU.blocked), instructions and tstates are the counts of the run.
+    """
+    def __init__(self, reason, instructions, tstates):
+        self.reason = reason
+        self.instructions = instructions
+        self.tstates = tstates
+
+    def __eq__(self, other):
+        if not isinstance(other, RunResult):
+            return False
+        return self.as_tuple() == other.as_tuple()
+
+    def as_tuple(self):
+        return (self.reason, self.instructions, self.tstates)
+
+    def __repr__(self):
+        return 'RunResult({0!r}, {1}, {2})'.format(*self.as_tuple())
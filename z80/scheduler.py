@@ -0,0 +1,56 @@
+import heapq
+from itertools import count
+
+
+INFINITY = float('inf')
+
+
+class Event(object):
+    """ callback scheduled at the T-state count due, see Scheduler """
+    def __init__(self, due, callback):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    Heap of the events of a CPU ordered by due T-state count (and by
+    the order of scheduling). A callback is called with the due count
+    of its event and may schedule further events, so that a device
+    schedules its own next state change instead of being polled.
+    """
+    def __init__(self):
+        self.heap = []
+        self.sequence = count()
+
+    def __len__(self):
+        return sum(1 for _, _, event in self.heap if not event.cancelled)
+
+    def schedule(self, due, callback):
+        """ Returns the Event calling callback(due) """
+        event = Event(due, callback)
+        heapq.heappush(self.heap, (due, next(self.sequence), event))
+        return event
+
+    @property
+    def next_due(self):
+        """ due count of the next event or INFINITY """
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else INFINITY
+
+    def fire(self, now):
+        """ calls the callbacks of the events due at now """
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            event = heapq.heappop(heap)[2]
+            if not event.cancelled:
+                event.callback(event.due)
+
+    def clear(self):
+        self.heap = []
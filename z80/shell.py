@@ -2,9 +2,21 @@ import sys
 from functools import partial
 import argparse
 from cmd import Cmd
-from .cpu import INSTRUCTION_SET
-from .printer.instr import InstrJsonPrinter
-from .printer.instr import InstrPrettyPrinter
+
+
+def instruction_set():
+    """ the instruction set, z80.cpu is imported on first use """
+    from .cpu import INSTRUCTION_SET
+    return INSTRUCTION_SET
+
+
+def instr_printer(json_format):
+    if json_format:
+        from .printer.instr import InstrJsonPrinter
+        return InstrJsonPrinter()
+    else:
+        from .printer.instr import InstrPrettyPrinter
+        return InstrPrettyPrinter()
 
 
 class ArgumentError(Exception):
@@ -82,7 +94,14 @@ class InstrGroupShell(BasicShell):
     def __init__(self, group, *args, **kwargs):
         BasicShell.__init__(self, *args, **kwargs)
         self.group = group
-        self.parser_ls = InstrListArgumentParser(group_name=group.name)
+        self._parser_ls = None
+
+    @property
+    def parser_ls(self):
+        if self._parser_ls is None:
+            self._parser_ls = InstrListArgumentParser(
+                group_name=self.group.name)
+        return self._parser_ls
 
     def do_exit(self, args):
         return True
@@ -100,28 +119,57 @@ class InstrGroupShell(BasicShell):
         except ArgumentError as e:
             sys.stderr.write(str(e))
             return
-
-        if args.json:
-            printer = InstrJsonPrinter()
-        else:
-            printer = InstrPrettyPrinter()
-        printer.write([self.group.to_dict()])
+        instr_printer(args.json).write([self.group.to_dict()])
 
 
 class InstrShell(BasicShell):
+    """
+    The commands do_<group> and the subshells <group>_shell of the
+    instruction groups are looked up by the short name of the group
+    and created on first use.
+    """
     prompt = "z80/instr> "
 
-    @classmethod
-    def add_group_commands(cls, groups):
-        for group in groups:
-            group_shell = InstrGroupShell(group)
-            setattr(cls, group.short_name + "_shell", group_shell)
-            setattr(cls, "do_" + group.short_name,
-                    partial(InstrGroupShell.enter, **{'shell': group_shell}))
-
     def __init__(self, *args, **kwargs):
         BasicShell.__init__(self, *args, **kwargs)
-        self.parser_ls = InstrListArgumentParser()
+        self._parser_ls = None
+        self.group_shells = {}
+
+    @property
+    def parser_ls(self):
+        if self._parser_ls is None:
+            self._parser_ls = InstrListArgumentParser()
+        return self._parser_ls
+
+    def group_shell(self, short_name):
+        """ InstrGroupShell of the group or None """
+        shell = self.group_shells.get(short_name)
+        if shell is None:
+            for group in instruction_set().groups:
+                if group.short_name == short_name:
+                    shell = InstrGroupShell(group)
+                    self.group_shells[short_name] = shell
+        return shell
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'group_shells':
+            raise AttributeError(name)
+        if name.startswith('do_'):
+            shell = self.group_shell(name[3:])
+            if shell is not None:
+                return partial(InstrGroupShell.enter, shell=shell)
+        elif name.endswith('_shell'):
+            shell = self.group_shell(name[:-len('_shell')])
+            if shell is not None:
+                return shell
+        raise AttributeError(name)
+
+    def get_names(self):
+        return BasicShell.get_names(self) + \
+            ['do_' + group.short_name for group in instruction_set().groups]
+
+    def help_ls(self):
+        self.parser_ls.print_help()
 
     def do_ls(self, args):
         try:
@@ -129,12 +177,8 @@ class InstrShell(BasicShell):
         except ArgumentError as e:
             sys.stderr.write(str(e))
             return
-        if args.json:
-            printer = InstrJsonPrinter()
-        else:
-            printer = InstrPrettyPrinter()
-        printer.write([group.to_dict()
-                       for group in INSTRUCTION_SET.groups])
+        instr_printer(args.json).write([group.to_dict()
+                                        for group in instruction_set().groups])
 
     def complete_ls(self, text, line, begin, end, subline=None):
         # print("'{0}_{1}'".format(line, text))
@@ -166,25 +210,39 @@ class InstrShell(BasicShell):
             text = ''
         else:
             text = args[-1]
+        assembler = instruction_set().assembler
         if len(args) == 1:
-            return complete_assembler(INSTRUCTION_SET.assembler, [''])
+            return complete_assembler(assembler, [''])
         else:
             if not text:
                 args.append('')
-            return complete_assembler(INSTRUCTION_SET.assembler, args[1:])
-        return complete_assembler(INSTRUCTION_SET.assembler, text)
+            return complete_assembler(assembler, args[1:])
+        return complete_assembler(assembler, text)
 
     def do_exit(self, args):
         return True
 
 
 class Shell(BasicShell):
+    """ the subshells are created on first use """
     prompt = "z80> "
 
     def __init__(self, *args, **kwargs):
         Cmd.__init__(self, *args, **kwargs)
-        self.cpu_shell = CpuShell()
-        self.instr_shell = InstrShell()
+        self._cpu_shell = None
+        self._instr_shell = None
+
+    @property
+    def cpu_shell(self):
+        if self._cpu_shell is None:
+            self._cpu_shell = CpuShell()
+        return self._cpu_shell
+
+    @property
+    def instr_shell(self):
+        if self._instr_shell is None:
+            self._instr_shell = InstrShell()
+        return self._instr_shell
 
     def do_instr(self, args):
         self.enter_subshell(self.instr_shell, args)
@@ -196,13 +254,17 @@ class Shell(BasicShell):
         return True
 
 
-# Initialization
-InstrShell.add_group_commands(INSTRUCTION_SET.groups)
-
-
-if __name__ == "__main__":
+def main(argv=None):
+    """ runs the command given by argv (e.g. instr ls --json) or the
+        interactive shell if there is none """
+    if argv is None:
+        argv = sys.argv[1:]
     shell = Shell()
-    if len(sys.argv) > 1:
-        shell.onecmd(' '.join(sys.argv[1:]))
+    if argv:
+        shell.onecmd(' '.join(argv))
     else:
         shell.cmdloop()
+
+
+if __name__ == "__main__":
+    main()
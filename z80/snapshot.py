@@ -0,0 +1,103 @@
+from .memory import PAGE_BITS
+from .memory import PAGE_SIZE
+from .memory import PAGES
+from .register import MEMSIZE
+
+
+class Snapshot(object):
+    """
+    Registers, interrupt state (see CPU.save_interrupts), T-state
+    counter and RAM of a CPU.
+
+    The memory is a tuple of immutable PAGE_SIZE byte pages. Pages that
+    were not written between two snapshots are the same objects in
+    both, so that a snapshot only allocates its dirty pages.
+    """
+    def __init__(self, registers, tstates, pages, interrupts):
+        self.registers = registers
+        self.tstates = tstates
+        self.pages = pages
+        self.interrupts = interrupts
+
+    @property
+    def memory(self):
+        return b''.join(self.pages)
+
+
+class PageTracker(object):
+    """
+    Tracks the pages written since the last snapshot or restore (the
+    base snapshot) of a RegisterSet.
+
+    The tracker is registered in RegisterSet.code_caches and therefore
+    sees every write that is reported to the code caches. Writes to
+    reg.mem that bypass invalidate are not tracked. Only the plain RAM
+    reg.ram is saved, restore skips the pages mapped on the memory bus
+    (see memory.MemoryBus) whose handlers keep their state.
+    """
+    def __init__(self, reg):
+        self.reg = reg
+        self.dirty = bytearray(PAGES)
+        self.base = None
+        reg.code_caches.append(self)
+
+    def invalidate(self, addr):
+        self.dirty[addr >> PAGE_BITS] = 1
+
+    def invalidate_range(self, start, end):
+        if end - start >= MEMSIZE:
+            self.dirty[:] = b'\x01' * PAGES
+            return
+        for page in range(start >> PAGE_BITS, ((end - 1) >> PAGE_BITS) + 1):
+            self.dirty[page % PAGES] = 1
+
+    def dirty_pages(self):
+        """ indices of the pages written since the base snapshot """
+        if self.base is None:
+            return list(range(PAGES))
+        dirty = self.dirty
+        return [page for page in range(PAGES) if dirty[page]]
+
+    def snapshot(self, tstates, interrupts):
+        """ Snapshot sharing the clean pages with the base snapshot """
+        mem = self.reg.ram
+        dirty = self.dirty_pages()
+        if dirty:
+            pages = list(self.base.pages) if self.base is not None \
+                else [None] * PAGES
+            for page in dirty:
+                start = page << PAGE_BITS
+                pages[page] = bytes(mem[start:start + PAGE_SIZE])
+            pages = tuple(pages)
+        else:
+            pages = self.base.pages
+        self.base = Snapshot(self.reg.save_registers(), tstates, pages,
+                             interrupts)
+        self.dirty[:] = bytes(PAGES)
+        return self.base
+
+    def restore(self, snapshot):
+        """ rewrites the pages that differ from snapshot: the dirty ones
+            and those which are not shared with the base snapshot.
+            Returns the number of rewritten pages. """
+        reg = self.reg
+        mem = reg.ram
+        pages = snapshot.pages
+        dirty = self.dirty
+        mapped = reg.mapped
+        if self.base is None:
+            changed = [page for page in range(PAGES) if not mapped[page]]
+        else:
+            base = self.base.pages
+            changed = [page for page in range(PAGES)
+                       if not mapped[page]
+                       if dirty[page] or pages[page] is not base[page]]
+        for page in changed:
+            start = page << PAGE_BITS
+            mem[start:start + PAGE_SIZE] = pages[page]
+            # the other code caches drop the code of the page
+            reg.invalidate_range(start, start + PAGE_SIZE)
+        reg.restore_registers(snapshot.registers)
+        self.base = snapshot
+        dirty[:] = bytes(PAGES)
+        return len(changed)
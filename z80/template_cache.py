@@ -0,0 +1,122 @@
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+
+# directory of the cache files, an empty value disables the cache
+CACHE_DIR_ENV = 'Z80_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '__pycache__')
+# modules which determine the expansion of a template
+EXPANSION_SOURCES = ('instruction_template.py', 'instruction.py',
+                     'register.py')
+
+
+def source_key(paths):
+    """ hash of the contents of the files and of the python version """
+    h = hashlib.sha1(sys.version.encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_dir():
+    return os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+
+
+class TemplateCache(object):
+    """
+    Expanded instruction templates of a module stored in a marshal
+    file which is keyed by a hash of the module source (and of the
+    modules that take part in the expansion).
+
+    An entry maps the name of the instruction function to the
+    assembler of the template and a list of
+    (assembler, opcode, args, arg_order) tuples, one per expansion.
+    Entries of a stale or unreadable file are ignored, the templates
+    are expanded again and save writes a new file.
+    """
+    def __init__(self, module_path, directory=None):
+        if directory is None:
+            directory = cache_dir()
+        here = os.path.dirname(os.path.abspath(__file__))
+        sources = [module_path] + [os.path.join(here, name)
+                                   for name in EXPANSION_SOURCES]
+        self.key = source_key(sources)
+        self.prefix = os.path.splitext(os.path.basename(module_path))[0]
+        self.directory = directory
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            self.entries = self.load()
+
+    @property
+    def path(self):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, '{0}.{1}.templates'.
+                            format(self.prefix, self.key))
+
+    def load(self):
+        """ entries of the cache file or an empty dictionary """
+        try:
+            with open(self.path, 'rb') as f:
+                key, entries = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+        if key != self.key or not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, name, entry):
+        self.entries[name] = entry
+
+    def save(self):
+        """ writes the entries if a template was expanded. The file is
+            written to a temporary file which replaces it, so that a
+            concurrent load never sees a partial file. Nothing is
+            written if the directory is not writable, stale files of the
+            module are removed, errors are ignored. """
+        if not self.directory or not self.misses:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError:
+            return
+        if not os.access(self.directory, os.W_OK):
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path),
+                                       suffix='.tmp', dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((self.key, self.entries), f)
+            os.replace(tmp, self.path)
+        except (OSError, ValueError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        try:
+            for name in os.listdir(self.directory):
+                if name.startswith(self.prefix + '.') and \
+                   name.endswith('.templates') and \
+                   name != os.path.basename(self.path):
+                    os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
@@ -20,18 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 from .assertions import assert_n
+from .flags import PARITY
 
 
 def parity(n):
     """ returns True if n has even number of 1s."""
     assert_n(n)
-    p = 0
-    m = 1
-    for i in range(0, 8):
-        if n & m:
-            p += 1
-        m = m << 1
-    return p % 2 == 0
+    return PARITY[n] != 0
 
 
 def n2d(n):